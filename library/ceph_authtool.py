@@ -3,10 +3,14 @@ __metaclass__ = type
 
 from ansible.module_utils.basic import AnsibleModule
 try:
-    from ansible.module_utils.ca_common import container_exec, \
+    from ansible.module_utils.ca_common import add_trace, \
+                                               container_exec, \
+                                               exec_command, \
                                                is_containerized
 except ImportError:
-    from module_utils.ca_common import container_exec, \
+    from module_utils.ca_common import add_trace, \
+                                       container_exec, \
+                                       exec_command, \
                                        is_containerized
 import datetime
 import os
@@ -98,7 +102,7 @@ def run_module():
         out = f"{module.params['path']} already exists. Skipping"
         err = ""
     else:
-        rc, out, err = module.run_command(cmd)
+        rc, cmd, out, err = exec_command(module, cmd)
         if rc == 0:
             changed = True
 
@@ -115,6 +119,7 @@ def run_module():
         stderr=err.rstrip("\r\n"),
         changed=changed,
     )
+    add_trace(result)
     if rc != 0:
         module.fail_json(msg='non-zero return code', **result)
 
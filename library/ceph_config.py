@@ -7,12 +7,16 @@ __metaclass__ = type
 
 from ansible.module_utils.basic import AnsibleModule  # type: ignore
 try:
-    from ansible.module_utils.ca_common import exit_module, generate_cmd, fatal, is_containerized  # type: ignore
+    from ansible.module_utils.ca_common import exit_module, exec_command, exec_commands_batch, exec_read_command, \
+        generate_cmd, fatal, is_containerized  # type: ignore
 except ImportError:
-    from module_utils.ca_common import exit_module, generate_cmd, fatal, is_containerized  # type: ignore
+    from module_utils.ca_common import exit_module, exec_command, exec_commands_batch, exec_read_command, \
+        generate_cmd, fatal, is_containerized  # type: ignore
 
 import datetime
+import decimal
 import json
+import re
 
 ANSIBLE_METADATA = {
     'metadata_version': '1.1',
@@ -27,6 +31,10 @@ short_description: set ceph config
 version_added: "2.10"
 description:
     - Set Ceph config options.
+    - The current value of an option is looked up with its masks (in any
+      order) and compared on what it means, e.g. 4G and 4294967296, true
+      and 1 or 1h and 3600 are the same, so an option which is already
+      set isn't set again.
 options:
     fsid:
         description:
@@ -44,15 +52,30 @@ options:
     who:
         description:
             - which daemon the configuration should be set to
-        required: true
+            - the default daemon of the entries of 'options'.
+        required: true unless 'options' is set
     option:
         description:
             - name of the parameter to be set
-        required: true
+        required: true unless 'options' is set
     value:
         description:
             - value of the parameter
         required: true if action is 'set'
+    options:
+        description:
+            - the parameters to set or remove in a single run, instead of
+              'option'. Either a dict of parameters and values per daemon
+              (like ceph_conf_overrides), or a list of dicts with 'who'
+              (defaults to the module one), 'option' and 'value'.
+            - the current configuration is read once. The parameters
+              missing from the configuration and set on a daemon type or
+              name are assimilated at once with 'config assimilate-conf',
+              which doesn't update existing values. The others (updates,
+              masks, removals) are applied by a single batch of commands.
+            - the result of each parameter is returned in 'options', with
+              its value before the change in 'before'.
+        required: false
 
 author:
     - Guillaume Abrioux <gabrioux@redhat.com>
@@ -73,6 +96,16 @@ EXAMPLES = '''
     option: osd_memory_target
     value: 5368709120
 
+- name: set all the tuned options at once
+  ceph_config:
+    options:
+      global:
+        osd_pool_default_size: 3
+      osd:
+        osd_memory_target: 5368709120
+      osd/host:ceph-osd-02:
+        osd_memory_target: 4294967296
+
 - name: get osd_pool_default_size value
   ceph_config:
     action: get
@@ -98,7 +131,7 @@ def set_option(module,
                        cluster=module.params.get('cluster'),
                        container_image=container_image)
 
-    rc, out, err = module.run_command(cmd)
+    rc, cmd, out, err = exec_command(module, cmd)
 
     return rc, cmd, out.strip(), err
 
@@ -116,7 +149,7 @@ def rm_option(module,
                        cluster=module.params.get('cluster'),
                        container_image=container_image)
 
-    rc, out, err = module.run_command(cmd)
+    rc, cmd, out, err = exec_command(module, cmd)
 
     return rc, cmd, out.strip(), err
 
@@ -126,33 +159,298 @@ def get_config_dump(module, container_image=None):
                        args=[],
                        cluster=module.params.get('cluster'),
                        container_image=container_image)
-    rc, out, err = module.run_command(cmd)
+    rc, cmd, out, err = exec_read_command(module, cmd, epoch='config')
     if rc:
         fatal(message=f"Can't get current configuration via `ceph config dump`.Error:\n{err}", module=module)
     out = out.strip()
     return rc, cmd, out, err
 
 
+# values ceph parses as booleans, besides 1 and 0
+BOOLEANS = {'true': 1, 'false': 0}
+
+NUMBER = re.compile(r'^[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?$')
+
+# sizes take IEC units, e.g. 4G, 4Gi or 4GiB
+SIZE = re.compile(r'^(\d+)\s*([KMGTPE])(i?B?)?$')
+
+SIZE_UNITS = {'K': 1, 'M': 2, 'G': 3, 'T': 4, 'P': 5, 'E': 6}
+
+# durations are made of <number><unit>, e.g. 1h30m
+DURATION = re.compile(r'(\d+(?:\.\d+)?)\s*([a-z]+)\s*')
+
+DURATION_UNITS = {
+    's': 1, 'sec': 1, 'secs': 1, 'second': 1, 'seconds': 1,
+    'm': 60, 'min': 60, 'mins': 60, 'minute': 60, 'minutes': 60,
+    'h': 3600, 'hr': 3600, 'hrs': 3600, 'hour': 3600, 'hours': 3600,
+    'd': 86400, 'day': 86400, 'days': 86400,
+    'w': 604800, 'wk': 604800, 'week': 604800, 'weeks': 604800,
+}
+
+
+def normalize_name(option):
+    '''
+    Normalize an option name the way ceph does
+    '''
+
+    return option.strip().replace('-', '_').replace(' ', '_')
+
+
+def normalize_who(who):
+    '''
+    Normalize a daemon and its masks, the location mask
+    (e.g. host:ceph-osd-02) comes before the device class one
+    (e.g. class:ssd) like in the config dump
+    '''
+
+    section, _, mask = who.strip().partition('/')
+    masks = [m.strip() for m in mask.split('/') if m.strip()]
+    masks.sort(key=lambda m: m.startswith('class:'))
+
+    return '/'.join([section] + masks)
+
+
+def config_key(who, option):
+    '''
+    Build the key of an option in the index of the config dump
+    '''
+
+    return normalize_who(who), normalize_name(option)
+
+
+def normalize_value(value):
+    '''
+    Normalize a value the way ceph parses it, booleans, numbers, sizes
+    and durations are compared on what they mean (e.g. 4G is
+    4294967296, true is 1 and 1h is 3600), the other values are
+    compared case-insensitively
+    '''
+
+    value = str(value).strip()
+    if value.lower() in BOOLEANS:
+        return decimal.Decimal(BOOLEANS[value.lower()])
+    if NUMBER.match(value):
+        return decimal.Decimal(value)
+    size = SIZE.match(value)
+    if size:
+        return decimal.Decimal(int(size.group(1)) * 1024 ** SIZE_UNITS[size.group(2)])  # noqa: E501
+    if value and DURATION.sub('', value) == '':
+        units = DURATION.findall(value)
+        if all(unit in DURATION_UNITS for _, unit in units):
+            return sum(decimal.Decimal(number) * DURATION_UNITS[unit]
+                       for number, unit in units)
+
+    return value.lower()
+
+
 def get_current_value(who, option, config_dump):
+    return get_config_index(config_dump).get(config_key(who, option))
+
+
+def get_config_index(config_dump):
+    '''
+    Index the values of a config dump by (who, name), who is the
+    section followed by the masks if any (e.g. osd/host:ceph-osd-02)
+    '''
+
+    index = {}
     for config in config_dump:
-        if config['section'] == who and config['name'] == option:
-            return config['value']
-    return None
+        who = config['section']
+        if config.get('mask'):
+            who = '{}/{}'.format(who, config['mask'])
+        index[config_key(who, config['name'])] = config['value']
+
+    return index
+
+
+def is_value_set(current_value, value):
+    '''
+    Check if an option already has the requested value
+    '''
+
+    return bool(current_value) and normalize_value(value) == normalize_value(current_value)  # noqa: E501
+
+
+def get_config_entries(module):
+    '''
+    Build the list of (who, option, value) of 'options', either a dict
+    of options per daemon or a list of dicts with 'who' (defaults to the
+    module one), 'option' and 'value'. The last entry of an option wins.
+    '''
+
+    options = module.params.get('options')
+    if isinstance(options, dict):
+        items = []
+        for who, values in options.items():
+            if not isinstance(values, dict):
+                fatal(f"'options' of {who} must be a dict of option and value", module)  # noqa: E501
+            items.extend(dict(who=who, option=option, value=value)
+                         for option, value in values.items())
+    elif isinstance(options, list):
+        items = options
+    else:
+        fatal("'options' must be a dict or a list", module)
+
+    entries = {}
+    for item in items:
+        if not isinstance(item, dict) or not item.get('option'):
+            fatal(f"invalid entry in 'options': {item}", module)
+        who = item.get('who') or module.params.get('who')
+        value = item.get('value')
+        if not who:
+            fatal(f"no 'who' for the option {item['option']}", module)
+        if module.params.get('action') == 'set' and value is None:
+            fatal(f"no value for the option {item['option']} of {who}", module)  # noqa: E501
+        if isinstance(value, bool):
+            value = str(value).lower()
+        # the same option given twice (maybe spelled differently) is set once
+        entries[config_key(who, item['option'])] = (who, item['option'], None if value is None else str(value))  # noqa: E501
+
+    return list(entries.values())
+
+
+def can_assimilate(who, value):
+    '''
+    Check if an option can be set from a ceph.conf section, masks and
+    values which would break the ini syntax can't
+    '''
+
+    return '/' not in who and not any(c in value for c in '#;\n') and value.strip() == value  # noqa: E501
+
+
+def generate_conf(entries):
+    '''
+    Generate a ceph.conf setting a list of (who, option, value)
+    '''
+
+    sections = {}
+    for who, option, value in entries:
+        sections.setdefault(who, []).append('{} = {}'.format(option, value))
+
+    return ''.join('[{}]\n{}\n'.format(who, '\n'.join(lines))
+                   for who, lines in sections.items())
+
+
+def parse_conf_options(conf):
+    '''
+    Return the (section, option) set in a ceph.conf
+    '''
+
+    options = set()
+    section = 'global'
+    for line in conf.splitlines():
+        line = line.split('#', 1)[0].split(';', 1)[0].strip()
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1].strip()
+        elif '=' in line:
+            options.add((section, line.split('=', 1)[0].strip().replace(' ', '_')))  # noqa: E501
+
+    return options
+
+
+def assimilate_conf(module, entries, container_image=None):
+    '''
+    Set a list of (who, option, value) with a single
+    'config assimilate-conf', return (rc, cmd, out, err, rejected)
+    where rejected holds the (who, option) left in its output
+    '''
+
+    cmd = generate_cmd(sub_cmd=['config', 'assimilate-conf'],
+                       args=['-i', '-'],
+                       cluster=module.params.get('cluster'),
+                       container_image=container_image,
+                       interactive=True)
+
+    rc, cmd, out, err = exec_command(module, cmd, stdin=generate_conf(entries))  # noqa: E501
+    left = parse_conf_options(out)
+    rejected = set((who, option) for who, option, value in entries
+                   if (who, option.replace(' ', '_')) in left)
+
+    return rc, cmd, out, err, rejected
+
+
+def reconcile_options(module, entries, config_index, container_image=None):
+    '''
+    Set or remove a list of (who, option, value) against an indexed
+    config dump. The new options set on a plain section are assimilated
+    at once, 'config assimilate-conf' keeps the existing values so the
+    others are set or removed by a single batch.
+    Return (rc, cmd, out, err, changed, diff, results) where results
+    holds the result of each option.
+    '''
+
+    action = module.params.get('action')
+    results = []
+    for who, option, value in entries:
+        current_value = config_index.get(config_key(who, option))
+        if action == 'set':
+            changed = not is_value_set(current_value, value)
+        else:
+            changed = bool(current_value)
+        name = '{}/{}'.format(who, option)
+        results.append(dict(who=who, option=option, value=value,
+                            before=current_value, changed=changed, rc=0,
+                            stderr='',
+                            diff=dict(before='{} = {}\n'.format(option, current_value) if current_value is not None else '',  # noqa: E501
+                                      after='{} = {}\n'.format(option, value) if action == 'set' else '',  # noqa: E501
+                                      before_header=name, after_header=name)))  # noqa: E501
+
+    pending = [r for r in results if r['changed']]
+    cmd = []
+    if pending and not module.check_mode:
+        to_assimilate = [r for r in pending if action == 'set' and r['before'] is None and can_assimilate(r['who'], r['value'])]  # noqa: E501
+        to_batch = [r for r in pending if r not in to_assimilate]
+        if to_assimilate:
+            conf_entries = [(r['who'], r['option'], r['value']) for r in to_assimilate]  # noqa: E501
+            _rc, _cmd, _out, _err, rejected = assimilate_conf(module,
+                                                              conf_entries,
+                                                              container_image=container_image)  # noqa: E501
+            cmd.append(_cmd)
+            for result in to_assimilate:
+                if _rc != 0:
+                    result.update(rc=_rc, stderr=_err)
+                elif (result['who'], result['option']) in rejected:
+                    result.update(rc=1, stderr="{} can't be assimilated".format(result['option']))  # noqa: E501
+        if to_batch:
+            cmd_list = [generate_cmd(sub_cmd=['config', action],
+                                     args=[r['who'], r['option']] + ([r['value']] if action == 'set' else []),  # noqa: E501
+                                     cluster=module.params.get('cluster'),
+                                     container_image=container_image)
+                        for r in to_batch]
+            outputs = exec_commands_batch(module, cmd_list, stop_on_error=False)  # noqa: E501
+            outputs.extend((1, _cmd, '', 'not executed')
+                           for _cmd in cmd_list[len(outputs):])
+            for result, (_rc, _cmd, _out, _err) in zip(to_batch, outputs):
+                if _rc != 0:
+                    result.update(rc=_rc, stderr=_err)
+            cmd.extend(cmd_list)
+
+    failed = [r for r in results if r['rc'] != 0]
+    rc = failed[0]['rc'] if failed else 0
+    err = '\n'.join(r['stderr'].strip() for r in failed)
+    out = '\n'.join('who={} option={} {}'.format(r['who'], r['option'], 'value={} set'.format(r['value']) if action == 'set' else 'removed')  # noqa: E501
+                    for r in pending if r['rc'] == 0)
+    changed = len(pending) > 0
+    diff = [r['diff'] for r in results if r['changed']]
+
+    return rc, cmd, out, err, changed, diff, results
 
 
 def main() -> None:
     module = AnsibleModule(
         argument_spec=dict(
-            who=dict(type='str', required=True),
+            who=dict(type='str', required=False),
             action=dict(type='str', required=False, choices=['get', 'set', 'rm'], default='set'),
-            option=dict(type='str', required=True),
+            option=dict(type='str', required=False),
+            options=dict(type='raw', required=False),
             value=dict(type='str', required=False),
             fsid=dict(type='str', required=False),
             image=dict(type='str', required=False),
             cluster=dict(type='str', required=False, default='ceph')
         ),
         supports_check_mode=True,
-        required_if=[['action', 'set', ['value']]]
+        mutually_exclusive=[['option', 'options']],
+        required_one_of=[['option', 'options']],
     )
 
     # Gather module parameters in variables
@@ -163,6 +461,25 @@ def main() -> None:
 
     container_image = is_containerized()
 
+    if module.params.get('options') is not None:
+        if action == 'get':
+            fatal("action 'get' isn't supported with 'options'", module)
+        entries = get_config_entries(module)
+        startd = datetime.datetime.now()
+        rc, cmd, out, err = get_config_dump(module, container_image=container_image)  # noqa: E501
+        config_index = get_config_index(json.loads(out))
+        rc, cmd, out, err, changed, diff, results = reconcile_options(module,
+                                                                      entries,
+                                                                      config_index,  # noqa: E501
+                                                                      container_image=container_image)  # noqa: E501
+        exit_module(module=module, out=out, rc=rc, cmd=cmd, err=err,
+                    startd=startd, changed=changed, diff=diff, options=results)
+
+    if not who:
+        fatal("missing required arguments: who", module)
+    if action == 'set' and value is None:
+        fatal("action is set but all of the following are missing: value", module)
+
     if module.check_mode:
         module.exit_json(
             changed=False,
@@ -183,7 +500,7 @@ def main() -> None:
     current_value = get_current_value(who, option, config_dump)
 
     if action == 'set':
-        if current_value and value.lower() == current_value.lower():
+        if is_value_set(current_value, value):
             out = 'who={} option={} value={} already set. Skipping.'.format(who, option, value)
         else:
             rc, cmd, out, err = set_option(module, who, option, value, container_image=container_image)
@@ -9,10 +9,15 @@ __metaclass__ = type
 
 from ansible.module_utils.basic import AnsibleModule
 try:
-    from ansible.module_utils.ca_common import fatal
+    from ansible.module_utils.ca_common import add_trace, exec_command, exec_commands_batch, exec_read_command, fatal
 except ImportError:
-    from module_utils.ca_common import fatal
+    from module_utils.ca_common import add_trace, exec_command, exec_commands_batch, exec_read_command, fatal
+try:
+    from ansible.module_utils.ca_crush import CrushTree, location_hierarchy
+except ImportError:
+    from module_utils.ca_crush import CrushTree, location_hierarchy
 import datetime
+import shlex
 
 ANSIBLE_METADATA = {
     'metadata_version': '1.1',
@@ -33,6 +38,10 @@ version_added: "2.6"
 description:
     - By using the hostvar variable 'osd_crush_location'
     ceph_crush creates buckets and places them in the right CRUSH hierarchy
+    - With 'locations', the hierarchy of all the hosts is built at once:
+    the CRUSH map is fetched, edited offline with crushtool, checked and
+    injected back with a single 'osd setcrushmap', so the whole topology
+    changes in one osdmap epoch.
 
 options:
     cluster:
@@ -44,7 +53,13 @@ options:
         description:
             - osd_crush_location dict from the inventory file. It contains
             the placement of each host in the CRUSH map.
-        required: true
+            Mutually exclusive with 'locations'.
+        required: false
+    locations:
+        description:
+            - list of the osd_crush_location dicts of all the hosts.
+            Mutually exclusive with 'location'.
+        required: false
     containerized:
         description:
             - Weither or not this is a containerized cluster. The value is
@@ -61,10 +76,33 @@ EXAMPLES = '''
     containerized: "{{ container_exec_cmd }}"
   with_items: "{{ groups[osd_group_name] }}"
   when: crush_rule_config | bool
+
+- name: configure the crush hierarchy of all the osd hosts at once
+  ceph_crush:
+    cluster: "{{ cluster }}"
+    locations: "{{ groups[osd_group_name] | map('extract', hostvars)
+                   | selectattr('osd_crush_location', 'defined')
+                   | map(attribute='osd_crush_location') | list }}"
+    containerized: "{{ container_exec_cmd }}"
+  run_once: true
+  when: crush_rule_config | bool
 '''
 
 RETURN = '''#  '''
 
+CRUSH_BUCKET_TYPES = [
+    "host",
+    "chassis",
+    "rack",
+    "row",
+    "pdu",
+    "pod",
+    "room",
+    "datacenter",
+    "region",
+    "root",
+]
+
 
 def generate_cmd(cluster, subcommand, bucket, bucket_type, containerized=None):
     '''
@@ -96,21 +134,9 @@ def sort_osd_crush_location(location, module):
         fatal("You must specify a 'host' bucket.", module)
 
     try:
-        crush_bucket_types = [
-            "host",
-            "chassis",
-            "rack",
-            "row",
-            "pdu",
-            "pod",
-            "room",
-            "datacenter",
-            "region",
-            "root",
-        ]
-        return sorted(location, key=lambda crush: crush_bucket_types.index(crush[0]))  # noqa: E501
+        return sorted(location, key=lambda crush: CRUSH_BUCKET_TYPES.index(crush[0]))  # noqa: E501
     except ValueError as error:
-        fatal("{} is not a valid CRUSH bucket, valid bucket types are {}".format(error.args[0].split()[0], crush_bucket_types), module)  # noqa: E501
+        fatal("{} is not a valid CRUSH bucket, valid bucket types are {}".format(error.args[0].split()[0], CRUSH_BUCKET_TYPES), module)  # noqa: E501
 
 
 def get_crush_tree(module, cluster, containerized=None):
@@ -130,72 +156,148 @@ def get_crush_tree(module, cluster, containerized=None):
     if containerized:
         cmd = containerized.split() + cmd
 
-    rc, out, err = module.run_command(cmd)
-    return rc, cmd, out, err
+    return exec_read_command(module, cmd)
 
 
-def create_and_move_buckets_list(cluster, location, crush_map, containerized=None):  # noqa: E501
+def create_and_move_buckets_list(cluster, location, crush_map, containerized=None, module=None):  # noqa: E501
     '''
     Creates Ceph CRUSH buckets and arrange the hierarchy
     '''
-    def bucket_exists(bucket_name, bucket_type):
-        for item in crush_map['nodes']:
-            if item['name'] == bucket_name and item['type'] == bucket_type:
-                return True
-        return False
-
-    def bucket_in_place(bucket_name, target_bucket_name, target_bucket_type):  # noqa: E501
-        bucket_id = None
-        target_bucket = None
-        for item in crush_map['nodes']:
-            if item['name'] == bucket_name:
-                bucket_id = item['id']
-            if item['name'] == target_bucket_name and item['type'] == target_bucket_type:  # noqa: E501
-                target_bucket = item
 
-        if not bucket_id or not target_bucket:
-            return False
-
-        return bucket_id in target_bucket['children']
+    try:
+        changes = dict((bucket_name, action) for action, bucket_type, bucket_name, parent  # noqa: E501
+                       in CrushTree(crush_map['nodes']).diff(location))
+    except ValueError as error:
+        fatal(str(error), module)
 
     previous_bucket = None
     cmd_list = []
     for item in location:
         bucket_type, bucket_name = item
         # ceph osd crush add-bucket maroot root
-        if not bucket_exists(bucket_name, bucket_type):
+        if changes.get(bucket_name) == 'add':
             cmd_list.append(generate_cmd(cluster, "add-bucket", bucket_name, bucket_type, containerized))  # noqa: E501
         if previous_bucket:
             # ceph osd crush move monrack root=maroot
-            if not bucket_in_place(previous_bucket, bucket_name, bucket_type):  # noqa: E501
+            if previous_bucket in changes:
                 cmd_list.append(generate_cmd(cluster, "move", previous_bucket, "%s=%s" % (bucket_type, bucket_name), containerized))  # noqa: E501
         previous_bucket = item[1]
     return cmd_list
 
 
+def get_crush_hierarchy(locations, module):
+    '''
+    Merge the locations of several hosts into a single hierarchy
+    Return a list of (bucket_type, bucket_name, parent), parent is the
+    (bucket_type, bucket_name) tuple of the parent bucket or None
+    '''
+
+    hierarchy = {}
+    for location_dict in locations:
+        location = sort_osd_crush_location(tuple(location_dict.items()), module)  # noqa: E501
+        for bucket_type, bucket_name, parent in location_hierarchy(location):
+            bucket = hierarchy.setdefault(bucket_name, (bucket_type, parent))  # noqa: E501
+            if bucket[0] != bucket_type:
+                fatal("bucket {} is both a {} and a {}".format(bucket_name, bucket[0], bucket_type), module)  # noqa: E501
+            if parent is not None and bucket[1] is not None and bucket[1] != parent:  # noqa: E501
+                fatal("bucket {} is both in {}={} and {}={}".format(bucket_name, bucket[1][0], bucket[1][1], parent[0], parent[1]), module)  # noqa: E501
+            if bucket[1] is None:
+                hierarchy[bucket_name] = (bucket_type, parent)
+
+    return [(bucket_type, bucket_name, parent)
+            for bucket_name, (bucket_type, parent) in hierarchy.items()]
+
+
+def create_and_move_buckets_edits(hierarchy, crush_map, module=None):
+    '''
+    Return the crushtool arguments creating and moving the buckets of
+    a hierarchy, the parents are handled before their children
+    '''
+
+    try:
+        changes = CrushTree(crush_map['nodes']).diff_hierarchy(hierarchy)
+    except ValueError as error:
+        fatal(str(error), module)
+
+    edits = []
+    for action, bucket_type, bucket_name, parent in changes:
+        loc = ['--loc', parent[0], parent[1]] if parent else []
+        if action == 'add':
+            edits.append(['--add-bucket', bucket_name, bucket_type] + loc)
+        else:
+            edits.append(['--move', bucket_name] + loc)
+    return edits
+
+
+def generate_crushmap_script(cluster, edits):
+    '''
+    Generate a script fetching the CRUSH map, applying the crushtool
+    edits, checking the result and injecting it, the injection fails
+    if the map was changed in the meantime
+    '''
+
+    quote = shlex.quote
+    ceph = 'ceph --cluster {}'.format(quote(cluster))
+    script = [
+        'set -e',
+        'crushmap=$(mktemp -d)',
+        'trap \'rm -rf "$crushmap"\' EXIT',
+        # the crush version is the last word printed on stderr
+        'err=$({} osd getcrushmap -o "$crushmap/map" 2>&1 >/dev/null) || {{ rc=$?; echo "$err" >&2; exit $rc; }}'.format(ceph),  # noqa: E501
+        'version=$(printf \'%s\\n\' "$err" | tail -n 1 | grep -o \'[0-9]*$\' || true)',  # noqa: E501
+        'case "$version" in \'\'|*[!0-9]*) echo "unexpected crush version: $err" >&2; exit 1;; esac',  # noqa: E501
+    ]
+    for edit in edits:
+        script.append('crushtool -i "$crushmap/map" {} -o "$crushmap/map"'.format(' '.join(quote(arg) for arg in edit)))  # noqa: E501
+    script.append('crushtool -i "$crushmap/map" --check')
+    script.append('{} osd setcrushmap -i "$crushmap/map" "$version"'.format(ceph))  # noqa: E501
+    return '\n'.join(script)
+
+
+def update_crushmap(module, cluster, edits, containerized=None):
+    '''
+    Apply crushtool edits to the CRUSH map in a single injection
+    '''
+
+    cmd = ['sh', '-c', generate_crushmap_script(cluster, edits)]
+    if containerized:
+        cmd = containerized.split() + cmd
+    return exec_command(module, cmd)
+
+
 def exec_commands(module, cmd_list):
     '''
-    Creates Ceph commands
+    Creates Ceph commands, return the result of the first one that
+    failed or of the last one
     '''
-    for cmd in cmd_list:
-        rc, out, err = module.run_command(cmd)
-    return rc, cmd, out, err
+    results = exec_commands_batch(module, cmd_list, stop_on_error=False)
+    for result in results:
+        if result[0] != 0:
+            return result
+    return results[-1]
 
 
 def main():
     module = AnsibleModule(
         argument_spec=dict(
             cluster=dict(type='str', required=False, default='ceph'),
-            location=dict(type='dict', required=True),
+            location=dict(type='dict', required=False),
+            locations=dict(type='list', elements='dict', required=False),
             containerized=dict(type='str', required=False, default=None),
         ),
         supports_check_mode=True,
+        mutually_exclusive=[('location', 'locations')],
+        required_one_of=[('location', 'locations')],
     )
 
     cluster = module.params['cluster']
     location_dict = module.params['location']
-    location = sort_osd_crush_location(tuple(location_dict.items()), module)
+    locations = module.params['locations']
     containerized = module.params['containerized']
+    if locations is not None:
+        hierarchy = get_crush_hierarchy(locations, module)
+    else:
+        location = sort_osd_crush_location(tuple(location_dict.items()), module)  # noqa: E501
 
     diff = dict(before="", after="")
     startd = datetime.datetime.now()
@@ -211,14 +313,23 @@ def main():
     else:
         crush_map = {"nodes": []}
 
-    # run the Ceph command to add buckets
-    cmd_list = create_and_move_buckets_list(cluster, location, crush_map, containerized)  # noqa: E501
+    if locations is not None:
+        # edit the whole hierarchy offline and inject it at once
+        edits = create_and_move_buckets_edits(hierarchy, crush_map, module)
+        changed = len(edits) > 0
+        if changed:
+            diff['after'] = module.jsonify(edits)
+            if not module.check_mode:
+                rc, cmd, out, err = update_crushmap(module, cluster, edits, containerized)  # noqa: E501
+    else:
+        # run the Ceph command to add buckets
+        cmd_list = create_and_move_buckets_list(cluster, location, crush_map, containerized, module)  # noqa: E501
 
-    changed = len(cmd_list) > 0
-    if changed:
-        diff['after'] = module.jsonify(cmd_list)
-        if not module.check_mode:
-            rc, cmd, out, err = exec_commands(module, cmd_list)  # noqa: E501
+        changed = len(cmd_list) > 0
+        if changed:
+            diff['after'] = module.jsonify(cmd_list)
+            if not module.check_mode:
+                rc, cmd, out, err = exec_commands(module, cmd_list)  # noqa: E501
 
     endd = datetime.datetime.now()
     delta = endd - startd
@@ -235,6 +346,8 @@ def main():
         diff=diff
     )
 
+    add_trace(result)
+
     if rc != 0:
         module.fail_json(msg='non-zero return code', **result)
 
@@ -20,19 +20,34 @@ try:
     from ansible.module_utils.ca_common import generate_cmd, \
         is_containerized, \
         container_exec, \
+        exec_command, \
+        exec_commands_batch, \
+        read_cache_dir, \
+        write_read_cache, \
+        add_trace, \
+        exit_module, \
         fatal
 except ImportError:
     from module_utils.ca_common import generate_cmd, \
         is_containerized, \
         container_exec, \
+        exec_command, \
+        exec_commands_batch, \
+        read_cache_dir, \
+        write_read_cache, \
+        add_trace, \
+        exit_module, \
         fatal
 import datetime
+import hashlib
+import hmac
 import json
 import os
 import struct
 import time
 import base64
 import socket
+import tempfile
 
 
 ANSIBLE_METADATA = {
@@ -54,6 +69,12 @@ version_added: "2.6"
 description:
     - Manage CephX creation, deletion and updates.
     It can also list and get information about keyring(s).
+    - When the key trust cache is enabled (CEPH_KEY_TRUST), the keys found
+    in the cluster are remembered for CEPH_KEY_TRUST_TTL seconds (one day
+    by default), signed with their own secret. A keyring file matching the
+    requested key and a remembered one is then trusted without reading the
+    cluster. It is independent of the read cache (CEPH_READ_CACHE), only
+    the directory (CEPH_READ_CACHE_DIR) is shared.
 options:
     cluster:
         description:
@@ -63,7 +84,22 @@ options:
     name:
         description:
             - name of the CephX key
-        required: true
+            - required unless 'keys' is set.
+        required: false
+    keys:
+        description:
+            - list of keys to create or update in a single run, instead of
+              'name'.
+            - each item takes 'name' and optionally 'caps', 'secret',
+              'dest', 'mode', 'owner' and 'group', 'caps' and 'dest'
+              default to the ones given to the module.
+            - the existing entities are read once, the missing secrets
+              are generated by the module and all the new or updated
+              entities are imported with a single 'ceph auth import', so
+              'user' must be allowed to import keys.
+            - only 'present' and 'update' states are supported, the result
+              of each key is returned in 'keys'.
+        required: false
     user:
         description:
             - entity used to perform operation.
@@ -175,6 +211,11 @@ caps:
     caps: "{{ caps }}"
     import_key: False
 
+- name: create all the client keys at once
+  ceph_key:
+    keys: "{{ keys_to_create }}"
+    dest: /etc/ceph/
+
 - name: delete cephx key
   ceph_key:
     name: "my_key"
@@ -191,6 +232,9 @@ RETURN = '''#  '''
 CEPH_INITIAL_KEYS = ['client.admin', 'client.bootstrap-mds', 'client.bootstrap-mgr',  # noqa: E501
                      'client.bootstrap-osd', 'client.bootstrap-rbd', 'client.bootstrap-rbd-mirror', 'client.bootstrap-rgw']  # noqa: E501
 
+# how long a key found in the cluster is trusted, in seconds
+KEY_TRUST_TTL = 86400
+
 
 def str_to_bool(val):
     try:
@@ -401,12 +445,8 @@ def exec_commands(module, cmd_list):
     Execute command(s)
     '''
 
-    for cmd in cmd_list:
-        rc, out, err = module.run_command(cmd)
-        if rc != 0:
-            return rc, cmd, out, err
-
-    return rc, cmd, out, err
+    # the commands run in a single process and stop at the first failure
+    return exec_commands_batch(module, cmd_list)[-1]
 
 
 def lookup_ceph_initial_entities(module, out):
@@ -464,10 +504,287 @@ def build_key_path(cluster, entity):
     return key_path
 
 
+def build_key_dest(cluster, name, dest):
+    '''
+    Build the path of the keyring file of an entity, dest is either
+    the file or its directory
+    '''
+
+    # if dest is not a directory, the user wants to change the file's name
+    # (e,g: /etc/ceph/ceph.mgr.ceph-mon2.keyring)
+    if not os.path.isdir(dest):
+        return dest
+
+    if 'bootstrap' in dest:
+        # Build a different path for bootstrap keys as there are stored
+        # as /var/lib/ceph/bootstrap-rbd/ceph.keyring
+        keyring_filename = cluster + '.keyring'
+    else:
+        keyring_filename = cluster + "." + name + ".keyring"
+
+    return os.path.join(dest, keyring_filename)
+
+
+def generate_keyring(entities):
+    '''
+    Generate the content of a keyring from a list of (name, secret, caps)
+    '''
+
+    lines = []
+    for name, secret, caps in entities:
+        lines.append('[{}]'.format(name))
+        lines.append('\tkey = {}'.format(secret))
+        for k, v in sorted(caps.items()):
+            if len(k) == 0:
+                continue
+            lines.append('\tcaps {} = "{}"'.format(k, v))
+
+    return '\n'.join(lines) + '\n'
+
+
+def parse_keyring(content):
+    '''
+    Parse the content of a keyring, return a dict of the entities with
+    their key and caps
+    '''
+
+    entities = {}
+    entity = None
+    for line in content.splitlines():
+        line = line.strip()
+        if line.startswith('[') and line.endswith(']'):
+            entity = entities.setdefault(line[1:-1], {'key': None, 'caps': {}})  # noqa: E501
+            continue
+        k, _, v = line.partition('=')
+        k = k.strip()
+        if entity is None or not v:
+            continue
+        if k == 'key':
+            entity['key'] = v.strip()
+        elif k.startswith('caps '):
+            entity['caps'][k[5:].strip()] = v.strip().strip('"')
+
+    return entities
+
+
+def read_keyring(path):
+    '''
+    Read the entities of a keyring file, an empty dict if it can't be read
+    '''
+
+    try:
+        with open(path) as f:
+            return parse_keyring(f.read())
+    except (IOError, OSError):
+        return {}
+
+
+def write_keyring(path, content):
+    '''
+    Atomically write a keyring file, it's only readable by its owner
+    until its attributes are set
+    '''
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.rename(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def import_keys(cluster, user, user_key, container_image=None):
+    '''
+    Import the entities of a keyring read from stdin
+    '''
+
+    cmd_list = []
+
+    args = [
+        'import',
+        '-i',
+        '-',
+    ]
+
+    cmd_list.append(generate_cmd(sub_cmd=['auth'],
+                                 args=args,
+                                 cluster=cluster,
+                                 user=user,
+                                 user_key=user_key,
+                                 container_image=container_image,
+                                 interactive=True))
+
+    return cmd_list
+
+
+def key_fingerprint(name, entity):
+    '''
+    Sign the key and caps of an entity with its own secret
+    '''
+
+    payload = json.dumps([name, entity['key'], sorted(entity['caps'].items())])  # noqa: E501
+    return hmac.new(entity['key'].encode(), payload.encode(), hashlib.sha256).hexdigest()  # noqa: E501
+
+
+def key_cache_path(cluster, name):
+    '''
+    Build the path of the read cache entry of an entity
+    '''
+
+    digest = hashlib.sha1(name.encode()).hexdigest()
+    return os.path.join(read_cache_dir(cluster), 'auth-' + digest + '.json')
+
+
+def key_trust_enabled():
+    '''
+    Check if the key trust cache is enabled
+    '''
+
+    return os.getenv('CEPH_KEY_TRUST', 'false').lower() in ['true', 'yes', '1']  # noqa: E501
+
+
+def is_key_verified(cluster, name, entity):
+    '''
+    Check if the cluster was found to hold this key and caps for the
+    entity less than CEPH_KEY_TRUST_TTL seconds ago
+    '''
+
+    if not key_trust_enabled() or not entity or not entity['key']:
+        return False
+
+    try:
+        with open(key_cache_path(cluster, name)) as f:
+            entry = json.load(f)
+    except (IOError, ValueError):
+        return False
+
+    ttl = int(os.getenv('CEPH_KEY_TRUST_TTL', KEY_TRUST_TTL))
+    if time.time() - entry.get('time', 0) >= ttl:
+        return False
+
+    return hmac.compare_digest(str(entry.get('fingerprint')), key_fingerprint(name, entity))  # noqa: E501
+
+
+def record_key_verified(cluster, name, entity):
+    '''
+    Remember that the cluster holds this key and caps for the entity
+    '''
+
+    if key_trust_enabled():
+        write_read_cache(key_cache_path(cluster, name),
+                         dict(entity=name,
+                              time=time.time(),
+                              fingerprint=key_fingerprint(name, entity)))
+
+
+def key_matches(entity, secret, caps):
+    '''
+    Check if an entity has the requested secret and caps, the ones
+    which aren't requested match anything
+    '''
+
+    return bool(entity) and (not secret or secret == entity['key']) and \
+        (not caps or caps == entity['caps'])
+
+
+def provision_keys(module,
+                   cluster,
+                   user,
+                   user_key,
+                   keys,
+                   import_key,
+                   container_image=None):
+    '''
+    Create or update a list of keys. The existing entities are read
+    with a single 'auth ls', the missing secrets are generated here and
+    all the new or updated entities are imported at once, then the
+    keyring file of each key is written. The cluster isn't read when
+    the keyring files match the requested keys and were recently
+    verified against it.
+    Return (rc, cmd, out, err, changed, results) where results holds
+    the result of each key.
+    '''
+
+    paths = [build_key_dest(cluster, item['name'], item['dest']) for item in keys]  # noqa: E501
+    local_keys = [read_keyring(path).get(item['name']) for item, path in zip(keys, paths)]  # noqa: E501
+
+    rc, cmd, out, err = 0, [], '', ''
+    running = {}
+    if import_key and all(key_matches(local, item['secret'], item['caps']) and
+                          is_key_verified(cluster, item['name'], local)
+                          for item, local in zip(keys, local_keys)):
+        running = dict((item['name'], local) for item, local in zip(keys, local_keys))  # noqa: E501
+    elif import_key:
+        rc, cmd, out, err = exec_commands(module, list_keys(cluster, user, user_key, container_image))  # noqa: E501
+        if rc != 0:
+            return rc, cmd, out, err, False, []
+        for entity in json.loads(out).get('auth_dump', []):
+            running[entity['entity']] = {'key': entity['key'],
+                                         'caps': entity.get('caps', {})}
+
+    results = []
+    entities = []
+    to_import = []
+    for item, path, local in zip(keys, paths, local_keys):
+        name = item['name']
+        # without import, the keyring file is the reference
+        current = running.get(name) if import_key else local
+        if current is None and not item['caps']:
+            fatal("Capabilities must be provided for {0} as it doesn't exist".format(name), module)  # noqa: E501
+        secret = item['secret'] or (current or {}).get('key') or generate_secret().decode()  # noqa: E501
+        caps = item['caps'] or current['caps']
+        entity = {'key': secret, 'caps': caps}
+        if import_key and entity != current:
+            to_import.append((name, secret, caps))
+        entities.append((item, path, entity, local))
+        results.append(dict(name=name, dest=path,
+                            changed=entity != current or entity != local))
+
+    if to_import and not module.check_mode:
+        rc, cmd, out, err = exec_command(module,
+                                         import_keys(cluster, user, user_key, container_image)[0],  # noqa: E501
+                                         stdin=generate_keyring(to_import))
+        if rc != 0:
+            return rc, cmd, out, err, False, results
+
+    reports = []
+    for result, (item, path, entity, local) in zip(results, entities):
+        if module.check_mode:
+            continue
+        if import_key:
+            record_key_verified(cluster, item['name'], entity)
+        if entity != local:
+            write_keyring(path, generate_keyring([(item['name'], entity['key'], entity['caps'])]))  # noqa: E501
+        file_args = module.load_file_common_arguments(module.params)
+        file_args['path'] = path
+        for attribute in ('mode', 'owner', 'group'):
+            if item.get(attribute) is not None:
+                file_args[attribute] = item[attribute]
+        result['changed'] = module.set_fs_attributes_if_different(file_args, result['changed'])  # noqa: E501
+        if result['changed']:
+            reports.append('{0} has been created or updated in {1}'.format(item['name'], path))  # noqa: E501
+
+    changed = any(result['changed'] for result in results)
+    out = '\n'.join(reports)
+
+    return rc, cmd, out, err, changed, results
+
+
 def run_module():
     module_args = dict(
         cluster=dict(type='str', required=False, default='ceph'),
         name=dict(type='str', required=False),
+        keys=dict(type='list', required=False, elements='dict', no_log=False,
+                  options=dict(name=dict(type='str', required=True),
+                               caps=dict(type='dict', required=False),
+                               secret=dict(type='str', required=False, no_log=True),  # noqa: E501
+                               dest=dict(type='str', required=False),
+                               mode=dict(type='raw', required=False),
+                               owner=dict(type='str', required=False),
+                               group=dict(type='str', required=False))),
         state=dict(type='str', required=False, default='present', choices=['present', 'update', 'absent',  # noqa: E501
                                                                            'fetch_initial_keys', 'generate_secret']),  # noqa: E501
         caps=dict(type='dict', required=False, default=None),
@@ -483,6 +800,9 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=True,
         add_file_common_args=True,
+        mutually_exclusive=[
+            ('name', 'keys'),
+        ],
     )
 
     file_args = module.load_file_common_arguments(module.params)
@@ -490,6 +810,7 @@ def run_module():
     # Gather module parameters in variables
     state = module.params['state']
     name = module.params.get('name')
+    keys = module.params.get('keys')
     cluster = module.params.get('cluster')
     caps = module.params.get('caps')
     secret = module.params.get('secret')
@@ -500,7 +821,7 @@ def run_module():
     output_format = module.params.get('output_format')
 
     # Can't use required_if with 'name' for some reason...
-    if state in ['present', 'absent', 'update'] and not name:
+    if state in ['present', 'absent', 'update'] and not name and not keys:
         fatal(f'"state" is "{state}" but "name" is not defined.', module)
 
     changed = False
@@ -515,6 +836,25 @@ def run_module():
         delta='',
     )
 
+    if keys:
+        if state not in ['present', 'update']:
+            fatal(f"state '{state}' isn't supported with 'keys'", module)
+        startd = datetime.datetime.now()
+        if not user_key:
+            user_key = os.path.join('/etc/ceph', '{}.{}.keyring'.format(cluster, user))  # noqa: E501
+        # the options which aren't set on a key default to the module ones
+        keys = [dict(item, caps=item['caps'] or caps,
+                     dest=item['dest'] or dest) for item in keys]
+        rc, cmd, out, err, changed, results = provision_keys(module,
+                                                             cluster,
+                                                             user,
+                                                             user_key,
+                                                             keys,
+                                                             import_key,
+                                                             container_image=is_containerized())  # noqa: E501
+        exit_module(module=module, out=out, rc=rc, cmd=cmd, err=err,
+                    startd=startd, changed=changed, keys=results)
+
     if module.check_mode:
         module.exit_json(**result)
 
@@ -538,21 +878,19 @@ def run_module():
         user_key_path = user_key
 
     if (state in ["present", "update"]):
-        # if dest is not a directory, the user wants to change the file's name
-        # (e,g: /etc/ceph/ceph.mgr.ceph-mon2.keyring)
-        if not os.path.isdir(dest):
-            file_path = dest
-        else:
-            if 'bootstrap' in dest:
-                # Build a different path for bootstrap keys as there are stored
-                # as /var/lib/ceph/bootstrap-rbd/ceph.keyring
-                keyring_filename = cluster + '.keyring'
-            else:
-                keyring_filename = cluster + "." + name + ".keyring"
-            file_path = os.path.join(dest, keyring_filename)
+        file_path = build_key_dest(cluster, name, dest)
 
         file_args['path'] = file_path
 
+        # the keyring file is trusted when it matches what was recently
+        # verified against the cluster
+        local_key = read_keyring(file_path).get(name)
+        if import_key and key_matches(local_key, secret, caps) and \
+                is_key_verified(cluster, name, local_key):
+            result["stdout"] = "{0} already exists and doesn't need to be updated.".format(name)  # noqa: E501
+            module.set_fs_attributes_if_different(file_args, False)
+            module.exit_json(**result)
+
         if import_key:
             _info_key = []
             rc, cmd, out, err = exec_commands(
@@ -579,6 +917,7 @@ def run_module():
                             module.exit_json(**result)
                         result["stdout"] = "fetched the key {0} at {1}.".format(name, file_path)  # noqa: E501
 
+                    record_key_verified(cluster, name, {'key': _secret, 'caps': _caps})  # noqa: E501
                     result["stdout"] = "{0} already exists and doesn't need to be updated.".format(name)  # noqa: E501
                     result["rc"] = 0
                     module.set_fs_attributes_if_different(file_args, False)
@@ -595,6 +934,8 @@ def run_module():
                 result["stdout"] = "Couldn't create or update {0}".format(name)
                 result["stderr"] = err
                 module.exit_json(**result)
+            if import_key and secret:
+                record_key_verified(cluster, name, {'key': secret, 'caps': caps})  # noqa: E501
             module.set_fs_attributes_if_different(file_args, False)
             changed = True
 
@@ -613,8 +954,9 @@ def run_module():
         user = "mon."
         keyring_filename = cluster + "-" + hostname + "/keyring"
         user_key_path = os.path.join("/var/lib/ceph/mon/", keyring_filename)
-        rc, cmd, out, err = exec_commands(
-            module, list_keys(cluster, user, user_key_path, container_image))
+        # the dump holds every secret, it doesn't go through the read cache
+        rc, cmd, out, err = exec_command(
+            module, list_keys(cluster, user, user_key_path, container_image)[0])  # noqa: E501
         if rc != 0:
             result["stdout"] = "failed to retrieve ceph keys"
             result["sdterr"] = err
@@ -622,8 +964,11 @@ def run_module():
             module.exit_json(**result)
 
         entities = lookup_ceph_initial_entities(module, out)
+        # the keyrings are rendered from the keys and caps of the dump,
+        # there is no need to get each entity
+        auth_dump = dict((e['entity'], e) for e in json.loads(out)['auth_dump'])  # noqa: E501
 
-        output_format = "plain"
+        reports = []
         for entity in entities:
             key_path = build_key_path(cluster, entity)
             if key_path is None:
@@ -633,21 +978,18 @@ def run_module():
                 # there is no need to fetch it again
                 continue
 
-            extra_args = [
-                '-o',
-                key_path,
-            ]
-
-            info_cmd = info_key(cluster, entity, user,
-                                user_key_path, output_format, container_image)
-            # we use info_cmd[0] because info_cmd is an array made of an array
-            info_cmd[0].extend(extra_args)
-            rc, cmd, out, err = exec_commands(
-                module, info_cmd)  # noqa: E501
+            write_keyring(key_path, generate_keyring([(entity,
+                                                       auth_dump[entity]['key'],  # noqa: E501
+                                                       auth_dump[entity].get('caps', {}))]))  # noqa: E501
+            reports.append("fetched the key {0} at {1}.".format(entity, key_path))  # noqa: E501
+            changed = True
 
             file_args = module.load_file_common_arguments(module.params)
             file_args['path'] = key_path
             module.set_fs_attributes_if_different(file_args, False)
+
+        # the dump holds every secret, it isn't returned
+        out = '\n'.join(reports)
     elif state == "generate_secret":
         out = generate_secret().decode()
         cmd = ''
@@ -669,6 +1011,8 @@ def run_module():
         changed=changed,
     )
 
+    add_trace(result)
+
     if rc != 0:
         module.fail_json(msg='non-zero return code', **result)
 
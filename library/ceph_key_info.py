@@ -19,11 +19,15 @@ from ansible.module_utils.basic import AnsibleModule
 try:
     from ansible.module_utils.ca_common import generate_cmd, \
         is_containerized, \
-        fatal
+        fatal, \
+        add_trace, \
+        exec_command
 except ImportError:
     from module_utils.ca_common import generate_cmd, \
         is_containerized, \
-        fatal
+        fatal, \
+        add_trace, \
+        exec_command
 import datetime
 import os
 
@@ -163,7 +167,7 @@ def exec_commands(module, cmd_list):
     '''
 
     for cmd in cmd_list:
-        rc, out, err = module.run_command(cmd)
+        rc, cmd, out, err = exec_command(module, cmd)
         if rc != 0:
             return rc, cmd, out, err
 
@@ -250,6 +254,7 @@ def run_module():
         stderr=err.rstrip("\r\n"),
         changed=changed,
     )
+    add_trace(result)
 
     if rc != 0:
         module.fail_json(msg='non-zero return code', **result)
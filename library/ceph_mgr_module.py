@@ -17,11 +17,13 @@ __metaclass__ = type
 
 from ansible.module_utils.basic import AnsibleModule
 try:
-    from ansible.module_utils.ca_common import exit_module, \
+    from ansible.module_utils.ca_common import exec_command, \
+                                               exit_module, \
                                                generate_cmd, \
                                                is_containerized
 except ImportError:
-    from module_utils.ca_common import exit_module, \
+    from module_utils.ca_common import exec_command, \
+                                       exit_module, \
                                        generate_cmd, \
                                        is_containerized
 import datetime
@@ -113,7 +115,7 @@ def main():
             changed=False
         )
     else:
-        rc, out, err = module.run_command(cmd)
+        rc, cmd, out, err = exec_command(module, cmd)
         if 'is already enabled' in err:
             changed = False
         else:
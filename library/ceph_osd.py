@@ -17,9 +17,9 @@ __metaclass__ = type
 
 from ansible.module_utils.basic import AnsibleModule
 try:
-    from ansible.module_utils.ca_common import exit_module, generate_cmd, is_containerized  # noqa: E501
+    from ansible.module_utils.ca_common import exec_command, exit_module, generate_cmd, is_containerized  # noqa: E501
 except ImportError:
-    from module_utils.ca_common import exit_module, generate_cmd, is_containerized  # noqa: E501
+    from module_utils.ca_common import exec_command, exit_module, generate_cmd, is_containerized  # noqa: E501
 import datetime
 
 
@@ -127,7 +127,7 @@ def main():
             changed=False
         )
     else:
-        rc, out, err = module.run_command(cmd)
+        rc, cmd, out, err = exec_command(module, cmd)
         changed = True
         if state in ['down', 'in', 'out'] and 'marked' not in err:
             changed = False
@@ -18,10 +18,12 @@ __metaclass__ = type
 from ansible.module_utils.basic import AnsibleModule
 try:
     from ansible.module_utils.ca_common import exit_module, \
+                                               exec_command, \
                                                generate_cmd, \
                                                is_containerized
 except ImportError:
     from module_utils.ca_common import exit_module, \
+                                       exec_command, \
                                        generate_cmd, \
                                        is_containerized
 import datetime
@@ -114,7 +116,7 @@ def main():
             changed=False
         )
     else:
-        rc, out, err = module.run_command(cmd)
+        rc, cmd, out, err = exec_command(module, cmd)
         exit_module(
             module=module,
             out=out,
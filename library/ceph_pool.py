@@ -21,18 +21,26 @@ try:
                                                pre_generate_cmd, \
                                                is_containerized, \
                                                exec_command, \
-                                               exit_module
+                                               exec_commands_batch, \
+                                               exec_read_command, \
+                                               exit_module, \
+                                               run_concurrently
 except ImportError:
     from module_utils.ca_common import generate_cmd, \
                                        pre_generate_cmd, \
                                        is_containerized, \
                                        exec_command, \
-                                       exit_module
+                                       exec_commands_batch, \
+                                       exec_read_command, \
+                                       exit_module, \
+                                       run_concurrently
 
 
 import datetime
+import functools
 import json
 import os
+import time
 
 
 ANSIBLE_METADATA = {
@@ -62,7 +70,27 @@ options:
     name:
         description:
             - name of the Ceph pool
-        required: true
+            - required unless 'pools' is set.
+        required: false
+    pools:
+        description:
+            - list of pools to reconcile in a single run, instead of 'name'.
+            - each item takes 'name' and the pool options of this module
+              (size, min_size, pg_num, pgp_num, pg_autoscale_mode,
+              target_size_ratio, pool_type, erasure_profile, rule_name,
+              expected_num_objects and application), the options which
+              aren't set default to the ones given to the module.
+            - only 'present' and 'absent' states are supported, the result
+              of each pool is returned in 'pools'.
+            - the planned changes are returned in 'plan', in check mode
+              nothing else is done.
+        required: false
+    plan:
+        description:
+            - apply the 'plan' returned by a previous run with 'pools'
+              (typically in check mode) instead of 'name' or 'pools'. The
+              pools aren't read again, 'state' is ignored.
+        required: false
     state:
         description:
             If 'present' is used, the module creates a pool if it doesn't exist
@@ -128,6 +156,39 @@ options:
             - Set the pool application on the pool.
         required: false
         default: None
+    pg_num_step:
+        description:
+            - when set, pg_num and pgp_num of an existing pool are moved
+              toward their targets by steps of pg_num_step instead of in
+              one go. Before each step, the module waits for ceph to apply
+              the previous one and for its data movement to settle.
+            - the progress is read from the pg_num_target and
+              pg_placement_num_target of the pool, a paused migration is
+              resumed by the next run. It is reported in 'pg_migration'.
+            - not used when the pg autoscaler is enabled on the pool.
+        required: false
+        default: 0
+    max_misplaced_ratio:
+        description:
+            - the next step of a pg_num migration is only applied once the
+              ratio of misplaced objects is at most max_misplaced_ratio and
+              no PG is inactive.
+        required: false
+        default: 0.05
+    pg_num_step_timeout:
+        description:
+            - how long (in seconds) to wait for the cluster to be ready for
+              the next step of a pg_num migration, the migration is paused
+              when it's exceeded.
+        required: false
+        default: 600
+    pg_num_step_delay:
+        description:
+            - how long (in seconds) to wait after each step of a pg_num
+              migration before checking the pool and the cluster status,
+              and between two of these checks.
+        required: false
+        default: 10
 '''
 
 EXAMPLES = '''
@@ -148,31 +209,56 @@ pools:
         pool_type: "{{ item.pool_type }}"
         pg_autoscale_mode: "{{ item.pg_autoscale_mode }}"
       with_items: "{{ pools }}"
-'''
 
-RETURN = '''#  '''
+    - name: create all the pools at once
+      ceph_pool:
+        pools: "{{ pools }}"
+        pg_autoscale_mode: 'on'
 
+    - name: grow a pool by 64 PGs at a time
+      ceph_pool:
+        name: foo
+        pg_autoscale_mode: 'off'
+        pg_num: 1024
+        pg_num_step: 64
+      register: result
+      until: result.pg_migration.done
+      retries: 10
+
+    - name: preview the changes of the pools
+      ceph_pool:
+        pools: "{{ pools }}"
+      check_mode: true
+      register: pools_plan
 
-def check_pool_exist(cluster,
-                     name,
-                     user,
-                     user_key,
-                     output_format='json',
-                     container_image=None):
-    '''
-    Check if a given pool exists
-    '''
+    - name: apply the previewed changes
+      ceph_pool:
+        plan: "{{ pools_plan.plan }}"
+'''
 
-    args = ['stats', name, '-f', output_format]
+RETURN = '''
+plan:
+    description:
+        - the planned change of each pool of 'pools'. Its action is
+          create, update, remove or none, an update lists in 'changes'
+          each setting ('key') to move from 'from' to 'to' and a pending
+          pg_num migration in 'pg_migration'.
+    returned: when 'pools' is set
+    type: list
+'''
 
-    cmd = generate_cmd(sub_cmd=['osd', 'pool'],
-                       args=args,
-                       cluster=cluster,
-                       user=user,
-                       user_key=user_key,
-                       container_image=container_image)
+# PG states preventing the next step of a pg_num migration
+PG_BUSY_STATES = ['creating', 'peering', 'activating', 'unknown', 'down',
+                  'incomplete', 'stale']
 
-    return cmd
+# options of an item of 'pools', a planned creation keeps them
+POOL_OPTIONS = ['name', 'size', 'min_size', 'pg_num', 'pgp_num',
+                'pg_autoscale_mode', 'target_size_ratio', 'pool_type',
+                'erasure_profile', 'rule_name', 'expected_num_objects',
+                'application']
+
+# actions of a planned pool
+PLAN_ACTIONS = ['create', 'update', 'remove', 'none']
 
 
 def generate_get_config_cmd(param,
@@ -197,50 +283,6 @@ def generate_get_config_cmd(param,
     return cmd
 
 
-def get_application_pool(cluster,
-                         name,
-                         user,
-                         user_key,
-                         output_format='json',
-                         container_image=None):
-    '''
-    Get application type enabled on a given pool
-    '''
-
-    args = ['application', 'get', name, '-f', output_format]
-
-    cmd = generate_cmd(sub_cmd=['osd', 'pool'],
-                       args=args,
-                       cluster=cluster,
-                       user=user,
-                       user_key=user_key,
-                       container_image=container_image)
-
-    return cmd
-
-
-def get_crush_rule_pool(cluster,
-                        name,
-                        user,
-                        user_key,
-                        output_format='json',
-                        container_image=None):
-    '''
-    Get crush rule type on a given pool
-    '''
-
-    args = ['get', name, 'crush_rule', '-f', output_format]
-
-    cmd = generate_cmd(sub_cmd=['osd', 'pool'],
-                       args=args,
-                       cluster=cluster,
-                       user=user,
-                       user_key=user_key,
-                       container_image=container_image)
-
-    return cmd
-
-
 def enable_application_pool(cluster,
                             name,
                             application,
@@ -308,74 +350,6 @@ def disable_application_pool(cluster,
     return cmd
 
 
-def get_pool_details(module,
-                     cluster,
-                     name,
-                     user,
-                     user_key,
-                     output_format='json',
-                     container_image=None):
-    '''
-    Get details about a given pool
-    '''
-
-    args = ['ls', 'detail', '-f', output_format]
-
-    cmd = generate_cmd(sub_cmd=['osd', 'pool'],
-                       args=args,
-                       cluster=cluster,
-                       user=user,
-                       user_key=user_key,
-                       container_image=container_image)
-
-    rc, cmd, out, err = exec_command(module, cmd)
-
-    if rc == 0:
-        out = [p for p in json.loads(out.strip()) if p['pool_name'] == name][0]
-
-    _rc, _cmd, application_pool, _err = exec_command(module,
-                                                     get_application_pool(cluster,    # noqa: E501
-                                                                          name,    # noqa: E501
-                                                                          user,    # noqa: E501
-                                                                          user_key,    # noqa: E501
-                                                                          container_image=container_image))  # noqa: E501
-    _rc, _cmd, crush_rule, _err = exec_command(module,
-                                               get_crush_rule_pool(cluster,    # noqa: E501
-                                                                   name,    # noqa: E501
-                                                                   user,    # noqa: E501
-                                                                   user_key,    # noqa: E501
-                                                                   container_image=container_image))  # noqa: E501
-
-    # This is a trick because "target_size_ratio" isn't present at the same
-    # level in the dict
-    # ie:
-    # {
-    # 'pg_num': 8,
-    # 'pgp_num': 8,
-    # 'pg_autoscale_mode': 'on',
-    #     'options': {
-    #          'target_size_ratio': 0.1
-    #     }
-    # }
-    # If 'target_size_ratio' is present in 'options', we set it, this way we
-    # end up with a dict containing all needed keys at the same level.
-    if 'target_size_ratio' in out['options'].keys():
-        out['target_size_ratio'] = out['options']['target_size_ratio']
-    else:
-        out['target_size_ratio'] = None
-
-    application = list(json.loads(application_pool.strip()).keys())
-
-    if len(application) == 0:
-        out['application'] = ''
-    else:
-        out['application'] = application[0]
-
-    out['crush_rule'] = json.loads(crush_rule.strip())['crush_rule']
-
-    return rc, cmd, out, err
-
-
 def compare_pool_config(user_pool_config, running_pool_details):
     '''
     Compare user input config pool details with current running pool details
@@ -402,6 +376,114 @@ def compare_pool_config(user_pool_config, running_pool_details):
     return delta
 
 
+def get_user_pool_config(params):
+    '''
+    Build the desired configuration of a pool from the module parameters
+    (or the ones of an item of 'pools')
+    '''
+
+    if params.get('pg_autoscale_mode').lower() in ['true', 'on', 'yes']:
+        pg_autoscale_mode = 'on'
+    elif params.get('pg_autoscale_mode').lower() in ['false', 'off', 'no']:
+        pg_autoscale_mode = 'off'
+    else:
+        pg_autoscale_mode = 'warn'
+
+    if params.get('pool_type') == '1':
+        pool_type = 'replicated'
+    elif params.get('pool_type') == '3':
+        pool_type = 'erasure'
+    else:
+        pool_type = params.get('pool_type')
+
+    if not params.get('rule_name'):
+        rule_name = 'replicated_rule' if pool_type == 'replicated' else None
+    else:
+        rule_name = params.get('rule_name')
+
+    user_pool_config = {
+        'pool_name': {'value': params.get('name')},
+        'pg_num': {'value': params.get('pg_num'), 'cli_set_opt': 'pg_num'},
+        'pgp_num': {'value': params.get('pgp_num'), 'cli_set_opt': 'pgp_num'},
+        'pg_autoscale_mode': {'value': pg_autoscale_mode,
+                              'cli_set_opt': 'pg_autoscale_mode'},
+        'target_size_ratio': {'value': params.get('target_size_ratio'),
+                              'cli_set_opt': 'target_size_ratio'},
+        'application': {'value': params.get('application')},
+        'type': {'value': pool_type},
+        'erasure_profile': {'value': params.get('erasure_profile')},
+        'crush_rule': {'value': rule_name, 'cli_set_opt': 'crush_rule'},
+        'expected_num_objects': {'value': params.get('expected_num_objects')},
+        'size': {'value': params.get('size'), 'cli_set_opt': 'size'},
+        'min_size': {'value': params.get('min_size')}
+    }
+
+    return user_pool_config
+
+
+def get_pool_delta(user_pool_config, running_pool_details, rule_name=None,
+                   pg_num_step=0):
+    '''
+    Get the settings to update on an existing pool and the matching diff,
+    pg_num is left to migrate_pg_num() when pg_num_step is set
+    '''
+
+    diff = dict(before="", after="")
+    user_pool_config['pg_placement_num'] = {'value': str(running_pool_details['pg_placement_num']), 'cli_set_opt': 'pgp_num'}  # noqa: E501
+    delta = compare_pool_config(user_pool_config, running_pool_details)
+    if len(delta) > 0:
+        keys = list(delta.keys())
+        if running_pool_details['erasure_code_profile'] and 'size' in keys:
+            del delta['size']
+        if running_pool_details['pg_autoscale_mode'] == 'on':
+            delta.pop('pg_num', None)
+            delta.pop('pgp_num', None)
+        if not rule_name:
+            delta.pop('crush_rule', None)
+        if pg_num_step:
+            delta.pop('pg_num', None)
+
+        for key in delta.keys():
+            diff['before'] += "{}: {}\n".format(key, running_pool_details[key])
+            diff['after'] += "{}: {}\n".format(key, delta[key]['value'])
+
+    return delta, diff
+
+
+def get_pg_migration(user_pool_config, running_pool_details):
+    '''
+    Get the pg_num and pgp_num a pool has to move from and to, as
+    ((pg_num, pgp_num), (target_pg_num, target_pgp_num)), or None when
+    they aren't managed. A pool is moving from the targets of the
+    previous changes, not from its current pg_num and pgp_num.
+    '''
+
+    pg_num = user_pool_config['pg_num']['value']
+    if not pg_num or running_pool_details['pg_autoscale_mode'] == 'on':
+        return None
+
+    target = (int(pg_num),
+              min(int(user_pool_config['pgp_num']['value'] or pg_num), int(pg_num)))  # noqa: E501
+    current = (int(running_pool_details.get('pg_num_target', running_pool_details['pg_num'])),  # noqa: E501
+               int(running_pool_details.get('pg_placement_num_target', running_pool_details['pg_placement_num'])))  # noqa: E501
+
+    return current, target
+
+
+def new_pg_migration(name, current, target):
+    '''
+    Report the progress of a pg_num migration
+    '''
+
+    return dict(pool=name,
+                pg_num=current[0],
+                pgp_num=current[1],
+                target_pg_num=target[0],
+                target_pgp_num=target[1],
+                steps=0,
+                done=current == target)
+
+
 def list_pools(cluster,
                user,
                user_key,
@@ -429,6 +511,120 @@ def list_pools(cluster,
     return cmd
 
 
+def list_crush_rules(cluster,
+                     user,
+                     user_key,
+                     output_format='json',
+                     container_image=None):
+    '''
+    List existing crush rules
+    '''
+
+    args = ['rule', 'dump', '-f', output_format]
+
+    cmd = generate_cmd(sub_cmd=['osd', 'crush'],
+                       args=args,
+                       cluster=cluster,
+                       user=user,
+                       user_key=user_key,
+                       container_image=container_image)
+
+    return cmd
+
+
+def get_running_pool_details(pool, crush_rules):
+    '''
+    Flatten a pool of 'osd pool ls detail', crush_rules maps the crush
+    rule ids to their names
+    '''
+
+    details = dict(pool)
+
+    # This is a trick because "target_size_ratio" isn't present at the same
+    # level in the dict
+    # ie:
+    # {
+    # 'pg_num': 8,
+    # 'pgp_num': 8,
+    # 'pg_autoscale_mode': 'on',
+    #     'options': {
+    #          'target_size_ratio': 0.1
+    #     }
+    # }
+    # If 'target_size_ratio' is present in 'options', we set it, this way we
+    # end up with a dict containing all needed keys at the same level.
+    details['target_size_ratio'] = pool['options'].get('target_size_ratio')
+    application = list(pool.get('application_metadata', {}).keys())
+    details['application'] = application[0] if application else ''
+    details['crush_rule'] = crush_rules.get(pool['crush_rule'],
+                                            pool['crush_rule'])
+
+    return details
+
+
+class PoolSnapshot(object):
+    '''
+    Running state of all the pools, read from a single pool dump and
+    indexed by pool name. The crush rule names are resolved with a
+    single crush rule dump, only read when they are needed. Both reads
+    go through exec_read_command() so they are cached across tasks when
+    the read cache is enabled.
+    '''
+
+    def __init__(self, module, cluster, user, user_key, container_image=None):  # noqa: E501
+        self.module = module
+        self.cluster = cluster
+        self.user = user
+        self.user_key = user_key
+        self.container_image = container_image
+        self.pools = {}
+        self.crush_rules = {}
+
+    def load(self, crush_rules=True):
+        '''
+        Read the pools, and the crush rules if crush_rules is set
+        (otherwise the details report the crush rule ids).
+        Return (rc, cmd, out, err) of the first failing read, or of the
+        pool dump.
+        '''
+
+        reads = [list_pools(self.cluster,
+                            self.user,
+                            self.user_key,
+                            True,
+                            container_image=self.container_image)]
+        if crush_rules:
+            reads.append(list_crush_rules(self.cluster,
+                                          self.user,
+                                          self.user_key,
+                                          container_image=self.container_image))  # noqa: E501
+
+        # the reads are independent, run them concurrently
+        results = run_concurrently([functools.partial(exec_read_command, self.module, cmd)  # noqa: E501
+                                    for cmd in reads])
+        for result in results:
+            if result[0] != 0:
+                return result
+
+        if crush_rules:
+            self.crush_rules = dict((rule['rule_id'], rule['rule_name'])
+                                    for rule in json.loads(results[1][2]))
+        self.pools = dict((pool['pool_name'], pool)
+                          for pool in json.loads(results[0][2]))
+
+        return results[0]
+
+    def __contains__(self, name):
+        return name in self.pools
+
+    def details(self, name):
+        '''
+        Get the flattened details of a given pool
+        '''
+
+        return get_running_pool_details(self.pools[name], self.crush_rules)
+
+
 def create_pool(cluster,
                 user,
                 user_key,
@@ -502,13 +698,47 @@ def remove_pool(cluster, name, user, user_key, container_image=None):
     return cmd
 
 
-def update_pool(module, cluster, name,
-                user, user_key, delta, container_image=None):
+def generate_create_pool_cmds(cluster,
+                              user,
+                              user_key,
+                              user_pool_config,
+                              container_image=None):
     '''
-    Update an existing pool
+    Generate the commands creating a pool and enabling its application
+    '''
+
+    name = user_pool_config['pool_name']['value']
+    application = user_pool_config['application']['value']
+    cmd_list = [create_pool(cluster,
+                            user,
+                            user_key,
+                            user_pool_config=user_pool_config,
+                            container_image=container_image)]
+    if application:
+        cmd_list.append(enable_application_pool(cluster,
+                                                name,
+                                                application,
+                                                user,
+                                                user_key,
+                                                container_image=container_image))  # noqa: E501
+        if application == 'rbd':
+            cmd_list.append(init_rbd_pool(cluster,
+                                          name,
+                                          user,
+                                          user_key,
+                                          container_image=container_image))
+
+    return cmd_list
+
+
+def generate_update_pool_cmds(cluster, name, user, user_key, delta,
+                              container_image=None):
+    '''
+    Generate the commands updating an existing pool, and their report
     '''
 
     report = ""
+    cmd_list = []
 
     for key in delta.keys():
         if key != 'application':
@@ -517,36 +747,481 @@ def update_pool(module, cluster, name,
                     delta[key]['cli_set_opt'],
                     delta[key]['value']]
 
-            cmd = generate_cmd(sub_cmd=['osd', 'pool'],
-                               args=args,
-                               cluster=cluster,
-                               user=user,
-                               user_key=user_key,
-                               container_image=container_image)
-
-            rc, cmd, out, err = exec_command(module, cmd)
-            if rc != 0:
-                return rc, cmd, out, err
+            cmd_list.append(generate_cmd(sub_cmd=['osd', 'pool'],
+                                         args=args,
+                                         cluster=cluster,
+                                         user=user,
+                                         user_key=user_key,
+                                         container_image=container_image))
 
         else:
-            rc, cmd, out, err = exec_command(module, disable_application_pool(cluster, name, delta['application']['old_application'], user, user_key, container_image=container_image))  # noqa: E501
-            if rc != 0:
-                return rc, cmd, out, err
+            cmd_list.append(disable_application_pool(cluster, name, delta['application']['old_application'], user, user_key, container_image=container_image))  # noqa: E501
+            cmd_list.append(enable_application_pool(cluster, name, delta['application']['new_application'], user, user_key, container_image=container_image))  # noqa: E501
+
+        report = report + "\n" + "{} has been updated: {} is now {}".format(name, key, delta[key]['value'])  # noqa: E501
+
+    return cmd_list, report
+
+
+def get_cluster_status(cluster,
+                       user,
+                       user_key,
+                       output_format='json',
+                       container_image=None):
+    '''
+    Get the status of the cluster
+    '''
+
+    args = ['-f', output_format]
 
-            rc, cmd, out, err = exec_command(module, enable_application_pool(cluster, name, delta['application']['new_application'], user, user_key, container_image=container_image))  # noqa: E501
+    cmd = generate_cmd(sub_cmd=['status'],
+                       args=args,
+                       cluster=cluster,
+                       user=user,
+                       user_key=user_key,
+                       container_image=container_image)
+
+    return cmd
+
+
+def pg_migration_can_step(status, max_misplaced_ratio):
+    '''
+    Check if the data movement following a step of a pg_num migration
+    has settled enough to apply the next step
+    '''
+
+    pgmap = status.get('pgmap', {})
+    if float(pgmap.get('misplaced_ratio', 0)) > max_misplaced_ratio:
+        return False
+
+    for pgs in pgmap.get('pgs_by_state', []):
+        states = pgs['state_name'].split('+')
+        if pgs['count'] and any(state in PG_BUSY_STATES for state in states):
+            return False
+
+    return True
+
+
+def pg_num_reached_target(pool):
+    '''
+    Check if ceph is done moving pg_num and pgp_num of a pool of
+    'osd pool ls detail' to their targets
+    '''
+
+    return pool.get('pg_num') == pool.get('pg_num_target', pool.get('pg_num')) and \
+        pool.get('pg_placement_num') == pool.get('pg_placement_num_target', pool.get('pg_placement_num'))  # noqa: E501
+
+
+def wait_pg_migration_step(module, cluster, name, user, user_key,
+                           container_image=None, stepped=False):
+    '''
+    Wait up to pg_num_step_timeout seconds for the cluster to be ready
+    for the next step of a pg_num migration: pg_num and pgp_num of the
+    pool have reached their targets and the data movement has settled.
+    When a step was just applied, wait pg_num_step_delay seconds first so
+    that the peering and the backfill of the step have started.
+    Return (rc, cmd, out, err, ready)
+    '''
+
+    delay = module.params.get('pg_num_step_delay')
+    deadline = time.time() + module.params.get('pg_num_step_timeout')
+    if stepped:
+        time.sleep(delay)
+    while True:
+        # the pg counts and the status move without any map epoch change,
+        # don't cache them
+        rc, cmd, out, err = exec_command(module,
+                                         list_pools(cluster,
+                                                    user,
+                                                    user_key,
+                                                    True,
+                                                    container_image=container_image))  # noqa: E501
+        if rc != 0:
+            return rc, cmd, out, err, False
+        pool = next((pool for pool in json.loads(out) if pool['pool_name'] == name), {})  # noqa: E501
+        ready = pg_num_reached_target(pool)
+        if ready:
+            rc, cmd, out, err = exec_command(module,
+                                             get_cluster_status(cluster,
+                                                                user,
+                                                                user_key,
+                                                                container_image=container_image))  # noqa: E501
             if rc != 0:
-                return rc, cmd, out, err
+                return rc, cmd, out, err, False
+            ready = pg_migration_can_step(json.loads(out), module.params.get('max_misplaced_ratio'))  # noqa: E501
+        if ready:
+            return rc, cmd, out, err, True
+        if time.time() >= deadline:
+            return rc, cmd, out, err, False
+        time.sleep(delay)
 
-        report = report + "\n" + "{} has been updated: {} is now {}".format(name, key, delta[key]['value'])  # noqa: E501
+
+def next_pg_step(current, target, step):
+    '''
+    Get the value following current when moving toward target by step
+    '''
+
+    if current < target:
+        return min(current + step, target)
+    return max(current - step, target)
+
+
+def migrate_pg_num(module, cluster, name, user, user_key, current, target,
+                   container_image=None):
+    '''
+    Move pg_num and pgp_num of a pool from current to target,
+    both (pg_num, pgp_num), by steps of pg_num_step. Each step waits for
+    the previous one to be applied by ceph and for its data movement to
+    settle, the migration is paused when it doesn't in time.
+    Return (rc, cmd, out, err, migration) where migration reports the
+    progress.
+    '''
+
+    step = module.params.get('pg_num_step')
+    migration = new_pg_migration(name, current, target)
+    report = []
+    rc, cmd, out, err = 0, [], '', ''
+
+    while (migration['pg_num'], migration['pgp_num']) != target:
+        rc, cmd, out, err, ready = wait_pg_migration_step(module,
+                                                          cluster,
+                                                          name,
+                                                          user,
+                                                          user_key,
+                                                          container_image=container_image,  # noqa: E501
+                                                          stepped=migration['steps'] > 0)  # noqa: E501
+        if rc != 0:
+            return rc, cmd, out, err, migration
+        if not ready:
+            report.append("{} pg_num migration paused at pg_num {} pgp_num {}, "
+                          "the cluster is still moving data".format(name, migration['pg_num'], migration['pgp_num']))  # noqa: E501
+            return 0, cmd, '\n'.join(report), err, migration
+
+        pg_num = next_pg_step(migration['pg_num'], target[0], step)
+        pgp_num = min(next_pg_step(migration['pgp_num'], target[1], step), pg_num)  # noqa: E501
+        settings = [('pg_num', pg_num, migration['pg_num']),
+                    ('pgp_num', pgp_num, migration['pgp_num'])]
+        if pg_num < migration['pg_num']:
+            # pgp_num can't be greater than pg_num
+            settings.reverse()
+        cmd_list = [generate_cmd(sub_cmd=['osd', 'pool'],
+                                 args=['set', name, key, str(value)],
+                                 cluster=cluster,
+                                 user=user,
+                                 user_key=user_key,
+                                 container_image=container_image)
+                    for key, value, previous in settings if value != previous]  # noqa: E501
+
+        results = exec_commands_batch(module, cmd_list)
+        rc, cmd, out, err = results[-1]
+        if rc != 0:
+            return rc, cmd, out, err, migration
+
+        migration.update(pg_num=pg_num, pgp_num=pgp_num,
+                         steps=migration['steps'] + 1)
+        report.append("{} has been updated: pg_num is now {}, pgp_num is now {}".format(name, pg_num, pgp_num))  # noqa: E501
+
+    migration['done'] = True
+    return rc, cmd, '\n'.join(report), err, migration
+
+
+def update_pool(module, cluster, name,
+                user, user_key, delta, container_image=None):
+    '''
+    Update an existing pool
+    '''
+
+    cmd_list, report = generate_update_pool_cmds(cluster, name, user,
+                                                 user_key, delta,
+                                                 container_image=container_image)  # noqa: E501
+
+    # all the settings are applied by a single process
+    results = exec_commands_batch(module, cmd_list)
+    rc, cmd, out, err = results[-1]
+    if rc != 0:
+        return rc, cmd, out, err
 
     out = report
     return rc, cmd, out, err
 
 
+def plan_pool(params, running_pools, state, pg_num_step=0):
+    '''
+    Plan the changes of a pool against a snapshot of the running pools.
+    The action is 'create', 'remove', 'update' or 'none', an update
+    lists in 'changes' each setting to move from 'from' to 'to' (the
+    'application' change swaps the application) and a pending pg_num
+    migration in 'pg_migration'.
+    '''
+
+    name = params['name']
+    entry = dict(name=name, action='none', changes=[])
+    if state == 'absent':
+        if name in running_pools:
+            entry['action'] = 'remove'
+        return entry
+
+    if name not in running_pools:
+        entry['action'] = 'create'
+        entry['config'] = dict((key, params.get(key)) for key in POOL_OPTIONS)  # noqa: E501
+        return entry
+
+    user_pool_config = get_user_pool_config(params)
+    running_pool_details = running_pools.details(name)
+    delta, _ = get_pool_delta(user_pool_config,
+                              running_pool_details,
+                              params.get('rule_name'),
+                              pg_num_step=pg_num_step)
+    for key, value in delta.items():
+        if key == 'application':
+            entry['changes'].append({'key': key,
+                                     'from': value['old_application'],
+                                     'to': value['new_application']})
+        else:
+            entry['changes'].append({'key': key,
+                                     'option': value['cli_set_opt'],
+                                     'from': running_pool_details[key],
+                                     'to': value['value']})
+    if pg_num_step:
+        migration = get_pg_migration(user_pool_config, running_pool_details)
+        if migration:
+            entry['pg_migration'] = new_pg_migration(name, *migration)
+    if entry['changes'] or not entry.get('pg_migration', {'done': True})['done']:  # noqa: E501
+        entry['action'] = 'update'
+
+    return entry
+
+
+def plan_pools(module,
+               cluster,
+               user,
+               user_key,
+               pools,
+               state,
+               container_image=None):
+    '''
+    Plan the changes of a list of pools from a single read of the
+    running pools, return (rc, cmd, out, err, plan)
+    '''
+
+    pg_num_step = module.params.get('pg_num_step')
+
+    running_pools = PoolSnapshot(module,
+                                 cluster,
+                                 user,
+                                 user_key,
+                                 container_image=container_image)
+    # the crush rule names are only compared when a rule_name is given
+    rc, cmd, out, err = running_pools.load(crush_rules=any(pool.get('rule_name') for pool in pools))  # noqa: E501
+    if rc != 0:
+        return rc, cmd, out, err, []
+
+    plan = [plan_pool(params, running_pools, state, pg_num_step=pg_num_step)
+            for params in pools]
+
+    return rc, cmd, '', err, plan
+
+
+def get_plan_delta(entry):
+    '''
+    Rebuild the delta of get_pool_delta() from a planned update
+    '''
+
+    delta = {}
+    for change in entry['changes']:
+        if change['key'] == 'application':
+            delta['application'] = {'old_application': change['from'],
+                                    'new_application': change['to'],
+                                    'value': change['to']}
+        else:
+            delta[change['key']] = {'cli_set_opt': change['option'],
+                                    'value': change['to']}
+
+    return delta
+
+
+def get_plan_diff(entry):
+    '''
+    Build the diff of a planned pool
+    '''
+
+    name = entry['name']
+    diff = dict(before="", after="", before_header=name, after_header=name)
+    if entry['action'] == 'create':
+        diff.update(before='state: absent\n', after='state: present\n')
+    elif entry['action'] == 'remove':
+        diff.update(before='state: present\n', after='state: absent\n')
+
+    for change in entry['changes']:
+        diff['before'] += "{}: {}\n".format(change['key'], change['from'])
+        diff['after'] += "{}: {}\n".format(change['key'], change['to'])
+
+    migration = entry.get('pg_migration')
+    if migration and not migration['done']:
+        diff['before'] += "pg_num: {}\npgp_num: {}\n".format(migration['pg_num'], migration['pgp_num'])  # noqa: E501
+        diff['after'] += "pg_num: {}\npgp_num: {}\n".format(migration['target_pg_num'], migration['target_pgp_num'])  # noqa: E501
+
+    return diff
+
+
+def generate_plan_cmds(cluster, user, user_key, entry, container_image=None):
+    '''
+    Generate the commands applying a planned pool, and their report
+    '''
+
+    name = entry['name']
+    if entry['action'] == 'remove':
+        return [remove_pool(cluster,
+                            name,
+                            user,
+                            user_key,
+                            container_image=container_image)], '{} has been removed'.format(name)  # noqa: E501
+    if entry['action'] == 'create':
+        return generate_create_pool_cmds(cluster,
+                                         user,
+                                         user_key,
+                                         get_user_pool_config(entry['config']),  # noqa: E501
+                                         container_image=container_image), '{} has been created'.format(name)  # noqa: E501
+    if entry['changes']:
+        cmd_list, report = generate_update_pool_cmds(cluster,
+                                                     name,
+                                                     user,
+                                                     user_key,
+                                                     get_plan_delta(entry),
+                                                     container_image=container_image)  # noqa: E501
+        return cmd_list, report.strip()
+
+    return [], ''
+
+
+def apply_pool_plan(module,
+                    cluster,
+                    user,
+                    user_key,
+                    plan,
+                    container_image=None):
+    '''
+    Apply a plan of plan_pools() without reading the pools again: all
+    the commands are run by a single process, the pg_num migrations
+    follow, one pool at a time.
+    Return (rc, cmd, out, err, changed, diff, results) where results
+    holds the result of each pool.
+    '''
+
+    results = []
+    migrations = {}
+    for entry in plan:
+        name = entry['name']
+        cmd_list, report = generate_plan_cmds(cluster,
+                                              user,
+                                              user_key,
+                                              entry,
+                                              container_image=container_image)  # noqa: E501
+        result = dict(name=name, changed=False, rc=0, cmd=cmd_list,
+                      stdout=report, stderr='', diff=get_plan_diff(entry))
+        migration = entry.get('pg_migration')
+        if migration:
+            result['pg_migration'] = dict(migration)
+            if not migration['done']:
+                migrations[name] = ((migration['pg_num'], migration['pgp_num']),  # noqa: E501
+                                    (migration['target_pg_num'], migration['target_pgp_num']))  # noqa: E501
+        result['changed'] = len(result['cmd']) > 0 or name in migrations
+        results.append(result)
+
+    cmd = [_cmd for result in results for _cmd in result['cmd']]
+    if cmd and not module.check_mode:
+        # the pools are independent, a failure doesn't stop the others
+        outputs = exec_commands_batch(module, cmd, stop_on_error=False)
+        outputs.extend((1, _cmd, '', 'not executed')
+                       for _cmd in cmd[len(outputs):])
+        outputs = iter(outputs)
+        for result in results:
+            for _cmd in result['cmd']:
+                _rc, _cmd, _out, _err = next(outputs)
+                result['stderr'] += _err
+                if _rc != 0 and result['rc'] == 0:
+                    result['rc'] = _rc
+                    result['stdout'] = _out
+
+    for result in results:
+        if result['name'] not in migrations or result['rc'] != 0 or module.check_mode:  # noqa: E501
+            continue
+        current, target = migrations[result['name']]
+        _rc, _cmd, _out, _err, result['pg_migration'] = migrate_pg_num(module,  # noqa: E501
+                                                                       cluster,  # noqa: E501
+                                                                       result['name'],  # noqa: E501
+                                                                       user,  # noqa: E501
+                                                                       user_key,  # noqa: E501
+                                                                       current,  # noqa: E501
+                                                                       target,  # noqa: E501
+                                                                       container_image=container_image)  # noqa: E501
+        result['rc'] = _rc
+        result['stdout'] = '\n'.join(filter(None, [result['stdout'], _out]))
+        result['stderr'] += _err
+        result['changed'] = len(result['cmd']) > 0 or result['pg_migration']['steps'] > 0  # noqa: E501
+
+    failed = [result for result in results if result['rc'] != 0]
+    rc = failed[0]['rc'] if failed else 0
+    out = '\n'.join(result['stdout'] for result in results
+                    if result['changed'] and result['rc'] == 0)
+    err = ''.join(result['stderr'] for result in failed)
+    changed = any(result['changed'] for result in results)
+    diff = [result['diff'] for result in results if result['changed']]
+
+    return rc, cmd, out, err, changed, diff, results
+
+
+def reconcile_pools(module,
+                    cluster,
+                    user,
+                    user_key,
+                    pools,
+                    state,
+                    container_image=None):
+    '''
+    Create, update or remove a list of pools: plan their changes from a
+    single read of the running pools and apply the plan.
+    Return (rc, cmd, out, err, changed, diff, results, plan) where
+    results holds the result of each pool.
+    '''
+
+    rc, cmd, out, err, plan = plan_pools(module,
+                                         cluster,
+                                         user,
+                                         user_key,
+                                         pools,
+                                         state,
+                                         container_image=container_image)
+    if rc != 0:
+        return rc, cmd, out, err, False, dict(before="", after=""), [], []
+
+    return apply_pool_plan(module,
+                           cluster,
+                           user,
+                           user_key,
+                           plan,
+                           container_image=container_image) + (plan,)
+
+
 def run_module():
     module_args = dict(
         cluster=dict(type='str', required=False, default='ceph'),
-        name=dict(type='str', required=True),
+        name=dict(type='str', required=False),
+        plan=dict(type='list', required=False, elements='dict'),
+        pools=dict(type='list', required=False, elements='dict',
+                   options=dict(name=dict(type='str', required=True),
+                                size=dict(type='str', required=False),
+                                min_size=dict(type='str', required=False),
+                                pg_num=dict(type='str', required=False),
+                                pgp_num=dict(type='str', required=False),
+                                pg_autoscale_mode=dict(type='str', required=False),  # noqa: E501
+                                target_size_ratio=dict(type='str', required=False),  # noqa: E501
+                                pool_type=dict(type='str', required=False,
+                                               choices=['replicated', 'erasure', '1', '3']),  # noqa: E501
+                                erasure_profile=dict(type='str', required=False),  # noqa: E501
+                                rule_name=dict(type='str', required=False),
+                                expected_num_objects=dict(type='str', required=False),  # noqa: E501
+                                application=dict(type='str', required=False))),  # noqa: E501
         state=dict(type='str', required=False, default='present',
                    choices=['present', 'absent', 'list']),
         details=dict(type='bool', required=False, default=False),
@@ -562,11 +1237,21 @@ def run_module():
         rule_name=dict(type='str', required=False, default=None),
         expected_num_objects=dict(type='str', required=False, default="0"),
         application=dict(type='str', required=False, default=None),
+        pg_num_step=dict(type='int', required=False, default=0),
+        max_misplaced_ratio=dict(type='float', required=False, default=0.05),
+        pg_num_step_timeout=dict(type='int', required=False, default=600),
+        pg_num_step_delay=dict(type='int', required=False, default=10),
     )
 
     module = AnsibleModule(
         argument_spec=module_args,
-        supports_check_mode=True
+        supports_check_mode=True,
+        mutually_exclusive=[
+            ('name', 'pools', 'plan'),
+        ],
+        required_one_of=[
+            ('name', 'pools', 'plan'),
+        ],
     )
 
     # Gather module parameters in variables
@@ -574,53 +1259,10 @@ def run_module():
     name = module.params.get('name')
     state = module.params.get('state')
     details = module.params.get('details')
-    size = module.params.get('size')
-    min_size = module.params.get('min_size')
-    pg_num = module.params.get('pg_num')
-    pgp_num = module.params.get('pgp_num')
-    pg_autoscale_mode = module.params.get('pg_autoscale_mode')
-    target_size_ratio = module.params.get('target_size_ratio')
-    application = module.params.get('application')
-
-    if (module.params.get('pg_autoscale_mode').lower() in
-            ['true', 'on', 'yes']):
-        pg_autoscale_mode = 'on'
-    elif (module.params.get('pg_autoscale_mode').lower() in
-          ['false', 'off', 'no']):
-        pg_autoscale_mode = 'off'
-    else:
-        pg_autoscale_mode = 'warn'
-
-    if module.params.get('pool_type') == '1':
-        pool_type = 'replicated'
-    elif module.params.get('pool_type') == '3':
-        pool_type = 'erasure'
-    else:
-        pool_type = module.params.get('pool_type')
-
-    if not module.params.get('rule_name'):
-        rule_name = 'replicated_rule' if pool_type == 'replicated' else None
-    else:
-        rule_name = module.params.get('rule_name')
-
-    erasure_profile = module.params.get('erasure_profile')
-    expected_num_objects = module.params.get('expected_num_objects')
-    user_pool_config = {
-        'pool_name': {'value': name},
-        'pg_num': {'value': pg_num, 'cli_set_opt': 'pg_num'},
-        'pgp_num': {'value': pgp_num, 'cli_set_opt': 'pgp_num'},
-        'pg_autoscale_mode': {'value': pg_autoscale_mode,
-                              'cli_set_opt': 'pg_autoscale_mode'},
-        'target_size_ratio': {'value': target_size_ratio,
-                              'cli_set_opt': 'target_size_ratio'},
-        'application': {'value': application},
-        'type': {'value': pool_type},
-        'erasure_profile': {'value': erasure_profile},
-        'crush_rule': {'value': rule_name, 'cli_set_opt': 'crush_rule'},
-        'expected_num_objects': {'value': expected_num_objects},
-        'size': {'value': size, 'cli_set_opt': 'size'},
-        'min_size': {'value': min_size}
-    }
+    pools = module.params.get('pools')
+    plan = module.params.get('plan')
+    pg_num_step = module.params.get('pg_num_step')
+    user_pool_config = get_user_pool_config(module.params)
 
     startd = datetime.datetime.now()
     changed = False
@@ -633,49 +1275,93 @@ def run_module():
     user_key = os.path.join("/etc/ceph/", keyring_filename)
 
     diff = dict(before="", after="")
-
-    if state == "present":
-        rc, cmd, out, err = exec_command(module,
-                                         check_pool_exist(cluster,
-                                                          name,
-                                                          user,
-                                                          user_key,
-                                                          container_image=container_image))  # noqa: E501
-        changed = rc != 0
+    extra = {}
+
+    if plan:
+        for entry in plan:
+            if not entry.get('name') or entry.get('action') not in PLAN_ACTIONS:  # noqa: E501
+                module.fail_json(msg="invalid plan entry: {}".format(entry), rc=1)  # noqa: E501
+        rc, cmd, out, err, changed, diff, results = apply_pool_plan(module,
+                                                                    cluster,
+                                                                    user,
+                                                                    user_key,
+                                                                    plan,
+                                                                    container_image=container_image)  # noqa: E501
+        exit_module(module=module, out=out, rc=rc, cmd=cmd, err=err,
+                    startd=startd, changed=changed, diff=diff, pools=results)
+
+    elif pools:
+        if state not in ['present', 'absent']:
+            module.fail_json(msg="state '{}' isn't supported with 'pools'".format(state), rc=1)  # noqa: E501
+        # the options which aren't set on a pool default to the module ones
+        pools = [dict((key, module.params[key] if value is None else value)
+                      for key, value in pool.items()) for pool in pools]
+        rc, cmd, out, err, changed, diff, results, plan = reconcile_pools(module,  # noqa: E501
+                                                                          cluster,  # noqa: E501
+                                                                          user,
+                                                                          user_key,  # noqa: E501
+                                                                          pools,  # noqa: E501
+                                                                          state,  # noqa: E501
+                                                                          container_image=container_image)  # noqa: E501
+        exit_module(module=module, out=out, rc=rc, cmd=cmd, err=err,
+                    startd=startd, changed=changed, diff=diff, pools=results,
+                    plan=plan)
+
+    elif state == "present":
+        snapshot = PoolSnapshot(module,
+                                cluster,
+                                user,
+                                user_key,
+                                container_image=container_image)
+        rc, cmd, out, err = snapshot.load(crush_rules=bool(module.params.get('rule_name')))  # noqa: E501
+        if rc != 0:
+            exit_module(module=module, out=out, rc=rc, cmd=cmd, err=err,
+                        startd=startd)
+        out = ''
+        changed = name not in snapshot
         if not changed:
-            running_pool_details = get_pool_details(module,
-                                                    cluster,
-                                                    name,
-                                                    user,
-                                                    user_key,
-                                                    container_image=container_image)  # noqa: E501
-            user_pool_config['pg_placement_num'] = {'value': str(running_pool_details[2]['pg_placement_num']), 'cli_set_opt': 'pgp_num'}  # noqa: E501
-            delta = compare_pool_config(user_pool_config,
-                                        running_pool_details[2])
-            if len(delta) > 0:
-                keys = list(delta.keys())
-                details = running_pool_details[2]
-                if details['erasure_code_profile'] and 'size' in keys:
-                    del delta['size']
-                if details['pg_autoscale_mode'] == 'on':
-                    delta.pop('pg_num', None)
-                    delta.pop('pgp_num', None)
-                if not module.params.get('rule_name'):
-                    delta.pop('crush_rule', None)
-
-                for key in delta.keys():
-                    diff['before'] += "{}: {}\n".format(key, details[key])
-                    diff['after'] += "{}: {}\n".format(key, delta[key]['value'])
-
-                changed = len(delta) > 0
-                if changed and not module.check_mode:
-                    rc, cmd, out, err = update_pool(module,
-                                                    cluster,
-                                                    name,
-                                                    user,
-                                                    user_key,
-                                                    delta,
-                                                    container_image=container_image)  # noqa: E501
+            out = json.dumps(snapshot.pools[name])
+            running_pool_details = snapshot.details(name)
+            delta, diff = get_pool_delta(user_pool_config,
+                                         running_pool_details,
+                                         module.params.get('rule_name'),
+                                         pg_num_step=pg_num_step)
+            migration = None
+            if pg_num_step:
+                migration = get_pg_migration(user_pool_config,
+                                             running_pool_details)
+            if migration:
+                extra['pg_migration'] = new_pg_migration(name, *migration)
+                if migration[0] != migration[1]:
+                    diff['before'] += "pg_num: {}\npgp_num: {}\n".format(*migration[0])  # noqa: E501
+                    diff['after'] += "pg_num: {}\npgp_num: {}\n".format(*migration[1])  # noqa: E501
+                else:
+                    migration = None
+            if len(delta) > 0 or migration:
+                changed = True
+                if not module.check_mode:
+                    reports = []
+                    if delta:
+                        rc, cmd, out, err = update_pool(module,
+                                                        cluster,
+                                                        name,
+                                                        user,
+                                                        user_key,
+                                                        delta,
+                                                        container_image=container_image)  # noqa: E501
+                        reports.append(out.strip())
+                    if rc == 0 and migration:
+                        rc, cmd, out, err, extra['pg_migration'] = migrate_pg_num(module,  # noqa: E501
+                                                                                  cluster,  # noqa: E501
+                                                                                  name,  # noqa: E501
+                                                                                  user,  # noqa: E501
+                                                                                  user_key,  # noqa: E501
+                                                                                  migration[0],  # noqa: E501
+                                                                                  migration[1],  # noqa: E501
+                                                                                  container_image=container_image)  # noqa: E501
+                        reports.append(out)
+                        changed = len(delta) > 0 or extra['pg_migration']['steps'] > 0  # noqa: E501
+                    out = '\n'.join(reports)
         elif not module.check_mode:
             rc, cmd, out, err = exec_command(module,
                                              create_pool(cluster,
@@ -713,12 +1399,17 @@ def run_module():
             out = "Couldn't list pool(s) present on the cluster"
 
     elif state == "absent":
-        rc, cmd, out, err = exec_command(module,
-                                         check_pool_exist(cluster,
-                                                          name, user,
-                                                          user_key,
-                                                          container_image=container_image))  # noqa: E501
-        changed = rc == 0
+        snapshot = PoolSnapshot(module,
+                                cluster,
+                                user,
+                                user_key,
+                                container_image=container_image)
+        rc, cmd, out, err = snapshot.load(crush_rules=False)
+        if rc != 0:
+            exit_module(module=module, out=out, rc=rc, cmd=cmd, err=err,
+                        startd=startd)
+        out = ''
+        changed = name in snapshot
         if changed and not module.check_mode:
             rc, cmd, out, err = exec_command(module,
                                              remove_pool(cluster,
@@ -728,7 +1419,7 @@ def run_module():
                                                          container_image=container_image))  # noqa: E501
 
     exit_module(module=module, out=out, rc=rc, cmd=cmd, err=err, startd=startd,
-                changed=changed, diff=diff)
+                changed=changed, diff=diff, **extra)
 
 
 def main():
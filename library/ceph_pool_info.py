@@ -0,0 +1,300 @@
+# Copyright 2020, Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from ansible.module_utils.basic import AnsibleModule
+try:
+    from ansible.module_utils.ca_common import exit_module, \
+        generate_cmd, \
+        is_containerized, \
+        exec_read_command, \
+        run_concurrently
+except ImportError:
+    from module_utils.ca_common import exit_module, \
+        generate_cmd, \
+        is_containerized, \
+        exec_read_command, \
+        run_concurrently
+import datetime
+import fnmatch
+import functools
+import json
+
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: ceph_pool_info
+short_description: Get information about Ceph pools
+description:
+    - Get the details of the Ceph pools matching some filters, or
+      statistics about them. The pool dump is parsed on the managed node
+      and the pools are returned as structured data in 'pools'.
+options:
+    cluster:
+        description:
+            - The ceph cluster name.
+        required: false
+        default: ceph
+    name:
+        description:
+            - only return the pools whose name matches this glob pattern.
+        required: false
+    application:
+        description:
+            - only return the pools with this application enabled.
+        required: false
+    pool_type:
+        description:
+            - only return the pools of this type.
+        required: false
+        choices: ['replicated', 'erasure']
+    rule_name:
+        description:
+            - only return the pools using this crush rule.
+        required: false
+    fields:
+        description:
+            - only return these fields of each pool (pool_name is always
+              returned). Besides the fields of 'osd pool ls detail',
+              pool_type, application, target_size_ratio and crush_rule_id
+              are available, crush_rule is the name of the rule.
+        required: false
+    offset:
+        description:
+            - skip this number of matching pools.
+        required: false
+        default: 0
+    limit:
+        description:
+            - return at most this number of pools, 0 returns them all.
+        required: false
+        default: 0
+    summary:
+        description:
+            - return statistics about the matching pools in 'summary'
+              instead of the pools.
+        required: false
+        default: false
+author:
+    - agent <agent@local>
+'''
+
+EXAMPLES = '''
+- name: get the rgw pools
+  ceph_pool_info:
+    application: rgw
+    fields:
+      - size
+      - pg_num
+  register: rgw_pools
+
+- name: get the second page of 100 pools
+  ceph_pool_info:
+    offset: 100
+    limit: 100
+
+- name: get statistics about the erasure coded pools
+  ceph_pool_info:
+    pool_type: erasure
+    summary: true
+'''
+
+RETURN = '''
+pools:
+    description: the matching pools, sorted by pool id
+    returned: when summary is false
+    type: list
+total:
+    description: the number of matching pools
+    returned: always
+    type: int
+summary:
+    description: the number of matching pools per application, type and
+                 crush rule, and their total number of PGs
+    returned: when summary is true
+    type: dict
+'''
+
+POOL_TYPES = {1: 'replicated', 3: 'erasure'}
+
+
+def list_pools(cluster, container_image=None):
+    '''
+    List the details of all the pools
+    '''
+
+    args = ['ls', 'detail', '-f', 'json']
+
+    cmd = generate_cmd(sub_cmd=['osd', 'pool'],
+                       args=args,
+                       cluster=cluster,
+                       container_image=container_image)
+
+    return cmd
+
+
+def list_crush_rules(cluster, container_image=None):
+    '''
+    List the crush rules
+    '''
+
+    args = ['rule', 'dump', '-f', 'json']
+
+    cmd = generate_cmd(sub_cmd=['osd', 'crush'],
+                       args=args,
+                       cluster=cluster,
+                       container_image=container_image)
+
+    return cmd
+
+
+def get_pool_info(pool, crush_rules):
+    '''
+    Add the derived fields to a pool of 'osd pool ls detail',
+    crush_rules maps the crush rule ids to their names
+    '''
+
+    info = dict(pool)
+    info['pool_type'] = POOL_TYPES.get(pool.get('type'), str(pool.get('type')))  # noqa: E501
+    application = list(pool.get('application_metadata', {}).keys())
+    info['application'] = application[0] if application else ''
+    info['target_size_ratio'] = pool.get('options', {}).get('target_size_ratio')  # noqa: E501
+    info['crush_rule_id'] = pool['crush_rule']
+    info['crush_rule'] = crush_rules.get(pool['crush_rule'], pool['crush_rule'])  # noqa: E501
+
+    return info
+
+
+def match_pool(info, params):
+    '''
+    Check if a pool matches the filters given to the module
+    '''
+
+    if params.get('name') and not fnmatch.fnmatchcase(info['pool_name'], params['name']):  # noqa: E501
+        return False
+    if params.get('application') and params['application'] not in info.get('application_metadata', {}):  # noqa: E501
+        return False
+    if params.get('pool_type') and info['pool_type'] != params['pool_type']:
+        return False
+    if params.get('rule_name') and info['crush_rule'] != params['rule_name']:
+        return False
+
+    return True
+
+
+def project_pool(info, fields):
+    '''
+    Only keep some fields of a pool
+    '''
+
+    if not fields:
+        return info
+
+    return dict((field, info.get(field))
+                for field in ['pool_name'] + [f for f in fields if f != 'pool_name'])  # noqa: E501
+
+
+def get_summary(pools):
+    '''
+    Get statistics about a list of pools
+    '''
+
+    summary = dict(pools=len(pools),
+                   pg_num=0,
+                   by_application={},
+                   by_type={},
+                   by_crush_rule={})
+    for info in pools:
+        summary['pg_num'] += info.get('pg_num', 0)
+        for application in info.get('application_metadata', {}) or ['']:
+            summary['by_application'][application] = summary['by_application'].get(application, 0) + 1  # noqa: E501
+        summary['by_type'][info['pool_type']] = summary['by_type'].get(info['pool_type'], 0) + 1  # noqa: E501
+        rule = str(info['crush_rule'])
+        summary['by_crush_rule'][rule] = summary['by_crush_rule'].get(rule, 0) + 1  # noqa: E501
+
+    return summary
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            cluster=dict(type='str', required=False, default='ceph'),
+            name=dict(type='str', required=False),
+            application=dict(type='str', required=False),
+            pool_type=dict(type='str', required=False, choices=['replicated', 'erasure']),  # noqa: E501
+            rule_name=dict(type='str', required=False),
+            fields=dict(type='list', elements='str', required=False),
+            offset=dict(type='int', required=False, default=0),
+            limit=dict(type='int', required=False, default=0),
+            summary=dict(type='bool', required=False, default=False),
+        ),
+        supports_check_mode=True,
+    )
+
+    startd = datetime.datetime.now()
+    changed = False
+
+    cluster = module.params.get('cluster')
+    fields = module.params.get('fields')
+    offset = module.params.get('offset')
+    limit = module.params.get('limit')
+    summary = module.params.get('summary')
+
+    # will return either the image name or None
+    container_image = is_containerized()
+
+    # the crush rule names are only read when they are needed
+    cmds = [list_pools(cluster, container_image=container_image)]
+    if module.params.get('rule_name') or summary or not fields or 'crush_rule' in fields:  # noqa: E501
+        cmds.append(list_crush_rules(cluster, container_image=container_image))  # noqa: E501
+    results = run_concurrently([functools.partial(exec_read_command, module, cmd)  # noqa: E501
+                                for cmd in cmds])
+    for rc, cmd, out, err in results:
+        if rc != 0:
+            exit_module(module=module, out=out, rc=rc, cmd=cmd, err=err,
+                        startd=startd, changed=changed)
+
+    crush_rules = {}
+    if len(results) > 1:
+        crush_rules = dict((rule['rule_id'], rule['rule_name'])
+                           for rule in json.loads(results[1][2]))
+
+    pools = [get_pool_info(pool, crush_rules) for pool in json.loads(results[0][2])]  # noqa: E501
+    pools = sorted((info for info in pools if match_pool(info, module.params)),
+                   key=lambda info: info['pool_id'])
+
+    extra = dict(total=len(pools))
+    if summary:
+        extra['summary'] = get_summary(pools)
+    else:
+        page = pools[offset:offset + limit] if limit else pools[offset:]
+        extra['offset'] = offset
+        extra['pools'] = [project_pool(info, fields) for info in page]
+
+    # the pools are returned as data, not as a string to parse
+    rc, cmd, out, err = results[0]
+    exit_module(module=module, out='', rc=rc, cmd=cmd, err=err,
+                startd=startd, changed=changed, **extra)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# Copyright Red Hat
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from ansible.module_utils.basic import AnsibleModule
+try:
+    from ansible.module_utils.ca_common import exit_module, \
+                                               fatal, \
+                                               find_toolbox, \
+                                               is_containerized, \
+                                               list_toolboxes, \
+                                               list_toolboxes_cmd, \
+                                               remove_toolbox, \
+                                               start_toolbox, \
+                                               toolbox_name
+except ImportError:
+    from module_utils.ca_common import exit_module, \
+                                       fatal, \
+                                       find_toolbox, \
+                                       is_containerized, \
+                                       list_toolboxes, \
+                                       list_toolboxes_cmd, \
+                                       remove_toolbox, \
+                                       start_toolbox, \
+                                       toolbox_name
+import datetime
+import os
+
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: ceph_toolbox
+short_description: Manage the ceph toolbox container
+description:
+    - Start or remove the long-lived toolbox container used to run
+      the ceph CLI when CEPH_CONTAINER_TOOLBOX is enabled.
+      Instead of starting a new container for each command, the
+      ceph modules send their commands to this container with 'exec'.
+options:
+    image:
+        description:
+            - The Ceph container image to use.
+            Default to the CEPH_CONTAINER_IMAGE environment variable.
+        required: false
+    container_binary:
+        description:
+            - The container binary to use (podman or docker).
+            Default to the CEPH_CONTAINER_BINARY environment variable.
+        required: false
+    state:
+        description:
+            - If 'present' is used, the module starts the toolbox container
+            if it isn't already running or if it is about to expire. The
+            expiring one isn't removed, it exits once its ttl is reached.
+            If 'absent' is used, the module removes the toolbox containers.
+        required: false
+        choices: ['present', 'absent']
+        default: present
+author:
+    - agent <agent@local>
+'''
+
+EXAMPLES = '''
+- name: start the ceph toolbox container
+  ceph_toolbox:
+    state: present
+  environment:
+    CEPH_CONTAINER_IMAGE: "{{ ceph_docker_registry }}/{{ ceph_docker_image }}:{{ ceph_docker_image_tag }}"
+    CEPH_CONTAINER_BINARY: "{{ container_binary }}"
+
+- name: remove the ceph toolbox container
+  ceph_toolbox:
+    state: absent
+  environment:
+    CEPH_CONTAINER_IMAGE: "{{ ceph_docker_registry }}/{{ ceph_docker_image }}:{{ ceph_docker_image_tag }}"
+    CEPH_CONTAINER_BINARY: "{{ container_binary }}"
+'''
+
+RETURN = '''#  '''
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            image=dict(type='str', required=False),
+            container_binary=dict(type='str', required=False),
+            state=dict(type='str', required=False, default='present', choices=['present', 'absent']),  # noqa: E501
+        ),
+        supports_check_mode=True,
+    )
+
+    image = module.params.get('image') or is_containerized()
+    container_binary = module.params.get('container_binary') or os.getenv('CEPH_CONTAINER_BINARY')  # noqa: E501
+    state = module.params.get('state')
+
+    if not image or not container_binary:
+        fatal('image and container_binary must be provided.', module)
+
+    startd = datetime.datetime.now()
+
+    cmd = list_toolboxes_cmd(container_binary, image)
+    rc = 0
+    out = ''
+    err = ''
+
+    if state == 'present':
+        current = find_toolbox(container_binary, image, run_command=module.run_command)  # noqa: E501
+        changed = current is None
+        if not module.check_mode:
+            name = start_toolbox(container_binary, image, run_command=module.run_command)  # noqa: E501
+            if name is None:
+                fatal('Failed to start the toolbox container {}.'.format(toolbox_name(image)), module)  # noqa: E501
+            # a toolbox about to expire is replaced by a new one
+            changed = name != current
+            out = name
+    else:
+        changed = len(list_toolboxes(container_binary, image, run_command=module.run_command)) > 0  # noqa: E501
+        if changed and not module.check_mode:
+            rc, cmd, out, err = remove_toolbox(container_binary, image, run_command=module.run_command)  # noqa: E501
+
+    exit_module(module=module, out=out, rc=rc, cmd=cmd, err=err,
+                startd=startd, changed=changed)
+
+
+if __name__ == '__main__':
+    main()
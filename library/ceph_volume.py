@@ -4,16 +4,30 @@ from ansible.module_utils.basic import AnsibleModule
 try:
     from ansible.module_utils.ca_common import exec_command, \
                                                is_containerized, \
-                                               fatal
+                                               fatal, \
+                                               add_trace, \
+                                               run_concurrently, \
+                                               read_cache_enabled, \
+                                               write_read_cache, \
+                                               READ_CACHE_DIR
 except ImportError:
     from module_utils.ca_common import exec_command, \
                                        is_containerized, \
-                                       fatal
+                                       fatal, \
+                                       add_trace, \
+                                       run_concurrently, \
+                                       read_cache_enabled, \
+                                       write_read_cache, \
+                                       READ_CACHE_DIR
 import datetime
 import copy
+import functools
+import glob
+import hashlib
 import json
 import os
 import re
+import time
 
 ANSIBLE_METADATA = {
     'metadata_version': '1.0',
@@ -124,6 +138,11 @@ options:
             - No OSDs will be created.
             - Results will be returned in json format.
             - Only applicable if action is 'batch'.
+            - Without it, the batch only runs if the report plans some
+              OSDs. The planned OSDs are returned in 'plan' either way.
+            - When the read cache is enabled (CEPH_READ_CACHE), the
+              report is cached on the host like the inventory, so the
+              batch reuses the plan of an earlier report.
         required: false
     list:
         description:
@@ -132,6 +151,32 @@ options:
     inventory:
         description:
             - List storage device inventory.
+            - When the read cache is enabled (CEPH_READ_CACHE), the
+              inventory is cached on the host until the wwid, serial,
+              size, partitions or holders of a block device change, or
+              udev handles an event of one of them.
+        required: false
+    lvm_volumes:
+        description:
+            - A list of volumes to create or prepare OSDs on, each with
+              the data, data_vg, db, db_vg, wal, wal_vg and
+              crush_device_class keys of a single OSD, or a device.
+            - The OSDs of the host are listed once and the volumes not
+              used by an OSD yet are handled concurrently.
+            - If action is 'zap', a list of targets to zap, each a
+              volume with the data, data_vg, journal, journal_vg, db,
+              db_vg, wal, wal_vg, osd_id or osd_fsid keys, a device, an
+              OSD id or an OSD fsid. The LVs of the host are reported
+              once, the targets sharing a VG or a disk are zapped one
+              after the other and the others concurrently.
+            - Only applicable if action is 'create', 'prepare' or 'zap'.
+            - Mutually exclusive with data, osd_fsid and osd_id.
+        required: false
+    workers:
+        description:
+            - The number of volumes of lvm_volumes handled at the same
+              time. Defaults to the CEPH_MAX_WORKERS environment
+              variable or 4.
         required: false
 
 author:
@@ -155,8 +200,39 @@ EXAMPLES = '''
     db: /dev/sdc1
     wal: /dev/sdc2
     action: create
+
+- name: set up the bluestore osds of all the lvm_volumes of a host
+  ceph_volume:
+    objectstore: bluestore
+    lvm_volumes: "{{ lvm_volumes }}"
+    workers: 8
+    action: create
+
+- name: zap the devices and the osds of a host
+  ceph_volume:
+    lvm_volumes:
+      - /dev/sdb
+      - data: data-lv1
+        data_vg: data-vg
+      - 3
+      - 2e3e7bbd-59a6-4aa0-a39f-08a7a5b5b0c9
+    destroy: true
+    action: zap
 '''
 
+SYS_BLOCK_DIR = '/sys/block'
+UDEV_DATA_DIR = '/run/udev/data'
+
+VOLUME_KEYS = ['data', 'data_vg', 'db', 'db_vg', 'wal', 'wal_vg',
+               'crush_device_class']
+
+ZAP_DEVICE_TYPES = ['journal', 'data', 'db', 'wal']
+
+ZAP_KEYS = ['data', 'data_vg', 'journal', 'journal_vg', 'db', 'db_vg',
+            'wal', 'wal_vg', 'osd_id', 'osd_fsid']
+
+OSD_FSID_RE = re.compile('^[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12}$')
+
 
 def container_exec(binary, container_image, mounts=None):
     '''
@@ -319,23 +395,35 @@ def ceph_volume_cmd(subcommand, container_image, cluster=None):
     return cmd
 
 
-def prepare_or_create_osd(module, action, container_image):
+def mask_keys(text):
+    '''
+    Hide the cephx keys printed by ceph-volume
+    '''
+
+    return re.sub('[a-zA-Z0-9+/]{38}==', '*' * 8, text)
+
+
+def prepare_or_create_osd(module, action, container_image, params=None):
     '''
-    Prepare or create OSD devices
+    Prepare or create OSD devices, params overrides the module
+    parameters for a single volume of lvm_volumes
     '''
 
+    if params is None:
+        params = module.params
+
     # get module variables
-    cluster = module.params['cluster']
-    objectstore = module.params['objectstore']
-    data = module.params['data']
-    data_vg = module.params.get('data_vg', None)
+    cluster = params['cluster']
+    objectstore = params['objectstore']
+    data = params['data']
+    data_vg = params.get('data_vg', None)
     data = get_data(data, data_vg)
-    db = module.params.get('db', None)
-    db_vg = module.params.get('db_vg', None)
-    wal = module.params.get('wal', None)
-    wal_vg = module.params.get('wal_vg', None)
-    crush_device_class = module.params.get('crush_device_class', None)
-    dmcrypt = module.params.get('dmcrypt', None)
+    db = params.get('db', None)
+    db_vg = params.get('db_vg', None)
+    wal = params.get('wal', None)
+    wal_vg = params.get('wal_vg', None)
+    crush_device_class = params.get('crush_device_class', None)
+    dmcrypt = params.get('dmcrypt', None)
 
     # Build the CLI
     action = ['lvm', action]
@@ -385,6 +473,104 @@ def list_osd(module, container_image):
     return cmd
 
 
+def get_volume_params(module, volume):
+    '''
+    Merge an entry of lvm_volumes with the module parameters, the
+    crush device class of the module is the default one
+    '''
+
+    params = dict(module.params)
+    for key in VOLUME_KEYS:
+        params[key] = volume.get(key)
+    params['crush_device_class'] = volume.get('crush_device_class') or module.params.get('crush_device_class')  # noqa: E501
+    return params
+
+
+def resolve_device(path):
+    '''
+    Resolve the symlinks of a device path (/dev/disk/by-id/...,
+    /dev/mapper/vg-lv...), a vg/lv is returned as is
+    '''
+
+    if path.startswith('/'):
+        return os.path.realpath(path)
+    return path
+
+
+def get_osd_devices(osds):
+    '''
+    Return the lvs (as vg/lv and as a path) and the devices used by
+    the OSDs of 'lvm list --format=json', the paths are also given
+    resolved
+    '''
+
+    used = set()
+    for lvs in osds.values():
+        for lv in lvs:
+            used.add('{}/{}'.format(lv['vg_name'], lv['lv_name']))
+            for path in [lv['lv_path']] + lv.get('devices', []):
+                used.add(path)
+                used.add(resolve_device(path))
+    return used
+
+
+def prepare_volume(module, action, container_image, params):
+    '''
+    Prepare or create the OSD of a single volume, the keys are masked
+    before the output is shared with the other workers
+    '''
+
+    rc, cmd, out, err = exec_command(
+        module, prepare_or_create_osd(module, action, container_image, params))  # noqa: E501
+    return rc, cmd, mask_keys(out), mask_keys(err)
+
+
+def prepare_or_create_osds(module, action, container_image):
+    '''
+    Prepare or create the OSDs of lvm_volumes, the OSDs of the host
+    are listed once and the unused volumes are handled concurrently.
+    Return (rc, cmd, out, err, changed, results), one result per volume
+    '''
+
+    volumes = [(volume, get_volume_params(module, volume))
+               for volume in map(get_volume, module.params['lvm_volumes'])]
+    datas = [get_data(params['data'], params['data_vg']) for volume, params in volumes]  # noqa: E501
+    for data in datas:
+        if not data:
+            fatal('data must be provided for each of lvm_volumes', module)
+        if datas.count(data) > 1:
+            fatal('{} is used by more than one of lvm_volumes'.format(data), module)  # noqa: E501
+
+    rc, cmd, out, err = exec_command(module, list_osd(module, container_image))  # noqa: E501
+    try:
+        used = get_osd_devices(json.loads(out))
+    except ValueError:
+        fatal("Could not decode json output: {} from the command {}".format(out, cmd), module)  # noqa: E501
+
+    results = []
+    pending = []
+    for data, (volume, params) in zip(datas, volumes):
+        result = dict(data=data, cmd=cmd, rc=0, stdout='', stderr='', changed=False)  # noqa: E501
+        if data in used or resolve_device(data) in used:
+            result['stdout'] = 'skipped, since {0} is already used for an osd'.format(data)  # noqa: E501
+        else:
+            pending.append((result, params))
+        results.append(result)
+
+    outputs = run_concurrently([functools.partial(prepare_volume, module, action, container_image, params)  # noqa: E501
+                                for result, params in pending],
+                               max_workers=module.params.get('workers'))
+    for (result, params), (_rc, _cmd, _out, _err) in zip(pending, outputs):
+        result.update(cmd=_cmd, rc=_rc, stdout=_out.rstrip('\r\n'),
+                      stderr=_err.rstrip('\r\n'), changed=True)
+
+    failed = [result for result in results if result['rc'] != 0]
+    rc = failed[0]['rc'] if failed else 0
+    out = '\n'.join('{}: {}'.format(result['data'], result['stdout'] or 'done') for result in results)  # noqa: E501
+    err = '\n'.join('{}: {}'.format(result['data'], result['stderr']) for result in failed)  # noqa: E501
+    return rc, cmd, out, err, len(pending) > 0, results
+
+
 def list_storage_inventory(module, container_image):
     '''
     List storage inventory.
@@ -397,6 +583,155 @@ def list_storage_inventory(module, container_image):
     return cmd
 
 
+def read_sysfs(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def get_udev_event_time(node):
+    '''
+    Get the mtime of the udev database entry of a block device, udev
+    rewrites it on every event of the device
+    '''
+
+    dev = read_sysfs(os.path.join(node, 'dev'))
+    try:
+        return os.stat(os.path.join(UDEV_DATA_DIR, 'b' + dev)).st_mtime
+    except (OSError, TypeError):
+        return None
+
+
+def get_device_identity(name):
+    '''
+    Identify a block device by its wwid, serial, size and partitions,
+    with what holds them (lvm, dm-crypt) and their last udev events
+    '''
+
+    path = os.path.join(SYS_BLOCK_DIR, name)
+    partitions = sorted(os.path.basename(os.path.dirname(p))
+                        for p in glob.glob(os.path.join(path, '*', 'partition')))  # noqa: E501
+    nodes = [path] + [os.path.join(path, p) for p in partitions]
+    return dict(
+        wwid=read_sysfs(os.path.join(path, 'device', 'wwid')) or read_sysfs(os.path.join(path, 'wwid')),  # noqa: E501
+        serial=read_sysfs(os.path.join(path, 'device', 'serial')),
+        size=read_sysfs(os.path.join(path, 'size')),
+        partitions=[(p, read_sysfs(os.path.join(path, p, 'size'))) for p in partitions],  # noqa: E501
+        holders=[sorted(os.listdir(os.path.join(node, 'holders')))
+                 if os.path.isdir(os.path.join(node, 'holders')) else []
+                 for node in nodes],
+        events=[get_udev_event_time(node) for node in nodes],
+    )
+
+
+def get_inventory_fingerprint():
+    '''
+    Fingerprint the block devices of the host, None if they can't be
+    read (the inventory isn't cached then)
+    '''
+
+    try:
+        devices = dict((name, get_device_identity(name))
+                       for name in sorted(os.listdir(SYS_BLOCK_DIR)))
+    except OSError:
+        return None
+    return hashlib.sha1(json.dumps(devices, sort_keys=True).encode('utf-8')).hexdigest()  # noqa: E501
+
+
+HOST_CACHE_KINDS = ['inventory', 'batch-report']
+
+
+def host_cache_dir():
+    '''
+    The device inventory and the batch plans are cached per host, next
+    to the read cache of the clusters
+    '''
+
+    return os.getenv('CEPH_READ_CACHE_DIR', READ_CACHE_DIR)
+
+
+def host_cache_path(kind, cmd):
+    digest = hashlib.sha1(json.dumps(cmd).encode('utf-8')).hexdigest()
+    return os.path.join(host_cache_dir(), kind + '-' + digest + '.json')
+
+
+def invalidate_host_cache():
+    for kind in HOST_CACHE_KINDS:
+        for path in glob.glob(os.path.join(host_cache_dir(), kind + '-*.json')):  # noqa: E501
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def exec_device_probe(module, cmd, kind):
+    '''
+    Run a command probing the devices of the host through the host
+    cache when the read cache is enabled. The cached output is reused
+    until the fingerprint of the block devices changes.
+    '''
+
+    if not read_cache_enabled():
+        return exec_command(module, cmd)
+
+    fingerprint = get_inventory_fingerprint()
+    if fingerprint is None:
+        return exec_command(module, cmd)
+
+    path = host_cache_path(kind, cmd)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (IOError, ValueError):
+        entry = None
+
+    if entry and entry['fingerprint'] == fingerprint:
+        return 0, cmd, entry['out'], entry['err']
+
+    rc, cmd, out, err = exec_command(module, cmd)
+    # a device changing while it was probed isn't cached
+    if rc == 0 and get_inventory_fingerprint() == fingerprint:
+        write_read_cache(path, dict(fingerprint=fingerprint,
+                                    time=time.time(),
+                                    out=out,
+                                    err=err))
+
+    return rc, cmd, out, err
+
+
+def exec_inventory(module, cmd):
+    '''
+    Run 'ceph-volume inventory' through the host cache
+    '''
+
+    return exec_device_probe(module, cmd, 'inventory')
+
+
+def exec_batch_report(module, cmd):
+    '''
+    Run 'ceph-volume lvm batch --report' through the host cache, the
+    plan computed to count the OSDs to create is reused to decide if
+    the batch has to run, as long as the devices don't change
+    '''
+
+    return exec_device_probe(module, cmd, 'batch-report')
+
+
+def get_batch_plan(report_result):
+    '''
+    Return the OSDs a batch report plans to create, None for the legacy
+    report which only tells if something changes
+    '''
+
+    if isinstance(report_result, dict):
+        if 'changed' in report_result:
+            return None
+        return report_result.get('osds', [])
+    return report_result
+
+
 def activate_osd():
     '''
     Activate all the OSDs on a machine
@@ -411,11 +746,40 @@ def activate_osd():
     return cmd
 
 
-def is_lv(module, vg, lv, container_image):
+def get_lvs(module, container_image):
+    '''
+    Report all the LVs of the host with a single 'lvs' call, indexed by
+    vg/lv, with the devices the LV is on
+    '''
+
+    args = ['--noheadings', '--reportformat', 'json', '-o', 'lv_name,vg_name,lv_tags,devices']  # noqa: E501
+
+    cmd = build_cmd(args, container_image, binary='lvs')
+
+    rc, cmd, out, err = exec_command(module, cmd)
+
+    lvs = {}
+    if rc == 0:
+        # lvs reports one row per segment of an LV
+        for row in json.loads(out)['report'][0]['lv']:
+            lv = lvs.setdefault('{}/{}'.format(row['vg_name'], row['lv_name']),  # noqa: E501
+                                dict(row, devices=[]))
+            for device in row.get('devices', '').split(','):
+                device = device.split('(')[0]
+                if device and device not in lv['devices']:
+                    lv['devices'].append(device)
+
+    return lvs
+
+
+def is_lv(module, vg, lv, container_image, lvs=None):
     '''
-    Check if an LV exists
+    Check if an LV exists, in the report of get_lvs if one is given
     '''
 
+    if lvs is not None:
+        return '{}/{}'.format(vg, lv) in lvs
+
     args = ['--noheadings', '--reportformat', 'json', '--select', 'lv_name={},vg_name={}'.format(lv, vg)]  # noqa: E501
 
     cmd = build_cmd(args, container_image, binary='lvs')
@@ -430,24 +794,29 @@ def is_lv(module, vg, lv, container_image):
     return False
 
 
-def zap_devices(module, container_image):
+def zap_devices(module, container_image, params=None):
     '''
     Will run 'ceph-volume lvm zap' on all devices, lvs and partitions
     used to create the OSD. The --destroy flag is always passed so that
     if an OSD was originally created with a raw device or partition for
     'data' then any lvs that were created by ceph-volume are removed.
+    params overrides the module parameters for a single target of
+    lvm_volumes.
     '''
 
+    if params is None:
+        params = module.params
+
     # get module variables
-    data = module.params.get('data', None)
-    data_vg = module.params.get('data_vg', None)
-    db = module.params.get('db', None)
-    db_vg = module.params.get('db_vg', None)
-    wal = module.params.get('wal', None)
-    wal_vg = module.params.get('wal_vg', None)
-    osd_fsid = module.params.get('osd_fsid', None)
-    osd_id = module.params.get('osd_id', None)
-    destroy = module.params.get('destroy', True)
+    data = params.get('data', None)
+    data_vg = params.get('data_vg', None)
+    db = params.get('db', None)
+    db_vg = params.get('db_vg', None)
+    wal = params.get('wal', None)
+    wal_vg = params.get('wal_vg', None)
+    osd_fsid = params.get('osd_fsid', None)
+    osd_id = params.get('osd_id', None)
+    destroy = params.get('destroy', True)
 
     # build the CLI
     action = ['lvm', 'zap']
@@ -476,6 +845,198 @@ def zap_devices(module, container_image):
     return cmd
 
 
+def check_zap_params(module, params, container_image, lvs=None):
+    '''
+    Drop the vg/lv of params which aren't actual LVs, they were already
+    zapped. Return whether there is anything left to zap
+    '''
+
+    skip = []
+    lv_device_types = []
+    for device_type in ZAP_DEVICE_TYPES:
+        # 1/ if we passed vg/lv
+        if params.get('{}_vg'.format(device_type), None) and params.get(device_type, None):  # noqa: E501
+            lv_device_types.append(device_type)
+        # 4/ no journal|data|db|wal|_vg was passed, so it must be a raw device  # noqa: E501
+        elif not params.get('{}_vg'.format(device_type), None) and params.get(device_type, None):  # noqa: E501
+            skip.append(True)
+
+    # 2/ check these are actual lv/vg against one report of the LVs
+    if lvs is None:
+        lvs = get_lvs(module, container_image) if lv_device_types else {}
+    for device_type in lv_device_types:
+        ret = is_lv(module, params['{}_vg'.format(device_type)], params[device_type], container_image, lvs=lvs)  # noqa: E501
+        skip.append(ret)
+        # 3/ This isn't a lv/vg device
+        if not ret:
+            params['{}_vg'.format(device_type)] = False
+            params[device_type] = False
+
+    return bool(any(skip) or params.get('osd_fsid', None) or params.get('osd_id', None))  # noqa: E501
+
+
+def get_volume(entry):
+    '''
+    Turn an entry of lvm_volumes given as a string, an OSD id, an OSD
+    fsid or a device, into a volume
+    '''
+
+    if isinstance(entry, dict):
+        return entry
+    entry = str(entry)
+    if entry.isdigit():
+        return {'osd_id': entry}
+    if OSD_FSID_RE.match(entry.lower()):
+        return {'osd_fsid': entry}
+    return {'data': entry}
+
+
+def get_zap_params(module, volume):
+    '''
+    Merge a target of lvm_volumes with the module parameters
+    '''
+
+    params = dict(module.params)
+    for key in ZAP_KEYS:
+        value = volume.get(key)
+        params[key] = str(value) if key in ['osd_id', 'osd_fsid'] and value is not None else value  # noqa: E501
+    return params
+
+
+def get_zap_target(params):
+    '''
+    Name a target of lvm_volumes in the results
+    '''
+
+    if params.get('osd_id'):
+        return 'osd.{}'.format(params['osd_id'])
+    if params.get('osd_fsid'):
+        return params['osd_fsid']
+    return ' '.join(get_data(params[device_type], params['{}_vg'.format(device_type)])  # noqa: E501
+                    for device_type in ZAP_DEVICE_TYPES if params.get(device_type))  # noqa: E501
+
+
+def get_parent_disk(device):
+    '''
+    Return the disk of a partition, the device itself otherwise
+    '''
+
+    device = os.path.realpath(device)
+    for path in glob.glob(os.path.join(SYS_BLOCK_DIR, '*', os.path.basename(device))):  # noqa: E501
+        return os.path.join('/dev', os.path.basename(os.path.dirname(path)))
+    return device
+
+
+def get_zap_resources(params, lvs):
+    '''
+    Return the VGs and the disks a zap of params touches, the LVs of
+    the OSD ids and fsids are found by their tags
+    '''
+
+    lv_names = []
+    disks = set()
+    for device_type in ZAP_DEVICE_TYPES:
+        device = params.get(device_type)
+        if not device:
+            continue
+        name = get_data(device, params.get('{}_vg'.format(device_type)))
+        if name.startswith('/dev/'):
+            name = name[len('/dev/'):]
+        if name in lvs:
+            lv_names.append(name)
+        else:
+            disks.add(get_parent_disk(device))
+
+    for name, lv in lvs.items():
+        tags = dict(tag.split('=', 1) for tag in lv.get('lv_tags', '').split(',') if '=' in tag)  # noqa: E501
+        if (params.get('osd_id') and tags.get('ceph.osd_id') == params['osd_id']) or \
+                (params.get('osd_fsid') and tags.get('ceph.osd_fsid') == params['osd_fsid']):  # noqa: E501
+            lv_names.append(name)
+
+    resources = set(('disk', disk) for disk in disks)
+    for name, lv in lvs.items():
+        lv_disks = set(get_parent_disk(device) for device in lv['devices'])
+        if name in lv_names or lv_disks & disks:
+            resources.add(('vg', lv['vg_name']))
+            resources.update(('disk', disk) for disk in lv_disks)
+    return resources
+
+
+def group_zap_targets(resources):
+    '''
+    Group the targets sharing a VG or a disk, given the resources of
+    each of them. Return the indexes of the targets of each group
+    '''
+
+    groups = []
+    for i, target_resources in enumerate(resources):
+        group = ([i], set(target_resources))
+        for other in [g for g in groups if g[1] & group[1]]:
+            groups.remove(other)
+            group[0].extend(other[0])
+            group[1].update(other[1])
+        groups.append(group)
+    return sorted(sorted(indexes) for indexes, _ in groups)
+
+
+def zap_group(module, cmds):
+    '''
+    Zap the targets of a group one after the other
+    '''
+
+    return [exec_command(module, cmd) for cmd in cmds]
+
+
+def zap_osds(module, container_image):
+    '''
+    Zap the targets of lvm_volumes, the LVs of the host are reported
+    once. The targets sharing a VG or a disk are zapped one after the
+    other, the others concurrently.
+    Return (rc, cmd, out, err, changed, results), one result per target
+    '''
+
+    targets = [get_zap_params(module, get_volume(entry))
+               for entry in module.params['lvm_volumes']]
+    lvs = get_lvs(module, container_image)
+
+    results = []
+    pending = []
+    for params in targets:
+        result = dict(target=get_zap_target(params), rc=0, stdout='', stderr='', changed=False)  # noqa: E501
+        if not result['target']:
+            fatal('data, osd_id or osd_fsid must be provided for each of lvm_volumes', module)  # noqa: E501
+        resources = get_zap_resources(params, lvs)
+        if result['target'] in [r['target'] for r in results]:
+            result['stdout'] = 'Skipped, {} is zapped once'.format(result['target'])  # noqa: E501
+        elif check_zap_params(module, params, container_image, lvs=lvs):
+            result['cmd'] = zap_devices(module, container_image, params)
+            pending.append((result, resources))
+        else:
+            result['stdout'] = 'Skipped, nothing to zap'
+        results.append(result)
+
+    groups = [[pending[i][0] for i in indexes]
+              for indexes in group_zap_targets([resources for result, resources in pending])]  # noqa: E501
+    outputs = run_concurrently([functools.partial(zap_group, module, [result['cmd'] for result in group])  # noqa: E501
+                                for group in groups],
+                               max_workers=module.params.get('workers'))
+    for group, group_outputs in zip(groups, outputs):
+        for result, (_rc, _cmd, _out, _err) in zip(group, group_outputs):
+            result.update(cmd=_cmd, rc=_rc, stdout=_out.rstrip('\r\n'),
+                          stderr=_err.rstrip('\r\n'), changed=True)
+
+    if pending:
+        # a single scan refreshes the metadata of all the VGs and LVs
+        exec_command(module, ['vgscan', '--cache'])
+
+    cmd = [result['cmd'] for result in results if result.get('cmd')]
+    failed = [result for result in results if result['rc'] != 0]
+    rc = failed[0]['rc'] if failed else 0
+    out = '\n'.join('{}: {}'.format(result['target'], result['stdout'] or 'done') for result in results)  # noqa: E501
+    err = '\n'.join('{}: {}'.format(result['target'], result['stderr']) for result in failed)  # noqa: E501
+    return rc, cmd, out, err, len(pending) > 0, results
+
+
 def allowed_in_check_mode(module):
     '''
     Check if the action is allowed in check mode
@@ -518,16 +1079,18 @@ def run_module():
         osd_fsid=dict(type='str', required=False),
         osd_id=dict(type='str', required=False),
         destroy=dict(type='bool', required=False, default=True),
+        lvm_volumes=dict(type='list', required=False),
+        workers=dict(type='int', required=False),
     )
 
     module = AnsibleModule(
         argument_spec=module_args,
         supports_check_mode=True,
         mutually_exclusive=[
-            ('data', 'osd_fsid', 'osd_id'),
+            ('data', 'osd_fsid', 'osd_id', 'lvm_volumes'),
         ],
         required_if=[
-            ('action', 'zap', ('data', 'osd_fsid', 'osd_id'), True)
+            ('action', 'zap', ('data', 'osd_fsid', 'osd_id', 'lvm_volumes'), True)  # noqa: E501
         ]
     )
 
@@ -555,8 +1118,23 @@ def run_module():
 
     # Assume the task's status will be 'changed'
     changed = True
+    extra = {}
+
+    if module.params.get('lvm_volumes') is not None and action not in ['create', 'prepare', 'zap']:  # noqa: E501
+        fatal('lvm_volumes is only applicable if action is "create", "prepare" or "zap"', module)  # noqa: E501
 
-    if action == 'create' or action == 'prepare':
+    if module.params.get('workers') is not None and module.params['workers'] < 1:  # noqa: E501
+        fatal('workers must be greater than 0', module)
+
+    if module.params.get('lvm_volumes') is not None and action == 'zap':
+        rc, cmd, out, err, changed, extra['volumes'] = zap_osds(
+            module, container_image)
+
+    elif module.params.get('lvm_volumes') is not None:
+        rc, cmd, out, err, changed, extra['volumes'] = prepare_or_create_osds(  # noqa: E501
+            module, action, container_image)
+
+    elif action == 'create' or action == 'prepare':
         # First test if the device has Ceph LVM Metadata
         rc, cmd, out, err = exec_command(
             module, list_osd(module, container_image))
@@ -582,7 +1160,7 @@ def run_module():
         # Prepare or create the OSD
         rc, cmd, out, err = exec_command(
             module, prepare_or_create_osd(module, action, container_image))
-        err = re.sub('[a-zA-Z0-9+/]{38}==', '*' * 8, err)
+        err = mask_keys(err)
 
     elif action == 'activate':
         if container_image:
@@ -595,29 +1173,15 @@ def run_module():
 
     elif action == 'zap':
         # Zap the OSD
-        skip = []
-        for device_type in ['journal', 'data', 'db', 'wal']:
-            # 1/ if we passed vg/lv
-            if module.params.get('{}_vg'.format(device_type), None) and module.params.get(device_type, None):  # noqa: E501
-                # 2/ check this is an actual lv/vg
-                ret = is_lv(module, module.params['{}_vg'.format(device_type)], module.params[device_type], container_image)  # noqa: E501
-                skip.append(ret)
-                # 3/ This isn't a lv/vg device
-                if not ret:
-                    module.params['{}_vg'.format(device_type)] = False
-                    module.params[device_type] = False
-            # 4/ no journal|data|db|wal|_vg was passed, so it must be a raw device  # noqa: E501
-            elif not module.params.get('{}_vg'.format(device_type), None) and module.params.get(device_type, None):  # noqa: E501
-                skip.append(True)
+        zap = check_zap_params(module, module.params, container_image)
 
         cmd = zap_devices(module, container_image)
 
-        if any(skip) or module.params.get('osd_fsid', None) \
-                or module.params.get('osd_id', None):
+        if zap:
             rc, cmd, out, err = exec_command(
                 module, cmd)
-            for scan_cmd in ['vgscan', 'lvscan']:
-                module.run_command([scan_cmd, '--cache'])
+            # a single scan refreshes the metadata of all the VGs and LVs
+            exec_command(module, ['vgscan', '--cache'])
         else:
             out = 'Skipped, nothing to zap'
             err = ''
@@ -633,7 +1197,7 @@ def run_module():
     elif action == 'inventory':
         # List storage device inventory.
         changed = False
-        rc, cmd, out, err = exec_command(
+        rc, cmd, out, err = exec_inventory(
             module, list_storage_inventory(module, container_image))
 
     elif action == 'batch':
@@ -652,7 +1216,7 @@ def run_module():
 
         # Run batch --report to see what's going to happen
         # Do not run the batch command if there is nothing to do
-        rc, cmd, out, err = exec_command(
+        rc, cmd, out, err = exec_batch_report(
             module, batch_report_cmd)
         try:
             if not out:
@@ -685,8 +1249,12 @@ def run_module():
                 module.exit_json(**result)
             module.fail_json(msg='non-zero return code', **result)
 
+        plan = get_batch_plan(report_result)
+        if plan is not None:
+            extra['plan'] = plan
+
         if not report:
-            if 'changed' in report_result:
+            if plan is None:
                 # we have the old batch implementation
                 # if not asking for a report, let's just run the batch command
                 changed = report_result['changed']
@@ -694,16 +1262,25 @@ def run_module():
                     # Batch prepare the OSD
                     rc, cmd, out, err = exec_command(
                         module, batch(module, container_image))
-                    err = re.sub('[a-zA-Z0-9+/]{38}==', '*' * 8, err)
-            else:
-                # we have the refactored batch, its idempotent so lets just
-                # run it
+                    err = mask_keys(err)
+            elif plan:
+                # we have the refactored batch, it runs the plan of the
+                # report as long as the devices didn't change
                 rc, cmd, out, err = exec_command(
                     module, batch(module, container_image))
-                err = re.sub('[a-zA-Z0-9+/]{38}==', '*' * 8, err)
+                err = mask_keys(err)
+            else:
+                # the report plans no osd, there is nothing to do
+                changed = False
         else:
             cmd = batch_report_cmd
 
+    # the devices were changed, don't wait for udev to notice
+    if changed and read_cache_enabled() and \
+            action in ['create', 'prepare', 'batch', 'zap'] and \
+            not (action == 'batch' and module.params.get('report')):
+        invalidate_host_cache()
+
     endd = datetime.datetime.now()
     delta = endd - startd
 
@@ -716,8 +1293,11 @@ def run_module():
         stdout=out.rstrip('\r\n'),
         stderr=err.rstrip('\r\n'),
         changed=changed,
+        **extra
     )
 
+    add_trace(result)
+
     if rc != 0:
         module.fail_json(msg='non-zero return code', **result)
 
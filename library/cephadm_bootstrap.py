@@ -17,9 +17,9 @@ __metaclass__ = type
 
 from ansible.module_utils.basic import AnsibleModule
 try:
-    from ansible.module_utils.ca_common import exit_module
+    from ansible.module_utils.ca_common import exec_command, exit_module
 except ImportError:
-    from module_utils.ca_common import exit_module
+    from module_utils.ca_common import exec_command, exit_module
 import datetime
 
 
@@ -249,7 +249,7 @@ def main():
             changed=False
         )
     else:
-        rc, out, err = module.run_command(cmd)
+        rc, cmd, out, err = exec_command(module, cmd)
         exit_module(
             module=module,
             out=out,
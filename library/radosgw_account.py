@@ -16,6 +16,10 @@ from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
 from ansible.module_utils.basic import AnsibleModule
+try:
+    from ansible.module_utils.ca_common import add_trace, exec_command
+except ImportError:
+    from module_utils.ca_common import add_trace, exec_command
 import datetime
 import os
 
@@ -135,8 +139,7 @@ def generate_radosgw_cmd(cluster, args, container_image=None):
 
 
 def exec_commands(module, cmd):
-    rc, out, err = module.run_command(cmd)
-    return rc, cmd, out, err
+    return exec_command(module, cmd)
 
 
 def get_account(module, container_image=None):
@@ -216,7 +219,7 @@ def exit_module(module, out, rc, cmd, err, startd, changed=False):
         stderr=err.rstrip("\r\n"),
         changed=changed,
     )
-    module.exit_json(**result)
+    module.exit_json(**add_trace(result))
 
 
 def run_module():
@@ -17,10 +17,11 @@ __metaclass__ = type
 
 from ansible.module_utils.basic import AnsibleModule
 try:
-    from ansible.module_utils.ca_common import fatal
+    from ansible.module_utils.ca_common import add_trace, exec_command, fatal, run_concurrently  # noqa: E501
 except ImportError:
-    from module_utils.ca_common import fatal
+    from module_utils.ca_common import add_trace, exec_command, fatal, run_concurrently  # noqa: E501
 import datetime
+import functools
 import json
 import os
 
@@ -192,9 +193,7 @@ def exec_commands(module, cmd):
     Execute command(s)
     '''
 
-    rc, out, err = module.run_command(cmd)
-
-    return rc, cmd, out, err
+    return exec_command(module, cmd)
 
 
 def create_zone(module, container_image=None):
@@ -431,7 +430,7 @@ def exit_module(module, out, rc, cmd, err, startd, changed=False):
         stderr=err.rstrip("\r\n"),
         changed=changed,
     )
-    module.exit_json(**result)
+    module.exit_json(**add_trace(result))
 
 
 def run_module():
@@ -478,7 +477,17 @@ def run_module():
     # will return either the image name or None
     container_image = is_containerized()
 
-    rc, cmd, out, err = exec_commands(module, get_zone(module, container_image=container_image))  # noqa: E501
+    if state == "present":
+        # the realm and the zonegroup are only needed if the zone exists
+        # but fetching them concurrently is cheaper than waiting for it
+        probes = run_concurrently([
+            functools.partial(exec_commands, module, get_zone(module, container_image=container_image)),  # noqa: E501
+            functools.partial(exec_commands, module, get_realm(module, container_image=container_image)),  # noqa: E501
+            functools.partial(exec_commands, module, get_zonegroup(module, container_image=container_image)),  # noqa: E501
+        ])
+        rc, cmd, out, err = probes[0]
+    else:
+        rc, cmd, out, err = exec_commands(module, get_zone(module, container_image=container_image))  # noqa: E501
 
     if state == "set":
         zone = json.loads(out) if rc == 0 else {}
@@ -493,11 +502,11 @@ def run_module():
     if state == "present":
         if rc == 0:
             zone = json.loads(out)
-            _rc, _cmd, _out, _err = exec_commands(module, get_realm(module, container_image=container_image))  # noqa: E501
+            _rc, _cmd, _out, _err = probes[1]
             if _rc != 0:
                 fatal(_err, module)
             realm = json.loads(_out)
-            _rc, _cmd, _out, _err = exec_commands(module, get_zonegroup(module, container_image=container_image))  # noqa: E501
+            _rc, _cmd, _out, _err = probes[2]
             if _rc != 0:
                 fatal(_err, module)
             zonegroup = json.loads(_out)
@@ -17,9 +17,9 @@ __metaclass__ = type
 
 from ansible.module_utils.basic import AnsibleModule
 try:
-    from ansible.module_utils.ca_common import fatal
+    from ansible.module_utils.ca_common import add_trace, exec_command, fatal
 except ImportError:
-    from module_utils.ca_common import fatal
+    from module_utils.ca_common import add_trace, exec_command, fatal
 import datetime
 import json
 import os
@@ -176,9 +176,7 @@ def exec_commands(module, cmd):
     Execute command(s)
     '''
 
-    rc, out, err = module.run_command(cmd)
-
-    return rc, cmd, out, err
+    return exec_command(module, cmd)
 
 
 def create_zonegroup(module, container_image=None):
@@ -320,7 +318,7 @@ def exit_module(module, out, rc, cmd, err, startd, changed=False):
         stderr=err.rstrip("\r\n"),
         changed=changed,
     )
-    module.exit_json(**result)
+    module.exit_json(**add_trace(result))
 
 
 def run_module():
@@ -1,7 +1,28 @@
+import atexit
+import contextlib
+import errno
+import io
+import json
 import os
+import re
 import datetime
+import hashlib
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from ansible.module_utils.basic import AnsibleModule
+try:
+    import rados
+    from ceph_argparse import parse_json_funcsigs, validate_command
+    HAS_RADOS = True
+except ImportError:
+    HAS_RADOS = False
 
 
 def generate_cmd(cmd='ceph',
@@ -38,11 +59,304 @@ def generate_cmd(cmd='ceph',
     return cmd
 
 
+CONTAINER_MOUNTS = ['-v', '/etc/ceph:/etc/ceph:z',
+                    '-v', '/var/lib/ceph/:/var/lib/ceph/:z',
+                    '-v', '/var/log/ceph/:/var/log/ceph/:z']
+
+TOOLBOX_PREFIX = 'ceph-ansible-toolbox'
+TOOLBOX_LABEL = 'ceph-ansible.toolbox'
+TOOLBOX_DEFAULT_TTL = 3600
+# don't hand out a toolbox that is about to exit under a running command,
+# the margin covers the longest a single command blocks for (e.g. the
+# pg_num step timeout of ceph_pool), capped to half of the ttl
+TOOLBOX_MIN_REMAINING = 600
+
+# toolbox containers already checked by this process, keyed by
+# (container binary, image)
+_toolbox_sessions = {}
+
+# protects the per-process sessions when commands run concurrently
+_sessions_lock = threading.RLock()
+
+
+# options whose value is a secret
+SECRET_OPTIONS = ['--add-key', '--secret', '--secret-key', '--access-key',
+                  '--key']
+SECRET_PATTERNS = [
+    # cephx keys
+    (re.compile(r'[a-zA-Z0-9+/]{38}=='), '*' * 8),
+    # secret options inside a shell script
+    (re.compile(r'((?:{})[ =])[^ ]+'.format('|'.join(SECRET_OPTIONS))), r'\1' + '*' * 8),  # noqa: E501
+]
+
+# spans recorded by this process when tracing is enabled
+_trace = []
+
+
+def trace_enabled():
+    '''
+    Check if the subprocesses should be traced
+    '''
+
+    return os.getenv('CEPH_ANSIBLE_TRACE', 'false').lower() in ['true', 'yes', '1']  # noqa: E501
+
+
+def mask_secrets(cmd):
+    '''
+    Return a copy of a command line with its secrets masked
+    '''
+
+    masked = []
+    previous = None
+    for arg in cmd:
+        if isinstance(arg, bytes):
+            arg = arg.decode()
+        if previous in SECRET_OPTIONS:
+            arg = '*' * 8
+        else:
+            for pattern, repl in SECRET_PATTERNS:
+                arg = pattern.sub(repl, arg)
+        masked.append(arg)
+        previous = arg if arg in SECRET_OPTIONS else None
+    return masked
+
+
+def record_span(cmd, startd, rc, out, err, transport='cli', commands=1):
+    '''
+    Record the execution of a command in the module trace
+    '''
+
+    if not trace_enabled():
+        return
+
+    def size(data):
+        if data is None:
+            return 0
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8', 'replace')
+        return len(data)
+
+    with _sessions_lock:
+        _trace.append(dict(
+            cmd=mask_secrets(cmd),
+            transport=transport,
+            commands=commands,
+            start=str(startd),
+            duration=(datetime.datetime.now() - startd).total_seconds(),
+            rc=rc,
+            stdout_bytes=size(out),
+            stderr_bytes=size(err),
+        ))
+
+
+def add_trace(result):
+    '''
+    Add the recorded spans to a module result if tracing is enabled
+    '''
+
+    if trace_enabled():
+        result['trace'] = list(_trace)
+    return result
+
+
+def _run_command(cmd):
+    '''
+    Minimal run_command() used when no AnsibleModule is at hand
+    '''
+
+    startd = datetime.datetime.now()
+    try:
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE,
+                              universal_newlines=True)
+    except OSError as e:
+        record_span(cmd, startd, 1, '', str(e))
+        return 1, '', str(e)
+    record_span(cmd, startd, proc.returncode, proc.stdout, proc.stderr)
+    return proc.returncode, proc.stdout, proc.stderr
+
+
+def toolbox_enabled():
+    '''
+    Check if the persistent toolbox container mode is enabled
+    '''
+
+    return os.getenv('CEPH_CONTAINER_TOOLBOX', 'false').lower() in ['true', 'yes', '1']  # noqa: E501
+
+
+def toolbox_name(container_image, expires=None):
+    '''
+    Build the toolbox container name for a given image, a toolbox is
+    suffixed by the time it expires at
+    '''
+
+    digest = hashlib.sha1(container_image.encode('utf-8')).hexdigest()[:12]
+    name = '{}-{}'.format(TOOLBOX_PREFIX, digest)
+    if expires is not None:
+        name = '{}-{}'.format(name, expires)
+    return name
+
+
+def toolbox_expires(name):
+    '''
+    Get the time a toolbox expires at from its name, None if unknown
+    '''
+
+    try:
+        return int(name.rsplit('-', 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def toolbox_expiring(expires):
+    '''
+    Check if a toolbox expiring at a given time is too close to its end
+    to run a command in it
+    '''
+
+    ttl = int(os.getenv('CEPH_CONTAINER_TOOLBOX_TTL', TOOLBOX_DEFAULT_TTL))
+    return expires - time.time() <= min(TOOLBOX_MIN_REMAINING, ttl // 2)
+
+
+def list_toolboxes_cmd(container_binary, container_image):
+    '''
+    Build the CLI to list the running toolbox containers of an image
+    '''
+
+    return [container_binary, 'ps',
+            '--filter', 'label={}={}'.format(TOOLBOX_LABEL, toolbox_name(container_image)),  # noqa: E501
+            '--format', '{{.Names}}']
+
+
+def list_toolboxes(container_binary, container_image, run_command=None):
+    '''
+    List the running toolbox containers of an image.
+    Return a list of (name, expires), the latest to expire first
+    '''
+
+    if run_command is None:
+        run_command = _run_command
+
+    rc, out, err = run_command(list_toolboxes_cmd(container_binary, container_image))  # noqa: E501
+    if rc != 0:
+        return []
+
+    toolboxes = [(name, toolbox_expires(name)) for name in out.split()]
+    return sorted((toolbox for toolbox in toolboxes if toolbox[1] is not None),
+                  key=lambda toolbox: toolbox[1], reverse=True)
+
+
+def find_toolbox(container_binary, container_image, run_command=None):
+    '''
+    Find a running toolbox container of an image which isn't about to
+    expire. Return its name or None
+    '''
+
+    for name, expires in list_toolboxes(container_binary, container_image,
+                                        run_command=run_command):
+        if not toolbox_expiring(expires):
+            return name
+    return None
+
+
+def start_toolbox(container_binary, container_image, run_command=None):
+    '''
+    Make sure a toolbox container is running for the given image.
+    The container only sleeps, commands are sent to it with 'exec'.
+    It is started with --rm and exits by itself once its ttl
+    (CEPH_CONTAINER_TOOLBOX_TTL, in seconds) is reached.
+    A toolbox about to expire is never removed, commands may still be
+    running in it, a new one is started next to it instead.
+    Return the container name or None if it can't be started.
+    '''
+
+    if run_command is None:
+        run_command = _run_command
+
+    name = find_toolbox(container_binary, container_image,
+                        run_command=run_command)
+    if name is not None:
+        return name
+
+    ttl = int(os.getenv('CEPH_CONTAINER_TOOLBOX_TTL', TOOLBOX_DEFAULT_TTL))
+    expires = int(time.time()) + ttl
+    name = toolbox_name(container_image, expires)
+    run_cmd = [container_binary, 'run',
+               '--detach',
+               '--rm',
+               '--name', name,
+               '--label', '{}={}'.format(TOOLBOX_LABEL, toolbox_name(container_image)),  # noqa: E501
+               '--net=host'] + CONTAINER_MOUNTS + \
+              ['--entrypoint=sleep', container_image, str(ttl)]
+    rc, out, err = run_command(run_cmd)
+    if rc != 0:
+        # someone else may have started one in the meantime
+        return find_toolbox(container_binary, container_image,
+                            run_command=run_command)
+
+    return name
+
+
+def remove_toolbox(container_binary, container_image, run_command=None):
+    '''
+    Remove the toolbox containers of a given image
+    '''
+
+    if run_command is None:
+        run_command = _run_command
+
+    _toolbox_sessions.pop((container_binary, container_image), None)
+    names = [name for name, expires in list_toolboxes(container_binary, container_image,  # noqa: E501
+                                                      run_command=run_command)]  # noqa: E501
+    cmd = [container_binary, 'rm', '--force'] + names
+    if not names:
+        return 0, cmd, '', ''
+    rc, out, err = run_command(cmd)
+
+    return rc, cmd, out, err
+
+
+def toolbox_exec(binary, container_image, interactive=False):
+    '''
+    Build the CLI to run a command inside the toolbox container.
+    The expiry of the toolbox is checked before each command, a long
+    module run moves to a new toolbox before the current one exits.
+    Return None if the toolbox isn't available.
+    '''
+
+    container_binary = os.getenv('CEPH_CONTAINER_BINARY')
+    key = (container_binary, container_image)
+    with _sessions_lock:
+        name = _toolbox_sessions.get(key)
+        expires = toolbox_expires(name) if name else None
+        if key not in _toolbox_sessions or \
+                (expires is not None and toolbox_expiring(expires)):
+            _toolbox_sessions[key] = start_toolbox(container_binary,
+                                                   container_image)
+    name = _toolbox_sessions[key]
+    if name is None:
+        return None
+
+    command_exec = [container_binary, 'exec']
+
+    if interactive:
+        command_exec.extend(['--interactive'])
+
+    command_exec.extend([name, binary])
+    return command_exec
+
+
 def container_exec(binary, container_image, interactive=False):
     '''
     Build the docker CLI to run a command inside a container
     '''
 
+    if toolbox_enabled():
+        command_exec = toolbox_exec(binary, container_image,
+                                    interactive=interactive)
+        if command_exec is not None:
+            return command_exec
+
     container_binary = os.getenv('CEPH_CONTAINER_BINARY')
     command_exec = [container_binary, 'run']
 
@@ -50,11 +364,8 @@ def container_exec(binary, container_image, interactive=False):
         command_exec.extend(['--interactive'])
 
     command_exec.extend(['--rm',
-                         '--net=host',
-                         '-v', '/etc/ceph:/etc/ceph:z',
-                         '-v', '/var/lib/ceph/:/var/lib/ceph/:z',
-                         '-v', '/var/log/ceph/:/var/log/ceph/:z',
-                         '--entrypoint=' + binary, container_image])
+                         '--net=host'] + CONTAINER_MOUNTS +
+                        ['--entrypoint=' + binary, container_image])
     return command_exec
 
 
@@ -83,19 +394,498 @@ def pre_generate_cmd(cmd, container_image=None, interactive=False):
     return cmd
 
 
+# ceph_argparse flag of the commands handled by the mgr
+FLAG_MGR = 8
+RADOS_TIMEOUT = 30
+
+# librados connections opened by this process, keyed by
+# (cluster, user, user_key)
+_rados_transports = {}
+
+
+class RadosTransport(object):
+    '''
+    Send ceph CLI commands through librados instead of forking the
+    'ceph' binary. A single connection is used for the whole module run.
+    '''
+
+    def __init__(self, cluster, user, user_key):
+        self.handle = rados.Rados(name=user,
+                                  clustername=cluster,
+                                  conffile='/etc/ceph/{}.conf'.format(cluster),  # noqa: E501
+                                  conf=dict(keyring=user_key))
+        self.handle.connect(timeout=RADOS_TIMEOUT)
+
+        ret, outbuf, outs = self.handle.mon_command(json.dumps({'prefix': 'get_command_descriptions'}), b'', timeout=RADOS_TIMEOUT)  # noqa: E501
+        if ret != 0:
+            self.handle.shutdown()
+            raise RuntimeError('get_command_descriptions failed: {}'.format(outs))  # noqa: E501
+        descriptions = outbuf.decode('utf-8')
+        self.sigdict = parse_json_funcsigs(descriptions, 'cli')
+        self.mgr_prefixes = set()
+        for desc in json.loads(descriptions).values():
+            if desc.get('flags', 0) & FLAG_MGR:
+                self.mgr_prefixes.add(' '.join(w for w in desc['sig'] if isinstance(w, str)))  # noqa: E501
+
+    def command(self, args, output_format=None, inbuf=b''):
+        '''
+        Send a command, return None if it isn't a valid command
+        '''
+
+        try:
+            with contextlib.redirect_stderr(io.StringIO()):
+                valid_dict = validate_command(self.sigdict, args)
+        except Exception:
+            return None
+        if not valid_dict:
+            return None
+        if output_format:
+            valid_dict['format'] = output_format
+
+        if valid_dict['prefix'] in self.mgr_prefixes:
+            send = self.handle.mgr_command
+        else:
+            send = self.handle.mon_command
+        ret, outbuf, outs = send(json.dumps(valid_dict), inbuf, timeout=RADOS_TIMEOUT)  # noqa: E501
+
+        rc = -ret
+        err = outs
+        if rc != 0:
+            err = 'Error {}: {}'.format(errno.errorcode.get(rc, 'Unknown'), outs)  # noqa: E501
+        return rc, outbuf.decode('utf-8'), err
+
+    def shutdown(self):
+        self.handle.shutdown()
+
+
+def rados_enabled():
+    '''
+    Check if ceph commands should be sent through librados
+    '''
+
+    return HAS_RADOS and os.getenv('CEPH_TRANSPORT', 'cli').lower() == 'librados'  # noqa: E501
+
+
+def get_rados_transport(cluster, user, user_key):
+    '''
+    Return the librados connection for a given cluster/user,
+    None if it can't be established
+    '''
+
+    key = (cluster, user, user_key)
+    with _sessions_lock:
+        if key not in _rados_transports:
+            try:
+                _rados_transports[key] = RadosTransport(cluster, user, user_key)  # noqa: E501
+            except Exception:
+                _rados_transports[key] = None
+    return _rados_transports[key]
+
+
+@atexit.register
+def shutdown_rados_transports():
+    for transport in _rados_transports.values():
+        if transport is not None:
+            transport.shutdown()
+    _rados_transports.clear()
+
+
+def ceph_cmd_start(cmd):
+    '''
+    Return the index of the first argument passed to the 'ceph' binary
+    in a command line, None if it isn't a 'ceph' command
+    '''
+
+    if cmd[0] == 'ceph':
+        return 1
+    if '--entrypoint=ceph' in cmd:
+        return cmd.index('--entrypoint=ceph') + 2
+    if len(cmd) > 1 and cmd[1] == 'exec':
+        # <container_binary> exec [--interactive] <container> ceph ...
+        start = 2
+        while start < len(cmd) and cmd[start].startswith('-'):
+            start += 1
+        if cmd[start + 1:start + 2] == ['ceph']:
+            return start + 2
+    return None
+
+
+def parse_ceph_cmd(cmd, allow_files=False):
+    '''
+    Split a command line built by generate_cmd() into
+    (cluster, user, user_key, output_format, args).
+    Return None if it isn't a 'ceph' command librados can send.
+    Input/output files are rejected unless allow_files is set, in
+    which case they are left out of args.
+    '''
+
+    start = ceph_cmd_start(cmd)
+    if start is None:
+        return None
+
+    cluster = 'ceph'
+    user = 'client.admin'
+    user_key = None
+    output_format = None
+    args = []
+    options = iter(cmd[start:])
+    for arg in options:
+        if arg in ['-n', '--name']:
+            user = next(options, None)
+        elif arg in ['-k', '--keyring']:
+            user_key = next(options, None)
+        elif arg == '--cluster':
+            cluster = next(options, None)
+        elif arg in ['-f', '--format']:
+            output_format = next(options, None)
+        elif arg.startswith('--format='):
+            output_format = arg.split('=', 1)[1]
+        elif arg in ['-i', '-o', '--in-file', '--out-file']:
+            # files are handled by the CLI
+            if not allow_files:
+                return None
+            next(options, None)
+        else:
+            args.append(arg)
+
+    if not args or cluster is None or user is None:
+        return None
+    if user_key is None:
+        user_key = '/etc/ceph/{}.{}.keyring'.format(cluster, user)
+
+    return cluster, user, user_key, output_format, args
+
+
+def rados_command(cmd, stdin=None):
+    '''
+    Try to run a ceph command through librados.
+    Return None when the CLI has to be used instead.
+    '''
+
+    parsed = parse_ceph_cmd(cmd)
+    if parsed is None:
+        return None
+    cluster, user, user_key, output_format, args = parsed
+
+    transport = get_rados_transport(cluster, user, user_key)
+    if transport is None:
+        return None
+
+    inbuf = b''
+    if stdin:
+        inbuf = stdin if isinstance(stdin, bytes) else stdin.encode('utf-8')
+    return transport.command(args, output_format=output_format, inbuf=inbuf)
+
+
+READ_CACHE_DIR = '/run/ceph-ansible/cache'
+# entries that can't be checked against a map epoch expire after
+# this many seconds
+READ_CACHE_TTL = 300
+
+# commands giving the current epoch of the map a cached read depends on
+EPOCH_COMMANDS = {
+    'osdmap': ['osd', 'stat'],
+    'monmap': ['mon', 'stat'],
+    'config': ['config', 'log', '1'],
+}
+
+# a command having one of these words in its prefix doesn't change
+# the cluster state
+READ_ONLY_WORDS = ['ls', 'list', 'dump', 'get', 'stat', 'stats', 'status',
+                   'tree', 'df', 'info', 'log', 'versions', 'report',
+                   'health', 'export', 'find']
+
+# epochs already fetched by this process, keyed by (cluster, epoch type)
+_epochs = {}
+
+
+def read_cache_enabled():
+    '''
+    Check if the read cache is enabled
+    '''
+
+    return os.getenv('CEPH_READ_CACHE', 'false').lower() in ['true', 'yes', '1']  # noqa: E501
+
+
+def read_cache_dir(cluster):
+    '''
+    Build the read cache directory of a given cluster
+    '''
+
+    return os.path.join(os.getenv('CEPH_READ_CACHE_DIR', READ_CACHE_DIR), cluster)  # noqa: E501
+
+
+def is_read_only(args):
+    '''
+    Check if a ceph command only reads the cluster state
+    '''
+
+    return any(arg in READ_ONLY_WORDS for arg in args[:3])
+
+
+def invalidate_read_cache(cluster):
+    '''
+    Drop every cached read of a given cluster
+    '''
+
+    with _sessions_lock:
+        for key in [k for k in _epochs if k[0] == cluster]:
+            del _epochs[key]
+    shutil.rmtree(read_cache_dir(cluster), ignore_errors=True)
+
+
+def get_epoch(module, cmd, epoch):
+    '''
+    Get the current epoch of a map using the same binary, cluster
+    and credentials as cmd. Return None if it can't be determined.
+    '''
+
+    parsed = parse_ceph_cmd(cmd)
+    if parsed is None or epoch not in EPOCH_COMMANDS:
+        return None
+    cluster, user, user_key, output_format, args = parsed
+
+    key = (cluster, epoch)
+    with _sessions_lock:
+        if key not in _epochs:
+            epoch_cmd = cmd[:ceph_cmd_start(cmd)] + [
+                '-n', user, '-k', user_key, '--cluster', cluster
+            ] + EPOCH_COMMANDS[epoch] + ['-f', 'json']
+            rc, epoch_cmd, out, err = exec_command(module, epoch_cmd)
+            if rc != 0:
+                return None
+            try:
+                data = json.loads(out)
+                if epoch == 'config':
+                    value = data[0]['version'] if data else 0
+                else:
+                    # older releases nest the osdmap epoch
+                    value = data.get('epoch', data.get('osdmap', {}).get('epoch'))  # noqa: E501
+            except (ValueError, KeyError, IndexError, AttributeError):
+                return None
+            _epochs[key] = value
+
+        return _epochs[key]
+
+
+def write_read_cache(path, entry):
+    '''
+    Atomically write a read cache entry, readable by root only
+    since some outputs contain secrets
+    '''
+
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def exec_read_command(module, cmd, epoch='osdmap'):
+    '''
+    Execute a read-only ceph command through the on-disk read cache.
+    The cached output is reused as long as the epoch of the given map
+    (osdmap, monmap or config) doesn't change and no write went
+    through exec_command() in the meantime. With epoch=None, entries
+    expire after CEPH_READ_CACHE_TTL seconds. The outputs of the auth
+    commands hold secrets, they are never cached.
+    '''
+
+    if not read_cache_enabled():
+        return exec_command(module, cmd)
+
+    parsed = parse_ceph_cmd(cmd)
+    if parsed is None or parsed[4][:1] == ['auth']:
+        return exec_command(module, cmd)
+    cluster, user, user_key, output_format, args = parsed
+
+    current_epoch = None
+    if epoch:
+        current_epoch = get_epoch(module, cmd, epoch)
+        if current_epoch is None:
+            return exec_command(module, cmd)
+
+    digest = hashlib.sha1(json.dumps([user, output_format, args]).encode('utf-8')).hexdigest()  # noqa: E501
+    path = os.path.join(read_cache_dir(cluster), digest + '.json')
+    ttl = int(os.getenv('CEPH_READ_CACHE_TTL', READ_CACHE_TTL))
+
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (IOError, ValueError):
+        entry = None
+
+    if entry and entry['epoch'] == current_epoch and \
+            (epoch or time.time() - entry['time'] < ttl):
+        return 0, cmd, entry['out'], entry['err']
+
+    rc, cmd, out, err = exec_command(module, cmd)
+    if rc == 0:
+        write_read_cache(path, dict(args=args,
+                                    epoch=current_epoch,
+                                    time=time.time(),
+                                    out=out,
+                                    err=err))
+
+    return rc, cmd, out, err
+
+
 def exec_command(module, cmd, stdin=None, check_rc=False):
     '''
     Execute command(s)
     '''
 
-    binary_data = False
-    if stdin:
-        binary_data = True
-    rc, out, err = module.run_command(cmd, data=stdin, binary_data=binary_data, check_rc=check_rc)  # noqa: E501
+    startd = datetime.datetime.now()
+    result = None
+    if rados_enabled():
+        result = rados_command(cmd, stdin=stdin)
+
+    if result is not None:
+        rc, out, err = result
+        record_span(cmd, startd, rc, out, err, transport='librados')
+        if rc != 0 and check_rc:
+            module.fail_json(cmd=cmd, rc=rc, stdout=out, stderr=err, msg=err)  # noqa: E501
+    else:
+        binary_data = False
+        if stdin:
+            binary_data = True
+        rc, out, err = module.run_command(cmd, data=stdin, binary_data=binary_data, check_rc=check_rc)  # noqa: E501
+        record_span(cmd, startd, rc, out, err)
+
+    if read_cache_enabled():
+        parsed = parse_ceph_cmd(cmd, allow_files=True)
+        if parsed is not None and not is_read_only(parsed[4]):
+            invalidate_read_cache(parsed[0])
 
     return rc, cmd, out, err
 
 
+def split_launcher(cmd):
+    '''
+    Split a command line into the part starting the container (if any)
+    and the actual command.
+    Return (launcher, argv), launcher runs a shell at the place of the
+    command.
+    '''
+
+    for i, arg in enumerate(cmd):
+        if arg.startswith('--entrypoint='):
+            # <container_binary> run ... --entrypoint=<binary> <image> ...
+            binary = arg.split('=', 1)[1]
+            return cmd[:i] + ['--entrypoint=sh', cmd[i + 1]], [binary] + cmd[i + 2:]  # noqa: E501
+
+    if len(cmd) > 1 and cmd[1] == 'exec':
+        # <container_binary> exec [--interactive] <container> ...
+        i = 2
+        while i < len(cmd) and cmd[i].startswith('-'):
+            i += 1
+        return cmd[:i + 1] + ['sh'], cmd[i + 1:]
+
+    return ['sh'], cmd
+
+
+def exec_commands_batch(module, cmd_list, stop_on_error=True):
+    '''
+    Execute a list of commands in a single process (and a single
+    container when containerized), or over the librados connection
+    when it's enabled.
+    Return a list of (rc, cmd, out, err), one per executed command.
+    If stop_on_error is set, the commands following the first failure
+    aren't executed.
+    '''
+
+    if not cmd_list:
+        return []
+
+    # some modules pass secrets as bytes, the script is built from text
+    cmd_list = [[arg.decode() if isinstance(arg, bytes) else arg for arg in cmd]  # noqa: E501
+                for cmd in cmd_list]
+    launchers = [split_launcher(cmd) for cmd in cmd_list]
+    use_rados = rados_enabled() and all(parse_ceph_cmd(cmd) for cmd in cmd_list)  # noqa: E501
+    if len(cmd_list) == 1 or use_rados or \
+            any(launcher != launchers[0][0] for launcher, argv in launchers):
+        results = []
+        for cmd in cmd_list:
+            results.append(exec_command(module, cmd))
+            if stop_on_error and results[-1][0] != 0:
+                break
+        return results
+
+    # the ceph CLI can read commands from stdin but neither delimits
+    # their outputs nor reports their return codes, so the commands
+    # are run from a shell printing a marker around each of them.
+    marker = 'ca-batch-{}'.format(uuid.uuid4().hex)
+    script = []
+    for i, (launcher, argv) in enumerate(launchers):
+        script.append("echo '{0} {1}'; echo '{0} {1}' >&2; {2}; rc=$?; "
+                      "printf '\\n{0} {1} %d\\n' $rc; printf '\\n{0} {1}\\n' >&2".format(  # noqa: E501
+                          marker, i, ' '.join(shlex.quote(arg) for arg in argv)))  # noqa: E501
+        if stop_on_error:
+            script.append('[ $rc -eq 0 ] || exit $rc')
+    cmd = launchers[0][0] + ['-c', '\n'.join(script)]
+
+    startd = datetime.datetime.now()
+    rc, out, err = module.run_command(cmd)
+    record_span(cmd, startd, rc, out, err, transport='batch', commands=len(cmd_list))  # noqa: E501
+
+    # printf adds a newline before the end marker so the output of a
+    # command is kept as is, even without a trailing newline
+    pattern = re.compile(r'^{0} (\d+)\n(.*?)\n{0} \1(?: (-?\d+))?$'.format(marker),  # noqa: E501
+                         re.DOTALL | re.MULTILINE)
+
+    def split_output(output):
+        return dict((int(m.group(1)), (m.group(2), m.group(3)))
+                    for m in pattern.finditer(output))
+
+    outs = split_output(out)
+    errs = split_output(err)
+
+    results = []
+    for i, _cmd in enumerate(cmd_list):
+        if i not in outs:
+            # the shell or the container failed before running it
+            if i == 0 or not stop_on_error:
+                results.append((rc or 1, _cmd, '', err))
+            break
+        _out, _rc = outs[i]
+        results.append((int(_rc), _cmd, _out, errs.get(i, ('', None))[0]))
+
+    if read_cache_enabled():
+        for _cmd in cmd_list:
+            parsed = parse_ceph_cmd(_cmd, allow_files=True)
+            if parsed is not None and not is_read_only(parsed[4]):
+                invalidate_read_cache(parsed[0])
+                break
+
+    return results
+
+
+MAX_WORKERS = 4
+
+
+def run_concurrently(tasks, max_workers=None):
+    '''
+    Run callables (e.g. functools.partial of read-only probes) with a
+    bounded thread pool (CEPH_MAX_WORKERS threads by default).
+    Results are returned in the order of tasks. If some tasks raise,
+    the exception of the first of them in that order is re-raised once
+    all of them are done, so errors are reported deterministically.
+    '''
+
+    if max_workers is None:
+        max_workers = int(os.getenv('CEPH_MAX_WORKERS', MAX_WORKERS))
+    if len(tasks) < 2 or max_workers < 2:
+        return [task() for task in tasks]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:  # noqa: E501
+        futures = [executor.submit(task) for task in tasks]
+
+    return [future.result() for future in futures]
+
+
 def build_base_cmd(module: "AnsibleModule") -> List[str]:
     cmd = ['cephadm']
     docker = module.params.get('docker')
@@ -122,7 +912,11 @@ def build_base_cmd_orch(module: "AnsibleModule") -> List[str]:
     return cmd
 
 
-def exit_module(module, out, rc, cmd, err, startd, changed=False, diff=dict(before="", after="")):  # noqa: E501
+def exit_module(module, out, rc, cmd, err, startd, changed=False, diff=dict(before="", after=""), **kwargs):  # noqa: E501
+    '''
+    Exit with the result of a module, kwargs are added to the result
+    '''
+
     endd = datetime.datetime.now()
     delta = endd - startd
 
@@ -137,7 +931,8 @@ def exit_module(module, out, rc, cmd, err, startd, changed=False, diff=dict(befo
         changed=changed,
         diff=diff
     )
-    module.exit_json(**result)
+    result.update(kwargs)
+    module.exit_json(**add_trace(result))
 
 
 def fatal(message, module):
@@ -0,0 +1,154 @@
+import json
+
+
+def location_hierarchy(location):
+    '''
+    Turn a location, a list of (bucket_type, bucket_name) from the leaf
+    to the top, into a list of (bucket_type, bucket_name, parent)
+    '''
+
+    return [(bucket_type, bucket_name, location[i + 1] if i + 1 < len(location) else None)  # noqa: E501
+            for i, (bucket_type, bucket_name) in enumerate(location)]
+
+
+class CrushTree(object):
+    '''
+    Index of the nodes of 'ceph osd crush tree -f json' by id, name
+    and type, with a pointer from each node to its parent, so a lookup
+    doesn't scan the whole map
+    '''
+
+    def __init__(self, nodes):
+        self.by_id = {}
+        self.by_name = {}
+        self.by_type = {}
+        self.parents = {}
+        for node in nodes:
+            self.by_id[node['id']] = node
+            self.by_name[node['name']] = node
+            self.by_type.setdefault(node['type'], []).append(node)
+            for child in node.get('children', []):
+                self.parents[child] = node['id']
+
+    @classmethod
+    def from_json(cls, out):
+        '''
+        Build the tree from the output of 'ceph osd crush tree -f json'
+        '''
+
+        return cls(json.loads(out)['nodes'] if out else [])
+
+    def get(self, name, bucket_type=None):
+        '''
+        Get a node by name, None if it doesn't exist or if it isn't of
+        the given type
+        '''
+
+        node = self.by_name.get(name)
+        if node is None or (bucket_type is not None and node['type'] != bucket_type):  # noqa: E501
+            return None
+        return node
+
+    def exists(self, name, bucket_type=None):
+        return self.get(name, bucket_type) is not None
+
+    def parent(self, name):
+        '''
+        Get the node a node is in, None for the top of the tree
+        '''
+
+        node = self.by_name.get(name)
+        if node is None:
+            return None
+        return self.by_id.get(self.parents.get(node['id']))
+
+    def children(self, name):
+        node = self.by_name.get(name)
+        if node is None:
+            return []
+        return [self.by_id[child] for child in node.get('children', [])
+                if child in self.by_id]
+
+    def is_in(self, name, parent_name, parent_type=None):
+        '''
+        Check if a node is directly in a given bucket
+        '''
+
+        parent = self.parent(name)
+        return parent is not None and parent['name'] == parent_name and \
+            (parent_type is None or parent['type'] == parent_type)
+
+    def path(self, name):
+        '''
+        Return the (bucket_type, bucket_name) of a node and of all the
+        buckets it's in, from the node to the top
+        '''
+
+        path = []
+        node = self.by_name.get(name)
+        while node is not None:
+            path.append((node['type'], node['name']))
+            node = self.by_id.get(self.parents.get(node['id']))
+        return path
+
+    def location(self, name):
+        '''
+        Return the CRUSH location of a node, like 'ceph osd find'
+        '''
+
+        return dict(self.path(name)[1:])
+
+    def subtree(self, name):
+        '''
+        Return the nodes under a node, the node excluded
+        '''
+
+        nodes = []
+        pending = self.children(name)
+        while pending:
+            node = pending.pop()
+            nodes.append(node)
+            pending.extend(self.children(node['name']))
+        return nodes
+
+    def diff(self, location):
+        '''
+        Compare the tree with a location, a list of (bucket_type,
+        bucket_name) from the leaf to the top
+        '''
+
+        return self.diff_hierarchy(location_hierarchy(location))
+
+    def diff_hierarchy(self, hierarchy):
+        '''
+        Compare the tree with a hierarchy, a list of (bucket_type,
+        bucket_name, parent), parent is the (bucket_type, bucket_name)
+        of the bucket to place it in or None.
+        Return the (action, bucket_type, bucket_name, parent) changes to
+        make, action is 'add' or 'move', the parents come first.
+        Raise ValueError if a bucket exists with another type.
+        '''
+
+        wanted = dict((bucket_name, (bucket_type, parent))
+                      for bucket_type, bucket_name, parent in hierarchy)
+        changes = []
+        done = set()
+
+        def visit(bucket_name):
+            if bucket_name in done:
+                return
+            done.add(bucket_name)
+            bucket_type, parent = wanted[bucket_name]
+            if parent is not None and parent[1] in wanted:
+                visit(parent[1])
+            node = self.by_name.get(bucket_name)
+            if node is None:
+                changes.append(('add', bucket_type, bucket_name, parent))
+            elif node['type'] != bucket_type:
+                raise ValueError('bucket {} already exists with type {}'.format(bucket_name, node['type']))  # noqa: E501
+            elif parent is not None and not self.is_in(bucket_name, parent[1], parent[0]):  # noqa: E501
+                changes.append(('move', bucket_type, bucket_name, parent))
+
+        for bucket_type, bucket_name, parent in hierarchy:
+            visit(bucket_name)
+        return changes
@@ -0,0 +1,122 @@
+'''
+Benchmarks of the library modules against the fake cluster.
+
+    PYTHONPATH=library:module_utils:. pytest tests/benchmarks \\
+        --bench-latency 0.05 --bench-output after.json \\
+        --bench-baseline before.json
+
+Each scenario is measured on a fresh cluster (first_run) and on the
+cluster it leaves behind (idempotent). It records the processes spawned
+by the modules, the tool commands run (a batch spawns one process for
+several commands), the time spent in the modules (the time spent by
+the fake tools is excluded, the latencies are not) and the peak RSS.
+The results are written as JSON, and the suite fails when a result
+regresses beyond the allowed ratio compared to the baseline.
+'''
+
+import json
+import os
+import platform
+import time
+
+import pytest
+
+
+# time differences below this are considered as noise
+TIME_SLACK = 0.05
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmarks')
+    group.addoption('--bench-latency', type=float, default=0.0,
+                    help='seconds spent on each process spawned by a module')  # noqa: E501
+    group.addoption('--bench-command-latency', type=float, default=0.0,
+                    help='seconds spent on each ceph command')
+    group.addoption('--bench-scale', type=float, default=1.0,
+                    help='ratio applied to the size of the scenarios')
+    group.addoption('--bench-output', default='benchmark-results.json',
+                    help='file the results are written to')
+    group.addoption('--bench-baseline', default=None,
+                    help='results to compare to')
+    group.addoption('--bench-max-process-regression', type=float, default=0.0,  # noqa: E501
+                    help='allowed ratio of extra processes and commands')
+    group.addoption('--bench-max-time-regression', type=float, default=0.25,
+                    help='allowed ratio of extra time')
+    group.addoption('--bench-max-rss-regression', type=float, default=0.25,
+                    help='allowed ratio of extra peak RSS')
+
+
+class Benchmarks(object):
+
+    def __init__(self, config):
+        self.config = config
+        self.results = {}
+        self.baseline = {}
+        path = config.getoption('bench_baseline')
+        if path:
+            with open(path) as f:
+                self.baseline = json.load(f)['results']
+
+    def option(self, name):
+        return self.config.getoption(name)
+
+    def size(self, size):
+        return max(1, int(size * self.option('bench_scale')))
+
+    def check(self, name, result):
+        '''
+        Store a result, return the list of its regressions
+        '''
+
+        self.results[name] = result
+        baseline = self.baseline.get(name)
+        if baseline is None or baseline['size'] != result['size']:
+            return []
+
+        regressions = []
+        limits = [
+            ('processes', self.option('bench_max_process_regression'), 0),
+            ('commands', self.option('bench_max_process_regression'), 0),
+            ('time', self.option('bench_max_time_regression'), TIME_SLACK),
+            ('peak_rss_kb', self.option('bench_max_rss_regression'), 0),
+        ]
+        for key, ratio, slack in limits:
+            limit = baseline[key] * (1 + ratio) + slack
+            if result[key] > limit:
+                regressions.append('{}: {} > {} (baseline {})'.format(
+                    key, result[key], round(limit, 3), baseline[key]))
+        return regressions
+
+    def write(self):
+        path = self.option('bench_output')
+        if not path or not self.results:
+            return
+        report = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),  # noqa: E501
+                'python': platform.python_version(),
+                'latency': self.option('bench_latency'),
+                'command_latency': self.option('bench_command_latency'),
+                'scale': self.option('bench_scale'),
+            },
+            'results': self.results,
+        }
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        os.rename(tmp, path)
+
+
+def pytest_configure(config):
+    config._benchmarks = Benchmarks(config)
+
+
+def pytest_unconfigure(config):
+    benchmarks = getattr(config, '_benchmarks', None)
+    if benchmarks is not None:
+        benchmarks.write()
+
+
+@pytest.fixture(scope='session')
+def benchmarks(request):
+    return request.config._benchmarks
@@ -0,0 +1,261 @@
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from mock.mock import patch
+import pytest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'library'))  # noqa: E501
+import ca_test_common  # noqa: E402
+import ceph_config  # noqa: E402
+import ceph_crush  # noqa: E402
+import ceph_crush_rule  # noqa: E402
+import ceph_key  # noqa: E402
+import ceph_mgr_module  # noqa: E402
+import ceph_osd_flag  # noqa: E402
+import ceph_pool  # noqa: E402
+import ceph_volume  # noqa: E402
+import radosgw_realm  # noqa: E402
+import radosgw_user  # noqa: E402
+import radosgw_zone  # noqa: E402
+import radosgw_zonegroup  # noqa: E402
+from fake_cluster import FakeCluster  # noqa: E402
+
+
+def reset_caches():
+    '''
+    Each module invocation is a new process in a playbook, drop what
+    ca_common keeps between calls
+    '''
+
+    for name in ('module_utils.ca_common', 'ca_common'):
+        module = sys.modules.get(name)
+        if module is not None:
+            module._epochs.clear()
+            del module._trace[:]
+
+
+def run_module(module, args):
+    reset_caches()
+    ca_test_common.set_module_args(args)
+    try:
+        module.main()
+    except ca_test_common.AnsibleExitJson as e:
+        return e.args[0]
+    except ca_test_common.AnsibleFailJson as e:
+        raise AssertionError('{} failed: {}'.format(module.__name__, e.args[0]))  # noqa: E501
+    raise AssertionError('{} did not exit'.format(module.__name__))
+
+
+# Each scenario is (module, default size, setup, invocations): setup(cluster,
+# size, workdir) prepares the cluster, invocations(size, workdir) returns the
+# arguments of each module call of the loop.
+
+def no_setup(cluster, size, workdir):
+    pass
+
+
+def pools(size, workdir):
+    return [{'name': 'pool{}'.format(i), 'size': '3', 'pg_num': '32',
+             'application': 'rbd'} for i in range(size)]
+
+
+def pools_bulk(size, workdir):
+    return [{'pools': pools(size, workdir)}]
+
+
+def keys(size, workdir):
+    return [{'name': 'client.bench{}'.format(i),
+             'caps': {'mon': 'allow r', 'osd': 'allow rw pool=pool{}'.format(i)},  # noqa: E501
+             'dest': workdir} for i in range(size)]
+
+
+def keys_bulk(size, workdir):
+    return [{'keys': keys(size, workdir)}]
+
+
+def config(size, workdir):
+    return [{'who': 'osd.{}'.format(i), 'option': 'osd_memory_target',
+             'value': str(4294967296 + i)} for i in range(size)]
+
+
+def config_bulk(size, workdir):
+    return [{'options': config(size, workdir)}]
+
+
+def rgw_users(size, workdir):
+    return [{'name': 'user{}'.format(i), 'display_name': 'User {}'.format(i),
+             'email': 'user{}@example.com'.format(i)} for i in range(size)]
+
+
+def crush(size, workdir):
+    return [{'location': {'root': 'default', 'rack': 'rack{}'.format(i // 20),
+                          'host': 'host{}'.format(i)}} for i in range(size)]
+
+
+def crush_rules(size, workdir):
+    return [{'name': 'rule{}'.format(i), 'rule_type': 'replicated',
+             'bucket_root': 'default',
+             'bucket_type': 'host'} for i in range(size)]
+
+
+def osd_flags(size, workdir):
+    flags = ['noout', 'noscrub', 'nodeep-scrub', 'norebalance',
+             'nobackfill', 'norecover']
+    return [{'name': flags[i % len(flags)]} for i in range(size)]
+
+
+def mgr_modules(size, workdir):
+    modules = ['pg_autoscaler', 'balancer', 'prometheus', 'dashboard',
+               'status', 'iostat']
+    return [{'name': modules[i % len(modules)]} for i in range(size)]
+
+
+def rgw_multisite(size, workdir):
+    invocations = []
+    for i in range(size):
+        realm = 'realm{}'.format(i)
+        zonegroup = 'zonegroup{}'.format(i)
+        invocations.append((radosgw_realm, {'name': realm}))
+        invocations.append((radosgw_zonegroup, {
+            'name': zonegroup, 'realm': realm, 'master': True,
+            'endpoints': ['http://rgw{}:8080'.format(i)]}))
+        invocations.append((radosgw_zone, {
+            'name': 'zone{}'.format(i), 'realm': realm,
+            'zonegroup': zonegroup, 'master': True,
+            'endpoints': ['http://rgw{}:8080'.format(i)]}))
+    return invocations
+
+
+def add_devices(cluster, size, workdir):
+    for i in range(size):
+        cluster.add_device('/dev/bench{}'.format(i))
+
+
+def osds(size, workdir):
+    return [{'action': 'batch', 'batch_devices': ['/dev/bench{}'.format(i)]}
+            for i in range(size)]
+
+
+def osds_bulk(size, workdir):
+    return [{'action': 'create',
+             'lvm_volumes': [{'data': '/dev/bench{}'.format(i)} for i in range(size)]}]  # noqa: E501
+
+
+SCENARIOS = {
+    'pools': (ceph_pool, 50, no_setup, pools),
+    'pools_bulk': (ceph_pool, 50, no_setup, pools_bulk),
+    'keys': (ceph_key, 200, no_setup, keys),
+    'keys_bulk': (ceph_key, 200, no_setup, keys_bulk),
+    'config': (ceph_config, 500, no_setup, config),
+    'config_bulk': (ceph_config, 500, no_setup, config_bulk),
+    'rgw_users': (radosgw_user, 100, no_setup, rgw_users),
+    'crush': (ceph_crush, 1000, no_setup, crush),
+    'crush_rules': (ceph_crush_rule, 20, no_setup, crush_rules),
+    'osd_flags': (ceph_osd_flag, 6, no_setup, osd_flags),
+    'mgr_modules': (ceph_mgr_module, 6, no_setup, mgr_modules),
+    'rgw_multisite': (None, 5, no_setup, rgw_multisite),
+    'osds': (ceph_volume, 24, add_devices, osds),
+    'osds_bulk': (ceph_volume, 24, add_devices, osds_bulk),
+}
+
+MODES = ['first_run', 'idempotent']
+
+
+def rss_kb():
+    '''
+    Return the current and peak RSS of this process in kB
+    '''
+
+    current = peak = 0
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                current = int(line.split()[1])
+            elif line.startswith('VmHWM:'):
+                peak = int(line.split()[1])
+    return current, peak or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # noqa: E501
+
+
+def run_loop(invocations, default_module):
+    for invocation in invocations:
+        if isinstance(invocation, tuple):
+            module, args = invocation
+        else:
+            module, args = default_module, invocation
+        run_module(module, dict(args))
+
+
+def measure(cluster, invocations, default_module, conn):
+    '''
+    Run the loop in a forked child so the peak RSS only accounts for
+    this scenario, send the measures to the parent
+    '''
+
+    try:
+        start_rss, _ = rss_kb()
+        cluster.reset()
+        startd = time.time()
+        run_loop(invocations, default_module)
+        wall_time = time.time() - startd
+        _, peak_rss = rss_kb()
+        conn.send({
+            'processes': len(cluster.calls),
+            'commands': len(cluster.commands),
+            'wall_time': round(wall_time, 4),
+            'tool_time': round(cluster.tool_time, 4),
+            'time': round(wall_time - cluster.tool_time, 4),
+            'peak_rss_kb': peak_rss,
+            'rss_growth_kb': peak_rss - start_rss,
+        })
+    except BaseException as e:
+        conn.send({'error': '{}: {}'.format(type(e).__name__, e)})
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def patched_module():
+    env = dict((k, v) for k, v in os.environ.items()
+               if not k.startswith('CEPH_CONTAINER'))
+    with patch.dict(os.environ, env, clear=True), \
+            patch('ansible.module_utils.basic.AnsibleModule.exit_json',
+                  side_effect=ca_test_common.exit_json), \
+            patch('ansible.module_utils.basic.AnsibleModule.fail_json',
+                  side_effect=ca_test_common.fail_json):
+        yield
+
+
+@pytest.mark.parametrize('mode', MODES)
+@pytest.mark.parametrize('name', sorted(SCENARIOS))
+def test_benchmark(benchmarks, patched_module, name, mode):
+    module, default_size, setup, build = SCENARIOS[name]
+    size = benchmarks.size(default_size)
+    workdir = tempfile.mkdtemp(prefix='ceph-ansible-bench-')
+    cluster = FakeCluster(latency=benchmarks.option('bench_latency'),
+                          command_latency=benchmarks.option('bench_command_latency'))  # noqa: E501
+    try:
+        setup(cluster, size, workdir)
+        invocations = build(size, workdir)
+        with patch('ansible.module_utils.basic.AnsibleModule.run_command',
+                   side_effect=cluster.run_command):
+            if mode == 'idempotent':
+                run_loop(invocations, module)
+            context = multiprocessing.get_context('fork')
+            parent, child = context.Pipe(duplex=False)
+            process = context.Process(target=measure,
+                                      args=(cluster, invocations, module, child))  # noqa: E501
+            process.start()
+            child.close()
+            result = parent.recv()
+            process.join()
+    finally:
+        cluster.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    assert 'error' not in result, result['error']
+    result.update({'invocations': len(invocations), 'size': size})
+    regressions = benchmarks.check('{}[{}]'.format(name, mode), result)
+    assert not regressions, '\n'.join(regressions)
@@ -0,0 +1,16 @@
+'''
+Stateful stand-in for the ceph command line tools, to drive the
+library modules end to end without a cluster.
+
+    with FakeCluster() as cluster:
+        with patch.object(basic.AnsibleModule, 'run_command',
+                          side_effect=cluster.run_command):
+            ceph_pool.main()
+        assert 'foo' in cluster.state['pools']
+
+The tools can also be installed as executables (see FakeCluster.install
+or 'python -m fake_cluster install <dir> [<state file>]').
+'''
+
+from .cluster import FakeCluster  # noqa: F401
+from .state import CommandError, default_state  # noqa: F401
@@ -0,0 +1,41 @@
+'''
+Entry point of the fake tools installed by FakeCluster.install
+'''
+
+import fcntl
+import json
+import os
+import sys
+
+from .cluster import FakeCluster
+
+
+def main(argv):
+    if argv[:1] == ['install']:
+        if len(argv) < 2:
+            sys.stderr.write('usage: python -m fake_cluster install <dir> [<state file>]\n')  # noqa: E501
+            return 1
+        cluster = FakeCluster(argv[2] if len(argv) > 2 else os.path.abspath('fake-cluster.json'))  # noqa: E501
+        sys.stdout.write(cluster.install(argv[1]) + '\n')
+        return 0
+
+    path = os.environ.get('FAKE_CEPH_STATE')
+    if not path:
+        sys.stderr.write('FAKE_CEPH_STATE is not set\n')
+        return 1
+    # concurrent invocations must not lose each other's changes
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        cluster = FakeCluster(path)
+        rc, out, err = cluster.dispatch(argv, sys.stdin)
+        cluster.save()
+        if os.environ.get('FAKE_CEPH_LOG'):
+            with open(os.environ['FAKE_CEPH_LOG'], 'a') as log:
+                log.write(json.dumps(cluster.commands[0] if cluster.commands else argv) + '\n')  # noqa: E501
+    sys.stdout.write(out)
+    sys.stderr.write(err)
+    return rc
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
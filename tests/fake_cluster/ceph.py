@@ -0,0 +1,1223 @@
+'''
+Fake 'ceph', 'rbd', 'ceph-authtool' and 'crushtool' command line tools
+'''
+
+import errno
+import json
+import re
+import time
+
+from .state import CRUSH_TYPES, CommandError, ToolError, bump, bump_crush, new_key
+
+
+GLOBAL_OPTIONS = {
+    '-n': 'name', '--name': 'name', '--id': 'id',
+    '-k': 'keyring', '--keyring': 'keyring',
+    '-c': 'conf', '--conf': 'conf',
+    '--cluster': 'cluster',
+    '-f': 'format', '--format': 'format',
+    '-o': 'output', '--out-file': 'output',
+    '-i': 'input', '--in-file': 'input',
+    '--connect-timeout': 'timeout',
+}
+
+FLAGS = ['--yes-i-really-mean-it', '--yes-i-really-really-mean-it', '--force']
+
+OSD_FLAGS = ['full', 'pause', 'noup', 'nodown', 'noout', 'noin',
+             'nobackfill', 'norebalance', 'norecover', 'noscrub',
+             'nodeep-scrub', 'notieragent', 'nosnaptrim', 'pglog_hardlimit',
+             'noautoscale']
+
+MGR_MODULES = ['alerts', 'balancer', 'cephadm', 'crash', 'dashboard',
+               'devicehealth', 'influx', 'insights', 'iostat', 'localpool',
+               'nfs', 'orchestrator', 'pg_autoscaler', 'progress',
+               'prometheus', 'rbd_support', 'restful', 'rook', 'status',
+               'telemetry', 'volumes', 'zabbix']
+
+MGR_ALWAYS_ON = ['balancer', 'crash', 'devicehealth', 'orchestrator',
+                 'pg_autoscaler', 'progress', 'rbd_support', 'status',
+                 'telemetry', 'volumes']
+
+CONFIG_DEFAULTS = {
+    'mon_allow_pool_delete': 'false',
+    'osd_pool_default_size': '3',
+    'osd_pool_default_min_size': '0',
+    'osd_pool_default_pg_num': '32',
+    'osd_pool_default_pg_autoscale_mode': 'on',
+    'osd_memory_target': '4294967296',
+}
+
+
+class Context(object):
+    '''
+    What a single invocation of a fake tool works with
+    '''
+
+    def __init__(self, cluster, options, inbuf):
+        self.cluster = cluster
+        self.state = cluster.state
+        self.options = options
+        self.inbuf = inbuf
+        self.err = ''
+
+    @property
+    def json(self):
+        return self.options.get('format', 'plain').startswith('json')
+
+    def dump(self, data, plain=None):
+        '''
+        Format the output of a command, like ceph does 'plain' is
+        used unless a json format is asked
+        '''
+
+        if self.json or plain is None:
+            indent = 4 if self.options.get('format') == 'json-pretty' else None  # noqa: E501
+            return json.dumps(data, indent=indent) + '\n'
+        return plain
+
+    def read_input(self):
+        path = self.options.get('input')
+        if path is None:
+            raise CommandError(errno.EINVAL, 'missing input file')
+        if path == '-':
+            if hasattr(self.inbuf, 'read'):
+                return self.inbuf.read()
+            return self.inbuf or ''
+        try:
+            with open(path) as f:
+                return f.read()
+        except IOError as e:
+            raise CommandError(e.errno, "can't open {}: {}".format(path, e.strerror))  # noqa: E501
+
+
+def parse_global(argv):
+    '''
+    Split the global options from the command words
+    '''
+
+    options = {}
+    words = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        key = arg.split('=', 1)[0]
+        if key in GLOBAL_OPTIONS and '=' in arg:
+            options[GLOBAL_OPTIONS[key]] = arg.split('=', 1)[1]
+        elif arg in GLOBAL_OPTIONS and i + 1 < len(argv):
+            options[GLOBAL_OPTIONS[arg]] = argv[i + 1]
+            i += 1
+        elif arg == '-s':
+            words.append('status')
+        else:
+            words.append(arg)
+        i += 1
+    return options, words
+
+
+def split_options(args, flags=FLAGS):
+    '''
+    Split the '--opt value' and '--opt=value' arguments of a command
+    from its positional arguments
+    '''
+
+    positional = []
+    options = {}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in flags:
+            options[arg.lstrip('-')] = True
+        elif arg.startswith('--') and '=' in arg:
+            key, value = arg[2:].split('=', 1)
+            options[key] = value
+        elif arg.startswith('--') and i + 1 < len(args):
+            options[arg[2:]] = args[i + 1]
+            i += 1
+        else:
+            positional.append(arg)
+        i += 1
+    return positional, options
+
+
+def arg(args, index, what):
+    if len(args) <= index or args[index] in (None, ''):
+        raise CommandError(errno.EINVAL, 'missing required parameter {}'.format(what))  # noqa: E501
+    return args[index]
+
+
+def to_int(value, what):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise CommandError(errno.EINVAL, 'error parsing integer value for {}: {!r}'.format(what, value))  # noqa: E501
+
+
+# config
+
+def parse_who(who):
+    section, _, mask = who.partition('/')
+    return section, mask
+
+
+def config_value(state, name, sections=('global', 'mon')):
+    for entry in state['config']:
+        if entry['name'] == name and entry['section'] in sections and not entry['mask']:  # noqa: E501
+            return entry['value']
+    return CONFIG_DEFAULTS.get(name)
+
+
+def log_config(state, changes):
+    state['config_log'].insert(0, {
+        'version': bump(state, 'config'),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S.000000+0000', time.gmtime()),  # noqa: E501
+        'name': '',
+        'changes': changes,
+    })
+
+
+def set_config(state, who, name, value):
+    section, mask = parse_who(who)
+    for entry in state['config']:
+        if (entry['section'], entry['mask'], entry['name']) == (section, mask, name):  # noqa: E501
+            if entry['value'] == value:
+                return False
+            previous = entry['value']
+            entry['value'] = value
+            log_config(state, [{'name': '{}/{}'.format(who, name), 'previous_value': previous},  # noqa: E501
+                               {'name': '{}/{}'.format(who, name), 'new_value': value}])  # noqa: E501
+            return True
+    state['config'].append({'section': section, 'name': name, 'value': value,
+                            'level': 'advanced', 'can_update_at_runtime': True,
+                            'mask': mask})
+    log_config(state, [{'name': '{}/{}'.format(who, name), 'new_value': value}])  # noqa: E501
+    return True
+
+
+def config_set(ctx, args):
+    who = arg(args, 0, 'who')
+    name = arg(args, 1, 'name')
+    value = arg(args, 2, 'value')
+    set_config(ctx.state, who, name, value)
+    return ''
+
+
+def config_get(ctx, args):
+    who = arg(args, 0, 'who')
+    section, mask = parse_who(who)
+    if len(args) < 2:
+        values = dict((e['name'], e['value']) for e in ctx.state['config']
+                      if e['section'] in ('global', section.split('.')[0], section))  # noqa: E501
+        return ctx.dump(values, '\n'.join('{} {}'.format(k, v) for k, v in sorted(values.items())) + '\n')  # noqa: E501
+    name = args[1]
+    for sections in ([section], [section.split('.')[0]], ['global']):
+        for entry in ctx.state['config']:
+            if entry['name'] == name and entry['section'] in sections and entry['mask'] == mask:  # noqa: E501
+                return ctx.dump(entry['value'], entry['value'] + '\n')
+    if name in CONFIG_DEFAULTS:
+        return ctx.dump(CONFIG_DEFAULTS[name], CONFIG_DEFAULTS[name] + '\n')
+    raise CommandError(errno.ENOENT, 'unrecognized key \'{}\''.format(name))
+
+
+def config_rm(ctx, args):
+    who = arg(args, 0, 'who')
+    name = arg(args, 1, 'name')
+    section, mask = parse_who(who)
+    state = ctx.state
+    for entry in list(state['config']):
+        if (entry['section'], entry['mask'], entry['name']) == (section, mask, name):  # noqa: E501
+            state['config'].remove(entry)
+            log_config(state, [{'name': '{}/{}'.format(who, name), 'previous_value': entry['value']}])  # noqa: E501
+    return ''
+
+
+def config_dump(ctx, args):
+    entries = ctx.state['config']
+    plain = 'WHO  MASK  LEVEL  OPTION  VALUE  RO\n' + ''.join(
+        '{}  {}  {}  {}  {}\n'.format(e['section'], e['mask'], e['level'], e['name'], e['value'])  # noqa: E501
+        for e in entries)
+    return ctx.dump(entries, plain)
+
+
+def config_log(ctx, args):
+    count = to_int(args[0], 'num') if args else len(ctx.state['config_log'])
+    return ctx.dump(ctx.state['config_log'][:count])
+
+
+def config_assimilate(ctx, args):
+    '''
+    Store the options of a ceph.conf file missing from the config
+    database, the existing ones are kept and left in the minimal
+    ceph.conf of the output
+    '''
+
+    left = {'global': [('fsid', ctx.state['fsid'])]}
+    section = 'global'
+    for line in ctx.read_input().splitlines():
+        line = line.split('#', 1)[0].split(';', 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1].strip()
+            continue
+        name, _, value = line.partition('=')
+        name = name.strip().replace(' ', '_')
+        if name in ('fsid', 'mon_host', 'mon_initial_members'):
+            continue
+        section_name, mask = parse_who(section)
+        if any((entry['section'], entry['mask'], entry['name']) == (section_name, mask, name)  # noqa: E501
+               for entry in ctx.state['config']):
+            left.setdefault(section, []).append((name, value.strip()))
+            continue
+        set_config(ctx.state, section, name, value.strip())
+    lines = ['# minimal ceph.conf for {}'.format(ctx.state['fsid'])]
+    for section, options in left.items():
+        lines.append('[{}]'.format(section))
+        lines.extend('\t{} = {}'.format(name, value) for name, value in options)  # noqa: E501
+    return '\n'.join(lines) + '\n'
+
+
+# auth
+
+def keyring(entities):
+    lines = []
+    for name, entity in entities:
+        lines.append('[{}]'.format(name))
+        lines.append('\tkey = {}'.format(entity['key']))
+        for service, cap in sorted(entity['caps'].items()):
+            lines.append('\tcaps {} = "{}"'.format(service, cap))
+    return '\n'.join(lines) + '\n'
+
+
+def parse_keyring(text):
+    '''
+    Parse a keyring file, return a list of (entity, key, caps)
+    '''
+
+    entities = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('[') and line.endswith(']'):
+            entities.append((line[1:-1], None, {}))
+            continue
+        name, _, value = line.partition('=')
+        name = name.strip()
+        if not entities or not value:
+            continue
+        entity, key, caps = entities[-1]
+        if name == 'key':
+            entities[-1] = (entity, value.strip(), caps)
+        elif name.startswith('caps '):
+            caps[name[5:].strip()] = value.strip().strip('"')
+    return entities
+
+
+def auth_entity(ctx, name):
+    entity = ctx.state['auth'].get(name)
+    if entity is None:
+        raise CommandError(errno.ENOENT, 'failed to find {} in keyring'.format(name))  # noqa: E501
+    return entity
+
+
+def auth_json(name, entity):
+    return {'entity': name, 'key': entity['key'], 'caps': dict(entity['caps'])}  # noqa: E501
+
+
+def parse_caps(args):
+    if len(args) % 2:
+        raise CommandError(errno.EINVAL, 'caps must be pairs of service and capability')  # noqa: E501
+    return dict(zip(args[::2], args[1::2]))
+
+
+def auth_ls(ctx, args):
+    auth = sorted(ctx.state['auth'].items())
+    plain = ''.join('{}\n\tkey: {}\n{}'.format(
+        name, e['key'], ''.join('\tcaps: [{}] {}\n'.format(s, c) for s, c in sorted(e['caps'].items())))  # noqa: E501
+        for name, e in auth)
+    return ctx.dump({'auth_dump': [auth_json(name, e) for name, e in auth]}, plain)  # noqa: E501
+
+
+def auth_get(ctx, args):
+    name = arg(args, 0, 'entity')
+    entity = auth_entity(ctx, name)
+    ctx.err = 'exported keyring for {}\n'.format(name)
+    return ctx.dump([auth_json(name, entity)], keyring([(name, entity)]))
+
+
+def auth_get_key(ctx, args):
+    entity = auth_entity(ctx, arg(args, 0, 'entity'))
+    return ctx.dump({'key': entity['key']}, entity['key'] + '\n')
+
+
+def auth_get_or_create(ctx, args):
+    name = arg(args, 0, 'entity')
+    caps = parse_caps(args[1:])
+    entity = ctx.state['auth'].get(name)
+    if entity is None:
+        entity = ctx.state['auth'][name] = {'key': new_key(), 'caps': caps}
+    else:
+        for service, cap in caps.items():
+            if entity['caps'].get(service) != cap:
+                raise CommandError(errno.EINVAL, "key for {} exists but cap {} does not match".format(name, service))  # noqa: E501
+    return ctx.dump([auth_json(name, entity)], keyring([(name, entity)]))
+
+
+def auth_caps(ctx, args):
+    name = arg(args, 0, 'entity')
+    entity = auth_entity(ctx, name)
+    entity['caps'] = parse_caps(args[1:])
+    ctx.err = 'updated caps for {}\n'.format(name)
+    return ''
+
+
+def auth_del(ctx, args):
+    name = arg(args, 0, 'entity')
+    if ctx.state['auth'].pop(name, None) is None:
+        ctx.err = 'entity {} does not exist\n'.format(name)
+    else:
+        ctx.err = 'updated\n'
+    return ''
+
+
+def auth_import(ctx, args):
+    entities = parse_keyring(ctx.read_input())
+    if not entities:
+        raise CommandError(errno.EINVAL, 'no entity found in the keyring')
+    for name, key, caps in entities:
+        if key is None:
+            raise CommandError(errno.EINVAL, 'no key for {}'.format(name))
+        ctx.state['auth'][name] = {'key': key, 'caps': caps}
+    ctx.err = 'imported keyring\n'
+    return ''
+
+
+def auth_export(ctx, args):
+    if args:
+        entities = [(args[0], auth_entity(ctx, args[0]))]
+    else:
+        entities = sorted(ctx.state['auth'].items())
+    ctx.err = 'export auth(key={})\n'.format(len(entities))
+    return ctx.dump([auth_json(n, e) for n, e in entities], keyring(entities))  # noqa: E501
+
+
+# pools
+
+def find_pool(ctx, name):
+    pool = ctx.state['pools'].get(name)
+    if pool is None:
+        raise CommandError(errno.ENOENT, "unrecognized pool '{}'".format(name))  # noqa: E501
+    return pool
+
+
+def find_rule(ctx, name):
+    rule = ctx.state['crush']['rules'].get(name)
+    if rule is None:
+        raise CommandError(errno.ENOENT, "unknown crush rule '{}'".format(name))  # noqa: E501
+    return rule
+
+
+def rule_name(state, rule_id):
+    for name, rule in state['crush']['rules'].items():
+        if rule['rule_id'] == rule_id:
+            return name
+    return None
+
+
+def pool_ls(ctx, args):
+    pools = sorted(ctx.state['pools'].values(), key=lambda p: p['pool_id'])
+    if args and args[0] == 'detail':
+        plain = ''.join(
+            "pool {pool_id} '{pool_name}' {kind} size {size} min_size {min_size} "  # noqa: E501
+            "crush_rule {crush_rule} object_hash rjenkins pg_num {pg_num} "
+            "pgp_num {pg_placement_num} autoscale_mode {pg_autoscale_mode} "
+            "last_change {last_change} flags {flags_names} application {apps}\n".format(  # noqa: E501
+                kind='replicated' if p['type'] == 1 else 'erasure',
+                apps=','.join(p['application_metadata']), **p)
+            for p in pools)
+        return ctx.dump(pools, plain)
+    names = [p['pool_name'] for p in pools]
+    return ctx.dump(names, ''.join(n + '\n' for n in names))
+
+
+def pool_stats(ctx, args):
+    pools = [find_pool(ctx, args[0])] if args else ctx.state['pools'].values()
+    stats = [{'pool_name': p['pool_name'], 'pool_id': p['pool_id'],
+              'recovery': {}, 'recovery_rate': {}, 'client_io_rate': {}}
+             for p in pools]
+    return ctx.dump(stats, ''.join('pool {} id {}\n  nothing is going on\n\n'.format(s['pool_name'], s['pool_id']) for s in stats))  # noqa: E501
+
+
+def pool_create(ctx, args):
+    state = ctx.state
+    positional, options = split_options(args)
+    name = arg(positional, 0, 'pool')
+    kind = positional[1] if len(positional) > 1 and positional[1] else 'replicated'  # noqa: E501
+    if name in state['pools']:
+        ctx.err = "pool '{}' already exists\n".format(name)
+        return ''
+    if kind not in ('replicated', 'erasure'):
+        raise CommandError(errno.EINVAL, 'unknown pool type {}'.format(kind))  # noqa: E501
+
+    pg_num = to_int(options.get('pg_num') or config_value(state, 'osd_pool_default_pg_num'), 'pg_num')  # noqa: E501
+    pgp_num = to_int(options.get('pgp_num') or pg_num, 'pgp_num')
+    autoscale_mode = options.get('autoscale-mode') or config_value(state, 'osd_pool_default_pg_autoscale_mode')  # noqa: E501
+    profile = ''
+    if kind == 'replicated':
+        rule = positional[2] if len(positional) > 2 and positional[2] else 'replicated_rule'  # noqa: E501
+        size = to_int(options.get('size') or config_value(state, 'osd_pool_default_size'), 'size')  # noqa: E501
+        min_size = size - size // 2
+    else:
+        profile = positional[2] if len(positional) > 2 and positional[2] else 'default'  # noqa: E501
+        if profile not in state['erasure_code_profiles']:
+            raise CommandError(errno.ENOENT, 'specified erasure code profile does not exist')  # noqa: E501
+        ec = state['erasure_code_profiles'][profile]
+        size = int(ec['k']) + int(ec['m'])
+        min_size = int(ec['k']) + 1
+        rule = positional[3] if len(positional) > 3 and positional[3] else name  # noqa: E501
+        if rule not in state['crush']['rules']:
+            create_rule(state, rule, 3, 'default', 'host', profile=profile)
+    crush_rule = find_rule(ctx, rule)['rule_id']
+
+    state['last_pool_id'] += 1
+    epoch = bump(state, 'osdmap')
+    pool = {
+        'pool_id': state['last_pool_id'],
+        'pool_name': name,
+        'create_time': time.strftime('%Y-%m-%dT%H:%M:%S.000000+0000', time.gmtime()),  # noqa: E501
+        'flags': 1,
+        'flags_names': 'hashpspool',
+        'type': 1 if kind == 'replicated' else 3,
+        'size': size,
+        'min_size': min_size,
+        'crush_rule': crush_rule,
+        'object_hash': 2,
+        'pg_autoscale_mode': autoscale_mode,
+        'pg_num': pg_num,
+        'pg_placement_num': pgp_num,
+        'pg_placement_num_target': pgp_num,
+        'pg_num_target': pg_num,
+        'pg_num_pending': pg_num,
+        'last_change': str(epoch),
+        'erasure_code_profile': profile,
+        'expected_num_objects': to_int(options.get('expected_num_objects') or 0, 'expected_num_objects'),  # noqa: E501
+        'quota_max_bytes': 0,
+        'quota_max_objects': 0,
+        'application_metadata': {},
+        'options': {},
+    }
+    if options.get('target_size_ratio'):
+        pool['options']['target_size_ratio'] = float(options['target_size_ratio'])  # noqa: E501
+    state['pools'][name] = pool
+    ctx.err = "pool '{}' created\n".format(name)
+    return ''
+
+
+POOL_INT_VARS = {'size': 'size', 'min_size': 'min_size',
+                 'pg_num': 'pg_num', 'pgp_num': 'pg_placement_num'}
+
+
+def pool_set(ctx, args):
+    state = ctx.state
+    pool = find_pool(ctx, arg(args, 0, 'pool'))
+    var = arg(args, 1, 'var')
+    value = arg(args, 2, 'val')
+    if var in POOL_INT_VARS:
+        number = to_int(value, var)
+        if number < 1:
+            raise CommandError(errno.EINVAL, 'pool {} must be > 0'.format(var))  # noqa: E501
+        if var == 'size' and pool['type'] == 3:
+            raise CommandError(errno.ENOTSUP, 'can not change the size of an erasure-coded pool')  # noqa: E501
+        pool[POOL_INT_VARS[var]] = number
+        if var == 'pg_num':
+            pool['pg_num_target'] = pool['pg_num_pending'] = number
+        elif var == 'pgp_num':
+            pool['pg_placement_num_target'] = number
+    elif var == 'pg_autoscale_mode':
+        if value not in ('on', 'off', 'warn'):
+            raise CommandError(errno.EINVAL, 'pg_autoscale_mode must be one of on, off, warn')  # noqa: E501
+        pool['pg_autoscale_mode'] = value
+    elif var == 'crush_rule':
+        pool['crush_rule'] = find_rule(ctx, value)['rule_id']
+    elif var in ('target_size_ratio', 'target_size_bytes', 'pg_num_min', 'pg_num_max'):  # noqa: E501
+        number = float(value) if var == 'target_size_ratio' else to_int(value, var)  # noqa: E501
+        if number:
+            pool['options'][var] = number
+        else:
+            pool['options'].pop(var, None)
+    else:
+        raise CommandError(errno.EINVAL, 'unrecognized variable \'{}\''.format(var))  # noqa: E501
+    pool['last_change'] = str(bump(state, 'osdmap'))
+    ctx.err = 'set pool {} {} to {}\n'.format(pool['pool_id'], var, value)
+    return ''
+
+
+def pool_get(ctx, args):
+    pool = find_pool(ctx, arg(args, 0, 'pool'))
+    var = arg(args, 1, 'var')
+    if var in POOL_INT_VARS:
+        value = pool[POOL_INT_VARS[var]]
+    elif var == 'crush_rule':
+        value = rule_name(ctx.state, pool['crush_rule'])
+    elif var == 'pg_autoscale_mode':
+        value = pool[var]
+    elif var in pool['options']:
+        value = pool['options'][var]
+    else:
+        raise CommandError(errno.ENOENT, 'option \'{}\' is not set on pool \'{}\''.format(var, pool['pool_name']))  # noqa: E501
+    return ctx.dump({'pool': pool['pool_name'], 'pool_id': pool['pool_id'], var: value},  # noqa: E501
+                    '{}: {}\n'.format(var, value))
+
+
+def pool_rm(ctx, args):
+    state = ctx.state
+    positional, options = split_options(args)
+    name = arg(positional, 0, 'pool')
+    if name not in state['pools']:
+        ctx.err = "pool '{}' does not exist\n".format(name)
+        return ''
+    if len(positional) < 2 or positional[1] != name or not options.get('yes-i-really-really-mean-it'):  # noqa: E501
+        raise CommandError(errno.EPERM, 'WARNING: this will *PERMANENTLY DESTROY* all data stored in pool {0}.  '  # noqa: E501
+                                        'If you are *ABSOLUTELY CERTAIN* that is what you want, pass the pool name '  # noqa: E501
+                                        '*twice*, followed by --yes-i-really-really-mean-it.'.format(name))  # noqa: E501
+    if config_value(state, 'mon_allow_pool_delete') != 'true':
+        raise CommandError(errno.EPERM, 'pool deletion is disabled; you must first set the mon_allow_pool_delete '  # noqa: E501
+                                        'config option to true before you can destroy a pool')  # noqa: E501
+    del state['pools'][name]
+    bump(state, 'osdmap')
+    ctx.err = "pool '{}' removed\n".format(name)
+    return ''
+
+
+def pool_application(ctx, args):
+    positional, options = split_options(args)
+    action = arg(positional, 0, 'action')
+    pool = find_pool(ctx, arg(positional, 1, 'pool'))
+    apps = pool['application_metadata']
+    if action == 'get':
+        return ctx.dump(apps)
+    app = arg(positional, 2, 'app')
+    if action == 'enable':
+        if app not in apps:
+            if apps and not options.get('yes-i-really-mean-it'):
+                raise CommandError(errno.EPERM, 'Are you SURE? Pool \'{}\' already has an enabled application; '  # noqa: E501
+                                                'pass --yes-i-really-mean-it to proceed anyway'.format(pool['pool_name']))  # noqa: E501
+            apps[app] = {}
+            bump(ctx.state, 'osdmap')
+        ctx.err = "enabled application '{}' on pool '{}'\n".format(app, pool['pool_name'])  # noqa: E501
+    elif action == 'disable':
+        if app in apps:
+            if not options.get('yes-i-really-mean-it'):
+                raise CommandError(errno.EPERM, 'Are you SURE? Disabling an application within a pool might result in loss '  # noqa: E501
+                                                'of application functionality; pass --yes-i-really-mean-it to proceed anyway')  # noqa: E501
+            del apps[app]
+            bump(ctx.state, 'osdmap')
+        ctx.err = "disable application '{}' on pool '{}'\n".format(app, pool['pool_name'])  # noqa: E501
+    else:
+        raise CommandError(errno.EINVAL, 'invalid command')
+    return ''
+
+
+# erasure code profiles
+
+def ec_profile_ls(ctx, args):
+    names = sorted(ctx.state['erasure_code_profiles'])
+    return ctx.dump(names, ''.join(n + '\n' for n in names))
+
+
+def ec_profile_get(ctx, args):
+    name = arg(args, 0, 'name')
+    profile = ctx.state['erasure_code_profiles'].get(name)
+    if profile is None:
+        raise CommandError(errno.ENOENT, 'unknown erasure code profile \'{}\''.format(name))  # noqa: E501
+    return ctx.dump(profile, ''.join('{}={}\n'.format(k, v) for k, v in sorted(profile.items())))  # noqa: E501
+
+
+def ec_profile_set(ctx, args):
+    positional, options = split_options(args)
+    name = arg(positional, 0, 'name')
+    profile = {'plugin': 'jerasure', 'technique': 'reed_sol_van'}
+    profile.update(dict(p.split('=', 1) for p in positional[1:] if '=' in p))  # noqa: E501
+    current = ctx.state['erasure_code_profiles'].get(name)
+    if current is not None and current != profile and not options.get('force'):  # noqa: E501
+        raise CommandError(errno.EPERM, 'will not override erasure code profile {} because the existing profile {} '  # noqa: E501
+                                        'is different from the proposed profile {}'.format(name, current, profile))  # noqa: E501
+    ctx.state['erasure_code_profiles'][name] = profile
+    return ''
+
+
+def ec_profile_rm(ctx, args):
+    name = arg(args, 0, 'name')
+    for pool in ctx.state['pools'].values():
+        if pool['erasure_code_profile'] == name:
+            raise CommandError(errno.EBUSY, '{}: pool {} uses it'.format(name, pool['pool_name']))  # noqa: E501
+    ctx.state['erasure_code_profiles'].pop(name, None)
+    return ''
+
+
+# crush
+
+def create_rule(state, name, kind, root, failure_domain, device_class=None, profile=None):  # noqa: E501
+    rule_id = max([r['rule_id'] for r in state['crush']['rules'].values()] + [-1]) + 1  # noqa: E501
+    state['crush']['rules'][name] = {'rule_id': rule_id, 'type': kind,
+                                     'root': root,
+                                     'failure_domain': failure_domain,
+                                     'device_class': device_class}
+    bump_crush(state)
+    return rule_id
+
+
+def rule_json(name, rule):
+    item = rule['root']
+    if rule['device_class']:
+        item = '{}~{}'.format(item, rule['device_class'])
+    choose = 'chooseleaf_firstn' if rule['type'] == 1 else 'chooseleaf_indep'
+    return {'rule_id': rule['rule_id'], 'rule_name': name, 'type': rule['type'],  # noqa: E501
+            'steps': [{'op': 'take', 'item_name': item},
+                      {'op': choose, 'num': 0, 'type': rule['failure_domain']},  # noqa: E501
+                      {'op': 'emit'}]}
+
+
+def crush_nodes(state):
+    '''
+    Return the buckets and osds in the order of 'ceph osd crush tree'
+    '''
+
+    children = {}
+    for name, bucket in state['crush']['buckets'].items():
+        children.setdefault(bucket['parent'], []).append((bucket['id'], name, bucket))  # noqa: E501
+    osds = {}
+    for osd_id, osd in state['osds'].items():
+        osds.setdefault(osd['host'], []).append((int(osd_id), osd))
+    nodes = []
+
+    def walk(name, bucket):
+        buckets = sorted(children.get(name, []), key=lambda c: c[0], reverse=True)  # noqa: E501
+        devices = sorted(osds.get(name, []), key=lambda o: o[0], reverse=True)  # noqa: E501
+        nodes.append({'id': bucket['id'], 'name': name, 'type': bucket['type'],  # noqa: E501
+                      'type_id': CRUSH_TYPES.index(bucket['type']),
+                      'children': [c[0] for c in buckets] + [o[0] for o in devices]})  # noqa: E501
+        for _, child, child_bucket in buckets:
+            walk(child, child_bucket)
+        for osd_id, osd in devices:
+            nodes.append({'id': osd_id, 'device_class': osd['device_class'],
+                          'name': 'osd.{}'.format(osd_id), 'type': 'osd',
+                          'type_id': 0, 'crush_weight': osd['weight'],
+                          'depth': 2, 'pool_weights': {}})
+
+    for bucket_id, name, bucket in sorted(children.get(None, []), key=lambda c: c[0], reverse=True):  # noqa: E501
+        walk(name, bucket)
+    return nodes
+
+
+def crush_tree(ctx, args):
+    nodes = crush_nodes(ctx.state)
+    plain = 'ID  CLASS  WEIGHT  TYPE NAME\n' + ''.join(
+        '{}  {}  {}  {} {}\n'.format(n['id'], n.get('device_class', ''), n.get('crush_weight', 0), n['type'], n['name'])  # noqa: E501
+        for n in nodes)
+    return ctx.dump({'nodes': nodes, 'stray': []}, plain)
+
+
+def add_bucket(state, name, kind, parent=None):
+    state['crush']['last_bucket_id'] -= 1
+    state['crush']['buckets'][name] = {'id': state['crush']['last_bucket_id'],  # noqa: E501
+                                       'type': kind, 'parent': parent}
+    bump_crush(state)
+    return state['crush']['last_bucket_id']
+
+
+def parse_location(state, args):
+    '''
+    Return the nearest existing or created parent of a crush location
+    given as 'type=name' arguments
+    '''
+
+    location = sorted((CRUSH_TYPES.index(k), k, v) for k, v in
+                      (a.split('=', 1) for a in args if '=' in a)
+                      if k in CRUSH_TYPES)
+    parent = None
+    for _, kind, name in reversed(location):
+        if name not in state['crush']['buckets']:
+            add_bucket(state, name, kind, parent)
+        parent = name
+    return parent
+
+
+def crush_add_bucket(ctx, args):
+    name = arg(args, 0, 'name')
+    kind = arg(args, 1, 'type')
+    if kind not in CRUSH_TYPES[1:]:
+        raise CommandError(errno.EINVAL, 'type \'{}\' does not exist'.format(kind))  # noqa: E501
+    bucket = ctx.state['crush']['buckets'].get(name)
+    if bucket is not None:
+        if bucket['type'] != kind:
+            raise CommandError(errno.EEXIST, 'bucket \'{}\' already exists with a different type'.format(name))  # noqa: E501
+        ctx.err = "bucket '{}' already exists\n".format(name)
+        return ''
+    add_bucket(ctx.state, name, kind, parse_location(ctx.state, args[2:]))
+    ctx.err = "added bucket {} type {} to crush map\n".format(name, kind)
+    return ''
+
+
+def crush_move(ctx, args):
+    name = arg(args, 0, 'name')
+    bucket = ctx.state['crush']['buckets'].get(name)
+    if bucket is None:
+        raise CommandError(errno.ENOENT, 'item {} does not exist'.format(name))  # noqa: E501
+    parent = parse_location(ctx.state, args[1:])
+    if parent is None:
+        raise CommandError(errno.EINVAL, 'invalid location')
+    if bucket['parent'] == parent:
+        ctx.err = "no need to move item id {} name '{}' to location {}\n".format(bucket['id'], name, args[1:])  # noqa: E501
+        return ''
+    bucket['parent'] = parent
+    bump_crush(ctx.state)
+    ctx.err = "moved item id {} name '{}' to location {} in crush map\n".format(bucket['id'], name, args[1:])  # noqa: E501
+    return ''
+
+
+def check_crushmap(crush):
+    '''
+    Return why a CRUSH map is invalid, None if it's valid
+    '''
+
+    buckets = crush['buckets']
+    for name, bucket in buckets.items():
+        if bucket['type'] not in CRUSH_TYPES[1:]:
+            return 'bucket {} has an unknown type {}'.format(name, bucket['type'])  # noqa: E501
+        seen = set([name])
+        parent = bucket['parent']
+        while parent is not None:
+            if parent not in buckets:
+                return 'bucket {} is in the missing bucket {}'.format(name, parent)  # noqa: E501
+            if parent in seen:
+                return 'bucket {} is in a loop'.format(name)
+            seen.add(parent)
+            parent = buckets[parent]['parent']
+    for name, rule in crush['rules'].items():
+        if rule['root'] not in buckets:
+            return 'rule {} takes the missing bucket {}'.format(name, rule['root'])  # noqa: E501
+    return None
+
+
+def getcrushmap(ctx, args):
+    # the map is JSON instead of the binary encoding, only crushtool
+    # reads it
+    ctx.err = '{}\n'.format(ctx.state['epochs'].get('crush', 1))
+    return json.dumps(ctx.state['crush'])
+
+
+def setcrushmap(ctx, args):
+    try:
+        crush = json.loads(ctx.read_input())
+    except ValueError:
+        raise CommandError(errno.EINVAL, 'failed to decode crushmap')
+    version = ctx.state['epochs'].get('crush', 1)
+    if args and int(args[0]) != version:
+        raise CommandError(errno.EPERM, 'prior_version {} != crush version {}'.format(args[0], version))  # noqa: E501
+    error = check_crushmap(crush)
+    if error is not None:
+        raise CommandError(errno.EINVAL, 'crush smoke test failed: {}'.format(error))  # noqa: E501
+    ctx.state['crush'] = crush
+    ctx.err = '{}\n'.format(bump_crush(ctx.state))
+    return ''
+
+
+def crush_rule_ls(ctx, args):
+    names = sorted(ctx.state['crush']['rules'], key=lambda n: ctx.state['crush']['rules'][n]['rule_id'])  # noqa: E501
+    return ctx.dump(names, ''.join(n + '\n' for n in names))
+
+
+def crush_rule_dump(ctx, args):
+    if args:
+        return ctx.dump(rule_json(args[0], find_rule(ctx, args[0])))
+    rules = ctx.state['crush']['rules']
+    return ctx.dump(sorted([rule_json(n, r) for n, r in rules.items()], key=lambda r: r['rule_id']))  # noqa: E501
+
+
+def crush_rule_create_replicated(ctx, args):
+    name = arg(args, 0, 'name')
+    root = arg(args, 1, 'root')
+    failure_domain = arg(args, 2, 'type')
+    device_class = args[3] if len(args) > 3 else None
+    if name in ctx.state['crush']['rules']:
+        ctx.err = 'rule {} already exists\n'.format(name)
+        return ''
+    if root not in ctx.state['crush']['buckets']:
+        raise CommandError(errno.ENOENT, 'root item {} does not exist'.format(root))  # noqa: E501
+    create_rule(ctx.state, name, 1, root, failure_domain, device_class)
+    return ''
+
+
+def crush_rule_create_erasure(ctx, args):
+    name = arg(args, 0, 'name')
+    profile = args[1] if len(args) > 1 else 'default'
+    if name in ctx.state['crush']['rules']:
+        ctx.err = 'rule {} already exists\n'.format(name)
+        return ''
+    ec = ctx.state['erasure_code_profiles'].get(profile)
+    if ec is None:
+        raise CommandError(errno.ENOENT, 'failed to load plugin using profile {}'.format(profile))  # noqa: E501
+    create_rule(ctx.state, name, 3, ec.get('crush-root', 'default'),
+                ec.get('crush-failure-domain', 'host'), ec.get('crush-device-class'))  # noqa: E501
+    ctx.err = 'created rule {} at {}\n'.format(name, ctx.state['crush']['rules'][name]['rule_id'])  # noqa: E501
+    return ''
+
+
+def crush_rule_rm(ctx, args):
+    name = arg(args, 0, 'name')
+    rule = ctx.state['crush']['rules'].get(name)
+    if rule is None:
+        ctx.err = 'rule {} does not exist\n'.format(name)
+        return ''
+    for pool in ctx.state['pools'].values():
+        if pool['crush_rule'] == rule['rule_id']:
+            raise CommandError(errno.EBUSY, 'crush rule {} ({}) in use by pool {}'.format(  # noqa: E501
+                name, rule['rule_id'], pool['pool_name']))
+    del ctx.state['crush']['rules'][name]
+    bump_crush(ctx.state)
+    return ''
+
+
+# osd map
+
+def osd_stat_json(state):
+    up = [o for o in state['osds'].values() if o['up']]
+    return {'epoch': state['epochs']['osdmap'], 'num_osds': len(state['osds']),  # noqa: E501
+            'num_up_osds': len(up), 'osd_up_since': 0,
+            'num_in_osds': len([o for o in state['osds'].values() if o['in']]),  # noqa: E501
+            'osd_in_since': 0, 'num_remapped_pgs': 0}
+
+
+def osd_stat(ctx, args):
+    stat = osd_stat_json(ctx.state)
+    return ctx.dump(stat, '{num_osds} osds: {num_up_osds} up, {num_in_osds} in; epoch: e{epoch}\n'.format(**stat))  # noqa: E501
+
+
+def osd_ls(ctx, args):
+    ids = sorted(int(i) for i in ctx.state['osds'])
+    return ctx.dump(ids, ''.join('{}\n'.format(i) for i in ids))
+
+
+def osd_dump(ctx, args):
+    state = ctx.state
+    dump = {
+        'epoch': state['epochs']['osdmap'],
+        'fsid': state['fsid'],
+        'flags': ','.join(state['osd_flags']),
+        'flags_set': list(state['osd_flags']),
+        'pools': sorted(state['pools'].values(), key=lambda p: p['pool_id']),
+        'osds': [{'osd': int(i), 'uuid': o['fsid'], 'up': int(o['up']), 'in': int(o['in'])}  # noqa: E501
+                 for i, o in sorted(state['osds'].items(), key=lambda x: int(x[0]))],  # noqa: E501
+    }
+    return ctx.dump(dump, 'epoch {}\nfsid {}\nflags {}\n'.format(dump['epoch'], dump['fsid'], dump['flags']))  # noqa: E501
+
+
+def osd_set_flag(ctx, args):
+    flag = arg(args, 0, 'key')
+    if flag not in OSD_FLAGS:
+        raise CommandError(errno.EINVAL, 'unrecognized flag \'{}\''.format(flag))  # noqa: E501
+    if flag not in ctx.state['osd_flags']:
+        ctx.state['osd_flags'].append(flag)
+        bump(ctx.state, 'osdmap')
+    ctx.err = '{} is set\n'.format(flag)
+    return ''
+
+
+def osd_unset_flag(ctx, args):
+    flag = arg(args, 0, 'key')
+    if flag not in OSD_FLAGS:
+        raise CommandError(errno.EINVAL, 'unrecognized flag \'{}\''.format(flag))  # noqa: E501
+    if flag in ctx.state['osd_flags']:
+        ctx.state['osd_flags'].remove(flag)
+        bump(ctx.state, 'osdmap')
+    ctx.err = '{} is unset\n'.format(flag)
+    return ''
+
+
+# mon, mgr and status
+
+def mon_stat(ctx, args):
+    state = ctx.state
+    stat = {'epoch': state['epochs']['monmap'], 'min_mon_release_name': 'squid',  # noqa: E501
+            'num_mons': 1, 'leader': state['hostname'],
+            'quorum': [{'rank': 0, 'name': state['hostname']}]}
+    return ctx.dump(stat, 'e{}: 1 mons at {{{}}}, election epoch 3, leader 0 {}, quorum 0 {}\n'.format(  # noqa: E501
+        stat['epoch'], state['hostname'], state['hostname'], state['hostname']))  # noqa: E501
+
+
+def mgr_module_ls(ctx, args):
+    enabled = ctx.state['mgr_modules']
+    modules = {'always_on_modules': MGR_ALWAYS_ON,
+               'enabled_modules': sorted(enabled),
+               'disabled_modules': [{'name': m, 'can_run': True} for m in MGR_MODULES  # noqa: E501
+                                    if m not in enabled and m not in MGR_ALWAYS_ON]}  # noqa: E501
+    return ctx.dump(modules)
+
+
+def mgr_module_enable(ctx, args):
+    positional, options = split_options(args)
+    name = arg(positional, 0, 'module')
+    if name not in MGR_MODULES and not options.get('force'):
+        raise CommandError(errno.ENOENT, "all mgr daemons do not support module '{}', pass --force to force enablement".format(name))  # noqa: E501
+    if name in MGR_ALWAYS_ON:
+        ctx.err = "module '{}' is already enabled (always-on)\n".format(name)  # noqa: E501
+    elif name in ctx.state['mgr_modules']:
+        ctx.err = "module '{}' is already enabled\n".format(name)
+    else:
+        ctx.state['mgr_modules'].append(name)
+    return ''
+
+
+def mgr_module_disable(ctx, args):
+    name = arg(args, 0, 'module')
+    if name in MGR_ALWAYS_ON:
+        raise CommandError(errno.EINVAL, "module '{}' cannot be disabled (always-on)".format(name))  # noqa: E501
+    if name in ctx.state['mgr_modules']:
+        ctx.state['mgr_modules'].remove(name)
+    return ''
+
+
+def health_json(state):
+    warnings = [f for f in state['osd_flags'] if f in OSD_FLAGS and f != 'pglog_hardlimit']  # noqa: E501
+    checks = {}
+    if warnings:
+        checks['OSDMAP_FLAGS'] = {'severity': 'HEALTH_WARN',
+                                  'summary': {'message': '{} flag(s) set'.format(','.join(warnings))}}  # noqa: E501
+    return {'status': 'HEALTH_WARN' if checks else 'HEALTH_OK', 'checks': checks, 'mutes': []}  # noqa: E501
+
+
+def health(ctx, args):
+    data = health_json(ctx.state)
+    return ctx.dump(data, data['status'] + '\n')
+
+
+def status(ctx, args):
+    state = ctx.state
+    num_pgs = sum(p['pg_num'] for p in state['pools'].values())
+    data = {
+        'fsid': state['fsid'],
+        'health': health_json(state),
+        'election_epoch': 3,
+        'quorum': [0],
+        'quorum_names': [state['hostname']],
+        'monmap': {'epoch': state['epochs']['monmap'], 'min_mon_release_name': 'squid', 'num_mons': 1},  # noqa: E501
+        'osdmap': osd_stat_json(state),
+        'pgmap': {'pgs_by_state': [{'state_name': 'active+clean', 'count': num_pgs}] if num_pgs else [],  # noqa: E501
+                  'num_pgs': num_pgs, 'num_pools': len(state['pools']),
+                  'num_objects': 0, 'data_bytes': 0, 'bytes_used': 0},
+        'mgrmap': {'available': True, 'num_standbys': 0,
+                   'modules': sorted(state['mgr_modules'])},
+    }
+    plain = '  cluster:\n    id:     {}\n    health: {}\n'.format(state['fsid'], data['health']['status'])  # noqa: E501
+    return ctx.dump(data, plain)
+
+
+COMMANDS = {
+    ('status',): status,
+    ('health',): health,
+    ('mon', 'stat'): mon_stat,
+    ('osd', 'stat'): osd_stat,
+    ('osd', 'ls'): osd_ls,
+    ('osd', 'dump'): osd_dump,
+    ('osd', 'set'): osd_set_flag,
+    ('osd', 'unset'): osd_unset_flag,
+    ('osd', 'pool', 'ls'): pool_ls,
+    ('osd', 'pool', 'stats'): pool_stats,
+    ('osd', 'pool', 'create'): pool_create,
+    ('osd', 'pool', 'set'): pool_set,
+    ('osd', 'pool', 'get'): pool_get,
+    ('osd', 'pool', 'rm'): pool_rm,
+    ('osd', 'pool', 'delete'): pool_rm,
+    ('osd', 'pool', 'application'): pool_application,
+    ('osd', 'erasure-code-profile', 'ls'): ec_profile_ls,
+    ('osd', 'erasure-code-profile', 'get'): ec_profile_get,
+    ('osd', 'erasure-code-profile', 'set'): ec_profile_set,
+    ('osd', 'erasure-code-profile', 'rm'): ec_profile_rm,
+    ('osd', 'getcrushmap'): getcrushmap,
+    ('osd', 'setcrushmap'): setcrushmap,
+    ('osd', 'crush', 'tree'): crush_tree,
+    ('osd', 'crush', 'add-bucket'): crush_add_bucket,
+    ('osd', 'crush', 'move'): crush_move,
+    ('osd', 'crush', 'rule', 'ls'): crush_rule_ls,
+    ('osd', 'crush', 'rule', 'dump'): crush_rule_dump,
+    ('osd', 'crush', 'rule', 'create-replicated'): crush_rule_create_replicated,  # noqa: E501
+    ('osd', 'crush', 'rule', 'create-erasure'): crush_rule_create_erasure,
+    ('osd', 'crush', 'rule', 'rm'): crush_rule_rm,
+    ('config', 'set'): config_set,
+    ('config', 'get'): config_get,
+    ('config', 'rm'): config_rm,
+    ('config', 'dump'): config_dump,
+    ('config', 'log'): config_log,
+    ('config', 'assimilate-conf'): config_assimilate,
+    ('auth', 'ls'): auth_ls,
+    ('auth', 'list'): auth_ls,
+    ('auth', 'get'): auth_get,
+    ('auth', 'export'): auth_export,
+    ('auth', 'get-key'): auth_get_key,
+    ('auth', 'print-key'): auth_get_key,
+    ('auth', 'get-or-create'): auth_get_or_create,
+    ('auth', 'caps'): auth_caps,
+    ('auth', 'del'): auth_del,
+    ('auth', 'rm'): auth_del,
+    ('auth', 'import'): auth_import,
+    ('mgr', 'module', 'ls'): mgr_module_ls,
+    ('mgr', 'module', 'enable'): mgr_module_enable,
+    ('mgr', 'module', 'disable'): mgr_module_disable,
+}
+
+
+def dispatch(commands, ctx, words):
+    '''
+    Run the handler of the longest command prefix of words
+    '''
+
+    for length in range(min(len(words), 4), 0, -1):
+        handler = commands.get(tuple(words[:length]))
+        if handler is not None:
+            return handler(ctx, words[length:])
+    raise CommandError(errno.EINVAL, 'invalid command: {!r}'.format(' '.join(words)))  # noqa: E501
+
+
+def write_output(ctx, out):
+    path = ctx.options.get('output')
+    if path is None or path == '-':
+        return out
+    with open(path, 'w') as f:
+        f.write(out)
+    return ''
+
+
+def main(cluster, argv, inbuf=None):
+    options, words = parse_global(argv)
+    ctx = Context(cluster, options, inbuf)
+    out = dispatch(COMMANDS, ctx, words)
+    return 0, write_output(ctx, out), ctx.err
+
+
+def rbd(cluster, argv, inbuf=None):
+    options, words = parse_global(argv)
+    ctx = Context(cluster, options, inbuf)
+    if words[:2] != ['pool', 'init']:
+        raise CommandError(errno.EINVAL, 'invalid command: {!r}'.format(' '.join(words)))  # noqa: E501
+    pool = find_pool(ctx, arg(words, 2, 'pool'))
+    if 'rbd' not in pool['application_metadata']:
+        pool['application_metadata']['rbd'] = {}
+        bump(cluster.state, 'osdmap')
+    return 0, '', ''
+
+
+def authtool(cluster, argv, inbuf=None):
+    '''
+    Support what ceph-ansible does with ceph-authtool: create a keyring
+    with one entity, print its key or generate a key
+    '''
+
+    path = None
+    name = None
+    key = None
+    caps = {}
+    create = gen_key = print_key = False
+    i = 0
+    while i < len(argv):
+        option = argv[i]
+        if option in ('--create-keyring', '-C'):
+            create = True
+        elif option in ('--gen-key', '-g'):
+            gen_key = True
+        elif option in ('--print-key', '-p'):
+            print_key = True
+        elif option in ('--name', '-n'):
+            name = argv[i + 1]
+            i += 1
+        elif option in ('--add-key', '-a'):
+            key = argv[i + 1]
+            i += 1
+        elif option == '--cap':
+            caps[argv[i + 1]] = argv[i + 2]
+            i += 2
+        elif path is None and not option.startswith('-'):
+            path = option
+        i += 1
+    if path is None:
+        raise CommandError(errno.EINVAL, 'must specify filename')
+
+    if print_key:
+        with open(path) as f:
+            entities = parse_keyring(f.read())
+        for entity, entity_key, _ in entities:
+            if name is None or entity == name:
+                return 0, entity_key + '\n', ''
+        raise CommandError(errno.ENOENT, 'entity {} not found'.format(name))
+
+    if gen_key:
+        key = new_key()
+    if key is not None and not re.match(r'^[a-zA-Z0-9+/]{38}==$', key):
+        raise CommandError(errno.EINVAL, "can't decode key '{}'".format(key))  # noqa: E501
+    with open(path, 'w') as f:
+        f.write(keyring([(name, {'key': key, 'caps': caps})]))
+    return 0, '', 'creating {}\n'.format(path) if create else ''
+
+
+def crushtool(cluster, argv, inbuf=None):
+    '''
+    Support the offline edits of a map written by 'osd getcrushmap':
+    --add-bucket, --move with their --loc and --check
+    '''
+
+    path = output = None
+    edits = []
+    loc = []
+    check = False
+    i = 0
+    while i < len(argv):
+        option = argv[i]
+        if option == '-i':
+            path = argv[i + 1]
+            i += 1
+        elif option == '-o':
+            output = argv[i + 1]
+            i += 1
+        elif option == '--add-bucket':
+            edits.append(('add', argv[i + 1], argv[i + 2]))
+            i += 2
+        elif option == '--move':
+            edits.append(('move', argv[i + 1], None))
+            i += 1
+        elif option == '--loc':
+            loc.append('{}={}'.format(argv[i + 1], argv[i + 2]))
+            i += 2
+        elif option == '--check':
+            check = True
+        else:
+            raise ToolError(errno.EINVAL, 'unrecognized arg {}'.format(option))  # noqa: E501
+        i += 1
+    if path is None:
+        raise ToolError(errno.EINVAL, 'must specify input map')
+    try:
+        with open(path) as f:
+            crush = json.load(f)
+    except (IOError, ValueError):
+        raise ToolError(errno.EINVAL, 'crushtool: unable to read {}'.format(path))  # noqa: E501
+
+    # the edits are made on a copy of the map, not on the cluster
+    offline = {'crush': crush, 'epochs': {}}
+    for action, name, kind in edits:
+        bucket = crush['buckets'].get(name)
+        if action == 'add':
+            if kind not in CRUSH_TYPES[1:]:
+                raise ToolError(errno.EINVAL, 'bad bucket type: {}'.format(kind))  # noqa: E501
+            if bucket is not None:
+                raise ToolError(errno.EEXIST, 'add_bucket: {} already exists'.format(name))  # noqa: E501
+            add_bucket(offline, name, kind, parse_location(offline, loc))
+        elif bucket is None:
+            raise ToolError(errno.ENOENT, 'move_item: {} does not exist'.format(name))  # noqa: E501
+        else:
+            bucket['parent'] = parse_location(offline, loc)
+
+    if check:
+        error = check_crushmap(crush)
+        if error is not None:
+            raise ToolError(errno.EINVAL, error)
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(crush, f)
+    return 0, '', ''
@@ -0,0 +1,90 @@
+'''
+Fake 'cephadm' command line tool
+'''
+
+import errno
+import json
+
+from .state import ToolError
+
+
+VALUED_OPTIONS = ['--image', '--fsid', '--name', '-n', '--cluster',
+                  '--style', '--legacy-dir', '--config', '-c', '--keyring',
+                  '-k', '--mount', '-m', '--env', '-e', '--mon-ip',
+                  '--initial-dashboard-user', '--initial-dashboard-password',
+                  '--registry-url', '--registry-username',
+                  '--registry-password', '--registry-json', '--ssh-user',
+                  '--ssh-config']
+
+
+def split(argv):
+    '''
+    Split the options given before and after the cephadm subcommand
+    from its arguments
+    '''
+
+    options = {}
+    words = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == '--':
+            words.extend(argv[i + 1:])
+            break
+        if arg in VALUED_OPTIONS and i + 1 < len(argv):
+            options[arg.lstrip('-')] = argv[i + 1]
+            i += 1
+        elif arg.startswith('-'):
+            key, _, value = arg.lstrip('-').partition('=')
+            options[key] = value or True
+        else:
+            words.append(arg)
+            if len(words) > 1 and words[0] == 'shell':
+                words.extend(argv[i + 1:])
+                break
+        i += 1
+    return words, options
+
+
+def shell(cluster, words, options, inbuf):
+    if len(words) < 2:
+        raise ToolError(errno.EINVAL, 'cephadm shell: no command given')
+    return cluster.dispatch(words[1:], inbuf)
+
+
+def ls(cluster, words, options, inbuf):
+    daemons = cluster.state['daemons']
+    return 0, json.dumps(daemons, indent=4) + '\n', ''
+
+
+def adopt(cluster, words, options, inbuf):
+    name = options.get('name')
+    for daemon in cluster.state['daemons']:
+        if daemon['name'] == name:
+            daemon['style'] = 'cephadm:v1'
+            daemon['fsid'] = cluster.state['fsid']
+            return 0, '', 'Moving data...\nChowning content...\n'
+    raise ToolError(errno.ENOENT, 'ERROR: {} not found'.format(name))
+
+
+def bootstrap(cluster, words, options, inbuf):
+    if not options.get('mon-ip'):
+        raise ToolError(errno.EINVAL, 'ERROR: must specify --mon-ip or --mon-addrv')  # noqa: E501
+    state = cluster.state
+    if options.get('fsid'):
+        state['fsid'] = options['fsid']
+    state['daemons'].append({'style': 'cephadm:v1',
+                             'name': 'mon.{}'.format(state['hostname']),
+                             'fsid': state['fsid']})
+    return 0, 'Bootstrap complete.\n', ''
+
+
+COMMANDS = {'shell': shell, 'ls': ls, 'adopt': adopt, 'bootstrap': bootstrap}
+
+
+def main(cluster, argv, inbuf=None):
+    words, options = split(argv)
+    handler = COMMANDS.get(words[0] if words else None)
+    if handler is None:
+        raise ToolError(errno.EINVAL, 'cephadm: error: invalid choice: {}'.format(' '.join(words)))  # noqa: E501
+    return handler(cluster, words, options, inbuf)
@@ -0,0 +1,257 @@
+'''
+A stateful stand-in for a ceph cluster and its command line tools
+'''
+
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from . import ceph, cephadm, radosgw, shell, volume
+from .state import CommandError, default_state
+
+
+BINARIES = {
+    'ceph': ceph.main,
+    'rbd': ceph.rbd,
+    'ceph-authtool': ceph.authtool,
+    'crushtool': ceph.crushtool,
+    'radosgw-admin': radosgw.main,
+    'ceph-volume': volume.main,
+    'cephadm': cephadm.main,
+    'lvs': volume.lvs,
+    'vgscan': volume.scan,
+    'lvscan': volume.scan,
+}
+
+CONTAINER_BINARIES = ['podman', 'docker']
+
+# container options taking a value as a separate argument
+CONTAINER_VALUED_OPTIONS = ['-v', '--volume', '-e', '--env', '--name',
+                            '--label', '--entrypoint', '-w', '--workdir']
+
+SHIM = '''#!/bin/sh
+: "${{FAKE_CEPH_STATE:={state}}}"
+export FAKE_CEPH_STATE
+PYTHONPATH={path}${{PYTHONPATH:+:$PYTHONPATH}}
+export PYTHONPATH
+exec {python} -m fake_cluster {binary} "$@"
+'''
+
+
+def unwrap(argv):
+    '''
+    Return the command run by argv once the container prefix added by
+    ceph-ansible ('run --entrypoint=<binary> <image>' or
+    'exec <container> <binary>') is removed
+    '''
+
+    if not argv or os.path.basename(argv[0]) not in CONTAINER_BINARIES:
+        return argv
+    if len(argv) > 1 and argv[1] == 'exec':
+        i = 2
+        while i < len(argv) and argv[i].startswith('-'):
+            i += 1
+        return argv[i + 1:]
+    if len(argv) > 1 and argv[1] == 'run':
+        entrypoint = None
+        i = 2
+        while i < len(argv) and argv[i].startswith('-'):
+            if argv[i].startswith('--entrypoint='):
+                entrypoint = argv[i].split('=', 1)[1]
+            elif argv[i] == '--entrypoint':
+                entrypoint = argv[i + 1]
+            if argv[i] in CONTAINER_VALUED_OPTIONS:
+                i += 1
+            i += 1
+        if entrypoint is not None:
+            # argv[i] is the image
+            return [entrypoint] + argv[i + 1:]
+        return argv[i + 1:]
+    return argv
+
+
+class FakeCluster(object):
+    '''
+    Emulate the ceph, rbd, ceph-authtool, crushtool, radosgw-admin,
+    ceph-volume, cephadm and lvm command line tools against an in-memory
+    cluster state, optionally persisted in a JSON file.
+
+    run_command() has the signature of AnsibleModule.run_command so it
+    can be used as the side effect of a patched run_command, every call
+    is recorded in 'calls'. 'latency' seconds are spent on each call to
+    mimic the cost of starting the real tools (or their container).
+    Every tool invocation, including the ones made by a shell script,
+    is recorded in 'commands' and costs 'command_latency' seconds.
+    'tool_time' is the time spent emulating the tools, latencies
+    excluded.
+    '''
+
+    def __init__(self, path=None, latency=0.0, command_latency=0.0,
+                 fsid=None, hostname=None):
+        self.path = path
+        self.latency = latency
+        self.command_latency = command_latency
+        self.calls = []
+        self.commands = []
+        self.tool_time = 0.0
+        self.bin_dir = None
+        self._workdir = None
+        self._lock = threading.RLock()
+        self._depth = 0
+        if path and os.path.exists(path):
+            self.load()
+        else:
+            self.state = default_state(fsid=fsid, hostname=hostname)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._workdir is not None:
+            shutil.rmtree(self._workdir, ignore_errors=True)
+            self._workdir = None
+
+    def load(self):
+        with open(self.path) as f:
+            self.state = json.load(f)
+
+    def save(self):
+        '''
+        Atomically write the state file, create a temporary one if no
+        path was given
+        '''
+
+        if self.path is None:
+            self.path = os.path.join(self.workdir(), 'state.json')
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))  # noqa: E501
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.state, f, indent=1)
+        os.rename(tmp, self.path)
+
+    def workdir(self):
+        if self._workdir is None:
+            self._workdir = tempfile.mkdtemp(prefix='fake-cluster-')
+        return self._workdir
+
+    def add_device(self, path, size=10 * 1024 ** 3, rotational=True):
+        self.state['devices'][path] = {'size': size, 'rotational': rotational}  # noqa: E501
+
+    def add_lv(self, vg, lv, device=None, size=10 * 1024 ** 3):
+        return volume.create_lv(self.state, vg, lv, [device] if device else [], size)  # noqa: E501
+
+    def install(self, bin_dir=None):
+        '''
+        Write a shim for each binary in bin_dir, a process with bin_dir
+        first in its PATH runs the fake tools against the state file
+        '''
+
+        bin_dir = bin_dir or os.path.join(self.workdir(), 'bin')
+        if not os.path.isdir(bin_dir):
+            os.makedirs(bin_dir)
+        self.save()
+        package_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # noqa: E501
+        for binary in BINARIES:
+            shim = os.path.join(bin_dir, binary)
+            with open(shim, 'w') as f:
+                f.write(SHIM.format(state=shlex.quote(os.path.abspath(self.path)),  # noqa: E501
+                                    path=shlex.quote(package_path),
+                                    python=shlex.quote(sys.executable),
+                                    binary=binary))
+            os.chmod(shim, 0o755)
+        self.bin_dir = bin_dir
+        return bin_dir
+
+    def reset(self):
+        '''
+        Forget the recorded calls and timings, not the state
+        '''
+
+        self.calls = []
+        self.commands = []
+        self.tool_time = 0.0
+
+    def dispatch(self, argv, inbuf=None):
+        '''
+        Run one command against the state, without recording it
+        in 'calls'
+        '''
+
+        argv = unwrap([a.decode() if isinstance(a, bytes) else str(a) for a in argv])  # noqa: E501
+        if not argv:
+            return 0, '', ''
+        binary = os.path.basename(argv[0])
+        if binary == 'sh' and argv[1:2] == ['-c']:
+            return self.run_script(argv[2], inbuf)
+        handler = BINARIES.get(binary)
+        if handler is None:
+            return 127, '', 'sh: {}: command not found\n'.format(binary)
+        if self.command_latency:
+            time.sleep(self.command_latency)
+        with self._lock:
+            self.commands.append(argv)
+            # 'cephadm shell' dispatches the command it wraps, only time
+            # the outermost one
+            self._depth += 1
+            startd = time.time()
+            try:
+                return handler(self, argv[1:], inbuf)
+            except CommandError as e:
+                return e.code, '', e.format() + '\n'
+            finally:
+                self._depth -= 1
+                if not self._depth:
+                    self.tool_time += time.time() - startd
+
+    def run(self, argv, inbuf=None):
+        self.calls.append(list(argv))
+        if self.latency:
+            time.sleep(self.latency)
+        return self.dispatch(argv, inbuf)
+
+    def run_command(self, args, data=None, binary_data=False, **kwargs):
+        if isinstance(args, str):
+            args = shlex.split(args)
+        return self.run(args, data)
+
+    def run_script(self, script, inbuf=None):
+        '''
+        Run a shell script, in process when it only uses what the
+        scripts of exec_commands_batch use, otherwise with sh and the
+        shims first in PATH (the state is handed over through the
+        state file)
+        '''
+
+        try:
+            return shell.run(script, self.dispatch)
+        except shell.Unsupported:
+            pass
+
+        with self._lock:
+            startd = time.time()
+            if self.bin_dir is None:
+                self.install()
+            self.save()
+            log = os.path.join(self.workdir(), 'commands.log')
+            env = dict(os.environ, FAKE_CEPH_STATE=os.path.abspath(self.path),  # noqa: E501
+                       FAKE_CEPH_LOG=log,
+                       PATH=self.bin_dir + os.pathsep + os.environ.get('PATH', ''))  # noqa: E501
+            p = subprocess.Popen(['sh', '-c', script], env=env,
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, universal_newlines=True)  # noqa: E501
+            out, err = p.communicate(inbuf)
+            self.load()
+            if os.path.exists(log):
+                with open(log) as f:
+                    self.commands.extend(json.loads(line) for line in f)
+                os.unlink(log)
+            self.tool_time += time.time() - startd
+        return p.returncode, out, err
@@ -0,0 +1,404 @@
+'''
+Fake 'radosgw-admin' command line tool
+'''
+
+import errno
+import json
+import random
+import string
+
+from .state import ToolError, new_id
+
+
+VALUED_OPTIONS = ['--cluster', '-n', '--name', '-k', '--keyring', '-c',
+                  '--conf']
+
+USER_DEFAULTS = {'suspended': 0, 'max_buckets': 1000, 'subusers': [],
+                 'swift_keys': [], 'op_mask': 'read, write, delete',
+                 'default_placement': '', 'default_storage_class': '',
+                 'placement_tags': [], 'type': 'rgw', 'mfa_ids': []}
+
+
+def parse(argv):
+    '''
+    Split the command words from the options, radosgw-admin options
+    are given as '--opt=value' except for the global ones
+    '''
+
+    words = []
+    options = {}
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg in VALUED_OPTIONS and i + 1 < len(argv):
+            options[arg.lstrip('-')] = argv[i + 1]
+            i += 1
+        elif arg.startswith('-') and '=' in arg:
+            key, value = arg.lstrip('-').split('=', 1)
+            options[key.replace('_', '-')] = value
+        elif arg.startswith('-'):
+            options[arg.lstrip('-').replace('_', '-')] = True
+        else:
+            words.append(arg)
+        i += 1
+    return words, options
+
+
+def public(entry):
+    return dict((k, v) for k, v in entry.items() if not k.startswith('_'))
+
+
+def dump(data):
+    return json.dumps(data, indent=4) + '\n'
+
+
+def random_string(length, chars):
+    return ''.join(random.choice(chars) for _ in range(length))
+
+
+def required(options, name):
+    if not options.get(name) or options[name] is True:
+        raise ToolError(errno.EINVAL, 'ERROR: --{} not specified'.format(name))  # noqa: E501
+    return options[name]
+
+
+# realms
+
+def find_realm(rgw, options):
+    name = options.get('rgw-realm')
+    if not name:
+        name = rgw['default_realm']
+    realm = rgw['realms'].get(name) if name else None
+    if realm is None:
+        raise ToolError(errno.ENOENT, 'failed to init realm: (2) No such file or directory')  # noqa: E501
+    return realm
+
+
+def realm_create(rgw, options):
+    name = required(options, 'rgw-realm')
+    if name in rgw['realms']:
+        raise ToolError(errno.EEXIST, "ERROR: couldn't create realm {}: (17) File exists".format(name))  # noqa: E501
+    realm = rgw['realms'][name] = {'id': new_id(), 'name': name,
+                                   'current_period': new_id(), 'epoch': 1}
+    if options.get('default') or rgw['default_realm'] is None:
+        rgw['default_realm'] = name
+    return dump(realm)
+
+
+def realm_get(rgw, options):
+    return dump(find_realm(rgw, options))
+
+
+def realm_delete(rgw, options):
+    realm = find_realm(rgw, options)
+    del rgw['realms'][realm['name']]
+    if rgw['default_realm'] == realm['name']:
+        rgw['default_realm'] = None
+    return ''
+
+
+def realm_default(rgw, options):
+    rgw['default_realm'] = find_realm(rgw, options)['name']
+    return ''
+
+
+def realm_list(rgw, options):
+    default = rgw['realms'].get(rgw['default_realm'] or '', {}).get('id', '')
+    return dump({'default_info': default, 'realms': sorted(rgw['realms'])})
+
+
+def realm_pull(rgw, options):
+    required(options, 'url')
+    required(options, 'access-key')
+    required(options, 'secret')
+    name = required(options, 'rgw-realm')
+    if name not in rgw['realms']:
+        realm_create(rgw, {'rgw-realm': name, 'default': options.get('default')})  # noqa: E501
+    return dump(rgw['realms'][name])
+
+
+def period_update(rgw, options):
+    realm = find_realm(rgw, options)
+    if options.get('commit'):
+        realm['epoch'] += 1
+        realm['current_period'] = new_id()
+    return dump({'id': realm['current_period'], 'epoch': realm['epoch'],
+                 'realm_id': realm['id'], 'realm_name': realm['name']})
+
+
+def period_get(rgw, options):
+    return period_update(rgw, {'rgw-realm': options.get('rgw-realm')})
+
+
+# zonegroups
+
+def find_zonegroup(rgw, options):
+    name = required(options, 'rgw-zonegroup')
+    zonegroup = rgw['zonegroups'].get(name)
+    if zonegroup is None:
+        raise ToolError(errno.ENOENT, 'failed to init zonegroup: (2) No such file or directory')  # noqa: E501
+    return zonegroup
+
+
+def zonegroup_json(rgw, zonegroup):
+    data = public(zonegroup)
+    data['zones'] = [{'id': z['id'], 'name': n, 'endpoints': z['_endpoints']}  # noqa: E501
+                     for n, z in sorted(rgw['zones'].items())
+                     if z['_zonegroup'] == zonegroup['name']]
+    return dump(data)
+
+
+def update_zonegroup(rgw, zonegroup, options):
+    if options.get('endpoints'):
+        zonegroup['endpoints'] = options['endpoints'].split(',')
+    if options.get('master'):
+        for other in rgw['zonegroups'].values():
+            other['is_master'] = False
+        zonegroup['is_master'] = True
+    if options.get('default'):
+        rgw['default_zonegroup'] = zonegroup['name']
+
+
+def zonegroup_create(rgw, options):
+    name = required(options, 'rgw-zonegroup')
+    realm = find_realm(rgw, options)
+    if name in rgw['zonegroups']:
+        raise ToolError(errno.EEXIST, 'failed to create zonegroup {}: (17) File exists'.format(name))  # noqa: E501
+    zonegroup = rgw['zonegroups'][name] = {
+        'id': new_id(), 'name': name, 'api_name': name, 'is_master': False,
+        'endpoints': [], 'hostnames': [], 'hostnames_s3website': [],
+        'master_zone': '', 'placement_targets': [],
+        'default_placement': 'default-placement', 'realm_id': realm['id'],
+    }
+    update_zonegroup(rgw, zonegroup, options)
+    return zonegroup_json(rgw, zonegroup)
+
+
+def zonegroup_get(rgw, options):
+    return zonegroup_json(rgw, find_zonegroup(rgw, options))
+
+
+def zonegroup_modify(rgw, options):
+    zonegroup = find_zonegroup(rgw, options)
+    update_zonegroup(rgw, zonegroup, options)
+    return zonegroup_json(rgw, zonegroup)
+
+
+def zonegroup_delete(rgw, options):
+    zonegroup = find_zonegroup(rgw, options)
+    del rgw['zonegroups'][zonegroup['name']]
+    return ''
+
+
+def zonegroup_list(rgw, options):
+    return dump({'default_info': rgw.get('default_zonegroup', ''),
+                 'zonegroups': sorted(rgw['zonegroups'])})
+
+
+# zones
+
+def find_zone(rgw, options):
+    name = required(options, 'rgw-zone')
+    zone = rgw['zones'].get(name)
+    if zone is None:
+        raise ToolError(errno.ENOENT, 'unable to initialize zone: (2) No such file or directory')  # noqa: E501
+    return zone
+
+
+def update_zone(rgw, zone, options):
+    if options.get('endpoints'):
+        zone['_endpoints'] = options['endpoints'].split(',')
+    if options.get('access-key') not in (None, True):
+        zone['system_key']['access_key'] = options['access-key']
+    if options.get('secret-key') not in (None, True):
+        zone['system_key']['secret_key'] = options['secret-key']
+    if options.get('master'):
+        rgw['zonegroups'][zone['_zonegroup']]['master_zone'] = zone['id']
+    if options.get('default'):
+        rgw['default_zone'] = zone['name']
+
+
+def zone_create(rgw, options):
+    name = required(options, 'rgw-zone')
+    realm = find_realm(rgw, options)
+    zonegroup = find_zonegroup(rgw, options)
+    if name in rgw['zones']:
+        raise ToolError(errno.EEXIST, 'failed to create zone {}: (17) File exists'.format(name))  # noqa: E501
+    zone = rgw['zones'][name] = {
+        'id': new_id(), 'name': name,
+        'domain_root': '{}.rgw.meta:root'.format(name),
+        'control_pool': '{}.rgw.control'.format(name),
+        'log_pool': '{}.rgw.log'.format(name),
+        'system_key': {'access_key': '', 'secret_key': ''},
+        'placement_pools': [], 'realm_id': realm['id'], 'notif_pool': '',
+        '_zonegroup': zonegroup['name'], '_endpoints': [],
+    }
+    update_zone(rgw, zone, options)
+    return dump(public(zone))
+
+
+def zone_get(rgw, options):
+    return dump(public(find_zone(rgw, options)))
+
+
+def zone_modify(rgw, options):
+    zone = find_zone(rgw, options)
+    update_zone(rgw, zone, options)
+    return dump(public(zone))
+
+
+def zone_delete(rgw, options):
+    zone = find_zone(rgw, options)
+    del rgw['zones'][zone['name']]
+    return ''
+
+
+def zone_set(rgw, options):
+    path = required(options, 'infile')
+    with open(path) as f:
+        doc = json.load(f)
+    name = options.get('rgw-zone') or doc.get('name')
+    if not name:
+        raise ToolError(errno.EINVAL, 'missing zone name')
+    zone = rgw['zones'].get(name, {'id': new_id(), '_endpoints': [],
+                                   '_zonegroup': rgw.get('default_zonegroup')})  # noqa: E501
+    private = dict((k, v) for k, v in zone.items() if k.startswith('_'))
+    zone.clear()
+    zone.update(doc)
+    zone.update(private)
+    zone['name'] = name
+    rgw['zones'][name] = zone
+    return dump(public(zone))
+
+
+def zone_list(rgw, options):
+    return dump({'default_info': rgw.get('default_zone', ''),
+                 'zones': sorted(rgw['zones'])})
+
+
+# users
+
+def find_user(rgw, options):
+    uid = required(options, 'uid')
+    user = rgw['users'].get(uid)
+    if user is None:
+        raise ToolError(errno.ENOENT, 'could not fetch user info: no user info saved')  # noqa: E501
+    return user
+
+
+def parse_caps(value):
+    caps = []
+    for cap in value.split(';'):
+        kind, _, perm = cap.partition('=')
+        if kind:
+            caps.append({'type': kind.strip(), 'perm': perm.strip()})
+    return caps
+
+
+def update_user(user, options):
+    for option in ('display-name', 'email'):
+        if options.get(option) not in (None, True):
+            user[option.replace('-', '_')] = options[option]
+    for option in ('system', 'admin'):
+        if options.get(option):
+            user[option] = options[option] is True or options[option] == 'true'  # noqa: E501
+    if options.get('access-key') not in (None, True) or options.get('gen-access-key'):  # noqa: E501
+        access_key = options.get('access-key')
+        if access_key in (None, True):
+            access_key = random_string(20, string.ascii_uppercase + string.digits)  # noqa: E501
+        secret_key = options.get('secret-key')
+        if secret_key in (None, True):
+            secret_key = random_string(40, string.ascii_letters + string.digits)  # noqa: E501
+        user['keys'] = [k for k in user['keys'] if k['access_key'] != access_key]  # noqa: E501
+        user['keys'].append({'user': user['user_id'], 'access_key': access_key,  # noqa: E501
+                             'secret_key': secret_key})
+
+
+def user_create(rgw, options):
+    uid = required(options, 'uid')
+    required(options, 'display-name')
+    if uid in rgw['users']:
+        raise ToolError(errno.EEXIST, 'could not create user: unable to create user, user: {} exists'.format(uid))  # noqa: E501
+    user = dict(USER_DEFAULTS, user_id=uid, display_name='', email='',
+                keys=[], caps=[], system=False, admin=False)
+    if options.get('access-key') in (None, True):
+        options = dict(options, **{'gen-access-key': True})
+    update_user(user, options)
+    if options.get('caps') not in (None, True):
+        user['caps'] = parse_caps(options['caps'])
+    rgw['users'][uid] = user
+    return dump(user)
+
+
+def user_info(rgw, options):
+    return dump(find_user(rgw, options))
+
+
+def user_modify(rgw, options):
+    user = find_user(rgw, options)
+    update_user(user, options)
+    return dump(user)
+
+
+def user_rm(rgw, options):
+    user = find_user(rgw, options)
+    del rgw['users'][user['user_id']]
+    return ''
+
+
+def user_list(rgw, options):
+    return dump(sorted(rgw['users']))
+
+
+def caps_add(rgw, options):
+    user = find_user(rgw, options)
+    for cap in parse_caps(required(options, 'caps')):
+        user['caps'] = [c for c in user['caps'] if c['type'] != cap['type']]
+        user['caps'].append(cap)
+    return dump(user)
+
+
+def caps_rm(rgw, options):
+    user = find_user(rgw, options)
+    removed = [c['type'] for c in parse_caps(required(options, 'caps'))]
+    user['caps'] = [c for c in user['caps'] if c['type'] not in removed]
+    return dump(user)
+
+
+COMMANDS = {
+    ('realm', 'create'): realm_create,
+    ('realm', 'get'): realm_get,
+    ('realm', 'delete'): realm_delete,
+    ('realm', 'rm'): realm_delete,
+    ('realm', 'default'): realm_default,
+    ('realm', 'list'): realm_list,
+    ('realm', 'pull'): realm_pull,
+    ('period', 'update'): period_update,
+    ('period', 'get'): period_get,
+    ('zonegroup', 'create'): zonegroup_create,
+    ('zonegroup', 'get'): zonegroup_get,
+    ('zonegroup', 'modify'): zonegroup_modify,
+    ('zonegroup', 'delete'): zonegroup_delete,
+    ('zonegroup', 'list'): zonegroup_list,
+    ('zone', 'create'): zone_create,
+    ('zone', 'get'): zone_get,
+    ('zone', 'modify'): zone_modify,
+    ('zone', 'delete'): zone_delete,
+    ('zone', 'set'): zone_set,
+    ('zone', 'list'): zone_list,
+    ('user', 'create'): user_create,
+    ('user', 'info'): user_info,
+    ('user', 'modify'): user_modify,
+    ('user', 'rm'): user_rm,
+    ('user', 'list'): user_list,
+    ('caps', 'add'): caps_add,
+    ('caps', 'rm'): caps_rm,
+}
+
+
+def main(cluster, argv, inbuf=None):
+    words, options = parse(argv)
+    handler = COMMANDS.get(tuple(words[:2]))
+    if handler is None:
+        raise ToolError(errno.EINVAL, 'ERROR: unrecognized arg {}'.format(' '.join(words)))  # noqa: E501
+    return 0, handler(cluster.state['rgw'], options), ''
@@ -0,0 +1,157 @@
+'''
+Minimal in-process shell for the scripts built by exec_commands_batch:
+simple commands separated by ';', '&&', '||' or newlines, '>&2'
+redirections, whole word $? and $var expansions, variable assignments
+and the echo, printf, [, exit, true and false builtins.
+Anything else raises Unsupported so the script can be run by sh.
+'''
+
+import re
+import shlex
+
+
+class Unsupported(Exception):
+    pass
+
+
+class Exit(Exception):
+    pass
+
+
+OPERATORS = [';', '&&', '||']
+
+ASSIGNMENT = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*)=(.*)$')
+
+VARIABLE = re.compile(r'^\$(\?|[A-Za-z_][A-Za-z0-9_]*)$')
+
+TESTS = {'=': None, '!=': None,
+         '-eq': int.__eq__, '-ne': int.__ne__, '-lt': int.__lt__,
+         '-le': int.__le__, '-gt': int.__gt__, '-ge': int.__ge__}
+
+
+def parse(script):
+    '''
+    Return a list of (operator, words, to_stderr), operator tells how
+    a command is chained to the previous one
+    '''
+
+    commands = []
+    for line in script.split('\n'):
+        lexer = shlex.shlex(line, posix=True, punctuation_chars=';&|<>()')
+        lexer.whitespace_split = True
+        try:
+            tokens = list(lexer)
+        except ValueError:
+            raise Unsupported(line)
+        operator = ';'
+        words = []
+        to_stderr = False
+        i = 0
+        while i <= len(tokens):
+            token = tokens[i] if i < len(tokens) else ';'
+            if token in OPERATORS:
+                if words:
+                    check(words)
+                    commands.append((operator, words, to_stderr))
+                elif token != ';' or i < len(tokens):
+                    raise Unsupported(line)
+                operator, words, to_stderr = token, [], False
+            elif token == '>&' and tokens[i + 1:i + 2] == ['2']:
+                to_stderr = True
+                i += 1
+            elif (token and token[0] in ';&|<>()') or '`' in token or ('$' in token and not VARIABLE.match(token.split('=', 1)[-1])):  # noqa: E501
+                raise Unsupported(token)
+            else:
+                words.append(token)
+            i += 1
+    return commands
+
+
+def check(words):
+    '''
+    Reject the commands which can't be run, before running anything
+    '''
+
+    if ASSIGNMENT.match(words[0]) and len(words) > 1:
+        raise Unsupported(words[0])
+    if words[0] == '[' and (len(words) != 5 or words[-1] != ']' or words[2] not in TESTS):  # noqa: E501
+        raise Unsupported(' '.join(words))
+
+
+def printf(words):
+    fmt = words[0].replace('\\n', '\n').replace('\\t', '\t')
+    args = list(words[1:])
+
+    def substitute(match):
+        if match.group(0) == '%%':
+            return '%'
+        value = args.pop(0) if args else ''
+        return str(int(value or 0)) if match.group(0) == '%d' else value
+
+    return re.sub(r'%[%ds]', substitute, fmt)
+
+
+def test(words):
+    '''
+    Return the status of '[ <left> <op> <right> ]'
+    '''
+
+    left, op, right = words[1:4]
+    if op in ('=', '!='):
+        return int((left == right) != (op == '='))
+    try:
+        return int(not TESTS[op](int(left), int(right)))
+    except ValueError:
+        return 2
+
+
+def run(script, execute):
+    '''
+    Run script, execute(argv) runs the external commands and returns
+    (rc, out, err)
+    '''
+
+    commands = parse(script)
+    out = []
+    err = []
+    status = 0
+    variables = {}
+
+    def expand(word):
+        match = VARIABLE.match(word)
+        if match is None:
+            return word
+        if match.group(1) == '?':
+            return str(status)
+        return variables.get(match.group(1), '')
+
+    try:
+        for operator, words, to_stderr in commands:
+            if (operator == '&&' and status != 0) or (operator == '||' and status == 0):  # noqa: E501
+                continue
+            words = [expand(w) if not ASSIGNMENT.match(w) else w for w in words]  # noqa: E501
+            assignment = ASSIGNMENT.match(words[0])
+            _out = _err = ''
+            if assignment and len(words) == 1:
+                variables[assignment.group(1)] = expand(assignment.group(2))
+                status = 0
+            elif words[0] == 'echo':
+                _out, status = ' '.join(words[1:]) + '\n', 0
+            elif words[0] == 'printf':
+                _out, status = printf(words[1:]), 0
+            elif words[0] == '[':
+                status = test(words)
+            elif words[0] in ('true', 'false'):
+                status = int(words[0] == 'false')
+            elif words[0] == 'exit':
+                status = int(words[1]) if len(words) > 1 else status
+                raise Exit()
+            else:
+                status, _out, _err = execute(words)
+            if to_stderr:
+                _out, _err = '', _err + _out
+            out.append(_out)
+            err.append(_err)
+    except Exit:
+        pass
+    return status, ''.join(out), ''.join(err)
@@ -0,0 +1,123 @@
+'''
+Cluster state shared by the fake ceph tools
+'''
+
+import base64
+import errno
+import os
+import socket
+import struct
+import time
+import uuid
+
+
+CRUSH_TYPES = ['osd', 'host', 'chassis', 'rack', 'row', 'pdu', 'pod',
+               'room', 'datacenter', 'zone', 'region', 'root']
+
+INITIAL_KEYS = {
+    'client.admin': {'mds': 'allow *', 'mgr': 'allow *',
+                     'mon': 'allow *', 'osd': 'allow *'},
+    'client.bootstrap-mds': {'mon': 'allow profile bootstrap-mds'},
+    'client.bootstrap-mgr': {'mon': 'allow profile bootstrap-mgr'},
+    'client.bootstrap-osd': {'mon': 'allow profile bootstrap-osd'},
+    'client.bootstrap-rbd': {'mon': 'allow profile bootstrap-rbd'},
+    'client.bootstrap-rbd-mirror': {'mon': 'allow profile bootstrap-rbd-mirror'},  # noqa: E501
+    'client.bootstrap-rgw': {'mon': 'allow profile bootstrap-rgw'},
+    'mon.': {'mon': 'allow *'},
+}
+
+
+class CommandError(Exception):
+    '''
+    A command failed, rc is the (positive) errno like the real tools
+    '''
+
+    def __init__(self, code, message):
+        super(CommandError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+    def format(self):
+        return 'Error {}: {}'.format(errno.errorcode.get(self.code, 'EINVAL'),
+                                     self.message)
+
+
+class ToolError(CommandError):
+    '''
+    A failure of a tool which doesn't report errors the way the ceph
+    CLI does, message is printed as is
+    '''
+
+    def format(self):
+        return self.message
+
+
+def new_key():
+    '''
+    Generate a secret the same way ceph-authtool --gen-key does
+    '''
+
+    header = struct.pack('<HIIH', 1, int(time.time()), 0, 16)
+    return base64.b64encode(header + os.urandom(16)).decode()
+
+
+def new_id():
+    return str(uuid.uuid4())
+
+
+def default_state(fsid=None, hostname=None):
+    '''
+    Return the state of a freshly bootstrapped cluster: one monitor,
+    no OSD, no pool and the initial keys
+    '''
+
+    hostname = hostname or socket.gethostname().split('.', 1)[0]
+    auth = {}
+    for entity, caps in INITIAL_KEYS.items():
+        auth[entity] = {'key': new_key(), 'caps': dict(caps)}
+
+    return {
+        'fsid': fsid or new_id(),
+        'hostname': hostname,
+        'epochs': {'osdmap': 1, 'monmap': 1, 'config': 1, 'crush': 1},
+        'pools': {},
+        'last_pool_id': 0,
+        'osd_flags': ['sortbitwise', 'recovery_deletes',
+                      'purged_snapdirs', 'pglog_hardlimit'],
+        'config': [],
+        'config_log': [],
+        'auth': auth,
+        'crush': {
+            'buckets': {'default': {'id': -1, 'type': 'root', 'parent': None}},  # noqa: E501
+            'rules': {'replicated_rule': {'rule_id': 0, 'type': 1,
+                                          'root': 'default',
+                                          'failure_domain': 'host',
+                                          'device_class': None}},
+            'last_bucket_id': -1,
+        },
+        'erasure_code_profiles': {
+            'default': {'k': '2', 'm': '2', 'plugin': 'jerasure',
+                        'technique': 'reed_sol_van'},
+        },
+        'mgr_modules': ['iostat', 'nfs', 'restful'],
+        'rgw': {'realms': {}, 'zonegroups': {}, 'zones': {}, 'users': {},
+                'default_realm': None},
+        'devices': {},
+        'lvs': {},
+        'osds': {},
+        'daemons': [],
+    }
+
+
+def bump(state, epoch):
+    state['epochs'][epoch] = state['epochs'].get(epoch, 1) + 1
+    return state['epochs'][epoch]
+
+
+def bump_crush(state):
+    '''
+    A change of the CRUSH map bumps its version and the osdmap epoch
+    '''
+
+    bump(state, 'osdmap')
+    return bump(state, 'crush')
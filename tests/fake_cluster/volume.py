@@ -0,0 +1,329 @@
+'''
+Fake 'ceph-volume' and lvm command line tools
+'''
+
+import errno
+import json
+
+from .ceph import add_bucket, split_options
+from .state import ToolError, bump, new_id, new_key
+
+
+def fail(message):
+    raise ToolError(1, '-->  RuntimeError: {}'.format(message))
+
+
+def human_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size < 1024 or unit == 'TB':
+            return '{:.2f} {}'.format(size, unit)
+        size /= 1024.0
+
+
+def lv_used_by(state, lv):
+    for osd_id, osd in state['osds'].items():
+        if osd.get('lv') == lv:
+            return osd_id
+    return None
+
+
+def device_available(state, path):
+    device = state['devices'].get(path)
+    return device is not None and not any(path in lv['devices'] for lv in state['lvs'].values())  # noqa: E501
+
+
+def create_lv(state, vg, name, devices, size):
+    state['lvs']['{}/{}'.format(vg, name)] = {
+        'lv_name': name, 'vg_name': vg, 'lv_path': '/dev/{}/{}'.format(vg, name),  # noqa: E501
+        'devices': list(devices), 'lv_size': size, 'tags': {},
+    }
+    return '{}/{}'.format(vg, name)
+
+
+def create_osd(cluster, lv, options, prepare):
+    '''
+    Register a new OSD on an LV the way 'ceph-volume lvm prepare'
+    would, it is up unless only prepared
+    '''
+
+    state = cluster.state
+    osd_id = 0
+    while str(osd_id) in state['osds']:
+        osd_id += 1
+    host = state['hostname']
+    if host not in state['crush']['buckets']:
+        add_bucket(state, host, 'host', 'default')
+    osd_fsid = new_id()
+    lv_info = state['lvs'][lv]
+    lv_info['tags'] = {
+        'ceph.osd_id': str(osd_id), 'ceph.osd_fsid': osd_fsid,
+        'ceph.cluster_fsid': state['fsid'],
+        'ceph.cluster_name': options.get('cluster', 'ceph'),
+        'ceph.type': 'block',
+        'ceph.crush_device_class': options.get('crush-device-class', ''),
+        'ceph.encrypted': '1' if options.get('dmcrypt') else '0',
+    }
+    for role in ('block.db', 'block.wal'):
+        if options.get(role):
+            lv_info['tags']['ceph.{}_device'.format(role.replace('.', '_'))] = options[role]  # noqa: E501
+    size = lv_info['lv_size']
+    state['osds'][str(osd_id)] = {
+        'fsid': osd_fsid, 'host': host, 'lv': lv,
+        'device_class': options.get('crush-device-class') or 'hdd',
+        'weight': round(size / float(1 << 40), 5),
+        'up': not prepare, 'in': True,
+    }
+    state['auth']['osd.{}'.format(osd_id)] = {
+        'key': new_key(), 'caps': {'mgr': 'allow profile osd',
+                                   'mon': 'allow profile osd',
+                                   'osd': 'allow *'}}
+    bump(state, 'osdmap')
+    return osd_id
+
+
+def osd_lv(state, data):
+    '''
+    Return the LV to prepare an OSD on, given as vg/lv or a raw device
+    '''
+
+    if data in state['lvs']:
+        if lv_used_by(state, data) is not None:
+            fail('skipping {}, it is already prepared'.format(data))
+        return data
+    if '/' in data and not data.startswith('/dev/'):
+        fail('no LV found matching {}'.format(data))
+    if data not in state['devices']:
+        fail('Unable to proceed with non-existing device: {}'.format(data))
+    if not device_available(state, data):
+        fail('skipping {}, it is already used'.format(data))
+    vg = 'ceph-{}'.format(new_id())
+    return create_lv(state, vg, 'osd-block-{}'.format(new_id()), [data],
+                     state['devices'][data]['size'])
+
+
+def lvm_prepare(cluster, args, prepare=True):
+    positional, options = split_options(args, ['--bluestore', '--dmcrypt', '--no-systemd'])  # noqa: E501
+    data = options.get('data')
+    if not data:
+        fail('--data is required')
+    lv = osd_lv(cluster.state, data)
+    osd_id = create_osd(cluster, lv, options, prepare)
+    action = 'prepare' if prepare else 'create'
+    return '', '--> ceph-volume lvm {} successful for: {}\n'.format(action, data) + \
+        '--> osd.{} created\n'.format(osd_id)
+
+
+def lvm_create(cluster, args):
+    return lvm_prepare(cluster, args, prepare=False)
+
+
+def batch_plan(state, devices, osds_per_device):
+    plan = []
+    for device in devices:
+        if not device_available(state, device):
+            continue
+        size = state['devices'][device]['size'] // osds_per_device
+        for _ in range(osds_per_device):
+            plan.append({'block_db': None, 'block_db_size': None,
+                         'data': device, 'data_size': human_size(size),
+                         'encryption': 'None'})
+    return plan
+
+
+def lvm_batch(cluster, args):
+    state = cluster.state
+    flags = ['--bluestore', '--yes', '--prepare', '--dmcrypt', '--report',
+             '--no-auto', '--no-systemd']
+    devices = []
+    db_devices = []
+    wal_devices = []
+    target = devices
+    options = {}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--db-devices':
+            target = db_devices
+        elif arg == '--wal-devices':
+            target = wal_devices
+        elif arg in flags:
+            options[arg[2:]] = True
+        elif arg.startswith('--') and '=' in arg:
+            key, value = arg[2:].split('=', 1)
+            options[key] = value
+        elif arg.startswith('--'):
+            options[arg[2:]] = args[i + 1]
+            i += 1
+        else:
+            if arg not in state['devices']:
+                fail('Unable to proceed with non-existing device: {}'.format(arg))  # noqa: E501
+            target.append(arg)
+        i += 1
+
+    osds_per_device = int(options.get('osds-per-device', 1))
+    plan = batch_plan(state, devices, osds_per_device)
+    if options.get('report'):
+        if options.get('format', 'pretty').startswith('json'):
+            return json.dumps(plan, indent=4) + '\n', ''
+        return ''.join('  data: {data} {data_size}\n'.format(**p) for p in plan), ''  # noqa: E501
+    if not plan:
+        return '', '--> All data devices are unavailable\n'
+    if not options.get('yes'):
+        fail('batch requires --yes to proceed without prompting')
+    err = ''
+    for entry in plan:
+        vg = 'ceph-{}'.format(new_id())
+        size = state['devices'][entry['data']]['size'] // osds_per_device
+        lv = create_lv(state, vg, 'osd-block-{}'.format(new_id()), [entry['data']], size)  # noqa: E501
+        osd_id = create_osd(cluster, lv, options, options.get('prepare'))
+        err += '--> ceph-volume lvm {} successful for: {}\n'.format(
+            'prepare' if options.get('prepare') else 'activate', lv)
+        err += '--> osd.{} created\n'.format(osd_id)
+    return '', err
+
+
+def lvm_list(cluster, args):
+    state = cluster.state
+    positional, options = split_options(args)
+    listing = {}
+    for osd_id, osd in sorted(state['osds'].items(), key=lambda o: int(o[0])):  # noqa: E501
+        lv = state['lvs'].get(osd.get('lv'))
+        if lv is None:
+            continue
+        if positional and positional[0] not in [osd['lv'], lv['lv_path']] + lv['devices']:  # noqa: E501
+            continue
+        listing[osd_id] = [{
+            'devices': lv['devices'], 'lv_name': lv['lv_name'],
+            'lv_path': lv['lv_path'], 'lv_size': str(lv['lv_size']),
+            'lv_tags': ','.join('{}={}'.format(k, v) for k, v in sorted(lv['tags'].items())),  # noqa: E501
+            'name': lv['lv_name'], 'path': lv['lv_path'], 'tags': lv['tags'],  # noqa: E501
+            'type': 'block', 'vg_name': lv['vg_name'],
+        }]
+    if options.get('format') == 'json':
+        return json.dumps(listing, indent=4) + '\n', ''
+    if not listing:
+        raise ToolError(1, 'No valid Ceph lvm devices found')
+    return ''.join('====== osd.{} =======\n'.format(i) for i in listing), ''
+
+
+def inventory(cluster, args):
+    state = cluster.state
+    positional, options = split_options(args)
+    devices = []
+    for path, device in sorted(state['devices'].items()):
+        available = device_available(state, path)
+        devices.append({
+            'path': path, 'available': available, 'device_id': device.get('id', path.split('/')[-1]),  # noqa: E501
+            'rejected_reasons': [] if available else ['LVM detected', 'Has a FileSystem'],  # noqa: E501
+            'sys_api': {'size': float(device['size']), 'human_readable_size': human_size(device['size']),  # noqa: E501
+                        'rotational': '1' if device.get('rotational', True) else '0'},  # noqa: E501
+            'lvs': [{'name': lv['lv_name'], 'osd_id': lv['tags'].get('ceph.osd_id'), 'type': 'block'}  # noqa: E501
+                    for lv in state['lvs'].values() if path in lv['devices']],
+        })
+    if positional:
+        devices = [d for d in devices if d['path'] == positional[0]]
+    if options.get('format', 'plain').startswith('json'):
+        return json.dumps(devices[0] if positional and devices else devices) + '\n', ''  # noqa: E501
+    return ''.join('{path}  {available}\n'.format(**d) for d in devices), ''
+
+
+def forget_lv(state, lv):
+    del state['lvs'][lv]
+    for osd in state['osds'].values():
+        if osd.get('lv') == lv:
+            osd['lv'] = None
+            osd['up'] = False
+
+
+def lvm_zap(cluster, args):
+    state = cluster.state
+    positional, options = split_options(args, ['--destroy', '--no-systemd'])  # noqa: E501
+    targets = []
+    if options.get('osd-id') or options.get('osd-fsid'):
+        for osd_id, osd in state['osds'].items():
+            if options.get('osd-id') not in (None, osd_id):
+                continue
+            if options.get('osd-fsid') not in (None, osd['fsid']):
+                continue
+            if osd.get('lv'):
+                targets.append(osd['lv'])
+        if not targets:
+            fail('Unable to find any LV for zapping OSD: {}'.format(options.get('osd-id') or options.get('osd-fsid')))  # noqa: E501
+    for target in positional:
+        if target not in state['lvs'] and target not in state['devices']:
+            fail('Unable to proceed with non-existing device: {}'.format(target))  # noqa: E501
+        targets.append(target)
+
+    err = ''
+    for target in targets:
+        err += '--> Zapping: {}\n'.format(target)
+        if target in state['lvs']:
+            if options.get('destroy'):
+                forget_lv(state, target)
+            else:
+                state['lvs'][target]['tags'] = {}
+                for osd in state['osds'].values():
+                    if osd.get('lv') == target:
+                        osd['lv'] = None
+        else:
+            for lv, info in list(state['lvs'].items()):
+                if target in info['devices']:
+                    forget_lv(state, lv)
+    err += '--> Zapping successful for: {}\n'.format(', '.join(targets))
+    return '', err
+
+
+def lvm_activate(cluster, args):
+    activated = 0
+    for osd in cluster.state['osds'].values():
+        if osd.get('lv') and not osd['up']:
+            osd['up'] = True
+            activated += 1
+    if activated:
+        bump(cluster.state, 'osdmap')
+    return '', '--> ceph-volume lvm activate successful\n'
+
+
+COMMANDS = {
+    ('lvm', 'prepare'): lvm_prepare,
+    ('lvm', 'create'): lvm_create,
+    ('lvm', 'batch'): lvm_batch,
+    ('lvm', 'list'): lvm_list,
+    ('lvm', 'zap'): lvm_zap,
+    ('lvm', 'activate'): lvm_activate,
+    ('inventory',): inventory,
+}
+
+
+def main(cluster, argv, inbuf=None):
+    if argv[:1] == ['--cluster']:
+        argv = argv[2:]
+    for length in (2, 1):
+        handler = COMMANDS.get(tuple(argv[:length]))
+        if handler is not None:
+            out, err = handler(cluster, argv[length:])
+            return 0, out, err
+    raise ToolError(errno.EINVAL, 'ceph-volume: error: invalid choice: {}'.format(' '.join(argv)))  # noqa: E501
+
+
+def lvs(cluster, argv, inbuf=None):
+    '''
+    Only the json report is supported, with an optional --select
+    '''
+
+    selected = {}
+    for i, arg in enumerate(argv):
+        if arg in ('--select', '-S'):
+            selected = dict(s.split('=', 1) for s in argv[i + 1].split(','))
+    report = []
+    for lv in sorted(cluster.state['lvs'].values(), key=lambda lv: lv['lv_path']):  # noqa: E501
+        if all(lv.get(k) == v for k, v in selected.items()):
+            report.append({'lv_name': lv['lv_name'], 'vg_name': lv['vg_name'],  # noqa: E501
+                           'lv_attr': '-wi-a-----', 'lv_size': '{}B'.format(lv['lv_size']),  # noqa: E501
+                           'lv_tags': ','.join('{}={}'.format(k, v) for k, v in sorted(lv['tags'].items())),  # noqa: E501
+                           'devices': ','.join('{}(0)'.format(d) for d in lv['devices'])})  # noqa: E501
+    return 0, json.dumps({'report': [{'lv': report}]}) + '\n', ''
+
+
+def scan(cluster, argv, inbuf=None):
+    return 0, '', ''
@@ -0,0 +1,123 @@
+from mock.mock import MagicMock, patch
+import pytest
+import ca_test_common
+import ceph_config
+
+
+class TestCephConfigModule(object):
+
+    def test_get_config_index(self):
+        config_dump = [
+            {'section': 'osd', 'name': 'osd_memory_target', 'value': '5368709120', 'mask': ''},  # noqa: E501
+            {'section': 'osd', 'name': 'osd_memory_target', 'value': '4294967296', 'mask': 'host:node1'},  # noqa: E501
+        ]
+
+        assert ceph_config.get_config_index(config_dump) == {
+            ('osd', 'osd_memory_target'): '5368709120',
+            ('osd/host:node1', 'osd_memory_target'): '4294967296',
+        }
+
+    @pytest.mark.parametrize('current,value,expected', [
+        ('4294967296', '4G', True),
+        ('4Gi', '4294967296', True),
+        ('4GiB', '4G', True),
+        ('4G', '4M', False),
+        ('true', '1', True),
+        ('False', '0', True),
+        ('false', 'no', False),
+        ('1', 'yes', False),
+        ('true', '0', False),
+        ('3600', '1h', True),
+        ('1h30m', '5400', True),
+        ('0.50', '.5', True),
+        ('cephx', 'CEPHX', True),
+        ('on', 'true', False),
+        ('warn', 'on', False),
+        (None, 'true', False),
+    ])
+    def test_is_value_set(self, current, value, expected):
+        assert ceph_config.is_value_set(current, value) == expected
+
+    def test_get_current_value(self):
+        config_dump = [
+            {'section': 'osd', 'name': 'osd_memory_target', 'value': '4G', 'mask': 'host:node1/class:ssd'},  # noqa: E501
+            {'section': 'osd', 'name': 'osd_memory_target', 'value': '8G', 'mask': ''},  # noqa: E501
+        ]
+
+        assert ceph_config.get_current_value('osd/class:ssd/host:node1', 'osd-memory-target', config_dump) == '4G'  # noqa: E501
+        assert ceph_config.get_current_value('osd', 'osd_memory_target', config_dump) == '8G'  # noqa: E501
+        assert ceph_config.get_current_value('osd/host:node2', 'osd_memory_target', config_dump) is None  # noqa: E501
+
+    def test_get_config_entries(self):
+        module = MagicMock(params={'who': 'osd', 'action': 'set', 'options': {
+            'global': {'osd_pool_default_size': 3, 'mon_allow_pool_delete': True}}})  # noqa: E501
+        assert ceph_config.get_config_entries(module) == [
+            ('global', 'osd_pool_default_size', '3'),
+            ('global', 'mon_allow_pool_delete', 'true'),
+        ]
+
+        module.params['options'] = [
+            {'option': 'osd_memory_target', 'value': 1},
+            {'who': 'mon', 'option': 'mon_max_pg_per_osd', 'value': 300},
+            {'option': 'osd_memory_target', 'value': 2},
+        ]
+        assert ceph_config.get_config_entries(module) == [
+            ('osd', 'osd_memory_target', '2'),
+            ('mon', 'mon_max_pg_per_osd', '300'),
+        ]
+
+    @patch('ansible.module_utils.basic.AnsibleModule.fail_json')
+    def test_options_without_value(self, m_fail_json):
+        ca_test_common.set_module_args({'options': [{'who': 'osd', 'option': 'osd_memory_target'}]})  # noqa: E501
+        m_fail_json.side_effect = ca_test_common.fail_json
+
+        with pytest.raises(ca_test_common.AnsibleFailJson) as result:
+            ceph_config.main()
+
+        assert result.value.args[0]['msg'] == 'no value for the option osd_memory_target of osd'  # noqa: E501
+
+    def test_generate_conf(self):
+        entries = [('global', 'osd_pool_default_size', '3'),
+                   ('osd', 'osd_memory_target', '5368709120'),
+                   ('global', 'mon_allow_pool_delete', 'true')]
+
+        conf = ceph_config.generate_conf(entries)
+
+        assert conf == '[global]\nosd_pool_default_size = 3\nmon_allow_pool_delete = true\n' \
+                       '[osd]\nosd_memory_target = 5368709120\n'
+        assert ceph_config.parse_conf_options(conf) == set((who, option) for who, option, value in entries)  # noqa: E501
+
+    def test_can_assimilate(self):
+        assert ceph_config.can_assimilate('osd.0', '5368709120')
+        assert not ceph_config.can_assimilate('osd/host:node1', '5368709120')
+        assert not ceph_config.can_assimilate('global', 'a;b')
+
+    @patch('ceph_config.exec_commands_batch')
+    @patch('ceph_config.exec_command')
+    def test_reconcile_options(self, m_exec_command, m_exec_commands_batch):
+        # an option ceph can't store is left in the output
+        m_exec_command.return_value = (0, ['ceph', 'config', 'assimilate-conf'],
+                                       '[global]\n\tfsid = foo\n\tfoo_bar = 1\n', '')  # noqa: E501
+        m_exec_commands_batch.side_effect = lambda module, cmd_list, stop_on_error: [(0, cmd, '', '') for cmd in cmd_list]  # noqa: E501
+        module = MagicMock(check_mode=False, params={'action': 'set', 'cluster': 'ceph'})  # noqa: E501
+        entries = [('global', 'osd_pool_default_size', '3'),
+                   ('global', 'foo_bar', '1'),
+                   ('osd/host:node1', 'osd_memory_target', '4294967296'),
+                   ('osd', 'osd_memory_target', '5368709120')]
+        config_index = {('osd', 'osd_memory_target'): '5368709120',
+                        ('global', 'osd_pool_default_size'): '2'}
+
+        rc, cmd, out, err, changed, diff, results = ceph_config.reconcile_options(module, entries, config_index)  # noqa: E501
+
+        # only the new options are assimilated, the updates are batched
+        assert m_exec_command.call_args[1]['stdin'] == '[global]\nfoo_bar = 1\n'  # noqa: E501
+        assert [c[-3:] for c in m_exec_commands_batch.call_args[0][1]] == [
+            ['global', 'osd_pool_default_size', '3'],
+            ['osd/host:node1', 'osd_memory_target', '4294967296']]
+        assert [r['changed'] for r in results] == [True, True, True, False]
+        assert [r['rc'] for r in results] == [0, 1, 0, 0]
+        assert rc == 1
+        assert err == "foo_bar can't be assimilated"
+        assert diff[0] == {'before': 'osd_pool_default_size = 2\n', 'after': 'osd_pool_default_size = 3\n',  # noqa: E501
+                           'before_header': 'global/osd_pool_default_size',
+                           'after_header': 'global/osd_pool_default_size'}
@@ -1,5 +1,8 @@
+import os
+import subprocess
 import sys
 import pytest
+from mock.mock import patch
 
 sys.path.append('./library')
 import ceph_crush  # noqa: E402
@@ -110,3 +113,118 @@ class TestCephCrushModule(object):
         result = ceph_crush.create_and_move_buckets_list(
             cluster, location, crush_map, containerized)
         assert result == expected_command_list
+
+    def test_generate_commands_existing(self):
+        cluster = "test"
+        location = [
+            ("host", "monhost"),
+            ("rack", "monrack"),
+            ("root", "default"),
+        ]
+        crush_map = {"nodes": [
+            {"id": -1, "name": "default", "type": "root", "children": [-2]},
+            {"id": -2, "name": "monrack", "type": "rack", "children": []},
+            {"id": -3, "name": "monhost", "type": "host", "children": []},
+        ]}
+
+        result = ceph_crush.create_and_move_buckets_list(
+            cluster, location, crush_map)
+        assert result == [['ceph', '--cluster', cluster, 'osd', 'crush',
+                           "move", "monhost", "rack=monrack"]]
+
+        crush_map["nodes"][2]["type"] = "chassis"
+        with pytest.raises(Exception):
+            ceph_crush.create_and_move_buckets_list(cluster, location, crush_map)  # noqa: E501
+
+    def test_get_crush_hierarchy(self):
+        locations = [
+            {"host": "host1", "rack": "rack1", "root": "default"},
+            {"host": "host2", "rack": "rack1", "root": "default"},
+            {"host": "host3", "rack": "rack2"},
+        ]
+
+        result = ceph_crush.get_crush_hierarchy(locations, None)
+        assert result == [
+            ("host", "host1", ("rack", "rack1")),
+            ("rack", "rack1", ("root", "default")),
+            ("root", "default", None),
+            ("host", "host2", ("rack", "rack1")),
+            ("host", "host3", ("rack", "rack2")),
+            ("rack", "rack2", None),
+        ]
+
+    def test_get_crush_hierarchy_conflict(self):
+        locations = [
+            {"host": "host1", "rack": "rack1"},
+            {"host": "host1", "rack": "rack2"},
+        ]
+        with pytest.raises(Exception):
+            ceph_crush.get_crush_hierarchy(locations, None)
+
+    @patch('ceph_crush.exec_commands_batch')
+    def test_exec_commands_first_failure(self, m_exec_commands_batch):
+        m_exec_commands_batch.return_value = [(0, ['a'], '', ''), (2, ['b'], '', 'ENOENT'),
+                                              (1, ['c'], '', 'EINVAL'), (0, ['d'], '', '')]
+        assert ceph_crush.exec_commands(None, [['a'], ['b'], ['c'], ['d']]) == (2, ['b'], '', 'ENOENT')
+        m_exec_commands_batch.return_value = [(0, ['a'], '', ''), (0, ['b'], 'done', '')]
+        assert ceph_crush.exec_commands(None, [['a'], ['b']]) == (0, ['b'], 'done', '')
+
+    def test_create_and_move_buckets_edits(self):
+        hierarchy = [
+            ("host", "host1", ("rack", "rack1")),
+            ("rack", "rack1", ("root", "default")),
+            ("root", "default", None),
+            ("host", "host2", ("rack", "rack1")),
+        ]
+        crush_map = {"nodes": [
+            {"id": -1, "name": "default", "type": "root", "children": [-2]},
+            {"id": -2, "name": "host1", "type": "host", "children": []},
+        ]}
+
+        result = ceph_crush.create_and_move_buckets_edits(hierarchy, crush_map)  # noqa: E501
+        assert result == [
+            ["--add-bucket", "rack1", "rack", "--loc", "root", "default"],
+            ["--move", "host1", "--loc", "rack", "rack1"],
+            ["--add-bucket", "host2", "host", "--loc", "rack", "rack1"],
+        ]
+
+    def test_generate_crushmap_script(self):
+        edits = [["--add-bucket", "rack1", "rack", "--loc", "root", "default"]]  # noqa: E501
+
+        script = ceph_crush.generate_crushmap_script("test", edits).split("\n")  # noqa: E501
+        assert script[6:] == [
+            'crushtool -i "$crushmap/map" --add-bucket rack1 rack --loc root default -o "$crushmap/map"',  # noqa: E501
+            'crushtool -i "$crushmap/map" --check',
+            'ceph --cluster test osd setcrushmap -i "$crushmap/map" "$version"',  # noqa: E501
+        ]
+
+    @pytest.mark.parametrize('stderr,rc,expected', [
+        ('42', 0, '42'),
+        ('2.0.0.1:0/1 monclient: warning\n42', 0, '42'),
+        ('got crush map from osdmap epoch 42', 0, '42'),
+        ('crush version unknown', 0, None),
+        ('', 0, None),
+        ('Error EACCES: access denied', 13, None),
+    ])
+    def test_generate_crushmap_script_version(self, tmp_path, stderr, rc, expected):  # noqa: E501
+        # the script only keeps the crush version printed on stderr
+        (tmp_path / 'stderr').write_text(stderr)
+        shims = {
+            'ceph': 'echo 7\n'
+                    'cat {0}/stderr >&2\n'
+                    'case "$*" in *setcrushmap*) echo "$@" > {0}/set;; *) exit {1};; esac'.format(tmp_path, rc),  # noqa: E501
+            'crushtool': 'exit 0',
+        }
+        for name, body in shims.items():
+            path = tmp_path / name
+            path.write_text('#!/bin/sh\n' + body + '\n')
+            path.chmod(0o755)
+        env = dict(os.environ, PATH='{}:{}'.format(tmp_path, os.environ['PATH']))  # noqa: E501
+        script = ceph_crush.generate_crushmap_script("ceph", [])
+        p = subprocess.run(['sh', '-c', script], env=env, stderr=subprocess.PIPE)  # noqa: E501
+        if expected is None:
+            assert p.returncode != 0
+            assert not (tmp_path / 'set').exists()
+        else:
+            assert p.returncode == 0
+            assert (tmp_path / 'set').read_text().split()[-1] == expected
@@ -2,6 +2,7 @@ import json
 import os
 import mock
 import pytest
+import time
 import ca_test_common
 import ceph_key
 import ceph_key_info
@@ -537,6 +538,80 @@ class TestCephKeyModule(object):
         result = ceph_key.build_key_path(fake_cluster, entity)
         assert result == expected_result
 
+    def test_generate_keyring(self):
+        entities = [('client.foo', 'AQAin8tUUK84ExAA/QgBtI7gEMWdmnvKBzlXdQ==', {'osd': 'allow rw', 'mon': 'allow r'}),  # noqa: E501
+                    ('client.bar', 'AQAin8tUMICVFBAALRHNrV0Z4MXupRw4v9JQ6Q==', {})]  # noqa: E501
+        expected_keyring = '[client.foo]\n' \
+                           '\tkey = AQAin8tUUK84ExAA/QgBtI7gEMWdmnvKBzlXdQ==\n' \
+                           '\tcaps mon = "allow r"\n' \
+                           '\tcaps osd = "allow rw"\n' \
+                           '[client.bar]\n' \
+                           '\tkey = AQAin8tUMICVFBAALRHNrV0Z4MXupRw4v9JQ6Q==\n'
+        keyring = ceph_key.generate_keyring(entities)
+        assert keyring == expected_keyring
+        assert ceph_key.parse_keyring(keyring) == {
+            'client.foo': {'key': entities[0][1], 'caps': entities[0][2]},
+            'client.bar': {'key': entities[1][1], 'caps': {}},
+        }
+
+    def test_build_key_dest(self, tmp_path):
+        assert ceph_key.build_key_dest('ceph', 'client.foo', str(tmp_path)) == str(tmp_path / 'ceph.client.foo.keyring')  # noqa: E501
+        assert ceph_key.build_key_dest('ceph', 'client.foo', '/etc/ceph/foo.keyring') == '/etc/ceph/foo.keyring'  # noqa: E501
+
+    def test_key_verified(self, tmp_path):
+        entity = {'key': 'AQAin8tUUK84ExAA/QgBtI7gEMWdmnvKBzlXdQ==', 'caps': {'mon': 'allow r'}}  # noqa: E501
+        with mock.patch.dict(os.environ, {'CEPH_KEY_TRUST': 'true', 'CEPH_READ_CACHE_DIR': str(tmp_path)}):  # noqa: E501
+            assert not ceph_key.is_key_verified('ceph', 'client.foo', entity)
+            ceph_key.record_key_verified('ceph', 'client.foo', entity)
+            assert ceph_key.is_key_verified('ceph', 'client.foo', entity)
+            assert not ceph_key.is_key_verified('ceph', 'client.foo', dict(entity, caps={'mon': 'allow *'}))  # noqa: E501
+            assert not ceph_key.is_key_verified('ceph', 'client.bar', entity)
+            # outlives the read cache ttl
+            with mock.patch('time.time', return_value=time.time() + ceph_key.KEY_TRUST_TTL - 60):  # noqa: E501
+                assert ceph_key.is_key_verified('ceph', 'client.foo', entity)
+            with mock.patch.dict(os.environ, {'CEPH_KEY_TRUST_TTL': '0'}):
+                assert not ceph_key.is_key_verified('ceph', 'client.foo', entity)  # noqa: E501
+        # the read cache doesn't enable it
+        with mock.patch.dict(os.environ, {'CEPH_READ_CACHE': 'true', 'CEPH_READ_CACHE_DIR': str(tmp_path)}):  # noqa: E501
+            assert not ceph_key.is_key_verified('ceph', 'client.foo', entity)
+        # the cache is disabled by default
+        assert not ceph_key.is_key_verified('ceph', 'client.foo', entity)
+
+    def test_key_matches(self):
+        entity = {'key': 'AQAin8tUUK84ExAA/QgBtI7gEMWdmnvKBzlXdQ==', 'caps': {'mon': 'allow r'}}  # noqa: E501
+        assert ceph_key.key_matches(entity, None, None)
+        assert ceph_key.key_matches(entity, entity['key'], {'mon': 'allow r'})
+        assert not ceph_key.key_matches(entity, None, {'mon': 'allow *'})
+        assert not ceph_key.key_matches(entity, 'AQAin8tUMICVFBAALRHNrV0Z4MXupRw4v9JQ6Q==', None)  # noqa: E501
+        assert not ceph_key.key_matches(None, None, None)
+
+    @mock.patch('ceph_key.exec_command')
+    @mock.patch('ceph_key.exec_commands')
+    def test_provision_keys(self, m_exec_commands, m_exec_command, tmp_path):
+        auth_dump = {'auth_dump': [{'entity': 'client.foo', 'key': 'AQAin8tUUK84ExAA/QgBtI7gEMWdmnvKBzlXdQ==',  # noqa: E501
+                                    'caps': {'mon': 'allow r'}}]}
+        m_exec_commands.return_value = (0, ['ceph', 'auth', 'ls'], json.dumps(auth_dump), '')  # noqa: E501
+        m_exec_command.return_value = (0, ['ceph', 'auth', 'import'], '', 'imported keyring')  # noqa: E501
+        module = mock.MagicMock(check_mode=False, params={})
+        module.set_fs_attributes_if_different.side_effect = lambda file_args, changed: changed  # noqa: E501
+        keys = [{'name': 'client.foo', 'caps': None, 'secret': None, 'dest': str(tmp_path)},  # noqa: E501
+                {'name': 'client.bar', 'caps': {'mon': 'allow r'}, 'secret': None, 'dest': str(tmp_path)}]  # noqa: E501
+
+        rc, cmd, out, err, changed, results = ceph_key.provision_keys(module, 'ceph', 'client.admin',  # noqa: E501
+                                                                      '/etc/ceph/ceph.client.admin.keyring',  # noqa: E501
+                                                                      keys, True)  # noqa: E501
+
+        assert rc == 0 and changed
+        # client.foo is up to date, only its keyring file is written
+        imported = ceph_key.parse_keyring(m_exec_command.call_args[1]['stdin'])  # noqa: E501
+        assert list(imported.keys()) == ['client.bar']
+        assert m_exec_command.call_args[0][1][-3:] == ['import', '-i', '-']
+        with open(str(tmp_path / 'ceph.client.foo.keyring')) as f:
+            assert ceph_key.parse_keyring(f.read()) == {'client.foo': {'key': 'AQAin8tUUK84ExAA/QgBtI7gEMWdmnvKBzlXdQ==', 'caps': {'mon': 'allow r'}}}  # noqa: E501
+        with open(str(tmp_path / 'ceph.client.bar.keyring')) as f:
+            assert ceph_key.parse_keyring(f.read()) == imported
+        assert [r['changed'] for r in results] == [True, True]
+
     @mock.patch('ansible.module_utils.basic.AnsibleModule.exit_json')
     @mock.patch('ceph_key_info.exec_commands')
     @pytest.mark.parametrize('output_format', ['json', 'plain', 'xml', 'yaml'])
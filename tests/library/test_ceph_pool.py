@@ -1,7 +1,8 @@
+import json
 import os
 import sys
 import ceph_pool
-from mock.mock import patch
+from mock.mock import MagicMock, patch
 import pytest
 
 sys.path.append('./library')
@@ -82,7 +83,7 @@ class TestCephPoolModule(object):
             'options': {},
             # 'target_size_ratio' is a key present in the dict above
             # 'options': {}
-            # see comment in get_pool_details() for more details
+            # see comment in get_running_pool_details() for more details
             'target_size_ratio': 0.3,
             'application_metadata': {
                 'rbd': {}
@@ -138,40 +139,6 @@ class TestCephPoolModule(object):
                 'cli_set_opt': 'pgp_num'
             }}
 
-    def test_check_pool_exist(self):
-        expected_command_list = [
-            'podman',
-            'run',
-            '--rm',
-            '--net=host',
-            '-v',
-            '/etc/ceph:/etc/ceph:z',
-            '-v',
-            '/var/lib/ceph/:/var/lib/ceph/:z',
-            '-v',
-            '/var/log/ceph/:/var/log/ceph/:z',
-            '--entrypoint=ceph',
-            fake_container_image_name,
-            '-n',
-            fake_user,
-            '-k',
-            fake_user_key,
-            '--cluster',
-            'ceph',
-            'osd',
-            'pool',
-            'stats',
-            self.fake_user_pool_config['pool_name']['value'],
-            '-f',
-            'json'
-            ]
-
-        cmd = ceph_pool.check_pool_exist(fake_cluster_name,
-                                         self.fake_user_pool_config['pool_name']['value'],
-                                         fake_user, fake_user_key, output_format='json',
-                                         container_image=fake_container_image_name)
-        assert cmd == expected_command_list
-
     def test_get_default_running_config(self):
         params = ['osd_pool_default_size',
                   'osd_pool_default_min_size',
@@ -212,78 +179,6 @@ class TestCephPoolModule(object):
                                                               container_image=fake_container_image_name))
         assert cmd_list == expected_command_list
 
-    def test_get_application_pool(self):
-        expected_command = [
-                'podman',
-                'run',
-                '--rm',
-                '--net=host',
-                '-v',
-                '/etc/ceph:/etc/ceph:z',
-                '-v',
-                '/var/lib/ceph/:/var/lib/ceph/:z',
-                '-v',
-                '/var/log/ceph/:/var/log/ceph/:z',
-                '--entrypoint=ceph',
-                fake_container_image_name,
-                '-n',
-                'client.admin',
-                '-k',
-                '/etc/ceph/ceph.client.admin.keyring',
-                '--cluster',
-                'ceph',
-                'osd',
-                'pool',
-                'application',
-                'get',
-                self.fake_user_pool_config['pool_name']['value'],
-                '-f',
-                'json'
-        ]
-
-        cmd = ceph_pool.get_application_pool(fake_cluster_name,
-                                             self.fake_user_pool_config['pool_name']['value'],
-                                             fake_user, fake_user_key, 'json',
-                                             container_image=fake_container_image_name)
-
-        assert cmd == expected_command
-
-    def test_get_crush_rule_pool(self):
-        expected_command = [
-                'podman',
-                'run',
-                '--rm',
-                '--net=host',
-                '-v',
-                '/etc/ceph:/etc/ceph:z',
-                '-v',
-                '/var/lib/ceph/:/var/lib/ceph/:z',
-                '-v',
-                '/var/log/ceph/:/var/log/ceph/:z',
-                '--entrypoint=ceph',
-                fake_container_image_name,
-                '-n',
-                'client.admin',
-                '-k',
-                '/etc/ceph/ceph.client.admin.keyring',
-                '--cluster',
-                'ceph',
-                'osd',
-                'pool',
-                'get',
-                self.fake_user_pool_config['pool_name']['value'],
-                'crush_rule',
-                '-f',
-                'json'
-        ]
-
-        cmd = ceph_pool.get_crush_rule_pool(fake_cluster_name,
-                                            self.fake_user_pool_config['pool_name']['value'],
-                                            fake_user, fake_user_key, 'json',
-                                            container_image=fake_container_image_name)
-
-        assert cmd == expected_command
-
     def test_enable_application_pool(self):
         expected_command = [
                 'podman',
@@ -761,3 +656,285 @@ class TestCephPoolModule(object):
                                     fake_user, fake_user_key, container_image=fake_container_image_name)
 
         assert cmd == expected_command
+
+    @patch('ceph_pool.exec_commands_batch')
+    def test_update_pool(self, m_exec_commands_batch):
+        delta = {
+            'size': {'cli_set_opt': 'size', 'value': '3'},
+            'application': {'new_application': 'rgw', 'old_application': 'rbd', 'value': 'rgw'},
+        }
+        m_exec_commands_batch.return_value = [(0, ['fake'], '', '')] * 3
+
+        rc, cmd, out, err = ceph_pool.update_pool(None, fake_cluster_name, fake_pool_name,
+                                                  fake_user, fake_user_key, delta)
+
+        cmd_list = m_exec_commands_batch.call_args[0][1]
+        assert [c[7:] for c in cmd_list] == [
+            ['osd', 'pool', 'set', fake_pool_name, 'size', '3'],
+            ['osd', 'pool', 'application', 'disable', fake_pool_name, 'rbd', '--yes-i-really-mean-it'],
+            ['osd', 'pool', 'application', 'enable', fake_pool_name, 'rgw'],
+        ]
+        assert rc == 0
+        assert out == '\nfoo has been updated: size is now 3\nfoo has been updated: application is now rgw'
+
+    def test_get_running_pool_details(self):
+        pool = dict(self.fake_running_pool_details, crush_rule=1,
+                    options={'target_size_ratio': 0.2})
+        del pool['application'], pool['target_size_ratio']
+
+        details = ceph_pool.get_running_pool_details(pool, {0: 'replicated_rule', 1: 'hdd'})  # noqa: E501
+
+        assert details['crush_rule'] == 'hdd'
+        assert details['application'] == 'rbd'
+        assert details['target_size_ratio'] == 0.2
+
+    @patch('ceph_pool.exec_read_command')
+    def test_pool_snapshot(self, m_exec_read_command):
+        pool = dict(self.fake_running_pool_details, crush_rule=1, options={})
+        m_exec_read_command.side_effect = [
+            (0, ['ceph'], json.dumps([pool, dict(pool, pool_name='bar')]), ''),  # noqa: E501
+            (0, ['ceph'], json.dumps([{'rule_id': 1, 'rule_name': 'hdd'}]), ''),  # noqa: E501
+        ]
+
+        snapshot = ceph_pool.PoolSnapshot(None, fake_cluster_name, fake_user, fake_user_key)  # noqa: E501
+        rc, cmd, out, err = snapshot.load()
+
+        assert rc == 0
+        assert m_exec_read_command.call_count == 2
+        assert 'foo2' in snapshot and 'bar' in snapshot
+        assert 'foo' not in snapshot
+        assert snapshot.details('foo2')['crush_rule'] == 'hdd'
+        assert snapshot.details('foo2')['application'] == 'rbd'
+
+    @patch('ceph_pool.exec_read_command')
+    def test_pool_snapshot_no_crush_rules(self, m_exec_read_command):
+        pool = dict(self.fake_running_pool_details, crush_rule=1, options={})
+        m_exec_read_command.return_value = (0, ['ceph'], json.dumps([pool]), '')  # noqa: E501
+
+        snapshot = ceph_pool.PoolSnapshot(None, fake_cluster_name, fake_user, fake_user_key)  # noqa: E501
+        snapshot.load(crush_rules=False)
+
+        assert m_exec_read_command.call_count == 1
+        assert snapshot.details('foo2')['crush_rule'] == 1
+
+    @patch('ceph_pool.exec_read_command')
+    def test_pool_snapshot_failure(self, m_exec_read_command):
+        m_exec_read_command.return_value = (1, ['ceph'], '', 'error')
+
+        snapshot = ceph_pool.PoolSnapshot(None, fake_cluster_name, fake_user, fake_user_key)  # noqa: E501
+        rc, cmd, out, err = snapshot.load(crush_rules=False)
+
+        assert (rc, err) == (1, 'error')
+        assert 'foo2' not in snapshot
+
+    @patch('ceph_pool.exec_commands_batch')
+    @patch('ceph_pool.exec_read_command')
+    def test_reconcile_pools(self, m_exec_read_command, m_exec_commands_batch):
+        running_pool = dict(self.fake_running_pool_details, pool_name='foo',
+                            crush_rule=0, options={})
+        m_exec_read_command.side_effect = [
+            (0, ['ceph'], json.dumps([running_pool, dict(running_pool, pool_name='bar', size=3)]), ''),  # noqa: E501
+            (0, ['ceph'], json.dumps([{'rule_id': 0, 'rule_name': 'replicated_rule'}]), ''),  # noqa: E501
+        ]
+        m_exec_commands_batch.side_effect = lambda module, cmd_list, stop_on_error: [(0, cmd, '', '') for cmd in cmd_list]  # noqa: E501
+        params = dict(pg_autoscale_mode='on', pool_type='replicated', size='3',
+                      erasure_profile='default', expected_num_objects='0',
+                      application='rbd')
+        pools = [dict(params, name=name) for name in ['foo', 'bar', 'baz']]
+        module = MagicMock(check_mode=False)
+
+        rc, cmd, out, err, changed, diff, results, plan = ceph_pool.reconcile_pools(module, fake_cluster_name,  # noqa: E501
+                                                                                    fake_user, fake_user_key,  # noqa: E501
+                                                                                    pools, 'present')  # noqa: E501
+
+        assert m_exec_commands_batch.call_count == 1
+        assert [entry['action'] for entry in plan] == ['update', 'none', 'create']
+        assert [r['changed'] for r in results] == [True, False, True]
+        assert [c[7:10] for c in cmd] == [
+            ['osd', 'pool', 'set'],
+            ['osd', 'pool', 'create'],
+            ['osd', 'pool', 'application'],
+            ['pool', 'init', 'baz'],
+        ]
+        assert results[0]['diff']['before'] == 'size: 2\n'
+        assert out == 'foo has been updated: size is now 3\nbaz has been created'  # noqa: E501
+        assert [d['before_header'] for d in diff] == ['foo', 'baz']
+        assert rc == 0 and changed
+
+    @patch('ceph_pool.exec_commands_batch')
+    @patch('ceph_pool.exec_read_command')
+    def test_reconcile_pools_check_mode(self, m_exec_read_command, m_exec_commands_batch):  # noqa: E501
+        m_exec_read_command.side_effect = [(0, ['ceph'], '[]', ''), (0, ['ceph'], '[]', '')]  # noqa: E501
+        module = MagicMock(check_mode=True)
+        pools = [dict(name='foo', pg_autoscale_mode='on', pool_type='replicated',  # noqa: E501
+                      erasure_profile='default', expected_num_objects='0')]
+
+        rc, cmd, out, err, changed, diff, results, plan = ceph_pool.reconcile_pools(module, fake_cluster_name,  # noqa: E501
+                                                                                    fake_user, fake_user_key,  # noqa: E501
+                                                                                    pools, 'present')  # noqa: E501
+
+        assert not m_exec_commands_batch.called
+        assert changed and results[0]['changed']
+
+    @patch('ceph_pool.exec_read_command')
+    def test_plan_pools(self, m_exec_read_command):
+        running_pool = dict(self.fake_running_pool_details, pool_name='foo',
+                            crush_rule=0, options={},
+                            application_metadata={'rgw': {}})
+        m_exec_read_command.return_value = (0, ['ceph'], json.dumps([running_pool, dict(running_pool, pool_name='bar', size=3, application_metadata={'rbd': {}})]), '')  # noqa: E501
+        params = dict(pg_autoscale_mode='on', pool_type='replicated', size='3',
+                      erasure_profile='default', expected_num_objects='0',
+                      application='rbd')
+        pools = [dict(params, name=name) for name in ['foo', 'bar', 'baz']]
+        module = MagicMock(check_mode=True, params={'pg_num_step': 0})
+
+        rc, cmd, out, err, plan = ceph_pool.plan_pools(module, fake_cluster_name,  # noqa: E501
+                                                       fake_user, fake_user_key,  # noqa: E501
+                                                       pools, 'present')
+
+        # the crush rules aren't needed
+        assert m_exec_read_command.call_count == 1
+        assert rc == 0
+        assert [entry['action'] for entry in plan] == ['update', 'none', 'create']  # noqa: E501
+        assert plan[0]['changes'] == [
+            {'key': 'size', 'option': 'size', 'from': 2, 'to': '3'},
+            {'key': 'application', 'from': 'rgw', 'to': 'rbd'},
+        ]
+        assert plan[2]['config']['application'] == 'rbd'
+
+        rc, cmd, out, err, plan = ceph_pool.plan_pools(module, fake_cluster_name,  # noqa: E501
+                                                       fake_user, fake_user_key,  # noqa: E501
+                                                       pools, 'absent')
+
+        assert [entry['action'] for entry in plan] == ['remove', 'remove', 'none']  # noqa: E501
+
+    @patch('ceph_pool.exec_commands_batch')
+    @patch('ceph_pool.exec_read_command')
+    def test_apply_pool_plan(self, m_exec_read_command, m_exec_commands_batch):  # noqa: E501
+        m_exec_commands_batch.side_effect = lambda module, cmd_list, stop_on_error: [(0, cmd, '', '') for cmd in cmd_list]  # noqa: E501
+        module = MagicMock(check_mode=False, params={'pg_num_step': 0})
+        plan = [
+            {'name': 'foo', 'action': 'update', 'changes': [
+                {'key': 'size', 'option': 'size', 'from': 2, 'to': '3'},
+                {'key': 'application', 'from': 'rgw', 'to': 'rbd'}]},
+            {'name': 'bar', 'action': 'none', 'changes': []},
+            {'name': 'baz', 'action': 'remove', 'changes': []},
+        ]
+
+        rc, cmd, out, err, changed, diff, results = ceph_pool.apply_pool_plan(module, fake_cluster_name,  # noqa: E501
+                                                                              fake_user, fake_user_key,  # noqa: E501
+                                                                              plan)  # noqa: E501
+
+        # the pools aren't read again
+        assert not m_exec_read_command.called
+        assert m_exec_commands_batch.call_count == 1
+        assert [c[7:11] for c in cmd] == [
+            ['osd', 'pool', 'set', 'foo'],
+            ['osd', 'pool', 'application', 'disable'],
+            ['osd', 'pool', 'application', 'enable'],
+            ['osd', 'pool', 'rm', 'baz'],
+        ]
+        assert diff[0]['before'] == 'size: 2\napplication: rgw\n'
+        assert diff[0]['after'] == 'size: 3\napplication: rbd\n'
+        assert diff[1]['after'] == 'state: absent\n'
+        assert [r['changed'] for r in results] == [True, False, True]
+        assert rc == 0 and changed
+
+    def test_next_pg_step(self):
+        assert ceph_pool.next_pg_step(32, 128, 64) == 96
+        assert ceph_pool.next_pg_step(96, 128, 64) == 128
+        assert ceph_pool.next_pg_step(128, 32, 64) == 64
+        assert ceph_pool.next_pg_step(64, 32, 64) == 32
+
+    @pytest.mark.parametrize('pgmap,expected', [
+        ({'pgs_by_state': [{'state_name': 'active+clean', 'count': 32}]}, True),  # noqa: E501
+        ({'misplaced_ratio': 0.01,
+          'pgs_by_state': [{'state_name': 'active+remapped+backfilling', 'count': 2}]}, True),  # noqa: E501
+        ({'misplaced_ratio': 0.2,
+          'pgs_by_state': [{'state_name': 'active+remapped+backfilling', 'count': 20}]}, False),  # noqa: E501
+        ({'pgs_by_state': [{'state_name': 'peering', 'count': 1}]}, False),
+    ])
+    def test_pg_migration_can_step(self, pgmap, expected):
+        assert ceph_pool.pg_migration_can_step({'pgmap': pgmap}, 0.05) == expected  # noqa: E501
+
+    def test_get_pg_migration(self):
+        details = dict(self.fake_running_pool_details, pg_autoscale_mode='off',
+                       pg_num_target=64, pg_placement_num_target=48)
+        config = dict(self.fake_user_pool_config, pg_num={'value': '256'},
+                      pgp_num={'value': None})
+
+        assert ceph_pool.get_pg_migration(config, details) == ((64, 48), (256, 256))  # noqa: E501
+        assert ceph_pool.get_pg_migration(config, dict(details, pg_autoscale_mode='on')) is None  # noqa: E501
+
+    @patch('ceph_pool.time.sleep')
+    @patch('ceph_pool.exec_commands_batch')
+    @patch('ceph_pool.exec_command')
+    def test_migrate_pg_num(self, m_exec_command, m_exec_commands_batch, m_sleep):  # noqa: E501
+        pool = {'pool_name': fake_pool_name, 'pg_num': 32, 'pg_num_target': 32,
+                'pg_placement_num': 32, 'pg_placement_num_target': 32}
+        pools = [
+            [pool],
+            # the first step isn't applied yet
+            [dict(pool, pg_num=64, pg_num_target=96, pg_placement_num=64, pg_placement_num_target=96)],  # noqa: E501
+            [dict(pool, pg_num=96, pg_num_target=96, pg_placement_num=96, pg_placement_num_target=96)],  # noqa: E501
+        ]
+
+        def exec_command(module, cmd):
+            if cmd[-4:-2] == ['ls', 'detail']:
+                return 0, cmd, json.dumps(pools.pop(0) if pools else [pool]), ''  # noqa: E501
+            return 0, cmd, json.dumps({'pgmap': {'pgs_by_state': []}}), ''
+        m_exec_command.side_effect = exec_command
+        m_exec_commands_batch.side_effect = lambda module, cmd_list: [(0, cmd, '', '') for cmd in cmd_list]  # noqa: E501
+        module = MagicMock(params={'pg_num_step': 64, 'max_misplaced_ratio': 0.05,
+                                   'pg_num_step_timeout': 60, 'pg_num_step_delay': 10})  # noqa: E501
+
+        rc, cmd, out, err, migration = ceph_pool.migrate_pg_num(module, fake_cluster_name, fake_pool_name,  # noqa: E501
+                                                                fake_user, fake_user_key, (32, 32), (160, 128))  # noqa: E501
+
+        assert rc == 0
+        assert migration['done'] and migration['steps'] == 2
+        assert [[c[-2:] for c in call[0][1]] for call in m_exec_commands_batch.call_args_list] == [  # noqa: E501
+            [['pg_num', '96'], ['pgp_num', '96']],
+            [['pg_num', '160'], ['pgp_num', '128']],
+        ]
+        # the first step waits the delay, then until ceph has applied it
+        assert [c[0][1][-3] for c in m_exec_command.call_args_list] == ['detail', 'status', 'detail', 'detail', 'status']  # noqa: E501
+        assert m_sleep.call_args_list == [((10,),), ((10,),)]
+        assert m_exec_command.call_args_list[2][0][1][-4:] == ['ls', 'detail', '-f', 'json']  # noqa: E501
+        assert out == 'foo has been updated: pg_num is now 96, pgp_num is now 96\n' \
+                      'foo has been updated: pg_num is now 160, pgp_num is now 128'
+
+    @patch('ceph_pool.exec_commands_batch')
+    @patch('ceph_pool.exec_command')
+    def test_migrate_pg_num_decrease(self, m_exec_command, m_exec_commands_batch):  # noqa: E501
+        m_exec_command.side_effect = lambda module, cmd: (0, cmd, '[]' if 'ls' in cmd else json.dumps({'pgmap': {'pgs_by_state': []}}), '')  # noqa: E501
+        m_exec_commands_batch.side_effect = lambda module, cmd_list: [(0, cmd, '', '') for cmd in cmd_list]  # noqa: E501
+        module = MagicMock(params={'pg_num_step': 64, 'max_misplaced_ratio': 0.05,
+                                   'pg_num_step_timeout': 0, 'pg_num_step_delay': 0})  # noqa: E501
+
+        rc, cmd, out, err, migration = ceph_pool.migrate_pg_num(module, fake_cluster_name, fake_pool_name,  # noqa: E501
+                                                                fake_user, fake_user_key, (128, 128), (64, 64))  # noqa: E501
+
+        # pgp_num goes down first
+        assert [c[-2:] for c in m_exec_commands_batch.call_args[0][1]] == [['pgp_num', '64'], ['pg_num', '64']]  # noqa: E501
+        assert migration['done']
+
+    @patch('ceph_pool.time.sleep')
+    @patch('ceph_pool.exec_commands_batch')
+    @patch('ceph_pool.exec_command')
+    def test_migrate_pg_num_paused(self, m_exec_command, m_exec_commands_batch, m_sleep):  # noqa: E501
+        clean = json.dumps({'pgmap': {'pgs_by_state': []}})
+        busy = json.dumps({'pgmap': {'misplaced_ratio': 0.3, 'pgs_by_state': []}})  # noqa: E501
+        m_exec_command.side_effect = [(0, ['ceph'], '[]', ''), (0, ['ceph'], clean, ''),
+                                      (0, ['ceph'], '[]', ''), (0, ['ceph'], busy, '')]
+        m_exec_commands_batch.side_effect = lambda module, cmd_list: [(0, cmd, '', '') for cmd in cmd_list]  # noqa: E501
+        module = MagicMock(params={'pg_num_step': 32, 'max_misplaced_ratio': 0.05,
+                                   'pg_num_step_timeout': 0, 'pg_num_step_delay': 5})  # noqa: E501
+
+        rc, cmd, out, err, migration = ceph_pool.migrate_pg_num(module, fake_cluster_name, fake_pool_name,  # noqa: E501
+                                                                fake_user, fake_user_key, (32, 32), (128, 128))  # noqa: E501
+
+        assert rc == 0
+        assert not migration['done']
+        assert (migration['steps'], migration['pg_num'], migration['pgp_num']) == (1, 64, 64)  # noqa: E501
+        assert 'paused at pg_num 64 pgp_num 64' in out
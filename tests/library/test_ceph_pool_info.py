@@ -0,0 +1,116 @@
+from mock.mock import patch
+import json
+import os
+import pytest
+import ca_test_common
+import ceph_pool_info
+
+fake_cluster = 'ceph'
+fake_pools = [
+    {'pool_id': 2, 'pool_name': 'images', 'type': 1, 'size': 3,
+     'min_size': 2, 'crush_rule': 0, 'pg_num': 32, 'pg_placement_num': 32,
+     'options': {}, 'application_metadata': {'rbd': {}}},
+    {'pool_id': 1, 'pool_name': 'volumes', 'type': 1, 'size': 3,
+     'min_size': 2, 'crush_rule': 1, 'pg_num': 64, 'pg_placement_num': 64,
+     'options': {'target_size_ratio': 0.2},
+     'application_metadata': {'rbd': {}}},
+    {'pool_id': 3, 'pool_name': 'default.rgw.buckets.data', 'type': 3,
+     'size': 6, 'min_size': 5, 'crush_rule': 2, 'pg_num': 128,
+     'pg_placement_num': 128, 'options': {},
+     'application_metadata': {'rgw': {}}},
+]
+fake_crush_rules = [
+    {'rule_id': 0, 'rule_name': 'replicated_rule'},
+    {'rule_id': 1, 'rule_name': 'ssd'},
+    {'rule_id': 2, 'rule_name': 'default.rgw.buckets.data'},
+]
+
+
+def fake_run_command(args, **kwargs):
+    if 'pool' in args:
+        return 0, json.dumps(fake_pools), ''
+    return 0, json.dumps(fake_crush_rules), ''
+
+
+def run_module(args):
+    ca_test_common.set_module_args(args)
+    with pytest.raises(ca_test_common.AnsibleExitJson) as result:
+        ceph_pool_info.main()
+    return result.value.args[0]
+
+
+@patch.dict(os.environ, {'CEPH_CONTAINER_BINARY': 'podman'})
+@patch('ansible.module_utils.basic.AnsibleModule.exit_json',
+       side_effect=ca_test_common.exit_json)
+@patch('ansible.module_utils.basic.AnsibleModule.run_command',
+       side_effect=fake_run_command)
+class TestCephPoolInfoModule(object):
+
+    def test_all_pools(self, m_run_command, m_exit_json):
+        result = run_module({})
+
+        assert not result['changed']
+        assert result['rc'] == 0
+        assert result['stdout'] == ''
+        assert result['total'] == 3
+        assert [p['pool_name'] for p in result['pools']] == ['volumes', 'images', 'default.rgw.buckets.data']  # noqa: E501
+        volumes = result['pools'][0]
+        assert volumes['crush_rule'] == 'ssd'
+        assert volumes['crush_rule_id'] == 1
+        assert volumes['pool_type'] == 'replicated'
+        assert volumes['application'] == 'rbd'
+        assert volumes['target_size_ratio'] == 0.2
+        assert m_run_command.call_count == 2
+
+    def test_filters(self, m_run_command, m_exit_json):
+        assert [p['pool_name'] for p in run_module({'application': 'rbd'})['pools']] == ['volumes', 'images']  # noqa: E501
+        assert [p['pool_name'] for p in run_module({'pool_type': 'erasure'})['pools']] == ['default.rgw.buckets.data']  # noqa: E501
+        assert [p['pool_name'] for p in run_module({'rule_name': 'ssd'})['pools']] == ['volumes']  # noqa: E501
+        assert [p['pool_name'] for p in run_module({'name': 'default.rgw.*'})['pools']] == ['default.rgw.buckets.data']  # noqa: E501
+        assert run_module({'name': 'foo*'})['pools'] == []
+
+    def test_fields(self, m_run_command, m_exit_json):
+        result = run_module({'fields': ['size', 'pg_num']})
+
+        assert result['pools'][0] == {'pool_name': 'volumes', 'size': 3, 'pg_num': 64}  # noqa: E501
+        # the crush rule names are not needed
+        assert m_run_command.call_count == 1
+
+    def test_pagination(self, m_run_command, m_exit_json):
+        result = run_module({'offset': 1, 'limit': 1, 'fields': ['pg_num']})
+
+        assert result['total'] == 3
+        assert result['offset'] == 1
+        assert result['pools'] == [{'pool_name': 'images', 'pg_num': 32}]
+
+    def test_summary(self, m_run_command, m_exit_json):
+        result = run_module({'summary': True})
+
+        assert 'pools' not in result
+        assert result['summary'] == {
+            'pools': 3,
+            'pg_num': 224,
+            'by_application': {'rbd': 2, 'rgw': 1},
+            'by_type': {'replicated': 2, 'erasure': 1},
+            'by_crush_rule': {'replicated_rule': 1, 'ssd': 1,
+                              'default.rgw.buckets.data': 1},
+        }
+
+    def test_failure(self, m_run_command, m_exit_json):
+        m_run_command.side_effect = None
+        m_run_command.return_value = 2, '', 'error'
+
+        result = run_module({'fields': ['size']})
+
+        assert result['rc'] == 2
+        assert result['stderr'] == 'error'
+        assert 'pools' not in result
+
+    def test_with_check_mode(self, m_run_command, m_exit_json):
+        result = run_module({'_ansible_check_mode': True})
+
+        # the pools are only read, check mode returns them as well
+        assert not result['changed']
+        assert result['rc'] == 0
+        assert result['total'] == 3
+        assert [p['pool_name'] for p in result['pools']] == ['volumes', 'images', 'default.rgw.buckets.data']  # noqa: E501
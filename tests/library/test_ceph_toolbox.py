@@ -0,0 +1,103 @@
+from mock.mock import MagicMock, patch
+import os
+import pytest
+import ca_test_common
+import ceph_toolbox
+
+fake_container_binary = 'podman'
+fake_container_image = 'quay.io/ceph/daemon:latest'
+
+
+@patch.dict(os.environ, {'CEPH_CONTAINER_BINARY': fake_container_binary,
+                         'CEPH_CONTAINER_IMAGE': fake_container_image})
+@patch('time.time', MagicMock(return_value=1000))
+class TestCephToolboxModule(object):
+
+    @patch('ansible.module_utils.basic.AnsibleModule.exit_json')
+    @patch('ansible.module_utils.basic.AnsibleModule.run_command')
+    def test_state_present_already_running(self, m_run_command, m_exit_json):
+        ca_test_common.set_module_args({})
+        m_exit_json.side_effect = ca_test_common.exit_json
+        name = ceph_toolbox.toolbox_name(fake_container_image, 4600)
+        m_run_command.return_value = 0, name, ''
+
+        with pytest.raises(ca_test_common.AnsibleExitJson) as result:
+            ceph_toolbox.main()
+
+        result = result.value.args[0]
+        assert not result['changed']
+        assert result['rc'] == 0
+        assert result['stdout'] == name
+
+    @patch('ansible.module_utils.basic.AnsibleModule.exit_json')
+    @patch('ansible.module_utils.basic.AnsibleModule.run_command')
+    def test_state_present(self, m_run_command, m_exit_json):
+        ca_test_common.set_module_args({})
+        m_exit_json.side_effect = ca_test_common.exit_json
+        m_run_command.side_effect = [
+            (0, '', ''),
+            (0, '', ''),
+            (0, 'abc', ''),
+        ]
+
+        with pytest.raises(ca_test_common.AnsibleExitJson) as result:
+            ceph_toolbox.main()
+
+        result = result.value.args[0]
+        assert result['changed']
+        assert result['rc'] == 0
+        assert m_run_command.call_args_list[-1][0][0][:2] == [fake_container_binary, 'run']
+
+    @patch('ansible.module_utils.basic.AnsibleModule.exit_json')
+    @patch('ansible.module_utils.basic.AnsibleModule.run_command')
+    def test_state_present_expiring(self, m_run_command, m_exit_json):
+        ca_test_common.set_module_args({})
+        m_exit_json.side_effect = ca_test_common.exit_json
+        expiring = ceph_toolbox.toolbox_name(fake_container_image, 1100)
+        m_run_command.side_effect = [
+            (0, expiring, ''),
+            (0, expiring, ''),
+            (0, 'abc', ''),
+        ]
+
+        with pytest.raises(ca_test_common.AnsibleExitJson) as result:
+            ceph_toolbox.main()
+
+        # the expiring toolbox is replaced, not removed
+        result = result.value.args[0]
+        assert result['changed']
+        assert result['stdout'] == ceph_toolbox.toolbox_name(fake_container_image, 4600)
+        assert [c[0][0][1] for c in m_run_command.call_args_list] == ['ps', 'ps', 'run']
+
+    @patch('ansible.module_utils.basic.AnsibleModule.exit_json')
+    @patch('ansible.module_utils.basic.AnsibleModule.run_command')
+    def test_state_absent(self, m_run_command, m_exit_json):
+        ca_test_common.set_module_args({'state': 'absent'})
+        m_exit_json.side_effect = ca_test_common.exit_json
+        name = ceph_toolbox.toolbox_name(fake_container_image, 4600)
+        m_run_command.side_effect = [
+            (0, name, ''),
+            (0, name, ''),
+            (0, '', ''),
+        ]
+
+        with pytest.raises(ca_test_common.AnsibleExitJson) as result:
+            ceph_toolbox.main()
+
+        result = result.value.args[0]
+        assert result['changed']
+        assert result['cmd'] == [fake_container_binary, 'rm', '--force', name]
+
+    @patch('ansible.module_utils.basic.AnsibleModule.exit_json')
+    @patch('ansible.module_utils.basic.AnsibleModule.run_command')
+    def test_state_absent_not_running(self, m_run_command, m_exit_json):
+        ca_test_common.set_module_args({'state': 'absent'})
+        m_exit_json.side_effect = ca_test_common.exit_json
+        m_run_command.return_value = 0, '', ''
+
+        with pytest.raises(ca_test_common.AnsibleExitJson) as result:
+            ceph_toolbox.main()
+
+        result = result.value.args[0]
+        assert not result['changed']
+        assert result['rc'] == 0
@@ -1,4 +1,5 @@
 import sys
+import json
 import mock
 import os
 import pytest
@@ -141,6 +142,124 @@ class TestCephVolumeModule(object):
         result = ceph_volume.zap_devices(fake_module, fake_container_image)
         assert result == expected_command_list
 
+    def test_get_lvs(self):
+        fake_module = MagicMock()
+        report = {'report': [{'lv': [
+            {'lv_name': 'data-lv1', 'vg_name': 'data-vg', 'lv_tags': 'ceph.osd_id=0', 'devices': '/dev/sdb(0)'},
+            {'lv_name': 'data-lv1', 'vg_name': 'data-vg', 'lv_tags': 'ceph.osd_id=0', 'devices': '/dev/sdc(0)'},
+            {'lv_name': 'db-lv1', 'vg_name': 'db-vg', 'lv_tags': '', 'devices': '/dev/sdd(0),/dev/sde(0)'},
+        ]}]}
+        fake_module.run_command.return_value = 0, json.dumps(report), ''
+        lvs = ceph_volume.get_lvs(fake_module, None)
+
+        assert fake_module.run_command.call_args[0][0] == ['lvs', '--noheadings', '--reportformat', 'json',
+                                                           '-o', 'lv_name,vg_name,lv_tags,devices']
+        assert sorted(lvs) == ['data-vg/data-lv1', 'db-vg/db-lv1']
+        assert lvs['data-vg/data-lv1']['devices'] == ['/dev/sdb', '/dev/sdc']
+        assert lvs['db-vg/db-lv1']['devices'] == ['/dev/sdd', '/dev/sde']
+        assert ceph_volume.is_lv(fake_module, 'db-vg', 'db-lv1', None, lvs=lvs)
+        assert not ceph_volume.is_lv(fake_module, 'db-vg', 'wal-lv1', None, lvs=lvs)
+        assert fake_module.run_command.call_count == 1
+
+    @patch('ansible.module_utils.basic.AnsibleModule.exit_json')
+    @patch('ansible.module_utils.basic.AnsibleModule.run_command')
+    def test_zap_lvs(self, m_run_command, m_exit_json):
+        ca_test_common.set_module_args({'action': 'zap', 'data': 'data-lv1', 'data_vg': 'data-vg',
+                                        'db': 'db-lv1', 'db_vg': 'db-vg', 'wal': 'wal-lv1', 'wal_vg': 'wal-vg'})
+        m_exit_json.side_effect = ca_test_common.exit_json
+        report = {'report': [{'lv': [
+            {'lv_name': 'data-lv1', 'vg_name': 'data-vg', 'lv_tags': '', 'devices': '/dev/sdb(0)'},
+            {'lv_name': 'db-lv1', 'vg_name': 'db-vg', 'lv_tags': '', 'devices': '/dev/sdc(0)'},
+        ]}]}
+        m_run_command.side_effect = [(0, json.dumps(report), ''), (0, '', ''), (0, '', '')]
+
+        with pytest.raises(ca_test_common.AnsibleExitJson) as result:
+            ceph_volume.main()
+
+        # one lvs report for all the checks, one zap and one rescan
+        assert [c[0][0][0] for c in m_run_command.call_args_list] == ['lvs', 'ceph-volume', 'vgscan']
+        assert result.value.args[0]['cmd'] == ['ceph-volume', '--cluster', 'ceph', 'lvm', 'zap', '--destroy',
+                                               'data-vg/data-lv1', 'db-vg/db-lv1']
+
+    def test_get_volume(self):
+        assert ceph_volume.get_volume({'data': 'data-lv1', 'data_vg': 'data-vg'}) == {'data': 'data-lv1', 'data_vg': 'data-vg'}
+        assert ceph_volume.get_volume('/dev/sda') == {'data': '/dev/sda'}
+        assert ceph_volume.get_volume(3) == {'osd_id': '3'}
+        assert ceph_volume.get_volume('2E3E7BBD-59A6-4AA0-A39F-08A7A5B5B0C9') == {'osd_fsid': '2E3E7BBD-59A6-4AA0-A39F-08A7A5B5B0C9'}
+
+    def test_group_zap_targets(self):
+        resources = [
+            {('disk', '/dev/sda')},
+            {('vg', 'vg1'), ('disk', '/dev/sdb')},
+            set(),
+            {('disk', '/dev/sdc')},
+            {('vg', 'vg1'), ('disk', '/dev/sdc')},
+        ]
+        assert ceph_volume.group_zap_targets(resources) == [[0], [1, 3, 4], [2]]
+
+    def test_get_zap_resources(self, tmpdir, monkeypatch):
+        sys_block = tmpdir.join('block')
+        sys_block.join('sdd', 'sdd1').ensure(dir=True)
+        sys_block.join('sdd', 'sdd2').ensure(dir=True)
+        monkeypatch.setattr(ceph_volume, 'SYS_BLOCK_DIR', str(sys_block))
+        lvs = {
+            'vg1/lv1': {'vg_name': 'vg1', 'lv_tags': 'ceph.osd_fsid=a_uuid,ceph.osd_id=0', 'devices': ['/dev/sdb']},
+            'vg1/lv2': {'vg_name': 'vg1', 'lv_tags': '', 'devices': ['/dev/sdc']},
+            'vg2/lv1': {'vg_name': 'vg2', 'lv_tags': 'ceph.osd_id=1', 'devices': ['/dev/sdd1']},
+        }
+
+        def resources(**volume):
+            return ceph_volume.get_zap_resources(ceph_volume.get_zap_params(MagicMock(params={}), volume), lvs)
+
+        assert resources(data='lv1', data_vg='vg1') == {('vg', 'vg1'), ('disk', '/dev/sdb')}
+        assert resources(data='/dev/vg1/lv2') == {('vg', 'vg1'), ('disk', '/dev/sdc')}
+        assert resources(osd_id=1) == {('vg', 'vg2'), ('disk', '/dev/sdd')}
+        assert resources(osd_fsid='a_uuid') == {('vg', 'vg1'), ('disk', '/dev/sdb')}
+        # another partition of the disk of an lv
+        assert resources(data='/dev/sdd2') == {('vg', 'vg2'), ('disk', '/dev/sdd')}
+        assert resources(data='/dev/sde') == {('disk', '/dev/sde')}
+
+    @patch('ansible.module_utils.basic.AnsibleModule.fail_json')
+    @patch('ansible.module_utils.basic.AnsibleModule.run_command')
+    def test_zap_lvm_volumes(self, m_run_command, m_fail_json):
+        ca_test_common.set_module_args({'action': 'zap', 'workers': 4, 'lvm_volumes': [
+            '/dev/sda', {'data': 'data-lv1', 'data_vg': 'data-vg'}, {'data': 'data-lv2', 'data_vg': 'data-vg'},
+            {'data': 'gone-lv', 'data_vg': 'data-vg'}, 0, '/dev/sda']})
+        m_fail_json.side_effect = ca_test_common.fail_json
+        report = {'report': [{'lv': [
+            {'lv_name': 'data-lv1', 'vg_name': 'data-vg', 'lv_tags': '', 'devices': '/dev/sdb(0)'},
+            {'lv_name': 'data-lv2', 'vg_name': 'data-vg', 'lv_tags': '', 'devices': '/dev/sdc(0)'},
+            {'lv_name': 'osd-lv0', 'vg_name': 'osd-vg', 'lv_tags': 'ceph.osd_id=0', 'devices': '/dev/sdd(0)'},
+        ]}]}
+
+        def run_command(cmd, **kwargs):
+            if cmd[0] == 'lvs':
+                return 0, json.dumps(report), ''
+            if cmd[-1] == 'data-vg/data-lv2':
+                return 1, '', 'busy'
+            return 0, '', ''
+        m_run_command.side_effect = run_command
+
+        with pytest.raises(ca_test_common.AnsibleFailJson) as result:
+            ceph_volume.main()
+
+        result = result.value.args[0]
+        assert result['changed']
+        assert result['rc'] == 1
+        assert result['stderr'] == 'data-vg/data-lv2: busy'
+        volumes = result['volumes']
+        assert [v['target'] for v in volumes] == ['/dev/sda', 'data-vg/data-lv1', 'data-vg/data-lv2', 'data-vg/gone-lv', 'osd.0', '/dev/sda']
+        assert [v['changed'] for v in volumes] == [True, True, True, False, True, False]
+        assert [v['rc'] for v in volumes] == [0, 0, 1, 0, 0, 0]
+        assert volumes[4]['cmd'] == ['ceph-volume', '--cluster', 'ceph', 'lvm', 'zap', '--destroy', '--osd-id', '0']
+        assert volumes[3]['stdout'] == 'Skipped, nothing to zap'
+        cmds = [c[0][0] for c in m_run_command.call_args_list]
+        assert cmds[0][0] == 'lvs'
+        assert cmds[-1] == ['vgscan', '--cache']
+        assert len(cmds) == 6
+        # the lvs of data-vg are zapped one after the other
+        assert cmds.index(volumes[1]['cmd']) < cmds.index(volumes[2]['cmd'])
+
     def test_activate_osd(self):
         expected_command_list = ['ceph-volume',
                                  '--cluster',
@@ -478,3 +597,232 @@ class TestCephVolumeModule(object):
         assert keyring not in result['stderr']
         assert '*' * 8 in result['stderr']
         assert not result['stdout']
+
+    def test_get_batch_plan(self):
+        plan = [{'data': '/dev/sda', 'data_size': '50.00 GB', 'encryption': 'None'}]
+        assert ceph_volume.get_batch_plan(plan) == plan
+        assert ceph_volume.get_batch_plan({'osds': plan, 'vgs': []}) == plan
+        assert ceph_volume.get_batch_plan({}) == []
+        assert ceph_volume.get_batch_plan({'changed': True, 'osds': plan}) is None
+
+    @patch('ansible.module_utils.basic.AnsibleModule.exit_json')
+    @patch('ansible.module_utils.basic.AnsibleModule.run_command')
+    def test_batch_nothing_planned(self, m_run_command, m_exit_json):
+        ca_test_common.set_module_args({'batch_devices': ['/dev/sda'],
+                                        'action': 'batch'})
+        m_exit_json.side_effect = ca_test_common.exit_json
+        m_run_command.return_value = 0, '[]', ''
+
+        with pytest.raises(ca_test_common.AnsibleExitJson) as result:
+            ceph_volume.main()
+
+        result = result.value.args[0]
+        # the batch isn't run when the report plans no osd
+        assert m_run_command.call_count == 1
+        assert not result['changed']
+        assert result['plan'] == []
+        assert result['cmd'][-2:] == ['--report', '--format=json']
+
+    def test_get_osd_devices(self):
+        osds = {'0': [{'vg_name': 'ceph-vg', 'lv_name': 'osd-block-0',
+                       'lv_path': '/dev/ceph-vg/osd-block-0',
+                       'devices': ['/dev/sda'], 'type': 'block'}],
+                '1': [{'vg_name': 'data-vg', 'lv_name': 'data-lv1',
+                       'lv_path': '/dev/data-vg/data-lv1',
+                       'devices': ['/dev/sdb'], 'type': 'block'}]}
+        result = ceph_volume.get_osd_devices(osds)
+        assert result == set(['ceph-vg/osd-block-0', '/dev/ceph-vg/osd-block-0',
+                              '/dev/sda', 'data-vg/data-lv1',
+                              '/dev/data-vg/data-lv1', '/dev/sdb'])
+
+    def test_get_osd_devices_symlinks(self, tmpdir):
+        # /dev/mapper/vg-lv and /dev/vg/lv both point to the dm device,
+        # /dev/disk/by-id/... to the disk
+        tmpdir.join('dm-0').write('')
+        tmpdir.join('sdb').write('')
+        tmpdir.join('data-vg-data--lv1').mksymlinkto(tmpdir.join('dm-0'))
+        tmpdir.join('data-lv1').mksymlinkto(tmpdir.join('dm-0'))
+        tmpdir.join('wwn-0x5000c500a1b2c3d4').mksymlinkto(tmpdir.join('sdb'))
+        osds = {'1': [{'vg_name': 'data-vg', 'lv_name': 'data-lv1',
+                       'lv_path': str(tmpdir.join('data-lv1')),
+                       'devices': [str(tmpdir.join('sdb'))], 'type': 'block'}]}
+        used = ceph_volume.get_osd_devices(osds)
+        assert str(tmpdir.join('dm-0')) in used
+        assert ceph_volume.resolve_device(str(tmpdir.join('data-vg-data--lv1'))) in used
+        assert ceph_volume.resolve_device(str(tmpdir.join('wwn-0x5000c500a1b2c3d4'))) in used
+        assert ceph_volume.resolve_device('data-vg/data-lv1') == 'data-vg/data-lv1'
+
+    def test_get_volume_params(self):
+        fake_module = MagicMock()
+        fake_module.params = {'cluster': 'ceph', 'objectstore': 'bluestore',
+                              'crush_device_class': 'hdd', 'data': None}
+        params = ceph_volume.get_volume_params(fake_module, {'data': 'data-lv1', 'data_vg': 'data-vg', 'journal': '/dev/sdc'})
+        assert params['data'] == 'data-lv1'
+        assert params['data_vg'] == 'data-vg'
+        assert params['db'] is None
+        assert params['crush_device_class'] == 'hdd'
+        assert 'journal' not in params
+        params = ceph_volume.get_volume_params(fake_module, {'data': '/dev/sdb', 'crush_device_class': 'ssd'})
+        assert params['crush_device_class'] == 'ssd'
+
+    @patch('ansible.module_utils.basic.AnsibleModule.exit_json')
+    @patch('ansible.module_utils.basic.AnsibleModule.run_command')
+    def test_prepare_lvm_volumes(self, m_run_command, m_exit_json):
+        ca_test_common.set_module_args({'lvm_volumes': [{'data': '/dev/sda'},
+                                                        {'data': 'data-lv1', 'data_vg': 'data-vg'},
+                                                        {'data': '/dev/sdc', 'db': 'db-lv1', 'db_vg': 'db-vg'}],
+                                        'workers': 2,
+                                        'action': 'prepare'})
+        keyring = 'AQBqkhNhQDlqEhAAXKxu87L3Mh3mHY+agonKZA=='
+        m_exit_json.side_effect = ca_test_common.exit_json
+        osds = '{"0": [{"vg_name": "data-vg", "lv_name": "data-lv1", "lv_path": "/dev/data-vg/data-lv1", "devices": ["/dev/sdb"]}]}'
+
+        def run_command(args, **kwargs):
+            if 'list' in args:
+                return 0, osds, ''
+            data = args[args.index('--data') + 1]
+            if data == '/dev/sdc':
+                return 1, '', ' stderr: added entity osd.2 auth(key={})\n-->  RuntimeError: failed'.format(keyring)
+            return 0, '', 'added entity osd.1 auth(key={})'.format(keyring)
+
+        m_run_command.side_effect = run_command
+        m_fail_json = patch('ansible.module_utils.basic.AnsibleModule.fail_json', side_effect=ca_test_common.fail_json)
+
+        with m_fail_json, pytest.raises(ca_test_common.AnsibleFailJson) as result:
+            ceph_volume.main()
+
+        result = result.value.args[0]
+        # a single listing, then one prepare per unused volume
+        assert m_run_command.call_count == 3
+        assert result['changed']
+        assert result['rc'] == 1
+        assert keyring not in str(result)
+        volumes = result['volumes']
+        assert [v['data'] for v in volumes] == ['/dev/sda', 'data-vg/data-lv1', '/dev/sdc']
+        assert [v['changed'] for v in volumes] == [True, False, True]
+        assert [v['rc'] for v in volumes] == [0, 0, 1]
+        assert volumes[0]['cmd'] == ['ceph-volume', '--cluster', 'ceph', 'lvm', 'prepare', '--bluestore', '--data', '/dev/sda']
+        assert volumes[1]['stdout'] == 'skipped, since data-vg/data-lv1 is already used for an osd'
+        assert volumes[2]['cmd'][-2:] == ['--block.db', 'db-vg/db-lv1']
+        assert '*' * 8 in volumes[2]['stderr']
+
+    @patch('ansible.module_utils.basic.AnsibleModule.exit_json')
+    @patch('ansible.module_utils.basic.AnsibleModule.run_command')
+    def test_prepare_lvm_volumes_symlink(self, m_run_command, m_exit_json, tmpdir):
+        tmpdir.join('sdb').write('')
+        tmpdir.join('wwn-0x5000c500a1b2c3d4').mksymlinkto(tmpdir.join('sdb'))
+        ca_test_common.set_module_args({'lvm_volumes': [{'data': str(tmpdir.join('wwn-0x5000c500a1b2c3d4'))}],
+                                        'action': 'prepare'})
+        m_exit_json.side_effect = ca_test_common.exit_json
+        osds = {'0': [{'vg_name': 'ceph-vg', 'lv_name': 'osd-block-0', 'lv_path': '/dev/ceph-vg/osd-block-0',
+                       'devices': [str(tmpdir.join('sdb'))]}]}
+        m_run_command.return_value = 0, json.dumps(osds), ''
+
+        with pytest.raises(ca_test_common.AnsibleExitJson) as result:
+            ceph_volume.main()
+
+        result = result.value.args[0]
+        # the OSD is found on the device the by-id link points to
+        assert m_run_command.call_count == 1
+        assert not result['changed']
+        assert result['volumes'][0]['stdout'].startswith('skipped')
+
+
+def make_block_device(sys_block, udev_data, name, dev, size, partitions=()):
+    path = sys_block.join(name)
+    path.join('size').write(size, ensure=True)
+    path.join('dev').write(dev)
+    path.join('device', 'wwid').write('naa.5000c500a1b2c3d4', ensure=True)
+    path.join('holders').ensure(dir=True)
+    udev_data.join('b' + dev).write('E:ID_PART_TABLE_TYPE=gpt\n', ensure=True)
+    for part, part_dev in partitions:
+        path.join(part, 'partition').write('1', ensure=True)
+        path.join(part, 'size').write('2048')
+        path.join(part, 'dev').write(part_dev)
+        path.join(part, 'holders').ensure(dir=True)
+        udev_data.join('b' + part_dev).write('E:ID_PART_ENTRY_NUMBER=1\n')
+    return path
+
+
+class TestCephVolumeInventoryCache(object):
+
+    @pytest.fixture(autouse=True)
+    def sysfs(self, tmpdir, monkeypatch):
+        self.sys_block = tmpdir.join('sys', 'block').ensure(dir=True)
+        self.udev_data = tmpdir.join('udev').ensure(dir=True)
+        monkeypatch.setattr(ceph_volume, 'SYS_BLOCK_DIR', str(self.sys_block))
+        monkeypatch.setattr(ceph_volume, 'UDEV_DATA_DIR', str(self.udev_data))
+        monkeypatch.setenv('CEPH_READ_CACHE', 'true')
+        monkeypatch.setenv('CEPH_READ_CACHE_DIR', str(tmpdir.join('cache')))
+        self.sda = make_block_device(self.sys_block, self.udev_data, 'sda', '8:0', '4096', [('sda1', '8:1')])
+
+    def test_get_device_identity(self):
+        identity = ceph_volume.get_device_identity('sda')
+        assert identity['wwid'] == 'naa.5000c500a1b2c3d4'
+        assert identity['size'] == '4096'
+        assert identity['partitions'] == [('sda1', '2048')]
+        assert identity['holders'] == [[], []]
+        assert None not in identity['events']
+
+    def test_get_inventory_fingerprint(self):
+        fingerprint = ceph_volume.get_inventory_fingerprint()
+        assert ceph_volume.get_inventory_fingerprint() == fingerprint
+        # an lv created on the partition
+        self.sda.join('sda1', 'holders', 'dm-0').ensure()
+        assert ceph_volume.get_inventory_fingerprint() != fingerprint
+        fingerprint = ceph_volume.get_inventory_fingerprint()
+        # a udev event of the disk
+        path = self.udev_data.join('b8:0')
+        path.setmtime(path.mtime() + 10)
+        assert ceph_volume.get_inventory_fingerprint() != fingerprint
+
+    @patch('ansible.module_utils.basic.AnsibleModule.exit_json')
+    @patch('ansible.module_utils.basic.AnsibleModule.run_command')
+    def test_inventory_cache(self, m_run_command, m_exit_json):
+        m_exit_json.side_effect = ca_test_common.exit_json
+        m_run_command.return_value = 0, '[{"path": "/dev/sda", "available": true}]', ''
+
+        def run(args):
+            ca_test_common.set_module_args(args)
+            with pytest.raises(ca_test_common.AnsibleExitJson) as result:
+                ceph_volume.main()
+            return result.value.args[0]
+
+        for _ in range(2):
+            result = run({'action': 'inventory'})
+            assert result['stdout'] == '[{"path": "/dev/sda", "available": true}]'
+        assert m_run_command.call_count == 1
+
+        self.sda.join('size').write('8192')
+        run({'action': 'inventory'})
+        assert m_run_command.call_count == 2
+
+        # zapping a device drops the cache
+        m_run_command.return_value = 0, '', ''
+        run({'action': 'zap', 'data': '/dev/sda'})
+        m_run_command.return_value = 0, '[]', ''
+        assert run({'action': 'inventory'})['stdout'] == '[]'
+
+    @patch('ansible.module_utils.basic.AnsibleModule.exit_json')
+    @patch('ansible.module_utils.basic.AnsibleModule.run_command')
+    def test_batch_report_cache(self, m_run_command, m_exit_json):
+        m_exit_json.side_effect = ca_test_common.exit_json
+        plan = '[{"data": "/dev/sda", "data_size": "4.00 KB", "encryption": "None"}]'
+        m_run_command.return_value = 0, plan, ''
+
+        def run(args):
+            ca_test_common.set_module_args(dict(args, batch_devices=['/dev/sda'], action='batch'))
+            with pytest.raises(ca_test_common.AnsibleExitJson) as result:
+                ceph_volume.main()
+            return result.value.args[0]
+
+        # the report counting the osds to create is reused by the batch
+        assert run({'report': True})['plan'] == [{'data': '/dev/sda', 'data_size': '4.00 KB', 'encryption': 'None'}]
+        result = run({})
+        assert result['changed']
+        assert [c[0][0][-1] for c in m_run_command.call_args_list] == ['--format=json', '/dev/sda']
+
+        # the devices were changed by the batch, they're planned again
+        m_run_command.return_value = 0, '[]', ''
+        assert not run({})['changed']
+        assert m_run_command.call_count == 3
@@ -0,0 +1,387 @@
+from mock.mock import patch
+import os
+import sys
+import pytest
+import ca_test_common
+import ceph_config
+import ceph_crush
+import ceph_key
+import ceph_mgr_module
+import ceph_osd_flag
+import ceph_pool
+import ceph_volume
+import radosgw_user
+from fake_cluster import FakeCluster
+
+
+@pytest.fixture
+def cluster():
+    fake_cluster = FakeCluster()
+    env = dict((k, v) for k, v in os.environ.items()
+               if not k.startswith('CEPH_CONTAINER'))
+    with patch.dict(os.environ, env, clear=True), \
+            patch('ansible.module_utils.basic.AnsibleModule.run_command',
+                  side_effect=fake_cluster.run_command), \
+            patch('ansible.module_utils.basic.AnsibleModule.exit_json',
+                  side_effect=ca_test_common.exit_json), \
+            patch('ansible.module_utils.basic.AnsibleModule.fail_json',
+                  side_effect=ca_test_common.fail_json):
+        yield fake_cluster
+    fake_cluster.close()
+
+
+def run(module, args):
+    ca_test_common.set_module_args(args)
+    with pytest.raises((ca_test_common.AnsibleExitJson,
+                        ca_test_common.AnsibleFailJson)) as result:
+        module.main()
+    return result.value.args[0]
+
+
+class TestFakeCluster(object):
+
+    def test_run_command(self, cluster):
+        rc, out, err = cluster.run_command(['ceph', 'osd', 'pool', 'get', 'foo', 'size'])  # noqa: E501
+        assert rc == 2
+        assert err == "Error ENOENT: unrecognized pool 'foo'\n"
+
+        rc, out, err = cluster.run_command(['podman', 'run', '--rm', '--net=host',  # noqa: E501
+                                            '-v', '/etc/ceph:/etc/ceph:z',
+                                            '--entrypoint=ceph', 'quay.io/ceph/daemon:latest',  # noqa: E501
+                                            'osd', 'pool', 'create', 'foo'])
+        assert rc == 0
+        rc, out, err = cluster.run_command('ceph osd pool get foo size -f json')  # noqa: E501
+        assert out == '{"pool": "foo", "pool_id": 1, "size": 3}\n'
+        assert len(cluster.calls) == 3
+
+    def test_script(self, cluster):
+        rc, out, err = cluster.run_command(['sh', '-c', 'ceph osd set noout && ceph osd stat -f json'])  # noqa: E501
+        assert rc == 0
+        assert '"epoch": 2' in out
+        assert 'noout' in cluster.state['osd_flags']
+        assert len(cluster.calls) == 1
+        assert len(cluster.commands) == 2
+
+    def test_script_with_sh(self, cluster):
+        # a pipe is not handled in process, the shims are run by sh
+        rc, out, err = cluster.run_command(['sh', '-c', 'ceph osd set noout | cat'])  # noqa: E501
+        assert rc == 0
+        assert 'noout' in cluster.state['osd_flags']
+        assert cluster.commands == [['ceph', 'osd', 'set', 'noout']]
+
+    def test_state_file(self, tmp_path):
+        path = str(tmp_path / 'state.json')
+        with FakeCluster(path) as fake_cluster:
+            fake_cluster.run(['ceph', 'osd', 'set', 'noup'])
+            fake_cluster.save()
+        assert 'noup' in FakeCluster(path).state['osd_flags']
+
+    def test_ceph_pool(self, cluster):
+        args = {'name': 'foo', 'size': '2', 'application': 'rbd'}
+        result = run(ceph_pool, args)
+        assert result['changed']
+        pool = cluster.state['pools']['foo']
+        assert pool['size'] == 2
+        assert pool['application_metadata'] == {'rbd': {}}
+
+        calls = len(cluster.calls)
+        result = run(ceph_pool, args)
+        assert not result['changed']
+        # no write when the pool is up to date
+        assert all(call[-4:-2] != ['pool', 'set'] for call in cluster.calls[calls:])  # noqa: E501
+
+        result = run(ceph_pool, dict(args, size='3'))
+        assert result['changed']
+        assert cluster.state['pools']['foo']['size'] == 3
+
+    def test_ceph_pool_bulk(self, cluster):
+        pools = [{'name': 'foo', 'size': '2'}, {'name': 'bar'}]
+        result = run(ceph_pool, {'pools': pools, 'application': 'rgw'})
+        assert result['changed']
+        assert cluster.state['pools']['foo']['size'] == 2
+        assert cluster.state['pools']['bar']['application_metadata'] == {'rgw': {}}  # noqa: E501
+        # one pool dump and one batch
+        assert len(cluster.calls) == 2
+
+        result = run(ceph_pool, {'pools': pools, 'application': 'rgw'})
+        assert not result['changed']
+        assert [pool['changed'] for pool in result['pools']] == [False, False]
+
+    def test_ceph_pool_plan(self, cluster):
+        run(ceph_pool, {'name': 'foo', 'size': '2'})
+        pools = [{'name': 'foo', 'size': '3'}, {'name': 'bar'}]
+        cluster.reset()
+        result = run(ceph_pool, {'pools': pools, '_ansible_check_mode': True})  # noqa: E501
+        assert result['changed']
+        assert [entry['action'] for entry in result['plan']] == ['update', 'create']  # noqa: E501
+        assert 'bar' not in cluster.state['pools']
+        # a single read
+        assert len(cluster.calls) == 1
+
+        cluster.reset()
+        result = run(ceph_pool, {'plan': result['plan']})
+        assert result['changed']
+        assert cluster.state['pools']['foo']['size'] == 3
+        assert 'bar' in cluster.state['pools']
+        # the pools aren't read again
+        assert len(cluster.calls) == 1
+
+    def test_ceph_pool_pg_num_step(self, cluster):
+        args = {'name': 'foo', 'pg_autoscale_mode': 'off', 'pg_num': '32'}
+        run(ceph_pool, args)
+        result = run(ceph_pool, dict(args, pg_num='128', pg_num_step=32, pg_num_step_delay=0))  # noqa: E501
+        assert result['changed']
+        assert result['pg_migration']['done']
+        assert result['pg_migration']['steps'] == 3
+        pool = cluster.state['pools']['foo']
+        assert (pool['pg_num'], pool['pg_placement_num']) == (128, 128)
+
+        result = run(ceph_pool, dict(args, pg_num='128', pg_num_step=32))
+        assert not result['changed']
+        assert result['pg_migration']['done']
+
+    def test_ceph_config(self, cluster):
+        args = {'who': 'osd', 'option': 'osd_memory_target', 'value': '5368709120'}  # noqa: E501
+        assert run(ceph_config, args)['changed']
+        assert not run(ceph_config, args)['changed']
+        result = run(ceph_config, {'who': 'osd', 'option': 'osd_memory_target', 'action': 'get'})  # noqa: E501
+        assert result['stdout'] == '5368709120'
+        assert run(ceph_config, dict(args, action='rm'))['changed']
+        assert cluster.state['config'] == []
+
+    def test_ceph_config_bulk(self, cluster):
+        options = {'global': {'osd_pool_default_size': 2},
+                   'osd': {'osd_memory_target': '5368709120'},
+                   'osd/host:node1': {'osd_memory_target': '4294967296'}}
+        result = run(ceph_config, {'options': options})
+        assert result['changed']
+        # one dump, one assimilate-conf for the sections and one batch
+        # for the mask
+        assert len(cluster.calls) == 3
+        values = dict(((e['section'], e['mask'], e['name']), e['value'])
+                      for e in cluster.state['config'])
+        assert values[('global', '', 'osd_pool_default_size')] == '2'
+        assert values[('osd', '', 'osd_memory_target')] == '5368709120'
+        assert values[('osd', 'host:node1', 'osd_memory_target')] == '4294967296'  # noqa: E501
+        assert [d['before_header'] for d in result['diff']] == [
+            'global/osd_pool_default_size', 'osd/osd_memory_target',
+            'osd/host:node1/osd_memory_target']
+
+        cluster.reset()
+        result = run(ceph_config, {'options': options})
+        assert not result['changed']
+        assert len(cluster.calls) == 1
+
+        options = [{'option': 'osd_memory_target'},
+                   {'who': 'osd/host:node1', 'option': 'osd_memory_target'}]
+        result = run(ceph_config, {'options': options, 'who': 'osd', 'action': 'rm'})  # noqa: E501
+        assert [r['changed'] for r in result['options']] == [True, True]
+        assert len(cluster.state['config']) == 1
+
+    def test_ceph_config_bulk_update(self, cluster):
+        run(ceph_config, {'who': 'global', 'option': 'osd_pool_default_size', 'value': '2'})  # noqa: E501
+        options = {'global': {'osd_pool_default_size': 3, 'mon_allow_pool_delete': 'true'}}  # noqa: E501
+        cluster.reset()
+        result = run(ceph_config, {'options': options})
+        assert result['changed']
+        assert [r['rc'] for r in result['options']] == [0, 0]
+        values = dict(((e['section'], e['name']), e['value'])
+                      for e in cluster.state['config'])
+        assert values[('global', 'osd_pool_default_size')] == '3'
+        assert values[('global', 'mon_allow_pool_delete')] == 'true'
+        # assimilate-conf doesn't update the existing values, they are set
+        # by the batch
+        assert [c[c.index('config') + 1] for c in cluster.commands[1:]] == ['assimilate-conf', 'set']  # noqa: E501
+
+    def test_ceph_config_semantic_values(self, cluster):
+        run(ceph_config, {'who': 'osd/class:ssd', 'option': 'osd_memory_target', 'value': '4G'})  # noqa: E501
+        run(ceph_config, {'who': 'global', 'option': 'mon_allow_pool_delete', 'value': 'true'})  # noqa: E501
+        version = cluster.state['config_log'][0]['version']
+
+        assert not run(ceph_config, {'who': 'osd/class:ssd', 'option': 'osd_memory_target', 'value': '4294967296'})['changed']  # noqa: E501
+        options = {'global': {'mon_allow_pool_delete': 1},
+                   'osd/class:ssd': {'osd_memory_target': '4Gi'}}
+        assert not run(ceph_config, {'options': options})['changed']
+        # no config epoch churn
+        assert cluster.state['config_log'][0]['version'] == version
+
+    def test_ceph_osd_flag(self, cluster):
+        run(ceph_osd_flag, {'name': 'noout'})
+        assert 'noout' in cluster.state['osd_flags']
+        run(ceph_osd_flag, {'name': 'noout', 'state': 'absent'})
+        assert 'noout' not in cluster.state['osd_flags']
+
+    def test_ceph_key(self, cluster, tmp_path):
+        args = {'name': 'client.foo', 'caps': {'mon': 'allow r'},
+                'dest': str(tmp_path)}
+        result = run(ceph_key, args)
+        assert result['changed']
+        key = cluster.state['auth']['client.foo']['key']
+        with open(str(tmp_path / 'ceph.client.foo.keyring')) as f:
+            assert key in f.read()
+
+        assert not run(ceph_key, args)['changed']
+        assert run(ceph_key, {'name': 'client.foo', 'state': 'absent'})['changed']  # noqa: E501
+        assert 'client.foo' not in cluster.state['auth']
+
+    def test_ceph_key_bulk(self, cluster, tmp_path):
+        keys = [{'name': 'client.foo{}'.format(i)} for i in range(3)]
+        args = {'keys': keys, 'caps': {'mon': 'allow r'}, 'dest': str(tmp_path)}  # noqa: E501
+        result = run(ceph_key, args)
+        assert result['changed']
+        # one 'auth ls' and one 'auth import'
+        assert len(cluster.calls) == 2
+        for i in range(3):
+            key = cluster.state['auth']['client.foo{}'.format(i)]['key']
+            with open(str(tmp_path / 'ceph.client.foo{}.keyring'.format(i))) as f:  # noqa: E501
+                assert key in f.read()
+
+        cluster.reset()
+        result = run(ceph_key, args)
+        assert not result['changed']
+        assert len(cluster.calls) == 1
+
+        keys[1]['caps'] = {'mon': 'allow rw'}
+        result = run(ceph_key, args)
+        assert [item['changed'] for item in result['keys']] == [False, True, False]  # noqa: E501
+        assert cluster.state['auth']['client.foo1']['caps'] == {'mon': 'allow rw'}  # noqa: E501
+
+    def test_ceph_key_verified(self, cluster, tmp_path):
+        cache = tmp_path / 'cache'
+        keyrings = tmp_path / 'keyrings'
+        keyrings.mkdir()
+        args = {'name': 'client.foo', 'caps': {'mon': 'allow r'},
+                'dest': str(keyrings)}
+        with patch.dict(os.environ, {'CEPH_KEY_TRUST': 'true',
+                                     'CEPH_READ_CACHE_DIR': str(cache)}):
+            assert run(ceph_key, args)['changed']
+            # the key is verified against the cluster once
+            assert not run(ceph_key, args)['changed']
+            cluster.reset()
+            assert not run(ceph_key, args)['changed']
+            assert cluster.calls == []
+
+            bulk_args = {'keys': [{'name': 'client.foo'}], 'caps': {'mon': 'allow r'},  # noqa: E501
+                         'dest': str(keyrings)}
+            assert not run(ceph_key, bulk_args)['changed']
+            assert cluster.calls == []
+
+            # a keyring file which was changed locally isn't trusted
+            path = keyrings / 'ceph.client.foo.keyring'
+            path.write_text(path.read_text().replace('allow r', 'allow rw'))
+            assert run(ceph_key, dict(args, caps={'mon': 'allow rw'}))['changed']  # noqa: E501
+            assert cluster.state['auth']['client.foo']['caps'] == {'mon': 'allow rw'}  # noqa: E501
+
+    def test_ceph_key_fetch_initial_keys(self, cluster, tmp_path):
+        def build_key_path(cluster_name, entity):
+            return str(tmp_path / '{}.{}.keyring'.format(cluster_name, entity))  # noqa: E501
+
+        cache = tmp_path / 'cache'
+        with patch('ceph_key.build_key_path', side_effect=build_key_path), \
+                patch.dict(os.environ, {'CEPH_READ_CACHE': 'true',
+                                        'CEPH_READ_CACHE_DIR': str(cache)}):
+            result = run(ceph_key, {'state': 'fetch_initial_keys'})
+            assert result['changed']
+            # a single 'auth ls'
+            assert len(cluster.calls) == 1
+            assert cluster.state['auth']['client.admin']['key'] not in result['stdout']  # noqa: E501
+            for entity, auth in cluster.state['auth'].items():
+                if entity.startswith('client.'):
+                    with open(build_key_path('ceph', entity)) as f:
+                        assert ceph_key.parse_keyring(f.read()) == {entity: auth}  # noqa: E501
+
+            assert not run(ceph_key, {'state': 'fetch_initial_keys'})['changed']  # noqa: E501
+            # the dump holds every secret, it isn't written to the read cache
+            assert not cache.exists()
+
+    def test_ceph_crush(self, cluster):
+        args = {'location': {'root': 'default', 'rack': 'rack1', 'host': 'host1'}}  # noqa: E501
+        assert run(ceph_crush, args)['changed']
+        buckets = cluster.state['crush']['buckets']
+        assert buckets['host1']['parent'] == 'rack1'
+        assert buckets['rack1']['parent'] == 'default'
+        assert not run(ceph_crush, args)['changed']
+
+    def test_ceph_crush_locations(self, cluster):
+        args = {'locations': [{'root': 'default', 'rack': 'rack1', 'host': 'host1'},  # noqa: E501
+                              {'root': 'default', 'rack': 'rack1', 'host': 'host2'},  # noqa: E501
+                              {'root': 'default', 'rack': 'rack2', 'host': 'host3'}]}  # noqa: E501
+        epoch = cluster.state['epochs']['osdmap']
+        result = run(ceph_crush, args)
+        assert result['changed']
+        buckets = cluster.state['crush']['buckets']
+        assert buckets['host1']['parent'] == 'rack1'
+        assert buckets['host2']['parent'] == 'rack1'
+        assert buckets['host3']['parent'] == 'rack2'
+        assert buckets['rack2']['parent'] == 'default'
+        # a single injection of the whole hierarchy
+        assert cluster.state['epochs']['osdmap'] == epoch + 1
+        assert len(cluster.calls) == 2
+
+        assert not run(ceph_crush, args)['changed']
+        args['locations'][0]['rack'] = 'rack2'
+        assert run(ceph_crush, args)['changed']
+        assert cluster.state['crush']['buckets']['host1']['parent'] == 'rack2'
+
+    def test_ceph_crush_locations_conflict(self, cluster):
+        # the map changed since it was fetched
+        rc, out, err = cluster.run_command(['ceph', 'osd', 'setcrushmap', '-i', '-', '0'], data='{}')  # noqa: E501
+        assert rc == 1
+        assert err == 'Error EPERM: prior_version 0 != crush version 1\n'
+
+    def test_ceph_volume_lvm_volumes(self, cluster):
+        for i in range(3):
+            cluster.add_device('/dev/sd{}'.format('abc'[i]))
+        cluster.add_lv('data-vg', 'data-lv1', '/dev/sdd')
+        args = {'action': 'prepare', 'lvm_volumes': [{'data': '/dev/sda'}]}
+        assert run(ceph_volume, args)['changed']
+
+        cluster.reset()
+        args['lvm_volumes'] = [{'data': '/dev/sda'}, {'data': '/dev/sdb'},
+                               {'data': '/dev/sdc', 'crush_device_class': 'ssd'},  # noqa: E501
+                               {'data': 'data-lv1', 'data_vg': 'data-vg'}]
+        result = run(ceph_volume, args)
+        assert result['changed']
+        assert [v['changed'] for v in result['volumes']] == [False, True, True, True]  # noqa: E501
+        assert len(cluster.calls) == 4
+        assert len(cluster.state['osds']) == 4
+        assert sorted(o['device_class'] for o in cluster.state['osds'].values()) == ['hdd', 'hdd', 'hdd', 'ssd']  # noqa: E501
+
+        cluster.reset()
+        assert not run(ceph_volume, args)['changed']
+        assert len(cluster.calls) == 1
+
+    def test_ceph_volume_zap_lvm_volumes(self, cluster):
+        for device in ['/dev/sda', '/dev/sdb', '/dev/sdc']:
+            cluster.add_device(device)
+        run(ceph_volume, {'action': 'create', 'lvm_volumes': ['/dev/sda', '/dev/sdb', '/dev/sdc']})  # noqa: E501
+        osd_id = [osd_id for osd_id, osd in cluster.state['osds'].items()
+                  if '/dev/sdc' in cluster.state['lvs'][osd['lv']]['devices']][0]  # noqa: E501
+
+        cluster.reset()
+        result = run(ceph_volume, {'action': 'zap', 'lvm_volumes': ['/dev/sda', '/dev/sdb', int(osd_id)]})  # noqa: E501
+        assert result['changed']
+        assert [v['target'] for v in result['volumes']] == ['/dev/sda', '/dev/sdb', 'osd.' + osd_id]  # noqa: E501
+        assert [v['rc'] for v in result['volumes']] == [0, 0, 0]
+        assert cluster.state['lvs'] == {}
+        # a report of the lvs, the zaps and a rescan
+        assert len(cluster.calls) == 5
+
+    def test_trace(self, cluster, monkeypatch):
+        monkeypatch.setenv('CEPH_ANSIBLE_TRACE', 'true')
+        for module, args in [(radosgw_user, {'name': 'foo', 'display_name': 'Foo'}),  # noqa: E501
+                             (ceph_mgr_module, {'name': 'dashboard'})]:
+            del sys.modules['module_utils.ca_common']._trace[:]
+            result = run(module, args)
+            assert result['changed']
+            assert [span['cmd'] for span in result['trace']] == cluster.commands  # noqa: E501
+            cluster.reset()
+        del sys.modules['module_utils.ca_common']._trace[:]
+
+    def test_radosgw_user(self, cluster):
+        args = {'name': 'foo', 'display_name': 'Foo', 'system': True}
+        assert run(radosgw_user, args)['changed']
+        assert cluster.state['rgw']['users']['foo']['system']
+        assert not run(radosgw_user, args)['changed']
+        assert run(radosgw_user, dict(args, display_name='Bar'))['changed']
+        assert cluster.state['rgw']['users']['foo']['display_name'] == 'Bar'
@@ -1,5 +1,10 @@
 from mock.mock import patch, MagicMock
+import datetime
+import functools
+import json
 import os
+import subprocess
+import time
 import ca_common
 import pytest
 
@@ -142,3 +147,328 @@ class TestCommon(object):
         assert _cmd == expected_cmd
         assert _err == stderr
         assert _out == stdout
+
+    @patch.dict(os.environ, {'CEPH_CONTAINER_BINARY': fake_container_binary,
+                             'CEPH_CONTAINER_TOOLBOX': 'true'})
+    @patch('ca_common.start_toolbox')
+    def test_container_exec_toolbox(self, m_start_toolbox):
+        name = ca_common.toolbox_name(fake_container_image, int(time.time()) + 3600)  # noqa: E501
+        m_start_toolbox.return_value = name
+        ca_common._toolbox_sessions.clear()
+        cmd = ca_common.container_exec(self.fake_binary, fake_container_image)
+        assert cmd == [fake_container_binary, 'exec', name, self.fake_binary]
+        cmd = ca_common.container_exec(self.fake_binary, fake_container_image, interactive=True)  # noqa: E501
+        assert cmd == [fake_container_binary, 'exec', '--interactive', name, self.fake_binary]  # noqa: E501
+        m_start_toolbox.assert_called_once_with(fake_container_binary, fake_container_image)  # noqa: E501
+        ca_common._toolbox_sessions.clear()
+
+    @patch.dict(os.environ, {'CEPH_CONTAINER_BINARY': fake_container_binary,
+                             'CEPH_CONTAINER_TOOLBOX': 'true'})
+    @patch('ca_common.start_toolbox')
+    def test_container_exec_toolbox_expiring(self, m_start_toolbox):
+        expiring = ca_common.toolbox_name(fake_container_image, int(time.time()) + 60)  # noqa: E501
+        name = ca_common.toolbox_name(fake_container_image, int(time.time()) + 3600)  # noqa: E501
+        m_start_toolbox.side_effect = [expiring, name]
+        ca_common._toolbox_sessions.clear()
+        cmd = ca_common.container_exec(self.fake_binary, fake_container_image)
+        assert cmd == [fake_container_binary, 'exec', expiring, self.fake_binary]  # noqa: E501
+        cmd = ca_common.container_exec(self.fake_binary, fake_container_image)
+        assert cmd == [fake_container_binary, 'exec', name, self.fake_binary]
+        cmd = ca_common.container_exec(self.fake_binary, fake_container_image)
+        assert cmd == [fake_container_binary, 'exec', name, self.fake_binary]
+        assert m_start_toolbox.call_count == 2
+        ca_common._toolbox_sessions.clear()
+
+    @patch.dict(os.environ, {'CEPH_CONTAINER_BINARY': fake_container_binary,
+                             'CEPH_CONTAINER_TOOLBOX': 'true'})
+    @patch('ca_common.start_toolbox')
+    def test_container_exec_toolbox_unavailable(self, m_start_toolbox):
+        m_start_toolbox.return_value = None
+        ca_common._toolbox_sessions.clear()
+        cmd = ca_common.container_exec(self.fake_binary, fake_container_image)
+        assert cmd == self.fake_container_cmd
+        ca_common._toolbox_sessions.clear()
+
+    @patch('time.time', MagicMock(return_value=1000))
+    def test_start_toolbox_reuse(self):
+        name = ca_common.toolbox_name(fake_container_image, 4600)
+        fake_run_command = MagicMock(return_value=(0, '{}\n{}\n'.format(ca_common.toolbox_name(fake_container_image, 1100), name), ''))  # noqa: E501
+        assert ca_common.start_toolbox(fake_container_binary, fake_container_image,  # noqa: E501
+                                       run_command=fake_run_command) == name
+        assert fake_run_command.call_count == 1
+        assert fake_run_command.call_args[0][0] == [fake_container_binary, 'ps', '--filter',  # noqa: E501
+                                                    'label={}={}'.format(ca_common.TOOLBOX_LABEL, ca_common.toolbox_name(fake_container_image)),  # noqa: E501
+                                                    '--format', '{{.Names}}']  # noqa: E501
+
+    @pytest.mark.parametrize('toolboxes', [(1, '', 'error'), (0, '', ''), (0, 'ceph-ansible-toolbox-ab-1010\n', '')])  # noqa: E501
+    @patch('time.time', MagicMock(return_value=1000))
+    def test_start_toolbox_create(self, toolboxes):
+        fake_run_command = MagicMock(side_effect=[toolboxes, (0, 'abc', '')])  # noqa: E501
+        name = ca_common.start_toolbox(fake_container_binary, fake_container_image,  # noqa: E501
+                                       run_command=fake_run_command)
+        assert name == ca_common.toolbox_name(fake_container_image, 4600)
+        # a toolbox about to expire is left running
+        assert fake_run_command.call_count == 2
+        run_cmd = fake_run_command.call_args_list[-1][0][0]
+        assert run_cmd[:3] == [fake_container_binary, 'run', '--detach']
+        assert '{}={}'.format(ca_common.TOOLBOX_LABEL, ca_common.toolbox_name(fake_container_image)) in run_cmd  # noqa: E501
+        assert run_cmd[-3:] == ['--entrypoint=sleep', fake_container_image, '3600']  # noqa: E501
+
+    @patch('time.time', MagicMock(return_value=1000))
+    def test_start_toolbox_race(self):
+        name = ca_common.toolbox_name(fake_container_image, 4599)
+        fake_run_command = MagicMock(side_effect=[(0, '', ''), (125, '', 'name in use'), (0, name, '')])  # noqa: E501
+        assert ca_common.start_toolbox(fake_container_binary, fake_container_image,  # noqa: E501
+                                       run_command=fake_run_command) == name
+
+    def test_remove_toolbox(self):
+        names = [ca_common.toolbox_name(fake_container_image, 1100), ca_common.toolbox_name(fake_container_image, 4600)]  # noqa: E501
+        fake_run_command = MagicMock(side_effect=[(0, '\n'.join(names), ''), (0, '', '')])  # noqa: E501
+        rc, cmd, out, err = ca_common.remove_toolbox(fake_container_binary, fake_container_image,  # noqa: E501
+                                                     run_command=fake_run_command)  # noqa: E501
+        assert cmd == [fake_container_binary, 'rm', '--force'] + names[::-1]
+
+    @pytest.mark.parametrize('image', [None, fake_container_image])
+    @patch.dict(os.environ, {'CEPH_CONTAINER_BINARY': fake_container_binary})
+    def test_parse_ceph_cmd(self, image):
+        cmd = ca_common.generate_cmd(sub_cmd=['osd', 'pool'],
+                                     args=['ls', 'detail', '-f', 'json'],
+                                     cluster='foo',
+                                     container_image=image)
+        assert ca_common.parse_ceph_cmd(cmd) == ('foo', 'client.admin',
+                                                 '/etc/ceph/foo.client.admin.keyring',  # noqa: E501
+                                                 'json',
+                                                 ['osd', 'pool', 'ls', 'detail'])  # noqa: E501
+
+    def test_parse_ceph_cmd_toolbox(self):
+        cmd = [fake_container_binary, 'exec', '--interactive', 'toolbox',
+               'ceph', '-n', 'client.admin', '-k', '/etc/ceph/ceph.client.admin.keyring',  # noqa: E501
+               '--cluster', 'ceph', 'config', 'dump', '--format', 'json']
+        assert ca_common.parse_ceph_cmd(cmd)[3:] == ('json', ['config', 'dump'])  # noqa: E501
+
+    @pytest.mark.parametrize('cmd', [
+        ['ceph-authtool', '--create-keyring', '/etc/ceph/foo.keyring'],
+        [fake_container_binary, 'exec', 'toolbox', 'radosgw-admin', '--cluster', 'ceph', 'user', 'list'],  # noqa: E501
+        ['ceph', '--cluster', 'ceph', 'auth', 'get', 'client.foo', '-o', '/etc/ceph/foo.keyring'],  # noqa: E501
+    ])
+    def test_parse_ceph_cmd_unsupported(self, cmd):
+        assert ca_common.parse_ceph_cmd(cmd) is None
+
+    @patch.dict(os.environ, {'CEPH_TRANSPORT': 'librados'})
+    @patch('ca_common.HAS_RADOS', True)
+    @patch('ca_common.get_rados_transport')
+    def test_exec_command_rados(self, m_get_rados_transport):
+        fake_module = MagicMock()
+        fake_transport = MagicMock()
+        fake_transport.command.return_value = 0, '[]', ''
+        m_get_rados_transport.return_value = fake_transport
+        cmd = ca_common.generate_cmd(sub_cmd=['osd', 'pool'], args=['ls', '-f', 'json'])  # noqa: E501
+        rc, _cmd, out, err = ca_common.exec_command(fake_module, cmd)
+        assert (rc, _cmd, out, err) == (0, cmd, '[]', '')
+        fake_transport.command.assert_called_once_with(['osd', 'pool', 'ls'], output_format='json', inbuf=b'')  # noqa: E501
+        fake_module.run_command.assert_not_called()
+
+    @patch.dict(os.environ, {'CEPH_TRANSPORT': 'librados'})
+    @patch('ca_common.HAS_RADOS', True)
+    @patch('ca_common.get_rados_transport')
+    def test_exec_command_rados_fallback(self, m_get_rados_transport):
+        fake_module = MagicMock()
+        fake_module.run_command.return_value = 0, '[]', ''
+        m_get_rados_transport.return_value = None
+        cmd = ca_common.generate_cmd(sub_cmd=['osd', 'pool'], args=['ls', '-f', 'json'])  # noqa: E501
+        rc, _cmd, out, err = ca_common.exec_command(fake_module, cmd)
+        assert (rc, out, err) == (0, '[]', '')
+        fake_module.run_command.assert_called_once()
+
+    @patch('ca_common.validate_command', create=True)
+    @patch('ca_common.parse_json_funcsigs', create=True)
+    @patch('ca_common.rados', create=True)
+    def test_rados_transport(self, m_rados, m_parse_json_funcsigs, m_validate_command):  # noqa: E501
+        descriptions = {
+            'cmd000': {'sig': ['osd', 'pool', 'ls'], 'flags': 0},
+            'cmd001': {'sig': ['mgr', 'module', 'ls'], 'flags': 8},
+        }
+        handle = m_rados.Rados.return_value
+        handle.mon_command.side_effect = [
+            (0, json.dumps(descriptions).encode('utf-8'), ''),
+            (-2, b'', "pool 'foo' does not exist"),
+        ]
+        handle.mgr_command.return_value = 0, b'{}', ''
+        transport = ca_common.RadosTransport('ceph', 'client.admin', '/etc/ceph/ceph.client.admin.keyring')  # noqa: E501
+
+        m_validate_command.return_value = {'prefix': 'mgr module ls'}
+        assert transport.command(['mgr', 'module', 'ls'], output_format='json') == (0, '{}', '')  # noqa: E501
+        assert json.loads(handle.mgr_command.call_args[0][0]) == {'prefix': 'mgr module ls', 'format': 'json'}  # noqa: E501
+
+        m_validate_command.return_value = {'prefix': 'osd pool stats', 'pool_name': 'foo'}  # noqa: E501
+        rc, out, err = transport.command(['osd', 'pool', 'stats', 'foo'])
+        assert rc == 2
+        assert err == "Error ENOENT: pool 'foo' does not exist"
+
+        m_validate_command.return_value = {}
+        assert transport.command(['foo']) is None
+
+    def test_exec_read_command_cache(self, tmp_path):
+        cmd = ca_common.generate_cmd(sub_cmd=['osd', 'pool'], args=['ls', 'detail', '-f', 'json'])  # noqa: E501
+        fake_module = MagicMock()
+        fake_module.run_command.side_effect = [
+            (0, '{"epoch": 10}', ''),
+            (0, '[{"pool_name": "foo"}]', ''),
+            (0, '', ''),
+            (0, '{"epoch": 11}', ''),
+            (0, '[]', ''),
+        ]
+        ca_common._epochs.clear()
+        with patch.dict(os.environ, {'CEPH_READ_CACHE': 'true', 'CEPH_READ_CACHE_DIR': str(tmp_path)}):  # noqa: E501
+            for i in range(2):
+                rc, _cmd, out, err = ca_common.exec_read_command(fake_module, cmd)  # noqa: E501
+                assert (rc, out) == (0, '[{"pool_name": "foo"}]')
+            assert fake_module.run_command.call_count == 2
+            assert fake_module.run_command.call_args_list[0][0][0][-4:] == ['osd', 'stat', '-f', 'json']  # noqa: E501
+            assert os.listdir(os.path.join(str(tmp_path), 'ceph'))
+
+            # a write drops the cache
+            ca_common.exec_command(fake_module, ca_common.generate_cmd(sub_cmd=['osd', 'pool'], args=['create', 'foo']))  # noqa: E501
+            assert not os.path.exists(os.path.join(str(tmp_path), 'ceph'))
+
+            rc, _cmd, out, err = ca_common.exec_read_command(fake_module, cmd)
+            assert (rc, out) == (0, '[]')
+        assert fake_module.run_command.call_count == 5
+
+    def test_exec_read_command_epoch_changed(self, tmp_path):
+        cmd = ca_common.generate_cmd(sub_cmd=['config', 'dump', '--format', 'json'])  # noqa: E501
+        fake_module = MagicMock()
+        fake_module.run_command.side_effect = [
+            (0, '[{"version": 3}]', ''),
+            (0, '[]', ''),
+            (0, '[{"version": 4}]', ''),
+            (0, '[{"name": "foo"}]', ''),
+        ]
+        ca_common._epochs.clear()
+        with patch.dict(os.environ, {'CEPH_READ_CACHE': 'true', 'CEPH_READ_CACHE_DIR': str(tmp_path)}):  # noqa: E501
+            assert ca_common.exec_read_command(fake_module, cmd, epoch='config')[2] == '[]'  # noqa: E501
+            # another process changed the config in the meantime
+            ca_common._epochs.clear()
+            assert ca_common.exec_read_command(fake_module, cmd, epoch='config')[2] == '[{"name": "foo"}]'  # noqa: E501
+        ca_common._epochs.clear()
+
+    def test_exec_read_command_auth(self, tmp_path):
+        cmd = ca_common.generate_cmd(sub_cmd=['auth'], args=['ls', '-f', 'json'])  # noqa: E501
+        fake_module = MagicMock()
+        fake_module.run_command.return_value = (0, '{"auth_dump": []}', '')
+        with patch.dict(os.environ, {'CEPH_READ_CACHE': 'true', 'CEPH_READ_CACHE_DIR': str(tmp_path)}):  # noqa: E501
+            for i in range(2):
+                assert ca_common.exec_read_command(fake_module, cmd, epoch=None)[2] == '{"auth_dump": []}'  # noqa: E501
+        # the secrets aren't written to disk
+        assert fake_module.run_command.call_count == 2
+        assert not os.path.exists(os.path.join(str(tmp_path), 'ceph'))
+
+    @pytest.mark.parametrize('args,expected', [
+        (['osd', 'pool', 'ls', 'detail'], True),
+        (['osd', 'pool', 'get', 'foo', 'size'], True),
+        (['osd', 'pool', 'set', 'foo', 'size', '3'], False),
+        (['auth', 'get-or-create', 'client.foo'], False),
+    ])
+    def test_is_read_only(self, args, expected):
+        assert ca_common.is_read_only(args) is expected
+
+    @patch.dict(os.environ, {'CEPH_CONTAINER_BINARY': fake_container_binary})
+    def test_split_launcher(self):
+        cmd = ca_common.generate_cmd(sub_cmd=['osd', 'pool'], args=['ls'], container_image=fake_container_image)  # noqa: E501
+        launcher, argv = ca_common.split_launcher(cmd)
+        assert launcher == self.fake_container_cmd[:-2] + ['--entrypoint=sh', fake_container_image]  # noqa: E501
+        assert argv == ['ceph', '-n', 'client.admin', '-k', '/etc/ceph/ceph.client.admin.keyring',  # noqa: E501
+                        '--cluster', 'ceph', 'osd', 'pool', 'ls']
+        assert ca_common.split_launcher(['docker', 'exec', 'ceph-mon-foo', 'ceph', 'osd', 'tree']) == \
+            (['docker', 'exec', 'ceph-mon-foo', 'sh'], ['ceph', 'osd', 'tree'])  # noqa: E501
+        assert ca_common.split_launcher(['ceph', 'osd', 'tree']) == (['sh'], ['ceph', 'osd', 'tree'])  # noqa: E501
+
+    @pytest.mark.parametrize('stop_on_error', [True, False])
+    def test_exec_commands_batch(self, stop_on_error):
+        def run_command(cmd, **kwargs):
+            proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)  # noqa: E501
+            return proc.returncode, proc.stdout, proc.stderr
+
+        fake_module = MagicMock()
+        fake_module.run_command.side_effect = run_command
+        cmd_list = [
+            ['echo', 'foo bar'],
+            ['printf', 'no newline'],
+            ['sh', '-c', 'echo error >&2; exit 3'],
+            ['echo', 'last'],
+        ]
+        results = ca_common.exec_commands_batch(fake_module, cmd_list, stop_on_error=stop_on_error)  # noqa: E501
+        assert fake_module.run_command.call_count == 1
+        expected = [
+            (0, cmd_list[0], 'foo bar\n', ''),
+            (0, cmd_list[1], 'no newline', ''),
+            (3, cmd_list[2], '', 'error\n'),
+        ]
+        if not stop_on_error:
+            expected.append((0, cmd_list[3], 'last\n', ''))
+        assert results == expected
+
+    def test_exec_commands_batch_bytes(self):
+        fake_module = MagicMock()
+        fake_module.run_command.return_value = 0, '', ''
+        # ceph_key passes the generated secret as bytes
+        ca_common.exec_commands_batch(fake_module, [['echo', b'secret'], ['echo', 'foo']])  # noqa: E501
+        script = fake_module.run_command.call_args[0][0][-1]
+        assert 'echo secret;' in script
+
+    @pytest.mark.parametrize('max_workers', [1, 4])
+    def test_run_concurrently(self, max_workers):
+        def probe(value, delay):
+            time.sleep(delay)
+            return value
+
+        tasks = [functools.partial(probe, i, (3 - i) * 0.01) for i in range(4)]
+        assert ca_common.run_concurrently(tasks, max_workers=max_workers) == [0, 1, 2, 3]  # noqa: E501
+
+    def test_run_concurrently_error(self):
+        def probe(value):
+            if value:
+                raise ValueError(value)
+            return value
+
+        tasks = [functools.partial(probe, i) for i in [0, 'first', 'second']]
+        with pytest.raises(ValueError, match='first'):
+            ca_common.run_concurrently(tasks)
+
+    def test_mask_secrets(self):
+        cmd = ['ceph-authtool', '--create-keyring', '/etc/ceph/ceph.client.foo.keyring',  # noqa: E501
+               '--add-key', 'AQAin8tUUK84ExAA/QgBtI7gEMWdmnvKBzlXdQ==',
+               'sh', '-c', 'radosgw-admin user create --access-key ABC --secret-key=XYZ']  # noqa: E501
+        assert ca_common.mask_secrets(cmd) == [
+            'ceph-authtool', '--create-keyring', '/etc/ceph/ceph.client.foo.keyring',  # noqa: E501
+            '--add-key', '********',
+            'sh', '-c', 'radosgw-admin user create --access-key ******** --secret-key=********']  # noqa: E501
+        assert ca_common.mask_secrets(['ceph-authtool', '--add-key', b'AQAin8tUUK84ExAA/QgBtI7gEMWdmnvKBzlXdQ==']) == \
+            ['ceph-authtool', '--add-key', '********']
+
+    @patch.dict(os.environ, {'CEPH_ANSIBLE_TRACE': 'true'})
+    @patch('ansible.module_utils.basic.AnsibleModule')
+    def test_exit_module_trace(self, m_module):
+        del ca_common._trace[:]
+        m_module.run_command.return_value = 0, 'foo', 'bar\n'
+        startd = datetime.datetime.now()
+        cmd = ['ceph', 'auth', 'get-key', 'client.foo']
+        ca_common.exec_command(m_module, cmd)
+        ca_common.exit_module(m_module, 'foo', 0, cmd, '', startd)
+        trace = m_module.exit_json.call_args[1]['trace']
+        assert len(trace) == 1
+        assert trace[0]['cmd'] == cmd
+        assert trace[0]['transport'] == 'cli'
+        assert (trace[0]['rc'], trace[0]['stdout_bytes'], trace[0]['stderr_bytes']) == (0, 3, 4)  # noqa: E501
+        assert trace[0]['duration'] >= 0
+        del ca_common._trace[:]
+
+    @patch('ansible.module_utils.basic.AnsibleModule')
+    def test_exit_module_no_trace(self, m_module):
+        ca_common.exit_module(m_module, 'foo', 0, ['ceph'], '', datetime.datetime.now())  # noqa: E501
+        assert 'trace' not in m_module.exit_json.call_args[1]
+
+    @patch('ansible.module_utils.basic.AnsibleModule')
+    def test_exit_module_extra_keys(self, m_module):
+        ca_common.exit_module(m_module, 'foo', 0, ['ceph'], '', datetime.datetime.now(), pools=[])  # noqa: E501
+        assert m_module.exit_json.call_args[1]['pools'] == []
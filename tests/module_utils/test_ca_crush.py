@@ -0,0 +1,56 @@
+import json
+import ca_crush
+import pytest
+
+fake_nodes = [
+    {'id': -1, 'name': 'default', 'type': 'root', 'children': [-3, -2]},
+    {'id': -3, 'name': 'rack2', 'type': 'rack', 'children': []},
+    {'id': -2, 'name': 'rack1', 'type': 'rack', 'children': [-4]},
+    {'id': -4, 'name': 'node1', 'type': 'host', 'children': [1, 0]},
+    {'id': 1, 'name': 'osd.1', 'type': 'osd', 'device_class': 'ssd'},
+    {'id': 0, 'name': 'osd.0', 'type': 'osd', 'device_class': 'hdd'},
+    {'id': -5, 'name': 'node2', 'type': 'host', 'children': []},
+]
+
+
+class TestCrushTree(object):
+
+    def setup_method(self):
+        self.tree = ca_crush.CrushTree.from_json(json.dumps({'nodes': fake_nodes, 'stray': []}))  # noqa: E501
+
+    def test_lookups(self):
+        assert self.tree.get('node1')['id'] == -4
+        assert self.tree.get('node1', 'rack') is None
+        assert self.tree.exists('rack2', 'rack')
+        assert not self.tree.exists('rack3')
+        assert self.tree.by_id[-2]['name'] == 'rack1'
+        assert [n['name'] for n in self.tree.by_type['host']] == ['node1', 'node2']  # noqa: E501
+
+    def test_parents(self):
+        assert self.tree.parent('osd.0')['name'] == 'node1'
+        assert self.tree.parent('default') is None
+        assert self.tree.parent('node2') is None
+        assert self.tree.is_in('node1', 'rack1', 'rack')
+        assert not self.tree.is_in('node1', 'rack1', 'row')
+        assert not self.tree.is_in('node1', 'default')
+        assert [n['name'] for n in self.tree.children('default')] == ['rack2', 'rack1']  # noqa: E501
+
+    def test_paths(self):
+        assert self.tree.path('osd.1') == [('osd', 'osd.1'), ('host', 'node1'),
+                                           ('rack', 'rack1'), ('root', 'default')]  # noqa: E501
+        assert self.tree.location('osd.1') == {'host': 'node1', 'rack': 'rack1', 'root': 'default'}  # noqa: E501
+        assert self.tree.path('foo') == []
+        assert sorted(n['name'] for n in self.tree.subtree('rack1')) == ['node1', 'osd.0', 'osd.1']  # noqa: E501
+
+    def test_diff(self):
+        location = [('host', 'node1'), ('rack', 'rack1'), ('root', 'default')]  # noqa: E501
+        assert self.tree.diff(location) == []
+
+        location = [('host', 'node2'), ('rack', 'rack3'), ('root', 'default')]  # noqa: E501
+        assert self.tree.diff(location) == [
+            ('add', 'rack', 'rack3', ('root', 'default')),
+            ('move', 'host', 'node2', ('rack', 'rack3')),
+        ]
+
+        with pytest.raises(ValueError):
+            self.tree.diff([('host', 'rack2'), ('root', 'default')])